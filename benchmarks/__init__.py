@@ -0,0 +1 @@
+"""Benchmarks of reading and writing, on synthetic data."""
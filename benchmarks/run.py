@@ -0,0 +1,322 @@
+"""Benchmark the readers and writers on synthetic data.
+
+Every reader and writer in napari.yaml is run on synthetic
+brainreg and brainmapper directories (see synthetic.py), registered to a
+generated stand-in atlas so no network access is needed. For each, the
+fastest of several runs is reported, along with the peak memory allocated
+during a separate run with tracemalloc (which slows code down, so isn't
+used for timing) and the time spent in each profiled stage.
+
+Run from the repository root, e.g.::
+
+    python -m benchmarks.run --size medium
+    python -m benchmarks.run --n-cells 5000000 --output results.json
+"""
+
+import argparse
+import gc
+import importlib
+import json
+import tempfile
+import time
+from collections import defaultdict
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import yaml
+
+import brainglobe_napari_io
+from benchmarks.synthetic import (
+    StandInAtlas,
+    make_brainmapper_dir,
+    use_stand_in_atlas,
+)
+from brainglobe_napari_io import profiling
+from brainglobe_napari_io.api import (
+    Layer,
+    as_layer_data_tuples,
+    export_session_zarr,
+    get_layer,
+    load_brainmapper_dir,
+    load_brainreg_dir,
+)
+from brainglobe_napari_io.brainreg.writer_labels import EDITED_CHUNKS_KEY
+
+SIZES: Dict[str, Dict[str, Any]] = {
+    "small": {"atlas_shape": (40, 32, 48), "n_cells": 1_000},
+    "medium": {"atlas_shape": (80, 64, 96), "n_cells": 100_000},
+    "large": {"atlas_shape": (132, 80, 114), "n_cells": 1_000_000},
+    "xlarge": {"atlas_shape": (132, 80, 114), "n_cells": 5_000_000},
+}
+
+MANIFEST_PATH = Path(brainglobe_napari_io.__file__).parent / "napari.yaml"
+
+# readers that are only opened via the IO Utilities submenu (see
+# brainglobe_napari_io.utils.open_with_reader), so aren't in "readers"
+MENU_READERS = [
+    "brainglobe-napari-io.brainmapper_read_dir_atlas_space",
+    "brainglobe-napari-io.brainmapper_read_cubes",
+]
+
+
+def get_manifest_functions(kind: str) -> Dict[str, Callable]:
+    """Get the functions of the readers or writers in napari.yaml
+    (including the readers in MENU_READERS).
+
+    Parameters
+    ----------
+    kind : str
+        "readers" or "writers".
+
+    Returns
+    -------
+    Dict[str, Callable]
+        The function of each command, keyed by command id.
+    """
+    with open(MANIFEST_PATH) as manifest_file:
+        manifest = yaml.safe_load(manifest_file)
+    python_names = {
+        command["id"]: command["python_name"]
+        for command in manifest["contributions"]["commands"]
+    }
+    command_ids = [
+        contribution["command"]
+        for contribution in manifest["contributions"][kind]
+    ]
+    if kind == "readers":
+        command_ids.extend(MENU_READERS)
+    functions = {}
+    for command_id in command_ids:
+        module_name, function_name = python_names[command_id].split(":")
+        module = importlib.import_module(module_name)
+        functions[command_id] = getattr(module, function_name)
+    return functions
+
+
+def get_reader_path(
+    command_id: str, brainmapper_dir: Path
+) -> Union[str, List[str]]:
+    """Get the path (or paths) to open with each reader."""
+    if "cohort" in command_id:
+        # a cohort of the same registration, twice
+        return [str(brainmapper_dir / "registration")] * 2
+    if "brainreg" in command_id:
+        return str(brainmapper_dir / "registration")
+    if "session_zarr" in command_id:
+        return str(brainmapper_dir.parent / "session.ome.zarr")
+    if "cellfinder" in command_id:
+        points_dirs = sorted(brainmapper_dir.glob("**/points"))
+        return str(points_dirs[0] / "cell_classification.xml")
+    return str(brainmapper_dir)
+
+
+def read(get_reader: Callable, path: Union[str, List[str]]) -> list:
+    """Open a path as napari does, with the reader's probe function, then
+    access the first element of each layer (to load lazy layers)."""
+    reader = get_reader(path)
+    if reader is None:
+        raise ValueError(f"{get_reader.__name__} does not accept {path}")
+    layers = reader(path)
+    for data, _, _ in layers:
+        # Zarr arrays have a shape, but no length
+        if data.shape[0] if hasattr(data, "shape") else len(data):
+            data[0]
+    return layers
+
+
+def write_labels_edit(writer: Callable, path: str, layer: Layer):
+    """Paint a voxel of a labels layer (as a brush edit in napari would),
+    then save the layer."""
+    edited_chunks = layer.metadata.setdefault(EDITED_CHUNKS_KEY, set())
+    layer.data[0, 0, 0] += 1
+    edited_chunks.add((0, 0, 0))
+    writer(path, layer.data, layer.attributes)
+
+
+def measure(function: Callable, repeat: int) -> Dict:
+    """Time a function, and measure its peak memory use and the time it
+    spends in each profiled stage."""
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        with profiling.profiling(trace_memory=False):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+
+    gc.collect()
+    with profiling.profiling(trace_memory=True) as records:
+        with profiling.span("benchmark"):
+            function()
+    stages: Dict[str, float] = defaultdict(float)
+    for record in records:
+        if record["depth"] == 2:
+            stages[record["name"]] += record["wall_time"]
+
+    return {
+        "wall_time": min(times),
+        "peak_memory": records[-1]["peak_memory_delta"],
+        "bytes_read": records[-1]["bytes_read"],
+        "stages": dict(stages),
+    }
+
+
+def run_benchmarks(
+    data_dir: Path,
+    atlas_shape: Tuple[int, int, int],
+    n_cells: int,
+    n_channels: int = 1,
+    scale: int = 2,
+    repeat: int = 3,
+    select: Optional[str] = None,
+) -> List[Dict]:
+    """Generate a synthetic dataset, and benchmark each reader and writer.
+
+    Parameters
+    ----------
+    data_dir : Path
+        Directory to write the synthetic dataset to.
+    atlas_shape : Tuple[int, int, int]
+        Shape of the stand-in atlas (and so of the registration images).
+    n_cells : int
+        Number of cell candidates per channel.
+    n_channels : int, optional
+        Number of signal channels, by default 1.
+    scale : int, optional
+        Size of an atlas voxel in raw data voxels, by default 2.
+    repeat : int, optional
+        Number of runs to time, by default 3.
+    select : str, optional
+        Only run benchmarks whose name contains this.
+
+    Returns
+    -------
+    List[Dict]
+        The results of each benchmark.
+    """
+    atlas = StandInAtlas(shape=atlas_shape)
+    print(
+        f"Generating dataset: atlas {atlas_shape}, {n_cells} cells, "
+        f"{n_channels} channel(s)"
+    )
+    brainmapper_dir = make_brainmapper_dir(
+        data_dir / "brainmapper",
+        atlas,
+        n_cells=n_cells,
+        n_channels=n_channels,
+        scale=scale,
+    )
+
+    benchmarks: Dict[str, Callable] = {}
+    for command_id, get_reader in get_manifest_functions("readers").items():
+        path = get_reader_path(command_id, brainmapper_dir)
+        benchmarks[command_id] = lambda g=get_reader, p=path: read(g, p)
+
+    writers = get_manifest_functions("writers")
+    with use_stand_in_atlas(atlas):
+        points_layers = read(
+            get_manifest_functions("readers")[
+                "brainglobe-napari-io.cellfinder_read_points"
+            ],
+            get_reader_path("cellfinder", brainmapper_dir),
+        )
+        atlas_layer = get_layer(
+            load_brainreg_dir(brainmapper_dir / "registration"),
+            atlas.atlas_name,
+        )
+        session_layers = as_layer_data_tuples(
+            load_brainmapper_dir(brainmapper_dir)
+        )
+    # read by the session reader
+    export_session_zarr(data_dir / "session.ome.zarr", session_layers)
+    output_path = str(data_dir / "written_points.xml")
+    benchmarks["brainglobe-napari-io.cellfinder_write_multiple_points"] = (
+        partial(
+            writers["brainglobe-napari-io.cellfinder_write_multiple_points"],
+            output_path,
+            points_layers,
+        )
+    )
+    benchmarks["brainglobe-napari-io.brainreg_write_labels"] = partial(
+        write_labels_edit,
+        writers["brainglobe-napari-io.brainreg_write_labels"],
+        str(brainmapper_dir / "registration" / "registered_atlas.tiff"),
+        atlas_layer,
+    )
+
+    benchmarks["brainglobe-napari-io.write_session_zarr"] = partial(
+        writers["brainglobe-napari-io.write_session_zarr"],
+        str(data_dir / "written_session.ome.zarr"),
+        session_layers,
+    )
+
+    results = []
+    with use_stand_in_atlas(atlas):
+        for name, function in benchmarks.items():
+            if select is not None and select not in name:
+                continue
+            result = {"name": name, **measure(function, repeat)}
+            print_result(result)
+            results.append(result)
+    return results
+
+
+def print_result(result: Dict):
+    stages = ", ".join(
+        f"{name} {duration:.3f}s"
+        for name, duration in sorted(
+            result["stages"].items(), key=lambda item: -item[1]
+        )
+    )
+    print(
+        f"{result['name']:<60} {result['wall_time']:8.3f}s "
+        f"{result['peak_memory'] / 1e6:9.1f} MB peak  {stages}"
+    )
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--size", choices=list(SIZES), default="small")
+    parser.add_argument(
+        "--atlas-shape", type=int, nargs=3, help="Override the atlas shape"
+    )
+    parser.add_argument(
+        "--n-cells", type=int, help="Override the number of cells"
+    )
+    parser.add_argument("--n-channels", type=int, default=1)
+    parser.add_argument("--scale", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--select", help="Only run benchmarks whose name contains this"
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=Path,
+        help="Directory to generate data in (a temporary one by default)",
+    )
+    parser.add_argument("--output", type=Path, help="JSON file for results")
+    args = parser.parse_args(argv)
+
+    size = SIZES[args.size]
+    options = dict(
+        atlas_shape=tuple(args.atlas_shape or size["atlas_shape"]),
+        n_cells=args.n_cells or size["n_cells"],
+        n_channels=args.n_channels,
+        scale=args.scale,
+        repeat=args.repeat,
+        select=args.select,
+    )
+    if args.data_dir is not None:
+        results = run_benchmarks(args.data_dir, **options)
+    else:
+        with tempfile.TemporaryDirectory() as data_dir:
+            results = run_benchmarks(Path(data_dir), **options)
+
+    if args.output is not None:
+        with open(args.output, "w") as output:
+            json.dump({"options": options, "results": results}, output)
+
+
+if __name__ == "__main__":
+    main()
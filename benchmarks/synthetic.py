@@ -0,0 +1,615 @@
+"""Generate synthetic brainreg and brainmapper output directories.
+
+The directories have the same layout as real output, at a configurable
+size, so readers can be benchmarked at scale without real data. They are
+registered to a StandInAtlas, a small generated atlas, so no atlas needs
+downloading. ThrottledOpener stands in for high-latency storage (e.g. NFS)
+when reading files ahead (see brainglobe_napari_io.readahead).
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Literal, Optional, Sequence, Tuple, Union
+from unittest import mock
+
+import brainglobe_space as bgs
+import numpy as np
+import pandas as pd
+import tifffile
+
+from brainglobe_napari_io.utils import get_atlas
+
+ROOT_ID = 997
+UNKNOWN_TYPE = 1
+CELL_TYPE = 2
+
+
+class StandInAtlas:
+    """A generated atlas with the attributes the readers use from a
+    BrainGlobeAtlas.
+
+    The annotation is an ellipsoidal "brain", split into slabs along the
+    first axis, each of which is a structure within a root structure.
+
+    Parameters
+    ----------
+    atlas_name : str, optional
+        Name of the atlas, by default "stand_in_25um".
+    shape : Tuple[int, int, int], optional
+        Shape of the atlas, by default (40, 32, 48).
+    resolution : float, optional
+        Resolution of the atlas in um, by default 25.
+    n_structures : int, optional
+        Number of structures within the root structure, by default 8.
+    mesh_directory : str or os.PathLike, optional
+        Directory to write structure meshes to when they are first asked
+        for (see meshfile_from_structure), by default a temporary directory.
+    """
+
+    orientation = "asr"
+
+    def __init__(
+        self,
+        atlas_name: str = "stand_in_25um",
+        shape: Tuple[int, int, int] = (40, 32, 48),
+        resolution: float = 25.0,
+        n_structures: int = 8,
+        mesh_directory: Optional[Union[str, os.PathLike]] = None,
+    ):
+        self.atlas_name = atlas_name
+        self.mesh_directory = mesh_directory
+        self.shape = tuple(int(s) for s in shape)
+        self.resolution = (float(resolution),) * 3
+        self.space = bgs.AnatomicalSpace(
+            self.orientation, shape=self.shape, resolution=self.resolution
+        )
+
+        acronyms = [f"S{i}" for i in range(1, n_structures + 1)]
+        self._children = {"root": acronyms}
+        structures = [{"acronym": "root", "id": ROOT_ID, "name": "root"}] + [
+            {"acronym": acronym, "id": i, "name": f"Structure {i}"}
+            for i, acronym in enumerate(acronyms, start=1)
+        ]
+        # like BrainGlobeAtlas.structures, index by acronym or id
+        self.structures: Dict = {}
+        for structure in structures:
+            self.structures[structure["acronym"]] = structure
+            self.structures[structure["id"]] = structure
+
+        grid = np.indices(self.shape, dtype=np.float32)
+        centre = (np.array(self.shape, dtype=np.float32) - 1) / 2
+        radii = np.maximum(np.array(self.shape, dtype=np.float32) / 2, 1)
+        inside = (
+            sum(((grid[i] - centre[i]) / radii[i]) ** 2 for i in range(3)) <= 1
+        )
+        slab = np.minimum(
+            grid[0] * n_structures // self.shape[0], n_structures - 1
+        ).astype(np.uint32)
+        self.annotation = np.where(inside, slab + 1, 0).astype(np.uint32)
+        self.hemispheres = np.where(grid[2] < self.shape[2] / 2, 1, 2).astype(
+            np.uint8
+        )
+
+    def get_structure_descendants(self, acronym: str) -> List[str]:
+        return list(self._children.get(acronym, []))
+
+    def meshfile_from_structure(self, structure) -> Path:
+        """Get the .obj mesh file of a structure (by acronym or id), an
+        ellipsoid filling the structure's bounding box, in um."""
+        import meshio
+
+        structure_id = self.structures[structure]["id"]
+        if self.mesh_directory is None:
+            self.mesh_directory = tempfile.mkdtemp(prefix="stand_in_meshes_")
+        path = Path(self.mesh_directory) / f"{structure_id}.obj"
+        if not path.exists():
+            if structure_id == ROOT_ID:
+                voxels = np.argwhere(self.annotation)
+            else:
+                voxels = np.argwhere(self.annotation == structure_id)
+            start, stop = voxels.min(axis=0), voxels.max(axis=0) + 1
+            vertices, faces = make_ellipsoid_mesh(
+                (start + stop) / 2 * self.resolution,
+                (stop - start) / 2 * self.resolution,
+            )
+            path.parent.mkdir(parents=True, exist_ok=True)
+            meshio.write(path, meshio.Mesh(vertices, [("triangle", faces)]))
+        return path
+
+
+def make_ellipsoid_mesh(
+    centre: Sequence[float],
+    radii: Sequence[float],
+    n_rings: int = 24,
+    n_segments: int = 48,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Make a closed triangle mesh of an ellipsoid, with outward-facing
+    (counter-clockwise) triangles.
+
+    Returns
+    -------
+    vertices : np.ndarray
+        Nx3 array of vertex positions.
+    faces : np.ndarray
+        Mx3 array of the vertex indices of each triangle.
+    """
+    theta = np.linspace(0, np.pi, n_rings + 1)[1:-1]
+    phi = np.linspace(0, 2 * np.pi, n_segments, endpoint=False)
+    theta, phi = np.meshgrid(theta, phi, indexing="ij")
+    unit = np.stack(
+        [
+            np.cos(theta).ravel(),
+            (np.sin(theta) * np.cos(phi)).ravel(),
+            (np.sin(theta) * np.sin(phi)).ravel(),
+        ],
+        axis=1,
+    )
+    unit = np.concatenate([[[1, 0, 0]], unit, [[-1, 0, 0]]])
+    vertices = np.asarray(centre) + unit * np.asarray(radii)
+
+    def ring(i):
+        return 1 + i * n_segments + np.arange(n_segments)
+
+    next_segment = np.roll(np.arange(n_segments), -1)
+    first = ring(0)
+    faces = [
+        np.stack(
+            [np.zeros(n_segments, dtype=int), first, first[next_segment]],
+            axis=1,
+        )
+    ]
+    for i in range(n_rings - 2):
+        upper, lower = ring(i), ring(i + 1)
+        faces.append(np.stack([upper, lower, lower[next_segment]], axis=1))
+        faces.append(
+            np.stack([upper, lower[next_segment], upper[next_segment]], axis=1)
+        )
+    last = ring(n_rings - 2)
+    faces.append(
+        np.stack(
+            [np.full(n_segments, len(vertices) - 1), last[next_segment], last],
+            axis=1,
+        )
+    )
+    return vertices, np.concatenate(faces)
+
+
+@contextmanager
+def use_stand_in_atlas(atlas: StandInAtlas):
+    """Make get_atlas return a stand-in atlas (for any atlas name) within
+    the block."""
+    get_atlas.cache_clear()
+    with mock.patch(
+        "brainglobe_atlasapi.bg_atlas.BrainGlobeAtlas",
+        side_effect=lambda atlas_name: atlas,
+    ):
+        try:
+            yield atlas
+        finally:
+            get_atlas.cache_clear()
+
+
+class ThrottledOpener:
+    """Opens local files as if they were on high-latency storage: every
+    open, and every read, waits for a latency first. Each read is recorded.
+
+    Use in place of open, e.g. as the opener of ReadAhead.
+
+    Parameters
+    ----------
+    latency : float, optional
+        Seconds each open and read waits, by default 0.02.
+
+    Attributes
+    ----------
+    reads : List[Tuple[Path, int, int]]
+        The file, offset and number of bytes of each read.
+    max_concurrent : int
+        Most reads waiting or in progress at once.
+    """
+
+    def __init__(self, latency: float = 0.02):
+        self.latency = latency
+        self.reads: List[Tuple[Path, int, int]] = []
+        self.max_concurrent = 0
+        self._concurrent = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, path: os.PathLike, mode: str = "rb"):
+        time.sleep(self.latency)
+        return ThrottledFile(self, open(path, mode), Path(path))
+
+    def wait(self, path: Path, offset: int, n_bytes: int):
+        """Wait for the latency of a read, and record it."""
+        with self._lock:
+            self._concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self._concurrent)
+        time.sleep(self.latency)
+        with self._lock:
+            self._concurrent -= 1
+            self.reads.append((path, offset, n_bytes))
+
+
+class ThrottledFile:
+    """A file opened by a ThrottledOpener."""
+
+    def __init__(self, opener: ThrottledOpener, file, path: Path):
+        self.opener = opener
+        self.file = file
+        self.path = path
+
+    def read(self, size: int = -1) -> bytes:
+        offset = self.file.tell()
+        data = self.file.read(size)
+        self.opener.wait(self.path, offset, len(data))
+        return data
+
+    def readinto(self, buffer) -> int:
+        offset = self.file.tell()
+        n_read = self.file.readinto(buffer)
+        self.opener.wait(self.path, offset, n_read)
+        return n_read
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self) -> "ThrottledFile":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def make_brainreg_dir(
+    path: os.PathLike,
+    atlas: StandInAtlas,
+    voxel_sizes: Sequence[float],
+    n_channels: int = 1,
+    deformation_fields: bool = True,
+) -> Path:
+    """Write a synthetic brainreg output directory.
+
+    The sample is in the atlas orientation, so every registration image has
+    the shape of the atlas.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Directory to write to (created if needed).
+    atlas : StandInAtlas
+        Atlas the sample is "registered" to.
+    voxel_sizes : Sequence[float]
+        Voxel sizes of the raw data in um.
+    n_channels : int, optional
+        Number of channels, by default 1. Channels other than the first are
+        written as additional downsampled channels.
+    deformation_fields : bool, optional
+        Whether to write deformation fields, by default True.
+
+    Returns
+    -------
+    Path
+        The directory.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    metadata = {
+        "atlas": atlas.atlas_name,
+        "orientation": atlas.orientation,
+        "voxel_sizes": [str(v) for v in voxel_sizes],
+    }
+    with open(path / "brainreg.json", "w") as json_file:
+        json.dump(metadata, json_file)
+
+    rng = np.random.default_rng(0)
+    brain = (atlas.annotation > 0).astype(np.uint16)
+    for channel in range(n_channels):
+        image = brain * 1000 + rng.integers(
+            0, 100, atlas.shape, dtype=np.uint16
+        )
+        names = (
+            ["downsampled.tiff", "downsampled_standard.tiff"]
+            if channel == 0
+            else [
+                f"downsampled_channel_{channel}.tiff",
+                f"downsampled_standard_channel_{channel}.tiff",
+            ]
+        )
+        for name in names:
+            tifffile.imwrite(path / name, image)
+
+    tifffile.imwrite(path / "registered_atlas.tiff", atlas.annotation)
+    tifffile.imwrite(path / "registered_hemispheres.tiff", atlas.hemispheres)
+    boundaries = np.zeros(atlas.shape, dtype=np.uint8)
+    boundaries[:-1] |= atlas.annotation[1:] != atlas.annotation[:-1]
+    tifffile.imwrite(path / "boundaries.tiff", boundaries * 255)
+
+    if deformation_fields:
+        # an identity transform, in mm
+        grid = np.indices(atlas.shape, dtype=np.float32)
+        for axis in range(3):
+            tifffile.imwrite(
+                path / f"deformation_field_{axis}.tiff",
+                grid[axis] * atlas.resolution[axis] / 1000,
+            )
+    return path
+
+
+def write_ome_zarr(
+    path: os.PathLike,
+    image: np.ndarray,
+    n_levels: int = 2,
+    chunks: Tuple[int, int, int] = (8, 8, 8),
+    zarr_format: Literal[2, 3] = 3,
+) -> Path:
+    """Write an image as a multiscale OME-Zarr image (0.5 for Zarr v3, 0.4
+    for Zarr v2), each level half the size of the last.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        The image directory to write, e.g. "registered_atlas.ome.zarr".
+    image : np.ndarray
+        The 3D image.
+    n_levels : int, optional
+        Number of resolution levels, by default 2.
+    chunks : Tuple[int, int, int], optional
+        Chunk shape, by default (8, 8, 8).
+    zarr_format : int, optional
+        Zarr format version, 2 or 3 (by default).
+
+    Returns
+    -------
+    Path
+        The image directory.
+    """
+    import zarr
+
+    path = Path(path)
+    group = zarr.open_group(str(path), mode="w", zarr_format=zarr_format)
+    datasets = []
+    for level in range(n_levels):
+        factor = 2**level
+        data = image[::factor, ::factor, ::factor]
+        group.create_array(
+            str(level),
+            data=data,
+            chunks=tuple(min(c, s) for c, s in zip(chunks, data.shape)),
+        )
+        datasets.append(
+            {
+                "path": str(level),
+                "coordinateTransformations": [
+                    {"type": "scale", "scale": [float(factor)] * 3}
+                ],
+            }
+        )
+    multiscales: List[Dict[str, Any]] = [
+        {
+            "name": path.name,
+            "axes": [
+                {"name": axis, "type": "space", "unit": "micrometer"}
+                for axis in "zyx"
+            ],
+            "datasets": datasets,
+        }
+    ]
+    if zarr_format == 3:
+        group.attrs["ome"] = {"version": "0.5", "multiscales": multiscales}
+    else:
+        multiscales[0]["version"] = "0.4"
+        group.attrs["multiscales"] = multiscales
+    return path
+
+
+def convert_brainreg_dir_to_zarr(
+    path: os.PathLike, remove_tiffs: bool = True, **kwargs
+) -> List[Path]:
+    """Store every image in a brainreg directory as an OME-Zarr image (see
+    write_ome_zarr, which kwargs are passed to), next to its TIFF file.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        The brainreg directory.
+    remove_tiffs : bool, optional
+        Whether to remove the TIFF files, by default True.
+
+    Returns
+    -------
+    List[Path]
+        The Zarr images.
+    """
+    zarr_paths = []
+    for tiff_path in sorted(Path(path).glob("*.tiff")):
+        zarr_paths.append(
+            write_ome_zarr(
+                tiff_path.with_name(tiff_path.stem + ".ome.zarr"),
+                tifffile.imread(tiff_path),
+                **kwargs,
+            )
+        )
+        if remove_tiffs:
+            tiff_path.unlink()
+    return zarr_paths
+
+
+def make_brainmapper_dir(
+    path: os.PathLike,
+    atlas: StandInAtlas,
+    n_cells: int = 1000,
+    n_channels: int = 1,
+    scale: int = 2,
+    cube_size: Tuple[int, int, int] = (20, 50, 50),
+    seed: int = 0,
+) -> Path:
+    """Write a synthetic brainmapper output directory.
+
+    This has raw signal and background planes, a registration directory,
+    detected cells (half of which are classified as cells) for each signal
+    channel and the table of cells in atlas space.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Directory to write to (created if needed).
+    atlas : StandInAtlas
+        Atlas the sample is "registered" to.
+    n_cells : int, optional
+        Number of cell candidates per channel, by default 1000.
+    n_channels : int, optional
+        Number of signal channels, by default 1.
+    scale : int, optional
+        Size of an atlas voxel in raw data voxels, by default 2.
+    cube_size : Tuple[int, int, int], optional
+        Size of the cubes around each cell (at the resolution of the raw
+        data), by default (20, 50, 50).
+    seed : int, optional
+        Random seed, by default 0.
+
+    Returns
+    -------
+    Path
+        The directory.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    voxel_sizes = [r / scale for r in atlas.resolution]
+    raw_shape = tuple(s * scale for s in atlas.shape)
+
+    signal_paths = []
+    for channel in range(n_channels):
+        signal_paths.append(
+            write_planes(path / "raw" / f"signal_{channel}", raw_shape, rng)
+        )
+    background_path = write_planes(path / "raw" / "background", raw_shape, rng)
+
+    metadata = {
+        "signal_planes_paths": [str(p) for p in signal_paths],
+        "background_planes_path": [str(background_path)],
+        "signal_ch_ids": list(range(n_channels)) if n_channels > 1 else None,
+        "background_ch_id": None,
+        "voxel_sizes": [str(v) for v in voxel_sizes],
+        "network_voxel_sizes": voxel_sizes,
+        "cube_depth": cube_size[0],
+        "cube_height": cube_size[1],
+        "cube_width": cube_size[2],
+        "atlas": atlas.atlas_name,
+        "orientation": atlas.orientation,
+    }
+    with open(path / "brainmapper.json", "w") as json_file:
+        json.dump(metadata, json_file)
+
+    make_brainreg_dir(
+        path / "registration",
+        atlas,
+        voxel_sizes,
+        n_channels=n_channels,
+        deformation_fields=False,
+    )
+
+    all_positions = []
+    for channel in range(n_channels):
+        positions = rng.integers(1, raw_shape, size=(n_cells, 3))
+        types = np.where(np.arange(n_cells) % 2 == 0, CELL_TYPE, UNKNOWN_TYPE)
+        cells_dir = path / f"channel_{channel}" if n_channels > 1 else path
+        write_cells_xml(
+            cells_dir / "points" / "cell_classification.xml", positions, types
+        )
+        all_positions.append(positions[types == CELL_TYPE])
+
+    write_atlas_points(
+        path / "analysis" / "all_points.csv",
+        np.concatenate(all_positions),
+        atlas,
+        scale,
+    )
+    return path
+
+
+def write_planes(
+    directory: Path, shape: Tuple[int, ...], rng: np.random.Generator
+) -> Path:
+    """Write a stack of random uint16 planes, one TIFF per plane."""
+    directory.mkdir(parents=True, exist_ok=True)
+    for z in range(shape[0]):
+        tifffile.imwrite(
+            directory / f"plane_{z:05d}.tif",
+            rng.integers(0, 1000, shape[1:], dtype=np.uint16),
+        )
+    return directory
+
+
+def write_cells_xml(
+    path: Path,
+    positions: np.ndarray,
+    types: np.ndarray,
+    chunk_size: int = 100_000,
+):
+    """Write cells (given as (z, y, x) positions) in the cellfinder XML
+    format, without building a Cell object per cell."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    marker = (
+        "      <Marker>\n"
+        "        <MarkerX>{}</MarkerX>\n"
+        "        <MarkerY>{}</MarkerY>\n"
+        "        <MarkerZ>{}</MarkerZ>\n"
+        "      </Marker>\n"
+    )
+    with open(path, "w") as xml_file:
+        xml_file.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            "<CellCounter_Marker_File>\n"
+            "  <Image_Properties>\n"
+            "    <Image_Filename>placeholder.tif</Image_Filename>\n"
+            "  </Image_Properties>\n"
+            "  <Marker_Data>\n"
+            "    <Current_Type>1</Current_Type>\n"
+        )
+        for cell_type in (UNKNOWN_TYPE, CELL_TYPE):
+            xml_file.write(
+                f"    <Marker_Type>\n      <Type>{cell_type}</Type>\n"
+            )
+            typed = positions[types == cell_type]
+            for start in range(0, len(typed), chunk_size):
+                xml_file.write(
+                    "".join(
+                        marker.format(x, y, z)
+                        for z, y, x in typed[start : start + chunk_size]
+                    )
+                )
+            xml_file.write("    </Marker_Type>\n")
+        xml_file.write("  </Marker_Data>\n</CellCounter_Marker_File>\n")
+
+
+def write_atlas_points(
+    path: Path, positions: np.ndarray, atlas: StandInAtlas, scale: int
+):
+    """Write the table of cells in atlas space, as brainmapper does."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    atlas_positions = positions // scale
+    labels = atlas.annotation[tuple(atlas_positions.T)]
+    names = np.array(
+        ["Outside atlas"]
+        + [
+            atlas.structures[i]["name"]
+            for i in range(1, int(atlas.annotation.max()) + 1)
+        ]
+    )
+    hemispheres = np.where(
+        atlas.hemispheres[tuple(atlas_positions.T)] == 1, "left", "right"
+    )
+    columns: Dict[str, Optional[np.ndarray]] = {}
+    for axis in range(3):
+        columns[f"coordinate_raw_axis_{axis}"] = positions[:, axis]
+    for axis in range(3):
+        columns[f"coordinate_atlas_axis_{axis}"] = atlas_positions[:, axis]
+    columns["structure_name"] = names[labels]
+    columns["hemisphere"] = hemispheres
+    pd.DataFrame(columns).to_csv(path, index=False)
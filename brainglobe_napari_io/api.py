@@ -0,0 +1,102 @@
+"""Load BrainGlobe outputs without napari.
+
+These functions return the same data as the napari readers, with the same
+orientation, scaling and cell features, as a list of Layers. Neither napari
+nor Qt is imported, so they can be used in scripts and batch jobs (e.g. on
+cluster nodes without a display), e.g.::
+
+    from brainglobe_napari_io.api import get_layer, load_brainreg_dir
+
+    layers = load_brainreg_dir("brainreg_output", structure="HIP")
+    annotation = get_layer(layers, "allen_mouse_25um").data
+
+Each Layer is a (data, attributes, layer_type) named tuple, where attributes
+holds the keyword arguments napari would add the layer with (e.g. "name",
+"scale", "translate", "features" and "metadata").
+"""
+
+from brainglobe_napari_io.brainmapper.brainmapper_reader_dir import (
+    is_brainmapper_dir,
+    load_brainmapper_dir,
+)
+from brainglobe_napari_io.brainmapper.brainmapper_reader_dir_atlas_space import (  # noqa: E501
+    load_brainmapper_dir_atlas_space,
+)
+from brainglobe_napari_io.brainmapper.cohort_counts import (
+    CohortCounts,
+    count_cohort,
+    read_cohort_counts,
+)
+from brainglobe_napari_io.brainmapper.cube_reader import (
+    load_brainmapper_cubes,
+)
+from brainglobe_napari_io.brainmapper.watch import BrainmapperWatcher
+from brainglobe_napari_io.brainreg.cohort import load_cohort_average
+from brainglobe_napari_io.brainreg.reader_dir import load_brainreg_dir
+from brainglobe_napari_io.brainreg.reader_dir_atlas_space import (
+    load_brainreg_dir_atlas_space,
+)
+from brainglobe_napari_io.brainreg.reader_dir_sample_space import (
+    load_brainreg_dir_sample_space,
+)
+from brainglobe_napari_io.brainreg.session_zarr import (
+    export_session_zarr,
+    load_session_zarr,
+)
+from brainglobe_napari_io.brainreg.writer_labels import (
+    compact_labels_edits,
+    save_labels_edits,
+)
+from brainglobe_napari_io.cellfinder.cell_index import CellIndex
+from brainglobe_napari_io.cellfinder.reader_points import load_points
+from brainglobe_napari_io.cellfinder.region_counts import (
+    RegionCounts,
+    get_region_counts,
+)
+from brainglobe_napari_io.meshes import load_atlas_meshes
+from brainglobe_napari_io.planning import (
+    LoadPlan,
+    format_plan,
+    plan_brainmapper_dir,
+    plan_brainreg_dir,
+)
+from brainglobe_napari_io.utils import (
+    Layer,
+    as_layer_data_tuples,
+    as_layers,
+    get_layer,
+    is_brainreg_dir,
+)
+
+__all__ = [
+    "BrainmapperWatcher",
+    "CellIndex",
+    "CohortCounts",
+    "Layer",
+    "LoadPlan",
+    "RegionCounts",
+    "as_layer_data_tuples",
+    "as_layers",
+    "compact_labels_edits",
+    "count_cohort",
+    "export_session_zarr",
+    "format_plan",
+    "get_layer",
+    "get_region_counts",
+    "is_brainmapper_dir",
+    "is_brainreg_dir",
+    "load_atlas_meshes",
+    "load_brainmapper_cubes",
+    "load_brainmapper_dir",
+    "load_brainmapper_dir_atlas_space",
+    "load_brainreg_dir",
+    "load_brainreg_dir_atlas_space",
+    "load_brainreg_dir_sample_space",
+    "load_cohort_average",
+    "load_points",
+    "load_session_zarr",
+    "plan_brainmapper_dir",
+    "plan_brainreg_dir",
+    "read_cohort_counts",
+    "save_labels_edits",
+]
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
+
+import numpy as np
+
+from brainglobe_napari_io.profiling import add_file_read, profile
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# brainmapper has used both names for the list of cells in atlas space
+ATLAS_POINTS_FILENAMES = ("all_points.csv", "all_points_information.csv")
+
+RAW_COORDINATE_COLUMNS = [f"coordinate_raw_axis_{axis}" for axis in range(3)]
+ATLAS_COORDINATE_COLUMNS = [
+    f"coordinate_atlas_axis_{axis}" for axis in range(3)
+]
+REGION_COLUMNS = ["structure_name", "hemisphere"]
+
+
+def find_atlas_points_file(directory: os.PathLike) -> Optional[Path]:
+    """Find the atlas-space points table in a brainmapper output directory.
+
+    Parameters
+    ----------
+    directory : os.PathLike
+        Path to a brainmapper output directory.
+
+    Returns
+    -------
+    Path or None
+        The path to the points table, or None if brainmapper analysis wasn't
+        run.
+    """
+    analysis_directory = Path(directory) / "analysis"
+    for filename in ATLAS_POINTS_FILENAMES:
+        if (analysis_directory / filename).exists():
+            return analysis_directory / filename
+    return None
+
+
+@profile("cells parse")
+def read_atlas_points(
+    csv_path: os.PathLike, chunk_size: int = 500_000
+) -> Dict[str, np.ndarray]:
+    """Read the table of cells in atlas space written by brainmapper.
+
+    The table is streamed in chunks, so only one chunk of text is held in
+    memory at once. Coordinates are stored as float32, and the region
+    columns as integer codes into a table of unique names (i.e. as
+    categoricals), so a cell costs ~32 bytes rather than several hundred.
+
+    Parameters
+    ----------
+    csv_path : os.PathLike
+        Path to the points table (e.g. "analysis/all_points.csv").
+    chunk_size : int, optional
+        Number of rows to parse at once, by default 500,000.
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        - "atlas_coordinates", "raw_coordinates": Nx3 float32 arrays.
+        - "structure_name", "hemisphere": pandas Categorical arrays of length
+          N. Missing values (e.g. cells outside the brain) are NaN.
+    """
+    import pandas as pd
+
+    dtypes: Dict[str, Union[str, type]] = {
+        column: np.float32
+        for column in RAW_COORDINATE_COLUMNS + ATLAS_COORDINATE_COLUMNS
+    }
+    dtypes.update({column: "category" for column in REGION_COLUMNS})
+
+    coordinates: Dict[str, List[np.ndarray]] = {
+        "raw_coordinates": [],
+        "atlas_coordinates": [],
+    }
+    codes: Dict[str, List[np.ndarray]] = {c: [] for c in REGION_COLUMNS}
+    categories: Dict[str, Dict[str, int]] = {c: {} for c in REGION_COLUMNS}
+
+    add_file_read(csv_path)
+    reader = pd.read_csv(
+        csv_path,
+        usecols=list(dtypes),
+        dtype=dtypes,
+        chunksize=chunk_size,
+    )
+    for chunk in reader:
+        coordinates["raw_coordinates"].append(
+            chunk[RAW_COORDINATE_COLUMNS].to_numpy(dtype=np.float32)
+        )
+        coordinates["atlas_coordinates"].append(
+            chunk[ATLAS_COORDINATE_COLUMNS].to_numpy(dtype=np.float32)
+        )
+        for column in REGION_COLUMNS:
+            codes[column].append(
+                _merge_category_codes(chunk[column], categories[column])
+            )
+
+    points: Dict[str, np.ndarray] = {}
+    for name, arrays in coordinates.items():
+        points[name] = (
+            np.concatenate(arrays)
+            if arrays
+            else np.empty((0, 3), dtype=np.float32)
+        )
+    for column in REGION_COLUMNS:
+        column_codes = (
+            np.concatenate(codes[column])
+            if codes[column]
+            else np.empty(0, dtype=np.int32)
+        )
+        points[column] = pd.Categorical.from_codes(
+            column_codes, categories=list(categories[column])
+        )
+    return points
+
+
+def _merge_category_codes(
+    column: pd.Series, categories: Dict[str, int]
+) -> np.ndarray:
+    """Convert the categorical codes of a single chunk into codes into the
+    categories seen across all chunks so far (which are updated)."""
+    chunk_categories = column.cat.categories
+    lookup = np.array(
+        [categories.setdefault(c, len(categories)) for c in chunk_categories]
+        + [-1],
+        dtype=np.int32,
+    )
+    # missing values have code -1, which indexes the trailing -1
+    return lookup[column.cat.codes.to_numpy()]
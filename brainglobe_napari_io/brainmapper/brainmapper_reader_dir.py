@@ -1,20 +1,63 @@
+from __future__ import annotations
+
 import json
 import os
+from functools import partial
 from pathlib import Path
-from typing import Callable, Dict, List, Optional, Union
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
-from napari.types import LayerDataTuple
+import numpy as np
 
-from brainglobe_napari_io.brainreg.reader_dir import (
-    reader_function as brainreg_reader,
+from brainglobe_napari_io.brainmapper.pyramids import (
+    get_pyramid_dir,
+    load_pyramid,
+)
+from brainglobe_napari_io.brainmapper.raw_planes import load_plane_stack
+from brainglobe_napari_io.brainreg.reader_dir import load_brainreg_dir
+from brainglobe_napari_io.brainreg.writer_labels import (
+    track_loaded_labels_edits,
+)
+from brainglobe_napari_io.cellfinder.region_counts import (
+    RegionCounts,
+    track_region_counts,
 )
 from brainglobe_napari_io.cellfinder.utils import load_cells
+from brainglobe_napari_io.planning import (
+    LoadPlan,
+    plan_brainmapper_dir,
+    report_plan,
+)
+from brainglobe_napari_io.profiling import profile, span
+from brainglobe_napari_io.progressive import (
+    read_progressively,
+    track_when_added,
+)
+from brainglobe_napari_io.readahead import read_ahead_plan
+from brainglobe_napari_io.reader_options import (
+    get_load_raw_data,
+    get_structure,
+)
+from brainglobe_napari_io.regions import get_layers_region
 from brainglobe_napari_io.utils import (
+    Layer,
+    as_layer_data_tuples,
+    as_layers,
     get_atlas_class,
     remove_downsampled_images,
     scale_reorient_layers,
 )
 
+if TYPE_CHECKING:
+    from napari.types import LayerDataTuple
+
 PathOrPaths = Union[List[os.PathLike], os.PathLike]
 
 
@@ -72,6 +115,8 @@ def reader_function(
     point_size: int = 15,
     opacity: float = 0.6,
     symbol: str = "ring",
+    load_raw_data: Optional[bool] = None,
+    structure: Optional[str] = None,
 ) -> List[LayerDataTuple]:
     """Take a path or list of paths and return a list of LayerData tuples.
 
@@ -79,10 +124,25 @@ def reader_function(
     is (data, [add_kwargs, [layer_type]]), "add_kwargs" and "layer_type" are
     both optional.
 
+    This is a napari adapter for load_brainmapper_dir. Large registration
+    images are first shown as a coarse preview, and large sets of cells by
+    every nth cell, replaced with the full data once it has loaded in the
+    background (see brainglobe_napari_io.progressive).
+
     Parameters
     ----------
     path : str or list of str
         Path to file, or list of paths.
+    load_raw_data : bool, optional
+        If True, also add the raw signal and background channels referenced
+        in the metadata as lazily loaded image layers. By default, from the
+        BRAINGLOBE_NAPARI_IO_LOAD_RAW_DATA environment variable (see
+        brainglobe_napari_io.reader_options), or False.
+    structure : str, optional
+        Acronym of an atlas structure (e.g. "HIP"). If given, only the
+        bounding box of the structure is loaded from the registration, and
+        only the cells within it are shown. By default, from the
+        BRAINGLOBE_NAPARI_IO_STRUCTURE environment variable.
 
     Returns
     -------
@@ -95,68 +155,314 @@ def reader_function(
         Both "meta", and "layer_type" are optional. napari will default to
         layer_type=="image" if not provided
     """
+    load_raw_data = get_load_raw_data(load_raw_data)
+    structure = get_structure(structure)
+    load = partial(
+        load_brainmapper_dir,
+        path,
+        point_size=point_size,
+        opacity=opacity,
+        symbol=symbol,
+        load_raw_data=load_raw_data,
+        structure=structure,
+    )
+    if structure is not None:
+        layer_data = as_layer_data_tuples(load())
+    else:
+        layer_data = read_progressively(
+            load,
+            partial(plan_brainmapper_dir, path, load_raw_data=load_raw_data),
+        )
+    return track_when_added(
+        layer_data, [track_loaded_labels_edits, track_region_counts]
+    )
+
+
+@profile("brainmapper read directory")
+def load_brainmapper_dir(
+    path: os.PathLike,
+    point_size: int = 15,
+    opacity: float = 0.6,
+    symbol: str = "ring",
+    load_raw_data: bool = False,
+    structure: Optional[str] = None,
+    memory_budget: Optional[int] = None,
+    load_plan: Optional[LoadPlan] = None,
+) -> List[Layer]:
+    """Load a brainmapper output directory, without napari.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to brainmapper output directory.
+    point_size : int, optional
+        Size of the cell points, by default 15.
+    opacity : float, optional
+        Opacity of the cell points, by default 0.6.
+    symbol : str, optional
+        Symbol of the cell points, by default "ring".
+    load_raw_data : bool, optional
+        If True, also load the raw signal and background channels referenced
+        in the metadata as lazily loaded images, by default False.
+    structure : str, optional
+        Acronym of an atlas structure (e.g. "HIP"). If given, only the
+        bounding box of the structure is loaded from the registration, and
+        only the cells within it are read (see
+        brainglobe_napari_io.cellfinder.cell_blocks).
+    memory_budget : int, optional
+        Memory budget in bytes, by default from
+        brainglobe_napari_io.planning.get_memory_budget. Files that don't
+        fit are memory-mapped, lazily loaded or decimated, and the plan is
+        printed before loading. Not used with a structure.
+    load_plan : LoadPlan, optional
+        A plan (e.g. from plan_brainmapper_dir) to use instead of planning
+        with memory_budget.
+
+    Returns
+    -------
+    List[Layer]
+        Optionally the raw data, then the registration (scaled and oriented
+        to the raw data) if there is one, then the non-cell and cell points
+        of each channel. If there is a registration, the cells in each atlas
+        region are counted, and the counts (a RegionCounts, kept up to date
+        while curating in napari) are in the metadata of the points layers
+        (see brainglobe_napari_io.cellfinder.region_counts).
+    """
 
     print("Loading brainmapper directory")
     path = Path(os.path.abspath(path))
-    metadata = get_metadata(path)
+    with span("metadata read"):
+        metadata = get_metadata(path)
+
+    if structure is not None:
+        load_plan = None
+    elif load_plan is None:
+        with span("load plan"):
+            load_plan = plan_brainmapper_dir(
+                path, memory_budget, load_raw_data=load_raw_data
+            )
+        report_plan(load_plan)
+        read_ahead_plan(load_plan)
 
     layers: List[LayerDataTuple] = []
 
+    if load_raw_data:
+        layers = load_raw_data_channels(
+            layers, path, metadata, load_plan=load_plan
+        )
+
+    region_bounds = None
+    region_counts = None
     registration_directory = path / "registration"
     if registration_directory.exists():
-        layers = load_registration(layers, registration_directory, metadata)
-
-    if len(metadata["signal_planes_paths"]) > 1:
-        for channel_path in path.glob("channel*"):
-            channel = channel_path.name.split("_")[-1]
-            layers = load_cells_from_file(
-                channel_path,
-                layers,
-                point_size,
-                opacity,
-                symbol,
-                channel=channel,
-            )
+        layers = load_registration(
+            layers,
+            registration_directory,
+            metadata,
+            structure=structure,
+            load_plan=load_plan,
+        )
+        if structure is not None:
+            region_bounds = get_layers_region(layers)
+        region_counts = RegionCounts.from_layers(layers)
+    elif structure is not None:
+        print(f"No registration found in {path}, loading all cells")
 
-    else:
-        layers = load_cells_from_file(
-            path, layers, point_size, opacity, symbol
+    for cells_path, channel in get_cell_file_paths(path, metadata):
+        layer_plan = None if load_plan is None else load_plan.get(cells_path)
+        layers = load_cells(
+            layers,
+            cells_path,
+            point_size,
+            opacity,
+            symbol,
+            "lightgoldenrodyellow",
+            "lightskyblue",
+            channel=channel,
+            decimation=1 if layer_plan is None else layer_plan.decimation,
+            region_counts=region_counts,
+            bounds=region_bounds,
         )
 
-    return layers
+    return as_layers(layers)
 
 
-def load_cells_from_file(
-    path: Path,
-    layers: List[LayerDataTuple],
-    point_size: int,
-    opacity: float,
-    symbol: str,
-    channel=None,
-) -> List[LayerDataTuple]:
-    classified_cells_path = path / "points" / "cell_classification.xml"
-    layers = load_cells(
-        layers,
-        classified_cells_path,
-        point_size,
-        opacity,
-        symbol,
-        "lightgoldenrodyellow",
-        "lightskyblue",
-        channel=channel,
-    )
-    return layers
+def get_cell_file_paths(
+    path: Path, metadata: Dict
+) -> List[Tuple[Path, Optional[str]]]:
+    """Get the classified cell file of each channel of a brainmapper output
+    directory.
+
+    Parameters
+    ----------
+    path : Path
+        Path to the brainmapper output directory.
+    metadata : dict
+        brainmapper metadata, as returned by get_metadata.
+
+    Returns
+    -------
+    List[Tuple[Path, Optional[str]]]
+        The path to each cell file, and its channel (None if there is only
+        one).
+    """
+    if len(metadata["signal_planes_paths"]) > 1:
+        return [
+            (
+                channel_path / "points" / "cell_classification.xml",
+                channel_path.name.split("_")[-1],
+            )
+            for channel_path in path.glob("channel*")
+        ]
+    return [(path / "points" / "cell_classification.xml", None)]
 
 
 def load_registration(
-    layers: List[LayerDataTuple], registration_directory: os.PathLike, metadata
+    layers: List[LayerDataTuple],
+    registration_directory: os.PathLike,
+    metadata,
+    structure: Optional[str] = None,
+    load_plan: Optional[LoadPlan] = None,
 ) -> List[LayerDataTuple]:
-    registration_layers = brainreg_reader(registration_directory)
+    registration_layers = load_brainreg_dir(
+        registration_directory,
+        structure=structure,
+        orientation=metadata["orientation"],
+        load_plan=load_plan,
+    )
     registration_layers = remove_downsampled_images(registration_layers)
     atlas = get_atlas_class(registration_layers)
 
     registration_layers = scale_reorient_layers(
-        registration_layers, atlas, metadata
+        registration_layers, atlas, metadata, reorient=False
     )
     layers.extend(registration_layers)
     return layers
+
+
+def load_raw_data_channels(
+    layers: List[LayerDataTuple],
+    path: Path,
+    metadata: Dict,
+    cache_size: int = 64,
+    prefetch: int = 2,
+    load_plan: Optional[LoadPlan] = None,
+) -> List[LayerDataTuple]:
+    """Add the raw signal and background channels as lazy image layers.
+
+    Each channel is a virtual 3D stack over its plane files, so only the
+    planes being viewed are read from disk (see LazyPlaneStack). Channels
+    with an up-to-date pyramid (written by brainglobe-napari-io convert) are
+    multiscale, with the pyramid levels after the full resolution stack.
+    Channels whose planes can't be found are skipped.
+
+    Parameters
+    ----------
+    layers : List[LayerDataTuple]
+        List of layers to which the raw data layers will be added.
+    path : Path
+        Path to the brainmapper output directory.
+    metadata : dict
+        brainmapper metadata, as returned by get_metadata.
+    cache_size : int, optional
+        Maximum number of decoded planes to keep per channel, by default 64.
+    prefetch : int, optional
+        Number of neighbouring planes to read ahead, by default 2.
+    load_plan : LoadPlan, optional
+        A plan including the raw data, whose cache sizes are used instead
+        of cache_size.
+
+    Returns
+    -------
+    List[LayerDataTuple]
+        Updated list of layers with the raw data layers added.
+    """
+    for channel in get_raw_data_channels(metadata):
+        planes_path = channel["planes_path"]
+        stack = load_plane_stack(
+            planes_path, path, cache_size=cache_size, prefetch=prefetch
+        )
+        if stack is None:
+            print(f"Could not find raw data: {planes_path}, skipping")
+            continue
+        layer_plan = (
+            None
+            if load_plan is None
+            else load_plan.get(stack.plane_paths[0].parent)
+        )
+        if layer_plan is not None:
+            stack.cache_size = layer_plan.cache_size
+        pyramid = load_pyramid(stack, get_pyramid_dir(path, channel["key"]))
+
+        # set the contrast limits from a single plane, otherwise napari
+        # may read much more of the stack to estimate them
+        middle_plane = stack[len(stack) // 2]
+        contrast_limits = [
+            float(np.min(middle_plane)),
+            float(np.max(middle_plane)),
+        ]
+        if contrast_limits[0] == contrast_limits[1]:
+            contrast_limits[1] = contrast_limits[0] + 1
+
+        layers.append(
+            (
+                stack if pyramid is None else pyramid,
+                {
+                    "name": channel["name"],
+                    "visible": channel["visible"],
+                    "colormap": channel["colormap"],
+                    "blending": "additive",
+                    "contrast_limits": contrast_limits,
+                    "multiscale": pyramid is not None,
+                },
+                "image",
+            )
+        )
+    return layers
+
+
+def get_raw_data_channels(metadata: Dict) -> List[Dict]:
+    """Get the raw data channels referenced in brainmapper metadata.
+
+    Parameters
+    ----------
+    metadata : dict
+        brainmapper metadata, as returned by get_metadata.
+
+    Returns
+    -------
+    List[Dict]
+        For each signal channel, then the background channel, the path to
+        its planes ("planes_path"), a unique "key" (e.g. "signal_0"), and
+        the "name", "colormap" and "visible" of its layer.
+    """
+    signal_paths = metadata.get("signal_planes_paths") or []
+    channel_ids = metadata.get("signal_ch_ids") or range(len(signal_paths))
+
+    channels = []
+    for channel_id, planes_path in zip(channel_ids, signal_paths):
+        if len(signal_paths) > 1:
+            name = f"channel_{channel_id}: Signal"
+        else:
+            name = "Signal"
+        channels.append(
+            {
+                "planes_path": planes_path,
+                "key": f"signal_{channel_id}",
+                "name": name,
+                "colormap": "gray",
+                "visible": True,
+            }
+        )
+
+    for planes_path in metadata.get("background_planes_path") or []:
+        channels.append(
+            {
+                "planes_path": planes_path,
+                "key": "background",
+                "name": "Background",
+                "colormap": "magenta",
+                "visible": False,
+            }
+        )
+    return channels
@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, List, Optional, Sequence, Union
+
+from brainglobe_napari_io.brainmapper.atlas_points import (
+    find_atlas_points_file,
+    read_atlas_points,
+)
+from brainglobe_napari_io.brainmapper.brainmapper_reader_dir import (
+    get_metadata,
+    is_brainmapper_dir,
+)
+from brainglobe_napari_io.profiling import profile, span
+from brainglobe_napari_io.reader_options import get_structure
+from brainglobe_napari_io.regions import (
+    crop_points_layers,
+    get_atlas_bounding_boxes,
+    get_structure_region,
+)
+from brainglobe_napari_io.utils import (
+    Layer,
+    as_layer_data_tuples,
+    as_layers,
+    get_atlas,
+    load_atlas,
+    open_with_reader,
+)
+
+if TYPE_CHECKING:
+    from napari.types import LayerDataTuple
+
+PathOrPaths = Union[List[os.PathLike], os.PathLike]
+
+
+def brainmapper_read_dir_atlas_space(
+    path: PathOrPaths,
+) -> Optional[Callable]:
+    """A napari_get_reader hook specification for a reader of the cells
+    in atlas space from a brainmapper output directory.
+
+    Parameters
+    ----------
+    path : str or list of str
+        Path to file, or list of paths.
+
+    Returns
+    -------
+    function or None
+        If the path is a recognized format, return a function that accepts the
+        same path or list of paths, and returns a list of layer data tuples.
+    """
+    if (
+        isinstance(path, str)
+        and is_brainmapper_dir(path)
+        and find_atlas_points_file(path) is not None
+    ):
+        return reader_function
+    else:
+        return None
+
+
+def reader_function(
+    path: os.PathLike,
+    point_size: int = 3,
+    opacity: float = 0.6,
+    symbol: str = "ring",
+    chunk_size: int = 500_000,
+    structure: Optional[str] = None,
+) -> List[LayerDataTuple]:
+    """Reader function to read the cells detected by brainmapper in atlas
+    space, overlaid on the atlas annotation.
+
+    This is a napari adapter for load_brainmapper_dir_atlas_space, see it
+    for the parameters. The structure is by default from the
+    BRAINGLOBE_NAPARI_IO_STRUCTURE environment variable (see
+    brainglobe_napari_io.reader_options).
+
+    Returns
+    -------
+    layer_data : list of LayerDataTuple
+        The atlas annotation labels layer, and a points layer of the cells in
+        atlas space, with their structure name and hemisphere as features.
+    """
+    return as_layer_data_tuples(
+        load_brainmapper_dir_atlas_space(
+            path,
+            point_size=point_size,
+            opacity=opacity,
+            symbol=symbol,
+            chunk_size=chunk_size,
+            structure=get_structure(structure),
+        )
+    )
+
+
+@profile("brainmapper read directory (atlas space)")
+def load_brainmapper_dir_atlas_space(
+    path: os.PathLike,
+    point_size: int = 3,
+    opacity: float = 0.6,
+    symbol: str = "ring",
+    chunk_size: int = 500_000,
+    structure: Optional[str] = None,
+    meshes: Optional[Sequence[str]] = None,
+) -> List[Layer]:
+    """Load the cells detected by brainmapper in atlas space, and the atlas
+    annotation, without napari.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to brainmapper output directory.
+    point_size : int, optional
+        Size of the cell points, by default 3 (atlas voxels).
+    opacity : float, optional
+        Opacity of the cell points, by default 0.6.
+    symbol : str, optional
+        Symbol of the cell points, by default "ring".
+    chunk_size : int, optional
+        Number of rows of the points table to parse at once,
+        by default 500,000.
+    structure : str, optional
+        Acronym of an atlas structure (e.g. "HIP"). If given, only the
+        bounding box of the structure is loaded from the annotation, and
+        only the cells within it are kept.
+    meshes : Sequence[str], optional
+        Acronyms of structures whose meshes are added as surface layers
+        (see brainglobe_napari_io.meshes), by default those in the
+        BRAINGLOBE_NAPARI_IO_ATLAS_MESHES environment variable.
+
+    Returns
+    -------
+    List[Layer]
+        The atlas annotation and any meshes, and the cells in atlas space,
+        with their structure name and hemisphere as features.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the directory has no table of the cells in atlas space.
+    """
+    print("Loading brainmapper directory in atlas space")
+    path = Path(os.path.abspath(path))
+    points_path = find_atlas_points_file(path)
+    if points_path is None:
+        raise FileNotFoundError(
+            f"{path} has no cells in atlas space, run brainmapper with its "
+            "analysis"
+        )
+    with span("metadata read"):
+        metadata = get_metadata(path)
+
+    with span("atlas init", atlas=metadata["atlas"]):
+        atlas = get_atlas(metadata["atlas"])
+    region = None
+    if structure is not None:
+        with span("region index", structure=structure):
+            region = get_structure_region(
+                get_atlas_bounding_boxes(atlas), atlas, structure
+            )
+
+    layers: List[LayerDataTuple] = []
+    layers = load_atlas(atlas, layers, region=region, meshes=meshes)
+    layers = load_atlas_space_cells(
+        layers,
+        points_path,
+        point_size,
+        opacity,
+        symbol,
+        chunk_size=chunk_size,
+    )
+    if region is not None:
+        layers = crop_points_layers(
+            layers,
+            region["start"],
+            region["stop"],
+            metadata_keys=("raw_coordinates",),
+        )
+    return as_layers(layers)
+
+
+def load_atlas_space_cells(
+    layers: List[LayerDataTuple],
+    points_path: os.PathLike,
+    point_size: int,
+    opacity: float,
+    symbol: str,
+    cell_color: str = "lightgoldenrodyellow",
+    chunk_size: int = 500_000,
+) -> List[LayerDataTuple]:
+    """Add the cells in atlas space as a points layer.
+
+    Parameters
+    ----------
+    layers : List[LayerDataTuple]
+        List of layers to which the cells will be added.
+    points_path : os.PathLike
+        Path to the atlas-space points table written by brainmapper.
+    point_size : int
+        Size of the cell points.
+    opacity : float
+        Opacity of the cell points.
+    symbol : str
+        Symbol of the cell points.
+    cell_color : str, optional
+        Colour of the cell points, by default "lightgoldenrodyellow".
+    chunk_size : int, optional
+        Number of rows of the points table to parse at once,
+        by default 500,000.
+
+    Returns
+    -------
+    List[LayerDataTuple]
+        Updated list of layers with the cells added.
+    """
+    points = read_atlas_points(points_path, chunk_size=chunk_size)
+    layers.append(
+        (
+            points["atlas_coordinates"],
+            {
+                "name": "Cells (atlas space)",
+                "features": {
+                    "structure_name": points["structure_name"],
+                    "hemisphere": points["hemisphere"],
+                },
+                "size": point_size,
+                "n_dimensional": True,
+                "opacity": opacity,
+                "symbol": symbol,
+                "face_color": cell_color,
+                "metadata": {"raw_coordinates": points["raw_coordinates"]},
+            },
+            "points",
+        )
+    )
+    return layers
+
+
+def select_dialog():
+    """Open a brainmapper folder selection dialog and view its cells in
+    atlas space in napari.
+
+    This function is called via the IO Utilities submenu in Napari. The
+    atlas space reader isn't registered with napari, as brainmapper
+    folders are opened by brainmapper_read_dir.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    None
+    """
+    from qtpy.QtWidgets import QFileDialog
+
+    brainmapper_folder = QFileDialog.getExistingDirectory(
+        caption="Select brainmapper folder (atlas space)"
+    )
+    if brainmapper_folder:
+        open_with_reader(brainmapper_read_dir_atlas_space, brainmapper_folder)
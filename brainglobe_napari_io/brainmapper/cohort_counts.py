@@ -0,0 +1,380 @@
+"""Count the cells in each atlas region, for a cohort of brains.
+
+For each brainmapper output directory, the cells are read (from the binary
+copy if there is an up-to-date one, otherwise streaming the XML file) and
+the region (and optionally hemisphere) of every cell is looked up at once
+in the registered atlas, in the sample's orientation and scaled to the raw
+data, as when the directory is opened in napari. Directories are counted in
+parallel, in a pool of processes.
+
+The counts are combined into a brains by regions matrix, saved as one
+compressed .npz file, with the matrix and an array for each column (or row)
+label, e.g.::
+
+    brainglobe-napari-io count /data/cohort -o cohort_counts.npz
+
+    counts = read_cohort_counts("cohort_counts.npz").to_dataframe()
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+)
+
+import numpy as np
+
+from brainglobe_napari_io.brainmapper.brainmapper_reader_dir import (
+    get_cell_file_paths,
+    get_metadata,
+)
+from brainglobe_napari_io.brainreg.writer_labels import (
+    apply_labels_edits,
+    has_labels_edits,
+)
+from brainglobe_napari_io.cellfinder.cell_files import read_cell_positions
+from brainglobe_napari_io.cellfinder.region_counts import lookup_labels
+from brainglobe_napari_io.profiling import profile, span
+from brainglobe_napari_io.utils import (
+    get_atlas,
+    get_scale,
+    read_tiff,
+    read_tiff_reoriented,
+    write_atomically,
+)
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# value of the hemisphere of columns not split by hemisphere
+BOTH_HEMISPHERES = 0
+HEMISPHERE_NAMES = {1: "left", 2: "right"}
+
+
+class CohortCounts(NamedTuple):
+    """A brains by regions matrix of cell counts.
+
+    Attributes
+    ----------
+    brains : np.ndarray
+        The path of the brainmapper directory of each row.
+    channels : np.ndarray
+        The signal channel of each row ("" if there is only one).
+    structure_ids : np.ndarray
+        The atlas structure of each column (0 for cells outside the brain).
+    hemispheres : np.ndarray
+        The hemisphere of each column (e.g. 1 for left), or
+        BOTH_HEMISPHERES if the counts aren't split by hemisphere.
+    acronyms : np.ndarray
+        The acronym of the structure of each column.
+    counts : np.ndarray
+        The number of cells of each row in each column.
+    errors : Dict[str, str]
+        The error of each brain that couldn't be counted.
+    """
+
+    brains: np.ndarray
+    channels: np.ndarray
+    structure_ids: np.ndarray
+    hemispheres: np.ndarray
+    acronyms: np.ndarray
+    counts: np.ndarray
+    errors: Dict[str, str] = {}
+
+    def get_column_names(self) -> List[str]:
+        """Get a name for each column, e.g. "HIP" or "HIP (left)"."""
+        names = []
+        for acronym, hemisphere in zip(self.acronyms, self.hemispheres):
+            name = str(acronym)
+            if hemisphere != BOTH_HEMISPHERES:
+                hemisphere_name = HEMISPHERE_NAMES.get(
+                    int(hemisphere), str(hemisphere)
+                )
+                name = f"{name} ({hemisphere_name})"
+            names.append(name)
+        return names
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Get the counts as a table, indexed by brain and channel, with a
+        column for each structure (and hemisphere)."""
+        import pandas as pd
+
+        index = pd.MultiIndex.from_arrays(
+            [self.brains, self.channels], names=["brain", "channel"]
+        )
+        return pd.DataFrame(
+            self.counts, index=index, columns=self.get_column_names()
+        )
+
+
+@profile("count brain")
+def count_brain(path: os.PathLike, hemispheres: bool = False) -> List[Dict]:
+    """Count the cells of a brainmapper directory in each atlas region.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to a brainmapper output directory, with a registration.
+    hemispheres : bool, optional
+        Whether to count the cells in each hemisphere separately, by
+        default False.
+
+    Returns
+    -------
+    List[Dict]
+        For each signal channel, the "brain" and "channel", and the
+        "structure_ids", "hemispheres" and "counts" of each region with any
+        cells, and the "acronyms" of the structures.
+    """
+    from brainglobe_utils.cells.cells import Cell
+
+    path = Path(os.path.abspath(path))
+    metadata = get_metadata(path)
+    registration_directory = path / "registration"
+    with open(registration_directory / "brainreg.json") as json_file:
+        atlas_name = json.load(json_file)["atlas"]
+    with span("atlas init", atlas=atlas_name):
+        atlas = get_atlas(atlas_name)
+    scale = get_scale(atlas, metadata)
+
+    def read_registered(filename: str) -> np.ndarray:
+        # in the sample orientation, as the cells are
+        image_path = registration_directory / filename
+        if has_labels_edits(image_path):
+            # with the edits saved in napari, as the reader shows them
+            image = apply_labels_edits(read_tiff(image_path), image_path)
+            if metadata["orientation"] == atlas.orientation:
+                return image
+            import brainglobe_space as bgs
+
+            return bgs.map_stack_to(
+                atlas.orientation, metadata["orientation"], image
+            )
+        if metadata["orientation"] == atlas.orientation:
+            return read_tiff(image_path)
+        return read_tiff_reoriented(
+            image_path, atlas.orientation, metadata["orientation"]
+        )
+
+    annotation = read_registered("registered_atlas.tiff")
+    hemispheres_image = (
+        read_registered("registered_hemispheres.tiff") if hemispheres else None
+    )
+
+    results = []
+    for cells_path, channel in get_cell_file_paths(path, metadata):
+        positions, types = read_cell_positions(cells_path)
+        positions = positions[types == Cell.CELL]
+        with span("region lookup", n_points=len(positions)):
+            regions = lookup_labels(annotation, positions, scale)
+            if hemispheres_image is not None:
+                cell_hemispheres = lookup_labels(
+                    hemispheres_image, positions, scale
+                )
+            else:
+                cell_hemispheres = np.full(len(positions), BOTH_HEMISPHERES)
+        columns, counts = np.unique(
+            np.stack([regions, cell_hemispheres]), axis=1, return_counts=True
+        )
+        results.append(
+            {
+                "brain": str(path),
+                "channel": channel or "",
+                "structure_ids": columns[0],
+                "hemispheres": columns[1],
+                "counts": counts,
+                "acronyms": [
+                    get_acronym(atlas, structure_id)
+                    for structure_id in columns[0]
+                ],
+            }
+        )
+    return results
+
+
+def get_acronym(atlas, structure_id: int) -> str:
+    """Get the acronym of an atlas structure ("outside" for 0)."""
+    if structure_id == 0:
+        return "outside"
+    try:
+        return atlas.structures[int(structure_id)]["acronym"]
+    except (AttributeError, KeyError, TypeError):
+        return str(structure_id)
+
+
+def build_count_matrix(
+    results: Sequence[Dict], errors: Optional[Dict[str, str]] = None
+) -> CohortCounts:
+    """Combine the counts of each brain (from count_brain) into a brains by
+    regions matrix, with the rows in the order of results and the columns
+    sorted by structure and hemisphere."""
+    acronyms: Dict[tuple, str] = {}
+    for result in results:
+        for structure_id, hemisphere, acronym in zip(
+            result["structure_ids"], result["hemispheres"], result["acronyms"]
+        ):
+            acronyms[int(structure_id), int(hemisphere)] = acronym
+    columns = sorted(acronyms)
+    column_indices = {column: i for i, column in enumerate(columns)}
+
+    counts = np.zeros((len(results), len(columns)), dtype=np.uint32)
+    for row, result in enumerate(results):
+        indices = [
+            column_indices[int(s), int(h)]
+            for s, h in zip(result["structure_ids"], result["hemispheres"])
+        ]
+        counts[row, indices] = result["counts"]
+
+    return CohortCounts(
+        brains=np.array([r["brain"] for r in results], dtype=str),
+        channels=np.array([r["channel"] for r in results], dtype=str),
+        structure_ids=np.array([c[0] for c in columns], dtype=np.int64),
+        hemispheres=np.array([c[1] for c in columns], dtype=np.int64),
+        acronyms=np.array([acronyms[c] for c in columns], dtype=str),
+        counts=counts,
+        errors=dict(errors or {}),
+    )
+
+
+def write_cohort_counts(path: os.PathLike, cohort_counts: CohortCounts):
+    """Save a count matrix as a compressed .npz file, with an array for
+    each field of the CohortCounts (except the errors)."""
+    path = Path(path)
+    with write_atomically(path) as temporary_path:
+        with open(temporary_path, "wb") as counts_file:
+            np.savez_compressed(
+                counts_file,
+                **{
+                    field: getattr(cohort_counts, field)
+                    for field in CohortCounts._fields
+                    if field != "errors"
+                },
+            )
+
+
+def read_cohort_counts(path: os.PathLike) -> CohortCounts:
+    """Read a count matrix saved by write_cohort_counts."""
+    with np.load(path) as counts_file:
+        return CohortCounts(
+            **{
+                field: counts_file[field]
+                for field in CohortCounts._fields
+                if field != "errors"
+            },
+            errors={},
+        )
+
+
+def count_cohort(
+    paths: Sequence[os.PathLike],
+    output_path: Optional[os.PathLike] = None,
+    hemispheres: bool = False,
+    n_workers: Optional[int] = None,
+    progress: Optional[Callable[[str], None]] = print,
+) -> CohortCounts:
+    """Count the cells in each atlas region of a cohort of brains, in a
+    pool of processes.
+
+    Parameters
+    ----------
+    paths : Sequence[os.PathLike]
+        Paths to brainmapper output directories, with registrations.
+    output_path : os.PathLike, optional
+        If given, the matrix is saved to this .npz file (see
+        write_cohort_counts).
+    hemispheres : bool, optional
+        Whether to count the cells in each hemisphere separately, by
+        default False.
+    n_workers : int, optional
+        Number of processes. By default, the number of CPUs. If 1, the
+        brains are counted in this process.
+    progress : Callable[[str], None], optional
+        Function to report each brain with, by default print. None to not
+        report them.
+
+    Returns
+    -------
+    CohortCounts
+        The matrix, with a row for each channel of each brain (in the order
+        of paths). Brains that couldn't be counted are left out, with their
+        errors.
+    """
+    start = time.perf_counter()
+    brain_paths = [str(Path(os.path.abspath(path))) for path in paths]
+    results: Dict[str, List[Dict]] = {}
+    errors: Dict[str, str] = {}
+
+    def report(
+        brain_path: str,
+        brain_results: Optional[List[Dict]] = None,
+        error: Optional[str] = None,
+    ):
+        if error is None:
+            results[brain_path] = brain_results or []
+        else:
+            errors[brain_path] = error
+        if progress is not None:
+            n_cells = sum(
+                int(np.sum(result["counts"])) for result in brain_results or []
+            )
+            status = f"failed, {error}" if error else f"{n_cells} cells"
+            progress(
+                f"[{len(results) + len(errors)}/{len(brain_paths)}] "
+                f"{brain_path} ({status})"
+            )
+
+    if n_workers == 1 or len(brain_paths) <= 1:
+        for brain_path in brain_paths:
+            try:
+                report(brain_path, count_brain(brain_path, hemispheres))
+            except Exception as error:
+                report(brain_path, error=f"{type(error).__name__}: {error}")
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {
+                executor.submit(count_brain, brain_path, hemispheres): (
+                    brain_path
+                )
+                for brain_path in brain_paths
+            }
+            for future in as_completed(futures):
+                brain_path = futures[future]
+                try:
+                    report(brain_path, future.result())
+                except BrokenProcessPool as error:
+                    report(brain_path, error=f"worker process died ({error})")
+                except Exception as error:
+                    report(
+                        brain_path, error=f"{type(error).__name__}: {error}"
+                    )
+
+    cohort_counts = build_count_matrix(
+        [
+            result
+            for brain_path in brain_paths
+            for result in results.get(brain_path, [])
+        ],
+        errors,
+    )
+    if output_path is not None:
+        write_cohort_counts(output_path, cohort_counts)
+    if progress is not None:
+        duration = time.perf_counter() - start
+        progress(
+            f"Counted {len(results)} brains in {duration:.1f}s "
+            f"({len(results) / max(duration, 1e-9):.1f} brains/s), "
+            f"{len(errors)} failed"
+        )
+    return cohort_counts
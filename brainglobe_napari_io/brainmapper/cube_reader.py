@@ -0,0 +1,319 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+from brainglobe_napari_io.brainmapper.brainmapper_reader_dir import (
+    get_metadata,
+    is_brainmapper_dir,
+)
+from brainglobe_napari_io.brainmapper.cubes import (
+    CellCubes,
+    get_cube_shape,
+    sort_cells,
+)
+from brainglobe_napari_io.brainmapper.raw_planes import load_plane_stack
+from brainglobe_napari_io.cellfinder.cell_files import read_cells
+from brainglobe_napari_io.profiling import profile, span
+from brainglobe_napari_io.utils import (
+    Layer,
+    as_layer_data_tuples,
+    as_layers,
+    open_with_reader,
+)
+
+if TYPE_CHECKING:
+    from napari.types import LayerDataTuple
+
+PathOrPaths = Union[List[os.PathLike], os.PathLike]
+
+
+def brainmapper_read_cubes(path: PathOrPaths) -> Optional[Callable]:
+    """A napari_get_reader hook specification for viewing the cubes around
+    the cells detected by brainmapper.
+
+    Parameters
+    ----------
+    path : str or list of str
+        Path to file, or list of paths.
+
+    Returns
+    -------
+    function or None
+        If the path is a recognized format, return a function that accepts the
+        same path or list of paths, and returns a list of layer data tuples.
+    """
+    if isinstance(path, str) and is_brainmapper_dir(path):
+        return reader_function
+    else:
+        return None
+
+
+def reader_function(
+    path: os.PathLike,
+    cell_type: Optional[int] = None,
+    batch_size: int = 32,
+    cache_size: int = 1024,
+) -> List[LayerDataTuple]:
+    """Reader function to view the cubes of raw data around each cell in a
+    brainmapper output directory.
+
+    This is a napari adapter for load_brainmapper_cubes, see it for the
+    parameters.
+
+    Returns
+    -------
+    layer_data : list of LayerDataTuple
+        For each signal channel, the signal and background cube image
+        layers, followed by a points layer marking the centre of each cube
+        (with whether it is a cell as a feature).
+    """
+    return as_layer_data_tuples(
+        load_brainmapper_cubes(
+            path,
+            cell_type=cell_type,
+            batch_size=batch_size,
+            cache_size=cache_size,
+        )
+    )
+
+
+@profile("brainmapper read cubes")
+def load_brainmapper_cubes(
+    path: os.PathLike,
+    cell_type: Optional[int] = None,
+    batch_size: int = 32,
+    cache_size: int = 1024,
+) -> List[Layer]:
+    """Load the cubes of raw data around each cell in a brainmapper output
+    directory, without napari.
+
+    Each channel of raw data is a 4D (cell, z, y, x) image. Cubes are
+    extracted from the raw planes only when indexed (see CellCubes). Cells
+    are ordered by position, so that neighbouring cells are extracted
+    together.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to brainmapper output directory.
+    cell_type : int, optional
+        Only include cells of this type (e.g. Cell.CELL to review the
+        classified cells). By default, all cell candidates are included.
+    batch_size : int, optional
+        Number of cubes to extract from the raw data at once, by default 32.
+    cache_size : int, optional
+        Maximum number of cubes to keep in memory per channel,
+        by default 1024.
+
+    Returns
+    -------
+    List[Layer]
+        For each signal channel, the signal and background cubes, followed
+        by the centre of each cube as points (with whether it is a cell as
+        a feature).
+    """
+    print("Loading brainmapper cell cubes")
+    path = Path(os.path.abspath(path))
+    with span("metadata read"):
+        metadata = get_metadata(path)
+    cube_shape = get_cube_shape(metadata)
+
+    layers: List[LayerDataTuple] = []
+
+    background_stack = None
+    background_paths = metadata.get("background_planes_path") or []
+    if background_paths:
+        background_stack = load_plane_stack(
+            background_paths[0], path, prefetch=0
+        )
+
+    signal_paths = metadata.get("signal_planes_paths") or []
+    channel_ids = metadata.get("signal_ch_ids") or range(len(signal_paths))
+    for channel_id, planes_path in zip(channel_ids, signal_paths):
+        if len(signal_paths) > 1:
+            channel_base = f"channel_{channel_id}: "
+            cells_dir = path / f"channel_{channel_id}"
+        else:
+            channel_base = ""
+            cells_dir = path
+
+        # only planes around the cells are needed, so don't read ahead
+        signal_stack = load_plane_stack(planes_path, path, prefetch=0)
+        if signal_stack is None:
+            print(f"Could not find raw data: {planes_path}, skipping")
+            continue
+
+        positions, types = load_cell_positions(
+            cells_dir / "points" / "cell_classification.xml", cell_type
+        )
+        layers = load_cubes(
+            layers,
+            signal_stack,
+            background_stack,
+            positions,
+            types,
+            cube_shape,
+            channel_base=channel_base,
+            batch_size=batch_size,
+            cache_size=cache_size,
+        )
+
+    return as_layers(layers)
+
+
+def load_cell_positions(
+    cells_path: os.PathLike, cell_type: Optional[int] = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """Load the cell positions and types, in the order to review them.
+
+    Parameters
+    ----------
+    cells_path : os.PathLike
+        Path to a cellfinder XML/YAML file.
+    cell_type : int, optional
+        Only return cells of this type. By default, all cells are returned.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Nx3 array of (z, y, x) positions, and an array of N cell types.
+    """
+    positions, types, _ = read_cells(cells_path)
+    if cell_type is not None:
+        positions = positions[types == cell_type]
+        types = types[types == cell_type]
+
+    order = sort_cells(positions)
+    return positions[order], types[order]
+
+
+def load_cubes(
+    layers: List[LayerDataTuple],
+    signal_stack,
+    background_stack,
+    positions: np.ndarray,
+    types: np.ndarray,
+    cube_shape: tuple[int, int, int],
+    channel_base: str = "",
+    batch_size: int = 32,
+    cache_size: int = 1024,
+) -> List[LayerDataTuple]:
+    """Add the cubes around cells as 4D (cell, z, y, x) layers.
+
+    Parameters
+    ----------
+    layers : List[LayerDataTuple]
+        List of layers to which the cube layers will be added.
+    signal_stack, background_stack : array-like
+        3D raw data to extract cubes from. background_stack may be None.
+    positions : np.ndarray
+        Nx3 array of (z, y, x) cell positions.
+    types : np.ndarray
+        Array of N cell types.
+    cube_shape : tuple[int, int, int]
+        Size of each cube in (z, y, x).
+    channel_base : str, optional
+        Prefix for the layer names, e.g. "channel_1: ".
+    batch_size : int, optional
+        Number of cubes to extract from the raw data at once, by default 32.
+    cache_size : int, optional
+        Maximum number of cubes to keep in memory per channel,
+        by default 1024.
+
+    Returns
+    -------
+    List[LayerDataTuple]
+        Updated list of layers with the cube layers added.
+    """
+    from brainglobe_utils.cells.cells import Cell
+
+    metadata: Dict = {"cell_positions": positions, "cell_types": types}
+
+    centres = np.zeros((len(positions), 4))
+    centres[:, 0] = np.arange(len(positions))
+    centres[:, 1:] = np.array(cube_shape) // 2
+
+    stacks = [(signal_stack, "Signal cubes", "gray", True)]
+    if background_stack is not None:
+        stacks.append((background_stack, "Background cubes", "magenta", False))
+
+    for stack, name, colormap, visible in stacks:
+        cubes = CellCubes(
+            stack,
+            positions,
+            cube_shape,
+            batch_size=batch_size,
+            cache_size=cache_size,
+        )
+        layers.append(
+            (
+                cubes,
+                {
+                    "name": channel_base + name,
+                    "visible": visible,
+                    "colormap": colormap,
+                    "blending": "additive",
+                    "contrast_limits": get_contrast_limits(cubes),
+                    "multiscale": False,
+                    "metadata": metadata,
+                },
+                "image",
+            )
+        )
+
+    layers.append(
+        (
+            centres,
+            {
+                "name": channel_base + "Cell centres",
+                "size": 3,
+                "symbol": "cross",
+                "face_color": "lightgoldenrodyellow",
+                "features": {"is_cell": types == Cell.CELL},
+                "metadata": metadata,
+            },
+            "points",
+        )
+    )
+    return layers
+
+
+def get_contrast_limits(cubes: CellCubes) -> List[float]:
+    """Estimate contrast limits from the first cube, to avoid napari reading
+    many cubes to estimate them."""
+    if len(cubes) == 0:
+        return [0.0, 1.0]
+    cube = cubes[0]
+    contrast_limits = [float(cube.min()), float(cube.max())]
+    if contrast_limits[0] == contrast_limits[1]:
+        contrast_limits[1] = contrast_limits[0] + 1
+    return contrast_limits
+
+
+def select_dialog():
+    """Open a brainmapper folder selection dialog and view the cubes around
+    its cells in napari.
+
+    This function is called via the IO Utilities submenu in Napari. The
+    cube reader isn't registered with napari, as brainmapper folders are
+    opened by brainmapper_read_dir.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    None
+    """
+    from qtpy.QtWidgets import QFileDialog
+
+    brainmapper_folder = QFileDialog.getExistingDirectory(
+        caption="Select brainmapper folder (cell cubes)"
+    )
+    if brainmapper_folder:
+        open_with_reader(brainmapper_read_cubes, brainmapper_folder)
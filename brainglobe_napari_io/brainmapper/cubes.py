@@ -0,0 +1,338 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import (
+    CancelledError,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def get_cube_shape(metadata: Dict) -> Tuple[int, int, int]:
+    """Get the (z, y, x) size of the cubes around each cell, in raw voxels.
+
+    brainmapper defines the cube size at the resolution of the
+    classification network, so this is converted to the resolution of the
+    raw data.
+
+    Parameters
+    ----------
+    metadata : dict
+        brainmapper metadata, as returned by get_metadata.
+
+    Returns
+    -------
+    Tuple[int, int, int]
+        The cube depth, height and width in raw data voxels.
+    """
+    cube_size = (
+        metadata["cube_depth"],
+        metadata["cube_height"],
+        metadata["cube_width"],
+    )
+    voxel_sizes = metadata["voxel_sizes"]
+    network_voxel_sizes = metadata.get("network_voxel_sizes", voxel_sizes)
+    return tuple(  # type: ignore[return-value]
+        max(int(round(size * float(network) / float(voxel))), 1)
+        for size, network, voxel in zip(
+            cube_size, network_voxel_sizes, voxel_sizes
+        )
+    )
+
+
+# threads extracting the next batch of cubes, for every CellCubes, shared
+# so that cubes that are never closed don't each keep a thread alive.
+# (Separate from the threads reading planes ahead, which extraction waits
+# on.)
+N_PREFETCH_THREADS = 2
+_prefetch_executor: Optional[ThreadPoolExecutor] = None
+_prefetch_executor_lock = threading.Lock()
+
+
+def get_prefetch_executor() -> ThreadPoolExecutor:
+    """Get the threads that extract batches of cubes ahead, for every
+    CellCubes."""
+    global _prefetch_executor
+    with _prefetch_executor_lock:
+        if _prefetch_executor is None:
+            _prefetch_executor = ThreadPoolExecutor(
+                max_workers=N_PREFETCH_THREADS,
+                thread_name_prefix="cube-prefetch",
+            )
+        return _prefetch_executor
+
+
+def _reset_prefetch_executor():
+    """Forget the prefetch threads in a forked process (e.g. a worker of a
+    process pool), where they don't exist."""
+    global _prefetch_executor, _prefetch_executor_lock
+    _prefetch_executor = None
+    _prefetch_executor_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_prefetch_executor)
+
+
+class CellCubes:
+    """A virtual 4D (cell, z, y, x) array of cubes centred on cells.
+
+    Cubes are extracted from a 3D raw data stack on demand. When a cube is
+    requested that hasn't been extracted, it is extracted along with the
+    cubes of the following cells (a batch), reading each plane covered by the
+    batch only once. Extracted cubes are kept in a bounded
+    least-recently-used cache, and once the viewer steps into the latter half
+    of a batch, the next batch is extracted in the background (see
+    get_prefetch_executor).
+
+    Cells are best ordered so that neighbouring cells in the list are close
+    in z (e.g. with sort_cells), so that a batch covers few planes.
+
+    Parameters
+    ----------
+    stack : array-like
+        3D (z, y, x) raw data. If it has a ``get_plane`` method (e.g.
+        LazyPlaneStack), this is used to read whole planes.
+    positions : np.ndarray
+        Nx3 array of (z, y, x) cell positions in raw data voxels.
+    cube_shape : Tuple[int, int, int]
+        Size of each cube in (z, y, x).
+    batch_size : int, optional
+        Number of cubes to extract together, by default 32.
+    cache_size : int, optional
+        Maximum number of cubes to keep in memory, by default 1024.
+    """
+
+    def __init__(
+        self,
+        stack,
+        positions: np.ndarray,
+        cube_shape: Tuple[int, int, int],
+        batch_size: int = 32,
+        cache_size: int = 1024,
+    ):
+        self.stack = stack
+        self.positions = np.round(
+            np.asarray(positions, dtype=float).reshape(-1, 3)
+        ).astype(np.int64)
+        self.cube_shape = tuple(int(s) for s in cube_shape)
+        self.batch_size = max(batch_size, 1)
+        self.cache_size = max(cache_size, self.batch_size)
+
+        self.dtype = np.dtype(stack.dtype)
+        self.shape: Tuple[int, ...] = (len(self.positions), *self.cube_shape)
+        self.ndim = 4
+
+        # start (inclusive) of each cube, per axis
+        self._starts = self.positions - np.array(self.cube_shape) // 2
+
+        self._cache: OrderedDict[int, np.ndarray] = OrderedDict()
+        self._pending: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}(n_cells={len(self)}, "
+            f"cube_shape={self.cube_shape}, dtype={self.dtype}, "
+            f"cached_cubes={len(self._cache)})"
+        )
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        data = self[:]
+        if dtype is not None:
+            data = data.astype(dtype, copy=False)
+        return data
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    def __getitem__(self, key) -> np.ndarray:
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            idx = key.index(Ellipsis)
+            fill = (slice(None),) * (self.ndim - len(key) + 1)
+            key = key[:idx] + fill + key[idx + 1 :]
+        cell_key, cube_key = key[0], key[1:]
+
+        if isinstance(cell_key, (int, np.integer)):
+            index = int(cell_key)
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError(
+                    f"Index {cell_key} is out of bounds for axis 0 with "
+                    f"size {len(self)}"
+                )
+            return self.get_cube(index)[cube_key]
+
+        indices = np.arange(len(self))[cell_key]
+        cubes = [self.get_cube(int(i))[cube_key] for i in indices]
+        if not cubes:
+            empty = np.zeros((0, *self.cube_shape), dtype=self.dtype)
+            return empty[(slice(None), *cube_key)]
+        return np.stack(cubes)
+
+    def get_cube(self, index: int) -> np.ndarray:
+        """Return the cube around a single cell, extracting it if needed."""
+        with self._lock:
+            cube = self._cache.get(index)
+            if cube is not None:
+                self._cache.move_to_end(index)
+            pending = self._pending.get(index)
+
+        if cube is None:
+            if pending is not None and not pending.cancelled():
+                try:
+                    pending.result()
+                except CancelledError:
+                    # cancelled (e.g. by close) while waiting for it
+                    pass
+                with self._lock:
+                    cube = self._cache.get(index)
+            if cube is None:
+                cube = self.extract_batch(self._batch_from(index))[index]
+
+        self._prefetch_next_batch(index)
+        return cube
+
+    def extract_batch(self, indices: Sequence[int]) -> Dict[int, np.ndarray]:
+        """Extract the cubes around several cells, reading each plane once.
+
+        Parameters
+        ----------
+        indices : Sequence[int]
+            Indices of the cells to extract cubes for.
+
+        Returns
+        -------
+        Dict[int, np.ndarray]
+            The extracted cubes, keyed by cell index.
+        """
+        depth = self.cube_shape[0]
+        cubes = {
+            i: np.zeros(self.cube_shape, dtype=self.dtype) for i in indices
+        }
+        if not cubes:
+            return cubes
+
+        z_starts = self._starts[list(indices), 0]
+        first_plane = max(int(z_starts.min()), 0)
+        last_plane = min(int(z_starts.max()) + depth, self.stack.shape[0])
+
+        for z in range(first_plane, last_plane):
+            covering = [
+                i
+                for i, z_start in zip(indices, z_starts)
+                if z_start <= z < z_start + depth
+            ]
+            if not covering:
+                continue
+            plane = self._read_plane(z)
+            for i in covering:
+                self._copy_from_plane(plane, z, i, cubes[i])
+
+        with self._lock:
+            for i, cube in cubes.items():
+                self._cache[i] = cube
+                self._cache.move_to_end(i)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return cubes
+
+    def clear_cache(self):
+        """Drop all extracted cubes from memory."""
+        with self._lock:
+            self._cache.clear()
+
+    def close(self):
+        """Cancel the batches queued to be extracted (waiting for those
+        being extracted), and drop cached cubes."""
+        with self._lock:
+            pending = set(self._pending.values())
+        for future in pending:
+            future.cancel()
+        wait(pending)
+        with self._lock:
+            self._pending.clear()
+            self._cache.clear()
+
+    def _batch_from(self, index: int) -> List[int]:
+        stop = min(index + self.batch_size, len(self))
+        with self._lock:
+            return [
+                i
+                for i in range(index, stop)
+                if i == index
+                or (i not in self._cache and i not in self._pending)
+            ]
+
+    def _prefetch_next_batch(self, index: int):
+        # once past the middle of a batch, extract the next one in the
+        # background so that stepping through cells doesn't wait on disk
+        lookahead = index + self.batch_size // 2
+        if lookahead >= len(self):
+            return
+        with self._lock:
+            if lookahead in self._cache or lookahead in self._pending:
+                return
+        batch = self._batch_from(lookahead)
+        executor = get_prefetch_executor()
+        with self._lock:
+            future = executor.submit(self._extract_pending, batch)
+            for i in batch:
+                self._pending[i] = future
+
+    def _extract_pending(self, indices: List[int]):
+        try:
+            self.extract_batch(indices)
+        finally:
+            with self._lock:
+                for i in indices:
+                    self._pending.pop(i, None)
+
+    def _read_plane(self, z: int) -> np.ndarray:
+        if hasattr(self.stack, "get_plane"):
+            return self.stack.get_plane(z)
+        return np.asarray(self.stack[z])
+
+    def _copy_from_plane(
+        self, plane: np.ndarray, z: int, index: int, cube: np.ndarray
+    ):
+        z_start, y_start, x_start = self._starts[index]
+        height, width = self.cube_shape[1:]
+        y0, x0 = max(y_start, 0), max(x_start, 0)
+        y1 = min(y_start + height, plane.shape[0])
+        x1 = min(x_start + width, plane.shape[1])
+        if y1 <= y0 or x1 <= x0:
+            return
+        cube[
+            z - z_start,
+            y0 - y_start : y1 - y_start,
+            x0 - x_start : x1 - x_start,
+        ] = plane[y0:y1, x0:x1]
+
+
+def sort_cells(positions: np.ndarray) -> np.ndarray:
+    """Get the order to step through cells so neighbours share planes.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Nx3 array of (z, y, x) cell positions.
+
+    Returns
+    -------
+    np.ndarray
+        Indices that sort the cells by z, then y, then x.
+    """
+    positions = np.asarray(positions).reshape(-1, 3)
+    return np.lexsort((positions[:, 2], positions[:, 1], positions[:, 0]))
@@ -0,0 +1,177 @@
+"""Multiscale pyramids of raw data, for fast viewing when zoomed out.
+
+Viewing a whole plane of raw data zoomed out means reading the whole plane,
+so scrolling through large data is slow. A pyramid (written by
+``brainglobe-napari-io convert``) stores the raw data at lower resolutions,
+halving the size of each plane at each level, so napari only reads as much
+data as it displays. Planes are not downsampled along z, so each level has
+the same planes as the raw data.
+
+Each level is an uncompressed 3D TIFF, so can be memory-mapped. The
+pyramid of a channel is stored in ``pyramids/<channel>`` in the brainmapper
+output directory, with a ``pyramid.json`` file, written last, describing it.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+
+from brainglobe_napari_io.profiling import span
+from brainglobe_napari_io.utils import is_up_to_date, write_atomically
+
+PYRAMID_METADATA_FILENAME = "pyramid.json"
+
+
+def get_pyramid_dir(directory: os.PathLike, channel: str) -> Path:
+    """Get the directory of the pyramid of a raw data channel.
+
+    Parameters
+    ----------
+    directory : os.PathLike
+        The brainmapper output directory.
+    channel : str
+        Name of the channel, e.g. "signal_0" or "background".
+
+    Returns
+    -------
+    Path
+        The pyramid directory, which may not exist.
+    """
+    return Path(directory) / "pyramids" / channel
+
+
+def get_n_levels(plane_shape: Sequence[int], min_size: int = 512) -> int:
+    """Get the number of downsampled levels needed for the largest plane
+    dimension to be no larger than min_size (at most 8)."""
+    n_levels = 0
+    size = max(plane_shape)
+    while size > min_size and n_levels < 8:
+        size //= 2
+        n_levels += 1
+    return n_levels
+
+
+def downsample_plane(plane: np.ndarray) -> np.ndarray:
+    """Halve the size of a plane by averaging 2x2 blocks of pixels (dropping
+    any odd last row and column)."""
+    height, width = plane.shape[0] // 2 * 2, plane.shape[1] // 2 * 2
+    blocks = plane[:height, :width].reshape(height // 2, 2, width // 2, 2)
+    return blocks.mean(axis=(1, 3), dtype=np.float64).astype(plane.dtype)
+
+
+def write_pyramid(
+    stack,
+    output_dir: Union[str, os.PathLike],
+    n_levels: Optional[int] = None,
+) -> List[Path]:
+    """Write the downsampled levels of a pyramid of a 3D stack.
+
+    Planes are read, and levels are written, one at a time, so memory use
+    doesn't depend on the size of the stack.
+
+    Parameters
+    ----------
+    stack : array-like
+        3D (z, y, x) stack, e.g. a LazyPlaneStack.
+    output_dir : str or os.PathLike
+        Directory to write the levels to.
+    n_levels : int, optional
+        Number of downsampled levels. By default, enough for the largest
+        plane dimension of the last level to be 512 or less.
+
+    Returns
+    -------
+    List[Path]
+        The paths to the levels, from the highest resolution.
+    """
+    import tifffile
+
+    output_dir = Path(output_dir)
+    if n_levels is None:
+        n_levels = get_n_levels(stack.shape[1:])
+
+    level_paths = []
+    source = stack
+    for level in range(1, n_levels + 1):
+        level_path = output_dir / f"level_{level}.tiff"
+        shape = (
+            source.shape[0],
+            source.shape[1] // 2,
+            source.shape[2] // 2,
+        )
+        with span("pyramid level", level=level):
+            with write_atomically(level_path) as temporary_path:
+                output = tifffile.memmap(
+                    temporary_path,
+                    shape=shape,
+                    dtype=stack.dtype,
+                    photometric="minisblack",
+                )
+                for z in range(shape[0]):
+                    output[z] = downsample_plane(np.asarray(source[z]))
+                output.flush()
+                del output
+        level_paths.append(level_path)
+        source = tifffile.memmap(level_path, mode="r")
+
+    with write_atomically(
+        output_dir / PYRAMID_METADATA_FILENAME
+    ) as temporary_path:
+        with open(temporary_path, "w") as metadata_file:
+            json.dump(
+                {
+                    "shape": list(stack.shape),
+                    "dtype": np.dtype(stack.dtype).str,
+                    "levels": [path.name for path in level_paths],
+                },
+                metadata_file,
+            )
+    return level_paths
+
+
+def is_pyramid_up_to_date(
+    pyramid_dir: Union[str, os.PathLike],
+    source_paths: Sequence[Union[str, os.PathLike]],
+) -> bool:
+    """Whether a pyramid is complete and newer than its source files."""
+    return is_up_to_date(
+        Path(pyramid_dir) / PYRAMID_METADATA_FILENAME, source_paths
+    )
+
+
+def load_pyramid(stack, pyramid_dir: os.PathLike) -> Optional[List]:
+    """Load the levels of a stack's pyramid, if it has an up-to-date one.
+
+    Parameters
+    ----------
+    stack : LazyPlaneStack
+        The raw data stack.
+    pyramid_dir : os.PathLike
+        The directory of the pyramid.
+
+    Returns
+    -------
+    list or None
+        The stack, followed by each downsampled level (memory-mapped), as
+        napari multiscale data. None if there is no up-to-date pyramid of
+        the stack.
+    """
+    import tifffile
+
+    pyramid_dir = Path(pyramid_dir)
+    if not is_pyramid_up_to_date(pyramid_dir, stack.plane_paths):
+        return None
+    with open(pyramid_dir / PYRAMID_METADATA_FILENAME) as metadata_file:
+        metadata = json.load(metadata_file)
+    if (
+        tuple(metadata["shape"]) != tuple(stack.shape)
+        or not metadata["levels"]
+    ):
+        return None
+    return [stack] + [
+        tifffile.memmap(pyramid_dir / level, mode="r")
+        for level in metadata["levels"]
+    ]
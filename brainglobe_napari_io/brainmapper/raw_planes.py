@@ -0,0 +1,360 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import (
+    CancelledError,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from brainglobe_napari_io.profiling import add_bytes_read, add_file_read, span
+
+TIFF_EXTENSIONS = (".tif", ".tiff")
+
+
+def get_plane_paths(planes_path: os.PathLike) -> List[Path]:
+    """Get the sorted list of 2D plane files making up a raw data channel.
+
+    Parameters
+    ----------
+    planes_path : os.PathLike
+        Either a directory containing one TIFF file per plane, or a text file
+        listing the plane files (one per line), as accepted by brainmapper.
+
+    Returns
+    -------
+    List[Path]
+        The plane files, sorted naturally (i.e. 1, 2, 10 rather than 1, 10, 2).
+    """
+    from brainglobe_utils.general.system import get_sorted_file_paths
+
+    paths = [Path(p) for p in get_sorted_file_paths(str(planes_path))]
+    return [p for p in paths if p.suffix.lower() in TIFF_EXTENSIONS]
+
+
+def resolve_planes_path(planes_path: str, directory: Path) -> Optional[Path]:
+    """Find the raw data referenced in brainmapper metadata.
+
+    Paths are stored as passed to brainmapper, so may be relative to the
+    directory brainmapper was run from. Absolute paths are used as-is,
+    relative paths are tried relative to the brainmapper output directory.
+
+    Parameters
+    ----------
+    planes_path : str
+        Path to the raw planes, as stored in the metadata.
+    directory : Path
+        The brainmapper output directory.
+
+    Returns
+    -------
+    Path or None
+        The path to the raw planes, or None if they can't be found.
+    """
+    for candidate in (Path(planes_path), directory / planes_path):
+        if candidate.exists():
+            return candidate
+    return None
+
+
+# threads reading ahead the planes of every stack, shared so that stacks
+# that are never closed (e.g. of layers removed from napari) don't each
+# keep a thread alive
+N_PREFETCH_THREADS = 4
+_prefetch_executor: Optional[ThreadPoolExecutor] = None
+_prefetch_executor_lock = threading.Lock()
+
+
+def get_prefetch_executor() -> ThreadPoolExecutor:
+    """Get the threads that read planes ahead, for every stack."""
+    global _prefetch_executor
+    with _prefetch_executor_lock:
+        if _prefetch_executor is None:
+            _prefetch_executor = ThreadPoolExecutor(
+                max_workers=N_PREFETCH_THREADS,
+                thread_name_prefix="plane-prefetch",
+            )
+        return _prefetch_executor
+
+
+def _reset_prefetch_executor():
+    """Forget the prefetch threads in a forked process (e.g. a worker of a
+    process pool), where they don't exist."""
+    global _prefetch_executor, _prefetch_executor_lock
+    _prefetch_executor = None
+    _prefetch_executor_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_prefetch_executor)
+
+
+class LazyPlaneStack:
+    """A virtual 3D (z, y, x) stack over a sequence of 2D plane files.
+
+    Only the planes that are indexed are decoded. Decoded planes are kept in
+    a bounded least-recently-used cache, and planes neighbouring those most
+    recently requested are read ahead on background threads (shared by
+    every stack, see get_prefetch_executor), so that scrolling through the
+    stack in napari rarely waits on disk.
+
+    The stack is array-like (``shape``, ``dtype``, ``ndim`` and numpy-style
+    indexing), so it can be passed directly to napari as layer data.
+
+    Parameters
+    ----------
+    plane_paths : Sequence[str or os.PathLike]
+        One file per z-plane, in order.
+    cache_size : int, optional
+        Maximum number of decoded planes to keep in memory, by default 64.
+    prefetch : int, optional
+        Number of planes either side of a requested plane to read ahead,
+        by default 2. Set to 0 to disable prefetching.
+    """
+
+    def __init__(
+        self,
+        plane_paths: Sequence[Union[str, os.PathLike]],
+        cache_size: int = 64,
+        prefetch: int = 2,
+    ):
+        if len(plane_paths) == 0:
+            raise ValueError("No planes were given to build a stack from.")
+        self.plane_paths = [Path(p) for p in plane_paths]
+        self.cache_size = max(cache_size, 1)
+        self.prefetch = prefetch
+
+        import tifffile
+
+        with tifffile.TiffFile(self.plane_paths[0]) as tif:
+            page = tif.pages[0]
+            plane_shape = tuple(page.shape)
+            self.dtype = np.dtype(page.dtype)
+
+        self.shape: Tuple[int, ...] = (len(self.plane_paths), *plane_shape)
+        self.ndim = len(self.shape)
+
+        self._cache: OrderedDict[int, np.ndarray] = OrderedDict()
+        self._pending: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}(shape={self.shape}, dtype={self.dtype}, "
+            f"cached_planes={len(self._cache)})"
+        )
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        data = self[:]
+        if dtype is not None:
+            data = data.astype(dtype, copy=False)
+        return data
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self) -> int:
+        return self.size * self.dtype.itemsize
+
+    def __getitem__(self, key) -> np.ndarray:
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            idx = key.index(Ellipsis)
+            fill = (slice(None),) * (self.ndim - len(key) + 1)
+            key = key[:idx] + fill + key[idx + 1 :]
+        z_key, plane_key = key[0], key[1:]
+
+        if isinstance(z_key, (int, np.integer)):
+            z = int(z_key)
+            if z < 0:
+                z += self.shape[0]
+            if not 0 <= z < self.shape[0]:
+                raise IndexError(
+                    f"Index {z_key} is out of bounds for axis 0 with "
+                    f"size {self.shape[0]}"
+                )
+            plane = self.get_plane(z)
+            self.prefetch_around(z)
+            return plane[plane_key]
+
+        if isinstance(z_key, slice):
+            z_indices = range(*z_key.indices(self.shape[0]))
+        else:
+            z_indices = np.arange(self.shape[0])[z_key]
+
+        planes = self.get_planes(z_indices)
+        if len(z_indices) > 0:
+            self.prefetch_around(int(z_indices[-1]))
+        if not planes:
+            empty = np.empty((0, *self.shape[1:]), dtype=self.dtype)
+            return empty[(slice(None), *plane_key)]
+        return np.stack([plane[plane_key] for plane in planes])
+
+    def get_plane(self, z: int) -> np.ndarray:
+        """Return a single decoded plane, reading it if it is not cached."""
+        with self._lock:
+            if z in self._cache:
+                self._cache.move_to_end(z)
+                return self._cache[z]
+            pending = self._pending.get(z)
+
+        if pending is not None and not pending.cancelled():
+            try:
+                return pending.result()
+            except CancelledError:
+                # cancelled (e.g. by close) while waiting for it
+                pass
+        return self._load(z)
+
+    def get_planes(self, z_indices: Sequence[int]) -> List[np.ndarray]:
+        """Return several decoded planes, in the order requested."""
+        return [self.get_plane(int(z)) for z in z_indices]
+
+    def prefetch_around(self, z: int):
+        """Read the planes neighbouring ``z`` in the background."""
+        if self.prefetch <= 0:
+            return
+        start = max(z - self.prefetch, 0)
+        stop = min(z + self.prefetch + 1, self.shape[0])
+        self.prefetch_planes(range(start, stop))
+
+    def prefetch_planes(self, z_indices: Sequence[int]):
+        """Queue planes to be read in the background, if not cached."""
+        executor = get_prefetch_executor()
+        with self._lock:
+            for z in z_indices:
+                if z in self._cache or z in self._pending:
+                    continue
+                self._pending[z] = executor.submit(self._load, z)
+
+    def clear_cache(self):
+        """Drop all decoded planes from memory."""
+        with self._lock:
+            self._cache.clear()
+
+    def close(self):
+        """Cancel the planes queued to be read ahead (waiting for those
+        being read), and drop all cached planes."""
+        with self._lock:
+            pending = list(self._pending.values())
+        for future in pending:
+            future.cancel()
+        wait(pending)
+        with self._lock:
+            self._pending.clear()
+            self._cache.clear()
+
+    def _read_plane(self, z: int) -> np.ndarray:
+        import tifffile
+
+        plane = tifffile.imread(self.plane_paths[z])
+        add_file_read(self.plane_paths[z])
+        return plane
+
+    def _load(self, z: int) -> np.ndarray:
+        try:
+            with span("decode plane", plane=z):
+                plane = self._read_plane(z)
+        except BaseException:
+            with self._lock:
+                self._pending.pop(z, None)
+            raise
+        with self._lock:
+            self._cache[z] = plane
+            self._cache.move_to_end(z)
+            self._pending.pop(z, None)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return plane
+
+
+class LazyPageStack(LazyPlaneStack):
+    """A virtual 3D (z, y, x) stack over the pages of a 3D TIFF file, with
+    one (possibly compressed) page per plane.
+
+    Like LazyPlaneStack, only the planes that are indexed are decoded, and
+    a bounded number are cached.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to a 3D TIFF file, with one page per plane (see
+        is_paged_tiff).
+    cache_size : int, optional
+        Maximum number of decoded planes to keep in memory, by default 64.
+    prefetch : int, optional
+        Number of planes either side of a requested plane to read ahead,
+        by default 2.
+    """
+
+    def __init__(
+        self, path: os.PathLike, cache_size: int = 64, prefetch: int = 2
+    ):
+        import tifffile
+
+        self.path = Path(path)
+        with tifffile.TiffFile(self.path) as tif:
+            n_pages = len(tif.pages)
+        super().__init__(
+            [self.path] * n_pages, cache_size=cache_size, prefetch=prefetch
+        )
+
+    def _read_plane(self, z: int) -> np.ndarray:
+        import tifffile
+
+        plane = tifffile.imread(self.path, key=z)
+        add_bytes_read(plane.nbytes)
+        return plane
+
+
+def is_paged_tiff(path: os.PathLike) -> bool:
+    """Whether a TIFF file is a 3D image stored as one 2D page per plane,
+    so planes can be read individually (see LazyPageStack)."""
+    import tifffile
+
+    with tifffile.TiffFile(path) as tif:
+        series = tif.series[0]
+        return (
+            len(series.shape) == 3
+            and len(tif.pages) == series.shape[0]
+            and tuple(tif.pages[0].shape) == tuple(series.shape[1:])
+        )
+
+
+def load_plane_stack(
+    planes_path: str, directory: Path, **kwargs
+) -> Optional[LazyPlaneStack]:
+    """Build a lazy stack over raw planes referenced in brainmapper metadata.
+
+    Parameters
+    ----------
+    planes_path : str
+        Path to the raw planes, as stored in the metadata.
+    directory : Path
+        The brainmapper output directory.
+    **kwargs
+        Passed to LazyPlaneStack.
+
+    Returns
+    -------
+    LazyPlaneStack or None
+        The raw data stack, or None if the planes can't be found.
+    """
+    resolved_path = resolve_planes_path(planes_path, directory)
+    if resolved_path is None:
+        return None
+    plane_paths = get_plane_paths(resolved_path)
+    if not plane_paths:
+        return None
+    return LazyPlaneStack(plane_paths, **kwargs)
@@ -0,0 +1,297 @@
+"""Watch a brainmapper output directory that is still being written.
+
+During a long brainmapper run, the output directory can be watched to see
+the intermediate results. The registration images and cell files are polled
+by modification time and size (so it works on any filesystem, including
+network drives), and when one has changed and stopped changing, the layers
+are updated:
+
+- cells added to a cell file are appended to the existing points layers,
+  and for XML files only the new cells are parsed (see read_new_cells),
+- registration images are reloaded,
+- files that appear for the first time are added as new layers.
+
+e.g. from the napari console::
+
+    from brainglobe_napari_io.brainmapper.watch import watch_brainmapper_dir
+
+    worker = watch_brainmapper_dir("brainmapper_output", viewer)
+    # later
+    worker.quit()
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from functools import partial
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from brainglobe_napari_io.brainmapper.brainmapper_reader_dir import (
+    get_cell_file_paths,
+    get_metadata,
+    load_registration,
+)
+from brainglobe_napari_io.cellfinder.cell_files import read_new_cells
+from brainglobe_napari_io.cellfinder.utils import get_cell_layers
+from brainglobe_napari_io.planning import REGISTRATION_IMAGES
+from brainglobe_napari_io.utils import Layer, as_layers
+
+
+class FileState(NamedTuple):
+    """When a file was last modified, and its size."""
+
+    mtime_ns: int
+    size: int
+
+
+def get_file_state(path: os.PathLike) -> Optional[FileState]:
+    """Get the state of a file, or None if it doesn't exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return FileState(stat.st_mtime_ns, stat.st_size)
+
+
+class LayerUpdate(NamedTuple):
+    """A change to a layer.
+
+    Attributes
+    ----------
+    layer : Layer
+        The layer to add, or replace the data of the layer with the same
+        name with.
+    append : bool
+        If True, the layer's points are added to the layer with the same
+        name instead.
+    """
+
+    layer: Layer
+    append: bool = False
+
+
+class BrainmapperWatcher:
+    """Incrementally load a brainmapper output directory as it is written.
+
+    This doesn't need napari: each call to update returns the changes to
+    the layers since the last call.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to the brainmapper output directory.
+    point_size : int, optional
+        Size of the cell points, by default 15.
+    opacity : float, optional
+        Opacity of the cell points, by default 0.6.
+    symbol : str, optional
+        Symbol of the cell points, by default "ring".
+    settle_time : float, optional
+        Seconds a file must be unchanged for before it is read, so files
+        that are still being written aren't read, by default 2. Files are
+        also read once they are unchanged between two updates.
+    """
+
+    def __init__(
+        self,
+        path: os.PathLike,
+        point_size: int = 15,
+        opacity: float = 0.6,
+        symbol: str = "ring",
+        settle_time: float = 2,
+    ):
+        self.path = Path(os.path.abspath(path))
+        self.point_size = point_size
+        self.opacity = opacity
+        self.symbol = symbol
+        self.settle_time = settle_time
+        self._polled: Dict[Path, FileState] = {}
+        self._loaded: Dict[Path, FileState] = {}
+        self._cell_counts: Dict[Path, Dict[int, int]] = {}
+
+    @property
+    def registration_directory(self) -> Path:
+        return self.path / "registration"
+
+    def get_watched_paths(self) -> List[Path]:
+        """Get the files that are watched: the registration metadata and
+        images, and the cell file of each channel."""
+        registration_paths = [
+            self.registration_directory / filename
+            for filename in ("brainreg.json", *REGISTRATION_IMAGES)
+        ]
+        metadata = get_metadata(self.path)
+        cell_paths = [
+            cells_path
+            for cells_path, _ in get_cell_file_paths(self.path, metadata)
+        ]
+        return registration_paths + cell_paths
+
+    def get_changed_paths(self) -> List[Path]:
+        """Poll the watched files, and get those that have changed since
+        they were last loaded, and have stopped changing."""
+        changed = []
+        now = time.time_ns()
+        for path in self.get_watched_paths():
+            state = get_file_state(path)
+            previous_state = self._polled.get(path)
+            if state is None:
+                continue
+            self._polled[path] = state
+            if state == self._loaded.get(path):
+                continue
+            settled = (
+                state == previous_state
+                or now - state.mtime_ns >= self.settle_time * 1e9
+            )
+            if settled:
+                changed.append(path)
+        return changed
+
+    def update(self) -> List[LayerUpdate]:
+        """Load the changes to the directory since the last update.
+
+        Returns
+        -------
+        List[LayerUpdate]
+            The layers to add, replace or append to.
+        """
+        changed = self.get_changed_paths()
+        updates: List[LayerUpdate] = []
+
+        registration_paths = [
+            path
+            for path in changed
+            if path.parent == self.registration_directory
+        ]
+        if registration_paths and all(
+            (self.registration_directory / filename).exists()
+            for filename in ("brainreg.json", *REGISTRATION_IMAGES)
+        ):
+            layers = load_registration(
+                [], self.registration_directory, get_metadata(self.path)
+            )
+            updates.extend(LayerUpdate(layer) for layer in as_layers(layers))
+            self._mark_loaded(registration_paths)
+
+        metadata = get_metadata(self.path)
+        for cells_path, channel in get_cell_file_paths(self.path, metadata):
+            if cells_path in changed:
+                updates.extend(self._update_cells(cells_path, channel))
+        return updates
+
+    def _update_cells(
+        self, cells_path: Path, channel: Optional[str]
+    ) -> List[LayerUpdate]:
+        from xml.etree.ElementTree import ParseError
+
+        counts = self._cell_counts.get(cells_path)
+        try:
+            new_cells = read_new_cells(cells_path, counts)
+            append = counts is not None
+            if counts is not None and any(
+                new_cells.counts.get(cell_type, 0) < n
+                for cell_type, n in counts.items()
+            ):
+                # the file was rewritten with fewer cells, so reload it
+                new_cells = read_new_cells(cells_path)
+                append = False
+        except (ParseError, ValueError):
+            # still being written, try again at the next update
+            return []
+
+        self._cell_counts[cells_path] = new_cells.counts
+        self._mark_loaded([cells_path])
+        layers = get_cell_layers(
+            new_cells.positions,
+            new_cells.types,
+            new_cells.metadata,
+            self.point_size,
+            self.opacity,
+            self.symbol,
+            "lightgoldenrodyellow",
+            "lightskyblue",
+            channel=channel,
+        )
+        return [LayerUpdate(layer, append) for layer in as_layers(layers)]
+
+    def _mark_loaded(self, paths: List[Path]):
+        for path in paths:
+            self._loaded[path] = self._polled[path]
+
+
+def apply_updates(viewer, updates: List[LayerUpdate]):
+    """Apply layer updates (from BrainmapperWatcher.update) to a napari
+    viewer."""
+    import pandas as pd
+
+    for update in updates:
+        layer = update.layer
+        if layer.name not in viewer.layers:
+            getattr(viewer, f"add_{layer.layer_type}")(
+                layer.data, **layer.attributes
+            )
+            continue
+
+        viewer_layer = viewer.layers[layer.name]
+        if not update.append:
+            viewer_layer.data = layer.data
+            viewer_layer.scale = layer.scale
+            if "features" in layer.attributes:
+                viewer_layer.features = layer.attributes["features"]
+            continue
+
+        if len(layer.data) == 0:
+            continue
+        n_points = len(viewer_layer.data)
+        features = viewer_layer.features.iloc[:n_points]
+        viewer_layer.data = np.concatenate([viewer_layer.data, layer.data])
+        new_features = layer.attributes.get("features")
+        if new_features:
+            viewer_layer.features = pd.concat(
+                [features, pd.DataFrame(new_features)], ignore_index=True
+            )
+
+
+def watch_brainmapper_dir(
+    path: os.PathLike, viewer=None, interval: float = 5, **kwargs
+):
+    """Watch a brainmapper output directory, updating the layers of a napari
+    viewer as it is written.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to the brainmapper output directory.
+    viewer : napari.Viewer, optional
+        The viewer to update, by default the current viewer.
+    interval : float, optional
+        Seconds between polls of the directory, by default 5.
+    **kwargs
+        Passed to BrainmapperWatcher.
+
+    Returns
+    -------
+    napari.qt.threading.GeneratorWorker
+        The worker polling the directory in the background. Call its quit
+        method to stop watching.
+    """
+    from napari import current_viewer
+    from napari.qt.threading import create_worker
+
+    viewer = viewer or current_viewer()
+    watcher = BrainmapperWatcher(path, **kwargs)
+
+    def poll():
+        while True:
+            yield watcher.update()
+            time.sleep(interval)
+
+    worker = create_worker(poll, _start_thread=False)
+    worker.yielded.connect(partial(apply_updates, viewer))
+    worker.start()
+    return worker
@@ -0,0 +1,423 @@
+"""Average the atlas-space images of a cohort of brainreg directories.
+
+Group templates are built by averaging the registered images of many brains
+(e.g. ``downsampled_standard.tiff``), which are all in the same atlas space.
+Rather than loading every image, the atlas space is split into chunks of
+planes, and each chunk is streamed through every image in turn, updating
+the mean, variance and count of each voxel with Welford's online algorithm
+(which, unlike summing values and squares, is numerically stable).
+
+Chunks are averaged in parallel, each by a worker thread reading the chunk
+from each image, so at most one chunk of each image (plus its running
+statistics) is in memory per worker. Uncompressed TIFF files (as written by
+brainreg) are memory-mapped, so only the chunk is read. Files with one
+compressed page per plane have only the chunk's planes decoded, and Zarr
+variants of the images (see brainglobe_napari_io.ome_zarr) only the chunks
+overlapping it. Other compressed TIFF files can only be decoded whole, so
+each is decoded once, into an uncompressed scratch copy that the chunks are
+then read from.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+
+from brainglobe_napari_io.ome_zarr import find_image, is_zarr
+from brainglobe_napari_io.profiling import profile, span
+from brainglobe_napari_io.utils import (
+    Layer,
+    as_layer_data_tuples,
+    as_layers,
+    get_atlas,
+    is_brainreg_dir,
+    load_atlas,
+    read_tiff,
+)
+
+if TYPE_CHECKING:
+    from napari.types import LayerDataTuple
+
+PathOrPaths = Union[List[os.PathLike], os.PathLike]
+
+COHORT_IMAGE = "downsampled_standard.tiff"
+# bytes of each image (as float64) to read per chunk
+CHUNK_BYTES = 2**25
+
+
+def brainreg_read_cohort(path: PathOrPaths) -> Optional[Callable]:
+    """A basic implementation of the napari_get_reader hook specification.
+
+    Several brainreg directories opened together (e.g. with
+    ``viewer.open(paths, stack=True)``) are read as a cohort.
+
+    Parameters
+    ----------
+    path : str or list of str
+        Path to file, or list of paths.
+
+    Returns
+    -------
+    function or None
+        If the path is a recognized format, return a function that accepts the
+        same path or list of paths, and returns a list of layer data tuples.
+    """
+    if (
+        isinstance(path, (list, tuple))
+        and len(path) > 1
+        and all(is_brainreg_dir(p) for p in path)
+    ):
+        return reader_function
+    return None
+
+
+def reader_function(paths: List[os.PathLike]) -> List[LayerDataTuple]:
+    """
+    This is a napari adapter for load_cohort_average.
+
+    Parameters
+    ----------
+    paths : list of str
+        Paths to brainreg directories.
+
+    Returns
+    -------
+    layer_data : list of tuples
+        A list of LayerData tuples where each tuple in the list contains
+        (data, metadata, layer_type), where data is a numpy array, metadata is
+        a dict of keyword arguments for the corresponding viewer.add_* method
+        in napari, and layer_type is a lower-case string naming the type of
+        layer.
+    """
+    return as_layer_data_tuples(load_cohort_average(paths))
+
+
+def get_cohort_image_paths(
+    paths: Sequence[os.PathLike], filename: str = COHORT_IMAGE
+) -> Tuple[List[Path], str]:
+    """Get the atlas-space image of each brainreg directory of a cohort.
+
+    Parameters
+    ----------
+    paths : Sequence[os.PathLike]
+        Paths to brainreg directories.
+    filename : str, optional
+        The image in each directory, by default "downsampled_standard.tiff".
+
+    Returns
+    -------
+    image_paths : List[Path]
+        The path of each image.
+    atlas_name : str
+        The atlas the cohort was registered to.
+    """
+    if not paths:
+        raise ValueError("No brainreg directories to average")
+    image_paths = []
+    atlas_names = set()
+    for path in paths:
+        path = Path(os.path.abspath(path))
+        with open(path / "brainreg.json") as json_file:
+            atlas_names.add(json.load(json_file)["atlas"])
+        image_paths.append(path / filename)
+    if len(atlas_names) > 1:
+        raise ValueError(
+            "The brainreg directories were registered to different atlases "
+            f"({', '.join(sorted(atlas_names))}), so can't be averaged"
+        )
+    return image_paths, atlas_names.pop()
+
+
+def get_image_shape(path: os.PathLike) -> Tuple[int, ...]:
+    """Get the shape of an image (from its Zarr variant, if up to date),
+    from its header."""
+    from brainglobe_napari_io.ome_zarr import get_image_shape
+
+    shape, _ = get_image_shape(find_image(path))
+    return tuple(int(s) for s in shape)
+
+
+def get_chunk_source(
+    path: os.PathLike, scratch_dir: Union[str, os.PathLike]
+) -> Path:
+    """Get the file to read chunks of a cohort image from.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to a 3D TIFF image.
+    scratch_dir : str or os.PathLike
+        Directory to decode the image into, if its planes can't be read
+        separately.
+
+    Returns
+    -------
+    Path
+        The up-to-date Zarr variant of the image, or the image if it is
+        uncompressed or has one page per plane, or otherwise an uncompressed
+        copy of it in scratch_dir.
+    """
+    import tifffile
+
+    source = find_image(path)
+    if is_zarr(source):
+        return source
+    with tifffile.TiffFile(source) as tif:
+        series = tif.series[0]
+        if series.dataoffset is not None or (
+            len(tif.pages) == series.shape[0] > 1
+        ):
+            return source
+    print(
+        f"Decoding {source.name} once, as its planes are compressed together"
+    )
+    scratch_path = Path(scratch_dir) / f"{len(os.listdir(scratch_dir))}.tiff"
+    with span("decode", file=source.name):
+        tifffile.imwrite(scratch_path, tifffile.imread(source))
+    return scratch_path
+
+
+def get_chunk_planes(shape: Sequence[int], chunk_bytes: int = CHUNK_BYTES):
+    """Get the number of planes per chunk, for a chunk of an image (as
+    float64) to be at most chunk_bytes."""
+    plane_bytes = int(np.prod(shape[1:])) * 8
+    return int(np.clip(chunk_bytes // max(plane_bytes, 1), 1, shape[0]))
+
+
+class CohortStatistics:
+    """Running mean, variance and count of each voxel of a chunk of a
+    cohort's images (Welford's algorithm).
+
+    Parameters
+    ----------
+    shape : Tuple[int, ...]
+        Shape of the chunk.
+    """
+
+    def __init__(self, shape: Tuple[int, ...]):
+        self.count = np.zeros(shape, dtype=np.uint32)
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.m2 = np.zeros(shape, dtype=np.float64)
+
+    def add(self, image: np.ndarray, ignore_zeros: bool = False):
+        """Add an image of the chunk to the statistics. NaNs (and zeros, if
+        ignore_zeros) aren't counted."""
+        image = np.asarray(image, dtype=np.float64)
+        valid = ~np.isnan(image)
+        if ignore_zeros:
+            valid &= image != 0
+        self.count += valid
+        delta = np.where(valid, image - self.mean, 0)
+        self.mean += np.divide(
+            delta, self.count, out=np.zeros_like(delta), where=valid
+        )
+        self.m2 += np.where(valid, delta * (image - self.mean), 0)
+
+    def std(self, ddof: int = 0) -> np.ndarray:
+        """The standard deviation of each voxel (NaN where there are ddof or
+        fewer values)."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            variance = self.m2 / (self.count.astype(np.float64) - ddof)
+        variance[self.count <= ddof] = np.nan
+        return np.sqrt(np.maximum(variance, 0))
+
+
+@profile("cohort average")
+def average_cohort(
+    image_paths: Sequence[os.PathLike],
+    ignore_zeros: bool = False,
+    ddof: int = 0,
+    n_workers: Optional[int] = None,
+    chunk_planes: Optional[int] = None,
+) -> Dict[str, np.ndarray]:
+    """Compute the mean, standard deviation and count of each voxel of a
+    cohort of images with the same shape, streaming them chunk by chunk.
+
+    Parameters
+    ----------
+    image_paths : Sequence[os.PathLike]
+        Paths to 3D TIFF images (read from their Zarr variants, if up to
+        date).
+    ignore_zeros : bool, optional
+        If True, zeros (e.g. outside the imaged sample) aren't counted, by
+        default False. NaNs are never counted.
+    ddof : int, optional
+        Delta degrees of freedom of the standard deviation, by default 0
+        (the population standard deviation). Use 1 for the sample standard
+        deviation.
+    n_workers : int, optional
+        Number of chunks to average at once, by default the number of CPUs.
+    chunk_planes : int, optional
+        Number of planes per chunk, by default so each chunk of an image is
+        at most CHUNK_BYTES (as float64).
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        "mean" and "std" (float32) and "count" (uint32) of each voxel. The
+        mean and standard deviation are NaN where nothing was counted.
+    """
+    shapes = {path: get_image_shape(path) for path in image_paths}
+    shape = shapes[image_paths[0]]
+    for path, image_shape in shapes.items():
+        if image_shape != shape:
+            raise ValueError(
+                f"{path} has shape {image_shape}, but {image_paths[0]} has "
+                f"shape {shape}, so they can't be averaged"
+            )
+    chunk_planes = chunk_planes or get_chunk_planes(shape)
+    chunks = [
+        (start, min(start + chunk_planes, shape[0]))
+        for start in range(0, shape[0], chunk_planes)
+    ]
+    n_workers = min(n_workers or os.cpu_count() or 1, len(chunks))
+    print(
+        f"Averaging {len(image_paths)} images in {len(chunks)} chunks, with "
+        f"{n_workers} workers"
+    )
+
+    result = {
+        "mean": np.empty(shape, dtype=np.float32),
+        "std": np.empty(shape, dtype=np.float32),
+        "count": np.empty(shape, dtype=np.uint32),
+    }
+
+    def average_chunk(chunk: Tuple[int, int]):
+        start, stop = chunk
+        region = {"start": (start, 0, 0), "stop": (stop, *shape[1:])}
+        with span("cohort chunk", start=start, stop=stop):
+            statistics = CohortStatistics((stop - start, *shape[1:]))
+            for path in sources:
+                statistics.add(read_tiff(path, region), ignore_zeros)
+            mean = statistics.mean
+            mean[statistics.count == 0] = np.nan
+            result["mean"][start:stop] = mean
+            result["std"][start:stop] = statistics.std(ddof)
+            result["count"][start:stop] = statistics.count
+
+    with tempfile.TemporaryDirectory(prefix="cohort-") as scratch_dir:
+        sources = [get_chunk_source(path, scratch_dir) for path in image_paths]
+        if n_workers == 1:
+            for chunk in chunks:
+                average_chunk(chunk)
+        else:
+            with ThreadPoolExecutor(
+                max_workers=n_workers, thread_name_prefix="cohort"
+            ) as executor:
+                # list, to raise any errors
+                list(executor.map(average_chunk, chunks))
+    return result
+
+
+@profile("brainreg read cohort")
+def load_cohort_average(
+    paths: Sequence[os.PathLike],
+    filename: str = COHORT_IMAGE,
+    ignore_zeros: bool = False,
+    ddof: int = 0,
+    n_workers: Optional[int] = None,
+) -> List[Layer]:
+    """Load the average of the atlas-space images of a cohort of brainreg
+    directories, without napari.
+
+    Parameters
+    ----------
+    paths : Sequence[os.PathLike]
+        Paths to brainreg directories, registered to the same atlas.
+    filename : str, optional
+        The image to average in each directory, by default
+        "downsampled_standard.tiff" (e.g. use
+        "downsampled_standard_<channel>.tiff" for an additional channel).
+    ignore_zeros, ddof, n_workers
+        As for average_cohort.
+
+    Returns
+    -------
+    List[Layer]
+        The mean, standard deviation and count of each voxel as images,
+        followed by the atlas annotation.
+    """
+    print(f"Loading cohort of {len(paths)} brainreg directories")
+    image_paths, atlas_name = get_cohort_image_paths(paths, filename)
+    with span("atlas init", atlas=atlas_name):
+        atlas = get_atlas(atlas_name)
+    statistics = average_cohort(
+        image_paths, ignore_zeros=ignore_zeros, ddof=ddof, n_workers=n_workers
+    )
+
+    metadata = {
+        "atlas": atlas_name,
+        "atlas_class": atlas,
+        "cohort": [str(path.parent) for path in image_paths],
+    }
+    layers: List[LayerDataTuple] = [
+        (
+            statistics["mean"],
+            {"name": "Cohort mean", "metadata": metadata},
+            "image",
+        ),
+        (
+            statistics["std"],
+            {"name": "Cohort std", "visible": False, "metadata": metadata},
+            "image",
+        ),
+        (
+            statistics["count"],
+            {"name": "Cohort count", "visible": False, "metadata": metadata},
+            "image",
+        ),
+    ]
+    layers = load_atlas(atlas, layers)
+    return as_layers(layers)
+
+
+def select_dialog():
+    """Open a folder selection dialog, and show the average of the
+    brainreg directories within it in napari.
+
+    The average is computed in the background, and added to the viewer
+    once it is done.
+
+    This function is called via the IO Utilities submenu in Napari.
+    """
+    from napari import current_viewer
+    from napari.qt.threading import create_worker
+    from qtpy.QtWidgets import QFileDialog
+
+    from brainglobe_napari_io.convert import find_output_dirs
+
+    folder = QFileDialog.getExistingDirectory(
+        caption="Select a folder of brainreg folders to average"
+    )
+    if not folder:
+        return
+    paths = [
+        path for kind, path in find_output_dirs(folder) if kind == "brainreg"
+    ]
+    if not paths:
+        print(f"No brainreg directories found in {folder}")
+        return
+    viewer = current_viewer()
+
+    def add_layers(layers: List[Layer]):
+        for data, attributes, layer_type in layers:
+            getattr(viewer, f"add_{layer_type}")(data, **attributes)
+
+    worker = create_worker(load_cohort_average, paths, _start_thread=False)
+    worker.returned.connect(add_layers)
+    worker.start()
@@ -0,0 +1,376 @@
+from __future__ import annotations
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional, Sequence
+
+import numpy as np
+
+from brainglobe_napari_io.ome_zarr import find_image, read_image
+from brainglobe_napari_io.profiling import profile
+from brainglobe_napari_io.utils import (
+    read_tiff,
+    region_attributes,
+    reorient_points,
+)
+
+if TYPE_CHECKING:
+    from napari.types import LayerDataTuple
+
+DEFORMATION_FIELD_FILENAMES = [
+    f"deformation_field_{axis}.tiff" for axis in range(3)
+]
+
+
+def has_deformation_fields(path: os.PathLike) -> bool:
+    """Whether a brainreg output directory contains deformation fields."""
+    return all(
+        find_image(Path(path) / filename).exists()
+        for filename in DEFORMATION_FIELD_FILENAMES
+    )
+
+
+def memmap_tiff(path: os.PathLike) -> np.ndarray:
+    """Memory-map a TIFF file, so data is only read from disk when accessed.
+
+    Falls back to reading the whole file if it can't be memory-mapped
+    (e.g. if it is compressed). If the file has an up-to-date Zarr variant
+    (see brainglobe_napari_io.ome_zarr), that is opened instead, and read
+    lazily.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to the TIFF file.
+
+    Returns
+    -------
+    np.ndarray
+        The image, as a read-only memory map if possible.
+    """
+    return read_image(find_image(path))
+
+
+def load_deformation_fields(path: os.PathLike) -> List[np.ndarray]:
+    """Load the three deformation fields from a brainreg output directory.
+
+    The deformation fields are defined on the grid of the downsampled
+    (registered) image, and give the position (in mm) that each voxel maps
+    to in the atlas, along each atlas axis.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to the brainreg output directory.
+
+    Returns
+    -------
+    List[np.ndarray]
+        The deformation field for each atlas axis, memory-mapped if possible.
+    """
+    return [
+        memmap_tiff(Path(path) / filename)
+        for filename in DEFORMATION_FIELD_FILENAMES
+    ]
+
+
+def load_deformation_field_layers(
+    path: os.PathLike,
+    layers: List[LayerDataTuple],
+    region: Optional[dict] = None,
+) -> List[LayerDataTuple]:
+    """Add the deformation fields in a brainreg directory as image layers.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to the brainreg output directory.
+    layers : List[LayerDataTuple]
+        List of layers to which the deformation fields will be added.
+    region : dict, optional
+        If given, only add this region of the deformation fields (see
+        brainglobe_napari_io.regions.get_structure_region).
+
+    Returns
+    -------
+    List[LayerDataTuple]
+        Updated list of layers with the deformation fields added.
+    """
+    if not has_deformation_fields(path):
+        print(f"No deformation fields found in {path}, skipping")
+        return layers
+
+    if region is None:
+        fields = load_deformation_fields(path)
+    else:
+        fields = [
+            read_tiff(Path(path) / filename, region)
+            for filename in DEFORMATION_FIELD_FILENAMES
+        ]
+
+    for axis, field in enumerate(fields):
+        layers.append(
+            (
+                field,
+                region_attributes(
+                    {
+                        "name": f"Deformation field {axis}",
+                        "visible": False,
+                        "colormap": "twilight",
+                    },
+                    region,
+                ),
+                "image",
+            )
+        )
+    return layers
+
+
+@profile("deformation transform")
+def transform_points_downsampled_to_atlas(
+    points: np.ndarray,
+    deformation_fields: Sequence[np.ndarray],
+    atlas_resolution: Sequence[float],
+    chunk_size: int = 250_000,
+    n_workers: Optional[int] = None,
+) -> np.ndarray:
+    """Transform points from brainreg's downsampled space to atlas space.
+
+    The deformation fields are sampled at each point with trilinear
+    interpolation, in one vectorised pass per chunk of points. Chunks are
+    transformed in parallel threads. If the fields are Zarr arrays, points
+    are chunked in order along the first axis, so each chunk only reads a
+    slab of the fields.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Nx3 array of points in the downsampled space (i.e. indices into the
+        registered image, which has the orientation and resolution of the
+        atlas).
+    deformation_fields : Sequence[np.ndarray]
+        The three deformation fields, as returned by load_deformation_fields.
+    atlas_resolution : Sequence[float]
+        Resolution of the atlas in um, per axis.
+    chunk_size : int, optional
+        Number of points to transform at once, by default 250,000.
+    n_workers : int, optional
+        Number of threads to transform chunks in. By default, uses
+        the number of CPUs.
+
+    Returns
+    -------
+    np.ndarray
+        Nx3 array of points in atlas voxel coordinates. Points outside the
+        deformation fields are NaN.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    # deformation fields are in mm
+    field_scales = np.array([1000 / float(r) for r in atlas_resolution])
+    if all(isinstance(field, np.ndarray) for field in deformation_fields):
+        order = np.arange(len(points))
+    else:
+        order = np.argsort(points[:, 0], kind="stable")
+    transformed = np.empty_like(points)
+
+    def transform_chunk(start: int):
+        chunk = order[start : start + chunk_size]
+        transformed[chunk] = (
+            sample_trilinear(deformation_fields, points[chunk]) * field_scales
+        )
+
+    starts = range(0, len(points), chunk_size)
+    if len(starts) > 1:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            list(executor.map(transform_chunk, starts))
+    else:
+        for start in starts:
+            transform_chunk(start)
+    return transformed
+
+
+def sample_trilinear(
+    volumes: Sequence[np.ndarray], points: np.ndarray
+) -> np.ndarray:
+    """Sample several volumes of the same shape at fractional points.
+
+    Volumes that aren't numpy arrays (e.g. Zarr arrays, see
+    load_deformation_fields) are read once, in the block around the points.
+
+    Parameters
+    ----------
+    volumes : Sequence[np.ndarray]
+        3D volumes to sample, all of the same shape.
+    points : np.ndarray
+        Nx3 array of points to sample at.
+
+    Returns
+    -------
+    np.ndarray
+        N x len(volumes) array of interpolated values. Points outside the
+        volumes are NaN.
+    """
+    shape = np.array(volumes[0].shape)
+    points = np.asarray(points, dtype=np.float64)
+    inside = np.all((points >= 0) & (points <= shape - 1), axis=1)
+
+    # the lower corner of the voxel each point is in, clipped so the upper
+    # corner is still within the volume
+    lower = np.clip(np.floor(points), 0, np.maximum(shape - 2, 0))
+    lower = lower.astype(np.int64)
+
+    # visit points in memory order, so reads from memory-mapped volumes are
+    # (mostly) sequential
+    order = np.argsort(
+        np.ravel_multi_index(lower.T, volumes[0].shape), kind="stable"
+    )
+    lower = lower[order]
+    fraction = points[order] - lower
+    upper = np.minimum(lower + 1, shape - 1)
+
+    block_shape = volumes[0].shape
+    if len(points) and not all(
+        isinstance(volume, np.ndarray) for volume in volumes
+    ):
+        start = lower.min(axis=0)
+        stop = upper.max(axis=0) + 1
+        block = tuple(slice(a, b) for a, b in zip(start, stop))
+        volumes = [np.asarray(volume[block]) for volume in volumes]
+        block_shape = tuple(stop - start)
+        lower = lower - start
+        upper = upper - start
+
+    sorted_values = np.zeros((len(points), len(volumes)))
+    for corner in range(8):
+        weight = np.ones(len(points))
+        indices = []
+        for axis in range(3):
+            if (corner >> axis) & 1:
+                weight *= fraction[:, axis]
+                indices.append(upper[:, axis])
+            else:
+                weight *= 1 - fraction[:, axis]
+                indices.append(lower[:, axis])
+        flat_indices = np.ravel_multi_index(indices, block_shape)
+        for idx, volume in enumerate(volumes):
+            sorted_values[:, idx] += weight * volume.reshape(-1)[flat_indices]
+
+    values = np.empty_like(sorted_values)
+    values[order] = sorted_values
+    values[~inside] = np.nan
+    return values
+
+
+def transform_points_sample_to_atlas(
+    points: np.ndarray,
+    deformation_fields: Sequence[np.ndarray],
+    atlas,
+    metadata: dict,
+    scale: Sequence[float],
+    **kwargs,
+) -> np.ndarray:
+    """Transform points in sample space to atlas space.
+
+    Sample space is that of the raw data, in which the sample-space readers
+    (e.g. reader_dir_sample_space) and load_cells display data. Points are
+    mapped to the downsampled space using the same scaling and reorientation
+    as scale_reorient_layers, then through the deformation fields.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Nx3 array of points in sample space, e.g. the data of the points
+        layers returned by load_cells.
+    deformation_fields : Sequence[np.ndarray]
+        The three deformation fields, as returned by load_deformation_fields.
+    atlas : BrainGlobeAtlas
+        The atlas the sample was registered to.
+    metadata : dict
+        Metadata with the orientation of the raw data, e.g. from
+        "brainreg.json" or "brainmapper.json".
+    scale : Sequence[float]
+        Scale from downsampled voxels to sample voxels, as returned by
+        get_scale.
+    **kwargs
+        Passed to transform_points_downsampled_to_atlas.
+
+    Returns
+    -------
+    np.ndarray
+        Nx3 array of points in atlas voxel coordinates. Points outside the
+        registered image are NaN.
+    """
+    import brainglobe_space as bgs
+
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    # shape of the downsampled image, reoriented to the raw data
+    order, _, _, _ = bgs.AnatomicalSpace(atlas.orientation).map_to(
+        metadata["orientation"]
+    )
+    reoriented_shape = np.asarray(deformation_fields[0].shape)[list(order)]
+    downsampled_points = reorient_points(
+        points / np.asarray(scale, dtype=np.float64),
+        metadata["orientation"],
+        atlas.orientation,
+        tuple(reoriented_shape),
+    )
+    return transform_points_downsampled_to_atlas(
+        downsampled_points,
+        deformation_fields,
+        atlas.resolution,
+        **kwargs,
+    )
+
+
+def cell_layers_to_atlas_space(
+    layers: List[LayerDataTuple],
+    deformation_fields: Sequence[np.ndarray],
+    atlas,
+    metadata: dict,
+    scale: Sequence[float],
+) -> List[LayerDataTuple]:
+    """Transform points layers (e.g. from load_cells) into atlas space.
+
+    Points that fall outside the registered image are dropped, along with
+    their features.
+
+    Parameters
+    ----------
+    layers : List[LayerDataTuple]
+        Points layers in sample space.
+    deformation_fields : Sequence[np.ndarray]
+        The three deformation fields, as returned by load_deformation_fields.
+    atlas : BrainGlobeAtlas
+        The atlas the sample was registered to.
+    metadata : dict
+        Metadata with the orientation of the raw data.
+    scale : Sequence[float]
+        Scale from downsampled voxels to sample voxels, as returned by
+        get_scale.
+
+    Returns
+    -------
+    List[LayerDataTuple]
+        New points layers, in atlas voxel coordinates.
+    """
+    new_layers = []
+    for data, attributes, layer_type in layers:
+        if len(data) == 0:
+            transformed = np.empty((0, 3))
+            keep = np.zeros(0, dtype=bool)
+        else:
+            transformed = transform_points_sample_to_atlas(
+                data, deformation_fields, atlas, metadata, scale
+            )
+            keep = np.asarray(~np.isnan(transformed).any(axis=1))
+
+        attributes = dict(attributes)
+        attributes["name"] = f"{attributes['name']} (atlas space)"
+        if attributes.get("features"):
+            attributes["features"] = {
+                key: np.asarray(values)[keep]
+                for key, values in attributes["features"].items()
+            }
+        new_layers.append((transformed[keep], attributes, layer_type))
+    return new_layers
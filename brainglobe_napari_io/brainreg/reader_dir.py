@@ -1,19 +1,69 @@
+from __future__ import annotations
+
 import json
 import os
+from functools import partial
 from pathlib import Path
-from typing import Callable, List, Optional, Union
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
-import tifffile
-from brainglobe_atlasapi.bg_atlas import BrainGlobeAtlas
-from napari import current_viewer
-from napari.types import LayerDataTuple
-from qtpy.QtWidgets import QFileDialog
+import numpy as np
 
+from brainglobe_napari_io.brainreg.deformation import (
+    load_deformation_field_layers,
+)
+from brainglobe_napari_io.brainreg.writer_labels import (
+    LABELS_SOURCE_KEY,
+    apply_labels_edits,
+    get_labels_source,
+    has_labels_edits,
+    track_loaded_labels_edits,
+)
+from brainglobe_napari_io.planning import (
+    LoadPlan,
+    get_registration_image_source,
+    plan_brainreg_dir,
+    read_tiff_planned,
+    report_plan,
+)
+from brainglobe_napari_io.profiling import profile, span
+from brainglobe_napari_io.progressive import (
+    read_progressively,
+    track_when_added,
+)
+from brainglobe_napari_io.readahead import read_ahead_plan
+from brainglobe_napari_io.reader_options import (
+    get_load_deformation_fields,
+    get_structure,
+)
+from brainglobe_napari_io.regions import (
+    get_structure_region,
+    load_bounding_boxes,
+)
 from brainglobe_napari_io.utils import (
+    Layer,
+    as_layer_data_tuples,
+    as_layers,
+    get_atlas,
     is_brainreg_dir,
     load_additional_downsampled_channels,
+    read_tiff,
+    read_tiff_reoriented,
+    region_attributes,
+    reorient_region,
+    reorient_registration_layers,
 )
 
+if TYPE_CHECKING:
+    from napari.types import LayerDataTuple
+
 PathOrPaths = Union[List[os.PathLike], os.PathLike]
 
 
@@ -39,16 +89,36 @@ def brainreg_read_dir(path: PathOrPaths) -> Optional[Callable]:
         return None
 
 
-def reader_function(path: os.PathLike) -> List[LayerDataTuple]:
+def reader_function(
+    path: os.PathLike,
+    load_deformation_fields: Optional[bool] = None,
+    structure: Optional[str] = None,
+) -> List[LayerDataTuple]:
     """
     Readers are expected to return data as a list of tuples, where each tuple
     is (data, [add_kwargs, [layer_type]]), "add_kwargs" and "layer_type" are
     both optional.
 
+    This is a napari adapter for load_brainreg_dir. Large images are first
+    shown as a coarse preview, and replaced with the full data once it has
+    loaded in the background (see brainglobe_napari_io.progressive). Edits
+    to the registered atlas and hemispheres layers are tracked, so they can
+    be saved (see brainglobe_napari_io.brainreg.writer_labels).
+
     Parameters
     ----------
     path : str or list of str
         Path to file, or list of paths.
+    load_deformation_fields : bool, optional
+        If True, also add the deformation fields as memory-mapped image
+        layers. By default, from the
+        BRAINGLOBE_NAPARI_IO_LOAD_DEFORMATION_FIELDS environment variable
+        (see brainglobe_napari_io.reader_options), or False.
+    structure : str, optional
+        Acronym of an atlas structure (e.g. "HIP"). If given, only the
+        bounding box of the structure is loaded from each image, and layers
+        are translated to line up with the whole brain. By default, from
+        the BRAINGLOBE_NAPARI_IO_STRUCTURE environment variable.
 
     Returns
     -------
@@ -62,65 +132,249 @@ def reader_function(path: os.PathLike) -> List[LayerDataTuple]:
         Both "meta", and "layer_type" are optional. napari will default to
         layer_type=="image" if not provided
     """
+    load_deformation_fields = get_load_deformation_fields(
+        load_deformation_fields
+    )
+    structure = get_structure(structure)
+    load = partial(
+        load_brainreg_dir,
+        path,
+        load_deformation_fields=load_deformation_fields,
+        structure=structure,
+    )
+    if structure is not None:
+        layer_data = as_layer_data_tuples(load())
+    else:
+        layer_data = read_progressively(load, partial(plan_brainreg_dir, path))
+    return track_when_added(layer_data, [track_loaded_labels_edits])
+
+
+@profile("brainreg read directory")
+def load_brainreg_dir(
+    path: os.PathLike,
+    load_deformation_fields: bool = False,
+    structure: Optional[str] = None,
+    orientation: Optional[str] = None,
+    memory_budget: Optional[int] = None,
+    load_plan: Optional[LoadPlan] = None,
+) -> List[Layer]:
+    """Load a brainreg registration directory in sample space, at atlas
+    resolution, without napari.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to brainreg registration directory.
+    load_deformation_fields : bool, optional
+        If True, also load the deformation fields as memory-mapped images,
+        by default False.
+    structure : str, optional
+        Acronym of an atlas structure (e.g. "HIP"). If given, only the
+        bounding box of the structure is loaded from each image, and layers
+        are translated to line up with the whole brain.
+    orientation : str, optional
+        Orientation to return the images in (e.g. the sample orientation).
+        By default, images are in the atlas orientation. Reoriented copies
+        written by brainglobe-napari-io convert are used if up to date.
+    memory_budget : int, optional
+        Memory budget in bytes, by default from
+        brainglobe_napari_io.planning.get_memory_budget. Registration images
+        that don't fit are memory-mapped, lazily loaded or decimated, and
+        the plan is printed before loading. Not used with a structure.
+    load_plan : LoadPlan, optional
+        A plan including the registration images (e.g. of a brainmapper
+        directory), to use instead of planning with memory_budget.
+
+    Returns
+    -------
+    List[Layer]
+        Any additional downsampled channels, the registered image, the
+        hemispheres and atlas annotation, the boundaries and optionally the
+        deformation fields.
+    """
 
     print("Loading brainreg directory")
     path = Path(os.path.abspath(path))
-    with open(path / "brainreg.json") as json_file:
-        metadata = json.load(json_file)
+    with span("metadata read"):
+        with open(path / "brainreg.json") as json_file:
+            metadata = json.load(json_file)
 
-    atlas = BrainGlobeAtlas(metadata["atlas"])
+    with span("atlas init", atlas=metadata["atlas"]):
+        atlas = get_atlas(metadata["atlas"])
     metadata["atlas_class"] = atlas
 
+    region = None
+    if structure is not None:
+        with span("region index", structure=structure):
+            region = get_structure_region(
+                load_bounding_boxes(path / "registered_atlas.tiff"),
+                atlas,
+                structure,
+            )
+        metadata["region"] = region
+        print(
+            f"Loading {structure}, from {region['start']} to "
+            f"{region['stop']}"
+        )
+
+    elif load_plan is None:
+        with span("load plan"):
+            load_plan = plan_brainreg_dir(
+                path, memory_budget, orientation, atlas
+            )
+        report_plan(load_plan)
+        read_ahead_plan(load_plan)
+
+    reorient = orientation is not None and orientation != atlas.orientation
+    # the region of the layers, which are cropped in the atlas orientation
+    # and then reoriented
+    layer_region = region
+    if reorient and region is not None and orientation is not None:
+        layer_region = reorient_region(region, atlas.orientation, orientation)
+
+    def reorient_layers(layers: List[LayerDataTuple]) -> List[LayerDataTuple]:
+        return [
+            (data, region_attributes(attributes, layer_region), layer_type)
+            for data, attributes, layer_type in reorient_registration_layers(
+                layers, atlas, {"orientation": orientation}
+            )
+        ]
+
+    def labels_metadata(filename: str, metadata: Dict) -> Dict:
+        return {
+            **metadata,
+            LABELS_SOURCE_KEY: get_labels_source(
+                path / filename,
+                orientation if reorient else None,
+                atlas.orientation if reorient else None,
+                region,
+            ),
+        }
+
+    def read_registration_image(
+        filename: str, attributes: Dict, labels: bool = False
+    ) -> Tuple[np.ndarray, Dict]:
+        attributes = region_attributes(attributes, layer_region)
+        # shared volumes are read-only, and labels layers are edited
+        shared = not labels
+        if has_labels_edits(path / filename):
+            # saved edits are applied to the image, read in full
+            image = apply_labels_edits(
+                read_tiff(path / filename, region, shared=shared),
+                path / filename,
+                region,
+            )
+            if reorient:
+                import brainglobe_space as bgs
+
+                image = bgs.map_stack_to(atlas.orientation, orientation, image)
+            return image, attributes
+
+        source, needs_reorienting = get_registration_image_source(
+            path / filename, atlas, orientation
+        )
+        layer_plan = (
+            None
+            if region is not None or load_plan is None
+            else load_plan.get(source)
+        )
+        if layer_plan is None or layer_plan.strategy == "eager":
+            if reorient and orientation is not None:
+                image = read_tiff_reoriented(
+                    path / filename,
+                    atlas.orientation,
+                    orientation,
+                    region,
+                    shared=shared,
+                )
+            else:
+                image = read_tiff(path / filename, region, shared=shared)
+            return image, attributes
+
+        image = read_tiff_planned(source, layer_plan)
+        if needs_reorienting:
+            import brainglobe_space as bgs
+
+            image = bgs.map_stack_to(atlas.orientation, orientation, image)
+        if layer_plan.decimation > 1:
+            attributes["scale"] = (layer_plan.decimation,) * 3
+        return image, attributes
+
     layers: List[LayerDataTuple] = []
-    layers = load_additional_downsampled_channels(path, layers)
+    layers = load_additional_downsampled_channels(path, layers, region=region)
+    if reorient:
+        layers = reorient_layers(layers)
 
     layers.append(
         (
-            tifffile.imread(path / "downsampled.tiff"),
-            {"name": "Registered image", "metadata": metadata},
+            *read_registration_image(
+                "downsampled.tiff",
+                {"name": "Registered image", "metadata": metadata},
+            ),
             "image",
         )
     )
     layers.append(
         (
-            tifffile.imread(path / "registered_hemispheres.tiff"),
-            {
-                "name": "Hemispheres",
-                "visible": False,
-                "opacity": 0.3,
-            },
+            *read_registration_image(
+                "registered_hemispheres.tiff",
+                {
+                    "name": "Hemispheres",
+                    "visible": False,
+                    "opacity": 0.3,
+                    "metadata": labels_metadata(
+                        "registered_hemispheres.tiff", metadata
+                    ),
+                },
+                labels=True,
+            ),
             "labels",
         )
     )
 
     layers.append(
         (
-            tifffile.imread(path / "registered_atlas.tiff"),
-            {
-                "name": metadata["atlas"],
-                "blending": "additive",
-                "opacity": 0.3,
-                "visible": False,
-                "metadata": metadata,
-            },
+            *read_registration_image(
+                "registered_atlas.tiff",
+                {
+                    "name": metadata["atlas"],
+                    "blending": "additive",
+                    "opacity": 0.3,
+                    "visible": False,
+                    "metadata": labels_metadata(
+                        "registered_atlas.tiff", metadata
+                    ),
+                },
+                labels=True,
+            ),
             "labels",
         )
     )
 
     layers.append(
         (
-            tifffile.imread(path / "boundaries.tiff"),
-            {
-                "name": "Boundaries",
-                "blending": "additive",
-                "opacity": 0.5,
-                "visible": False,
-            },
+            *read_registration_image(
+                "boundaries.tiff",
+                {
+                    "name": "Boundaries",
+                    "blending": "additive",
+                    "opacity": 0.5,
+                    "visible": False,
+                },
+            ),
             "image",
         )
     )
 
-    return layers
+    if load_deformation_fields:
+        deformation_layers = load_deformation_field_layers(
+            path, [], region=region
+        )
+        if reorient:
+            deformation_layers = reorient_layers(deformation_layers)
+        layers.extend(deformation_layers)
+
+    return as_layers(layers)
 
 
 def select_dialog():
@@ -137,6 +391,9 @@ def select_dialog():
     -------
     None
     """
+    from napari import current_viewer
+    from qtpy.QtWidgets import QFileDialog
+
     brainreg_folder = QFileDialog.getExistingDirectory(
         caption="Select brainreg folder (atlas space, atlas resolution)"
     )
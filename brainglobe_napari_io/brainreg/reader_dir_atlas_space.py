@@ -1,20 +1,33 @@
+from __future__ import annotations
+
 import json
 import os
 from pathlib import Path
-from typing import Callable, List, Optional, Union
-
-import tifffile
-from brainglobe_atlasapi.bg_atlas import BrainGlobeAtlas
-from napari import current_viewer
-from napari.types import LayerDataTuple
-from qtpy.QtWidgets import QFileDialog
-
+from typing import TYPE_CHECKING, Callable, List, Optional, Sequence, Union
+
+from brainglobe_napari_io.ome_zarr import find_image, get_tiff_path, is_zarr
+from brainglobe_napari_io.profiling import profile, span
+from brainglobe_napari_io.readahead import get_readahead_budget, read_ahead
+from brainglobe_napari_io.reader_options import get_structure
+from brainglobe_napari_io.regions import (
+    get_atlas_bounding_boxes,
+    get_structure_region,
+)
 from brainglobe_napari_io.utils import (
+    Layer,
+    as_layer_data_tuples,
+    as_layers,
+    get_atlas,
     is_brainreg_dir,
     load_additional_downsampled_channels,
     load_atlas,
+    read_tiff,
+    region_attributes,
 )
 
+if TYPE_CHECKING:
+    from napari.types import LayerDataTuple
+
 PathOrPaths = Union[List[os.PathLike], os.PathLike]
 
 
@@ -39,16 +52,26 @@ def brainreg_read_dir_atlas_space(path: PathOrPaths) -> Optional[Callable]:
         return None
 
 
-def reader_function(path: os.PathLike) -> List[LayerDataTuple]:
+def reader_function(
+    path: os.PathLike, structure: Optional[str] = None
+) -> List[LayerDataTuple]:
     """
     Readers are expected to return data as a list of tuples, where each tuple
     is (data, [add_kwargs, [layer_type]]), "add_kwargs" and "layer_type" are
     both optional.
 
+    This is a napari adapter for load_brainreg_dir_atlas_space.
+
     Parameters
     ----------
     path : str or list of str
         Path to file, or list of paths.
+    structure : str, optional
+        Acronym of an atlas structure (e.g. "HIP"). If given, only the
+        bounding box of the structure is loaded from each image, and layers
+        are translated to line up with the whole atlas. By default, from the
+        BRAINGLOBE_NAPARI_IO_STRUCTURE environment variable (see
+        brainglobe_napari_io.reader_options).
 
     Returns
     -------
@@ -62,31 +85,89 @@ def reader_function(path: os.PathLike) -> List[LayerDataTuple]:
         Both "meta", and "layer_type" are optional. napari will default to
         layer_type=="image" if not provided
     """
+    return as_layer_data_tuples(
+        load_brainreg_dir_atlas_space(path, structure=get_structure(structure))
+    )
+
+
+@profile("brainreg read directory (atlas space)")
+def load_brainreg_dir_atlas_space(
+    path: os.PathLike,
+    structure: Optional[str] = None,
+    meshes: Optional[Sequence[str]] = None,
+) -> List[Layer]:
+    """Load a brainreg registration directory in atlas space, at atlas
+    resolution, without napari.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to brainreg registration directory.
+    structure : str, optional
+        Acronym of an atlas structure (e.g. "HIP"). If given, only the
+        bounding box of the structure is loaded from each image, and layers
+        are translated to line up with the whole atlas.
+    meshes : Sequence[str], optional
+        Acronyms of structures whose meshes are added as surface layers
+        (see brainglobe_napari_io.meshes), by default those in the
+        BRAINGLOBE_NAPARI_IO_ATLAS_MESHES environment variable.
+
+    Returns
+    -------
+    List[Layer]
+        Any additional downsampled channels and the registered image in
+        atlas space, followed by the atlas annotation and any meshes.
+    """
 
     print("Loading brainreg directory")
     path = Path(os.path.abspath(path))
-    with open(path / "brainreg.json") as json_file:
-        metadata = json.load(json_file)
+    with span("metadata read"):
+        with open(path / "brainreg.json") as json_file:
+            metadata = json.load(json_file)
 
-    atlas = BrainGlobeAtlas(metadata["atlas"])
+    with span("atlas init", atlas=metadata["atlas"]):
+        atlas = get_atlas(metadata["atlas"])
     metadata["atlas_class"] = atlas
+
+    region = None
+    if structure is not None:
+        with span("region index", structure=structure):
+            region = get_structure_region(
+                get_atlas_bounding_boxes(atlas), atlas, structure
+            )
+        metadata["region"] = region
+
+    if region is None and get_readahead_budget() is not None:
+        # the images in atlas space, TIFF or Zarr (see find_image)
+        read_ahead(
+            list(
+                dict.fromkeys(
+                    find_image(get_tiff_path(p) if is_zarr(p) else p)
+                    for p in sorted(path.glob("downsampled_standard*"))
+                )
+            )
+        )
+
     layers: List[LayerDataTuple] = []
     layers = load_additional_downsampled_channels(
         path,
         layers,
         search_string="downsampled_standard",
         exclusion_string="downsampled_standard.tiff",
+        region=region,
     )
     layers.append(
         (
-            tifffile.imread(path / "downsampled_standard.tiff"),
-            {"name": "Registered image", "metadata": metadata},
+            read_tiff(path / "downsampled_standard.tiff", region),
+            region_attributes(
+                {"name": "Registered image", "metadata": metadata}, region
+            ),
             "image",
         )
     )
-    layers = load_atlas(atlas, layers)
+    layers = load_atlas(atlas, layers, region=region, meshes=meshes)
 
-    return layers
+    return as_layers(layers)
 
 
 def select_dialog():
@@ -103,6 +184,9 @@ def select_dialog():
     -------
     None
     """
+    from napari import current_viewer
+    from qtpy.QtWidgets import QFileDialog
+
     brainreg_folder = QFileDialog.getExistingDirectory(
         caption="Select brainreg folder (sample space, atlas resolution)"
     )
@@ -1,23 +1,39 @@
+from __future__ import annotations
+
 import json
 import os
+from functools import partial
 from pathlib import Path
-from typing import Callable, List, Optional, Union
-
-from brainglobe_atlasapi.bg_atlas import BrainGlobeAtlas
-from napari import current_viewer
-from napari.types import LayerDataTuple
-from qtpy.QtWidgets import QFileDialog
+from typing import TYPE_CHECKING, Callable, List, Optional, Union
 
-from brainglobe_napari_io.brainreg.reader_dir import (
-    reader_function as brainreg_reader,
+from brainglobe_napari_io.brainreg.reader_dir import load_brainreg_dir
+from brainglobe_napari_io.brainreg.writer_labels import (
+    track_loaded_labels_edits,
+)
+from brainglobe_napari_io.planning import LoadPlan, plan_brainreg_dir
+from brainglobe_napari_io.profiling import profile, span
+from brainglobe_napari_io.progressive import (
+    read_progressively,
+    track_when_added,
+)
+from brainglobe_napari_io.reader_options import (
+    get_load_deformation_fields,
+    get_structure,
 )
 from brainglobe_napari_io.utils import (
+    Layer,
+    as_layer_data_tuples,
+    as_layers,
+    get_atlas,
     get_atlas_class,
     is_brainreg_dir,
     remove_downsampled_images,
     scale_reorient_layers,
 )
 
+if TYPE_CHECKING:
+    from napari.types import LayerDataTuple
+
 PathOrPaths = Union[List[os.PathLike], os.PathLike]
 
 
@@ -45,20 +61,32 @@ def brainreg_read_dir_sample_space(
         return None
 
 
-def reader_function(path: os.PathLike) -> List[LayerDataTuple]:
+def reader_function(
+    path: os.PathLike,
+    load_deformation_fields: Optional[bool] = None,
+    structure: Optional[str] = None,
+) -> List[LayerDataTuple]:
     """Reader function to read a brainreg registration directory in sample
     space at sample resolution.
 
-    Original high-resolution images are expected to be loaded independently
-    by the user.
-
-    Use reader_dir_atlas_space for atlas space at atlas resolution, and
-    reader_dir for sample space at atlas resolution.
+    This is a napari adapter for load_brainreg_dir_sample_space. Large
+    images are first shown as a coarse preview, and replaced with the full
+    data once it has loaded in the background (see
+    brainglobe_napari_io.progressive).
 
     Parameters
     ----------
     path : str or list of str
         Path to brainreg registration directory.
+    load_deformation_fields : bool, optional
+        If True, also add the deformation fields as memory-mapped image
+        layers, scaled and oriented at sample resolution. By default, from
+        the BRAINGLOBE_NAPARI_IO_LOAD_DEFORMATION_FIELDS environment variable
+        (see brainglobe_napari_io.reader_options), or False.
+    structure : str, optional
+        Acronym of an atlas structure (e.g. "HIP"). If given, only the
+        bounding box of the structure is loaded. By default, from the
+        BRAINGLOBE_NAPARI_IO_STRUCTURE environment variable.
 
     Returns
     -------
@@ -72,22 +100,98 @@ def reader_function(path: os.PathLike) -> List[LayerDataTuple]:
         - Registered boundaries image layer scaled and oriented at sample
           resolution.
     """
+    load_deformation_fields = get_load_deformation_fields(
+        load_deformation_fields
+    )
+    structure = get_structure(structure)
+    load = partial(
+        load_brainreg_dir_sample_space,
+        path,
+        load_deformation_fields=load_deformation_fields,
+        structure=structure,
+    )
+    if structure is not None:
+        return track_when_added(
+            as_layer_data_tuples(load()), [track_loaded_labels_edits]
+        )
+
+    def plan() -> LoadPlan:
+        with open(Path(path) / "brainreg.json") as json_file:
+            orientation = json.load(json_file)["orientation"]
+        return plan_brainreg_dir(path, orientation=orientation)
+
+    return track_when_added(
+        read_progressively(load, plan), [track_loaded_labels_edits]
+    )
+
+
+@profile("brainreg read directory (sample space)")
+def load_brainreg_dir_sample_space(
+    path: os.PathLike,
+    load_deformation_fields: bool = False,
+    structure: Optional[str] = None,
+    load_plan: Optional[LoadPlan] = None,
+) -> List[Layer]:
+    """Load a brainreg registration directory in sample space, at sample
+    resolution, without napari.
+
+    Original high-resolution images are expected to be loaded independently
+    by the user.
+
+    Use load_brainreg_dir_atlas_space for atlas space at atlas resolution,
+    and load_brainreg_dir for sample space at atlas resolution.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to brainreg registration directory.
+    load_deformation_fields : bool, optional
+        If True, also load the deformation fields, scaled and oriented at
+        sample resolution, by default False.
+    structure : str, optional
+        Acronym of an atlas structure (e.g. "HIP"). If given, only the
+        bounding box of the structure is loaded.
+    load_plan : LoadPlan, optional
+        How to load the registration images (see
+        brainglobe_napari_io.planning), by default planned within the
+        default memory budget.
+
+    Returns
+    -------
+    List[Layer]
+        The hemispheres, atlas annotation and boundaries (and optionally the
+        deformation fields), scaled and oriented at sample resolution.
+    """
 
     path = Path(os.path.abspath(path))
-    with open(path / "brainreg.json") as json_file:
-        metadata = json.load(json_file)
+    with span("metadata read"):
+        with open(path / "brainreg.json") as json_file:
+            metadata = json.load(json_file)
 
-    atlas = BrainGlobeAtlas(metadata["atlas"])
+    with span("atlas init", atlas=metadata["atlas"]):
+        atlas = get_atlas(metadata["atlas"])
     metadata["atlas_class"] = atlas
     layers: List[LayerDataTuple] = []
 
-    layers = load_registration(layers, path, metadata)
+    layers = load_registration(
+        layers,
+        path,
+        metadata,
+        load_deformation_fields=load_deformation_fields,
+        structure=structure,
+        load_plan=load_plan,
+    )
 
-    return layers
+    return as_layers(layers)
 
 
 def load_registration(
-    layers: List[LayerDataTuple], registration_directory: os.PathLike, metadata
+    layers: List[LayerDataTuple],
+    registration_directory: os.PathLike,
+    metadata,
+    load_deformation_fields: bool = False,
+    structure: Optional[str] = None,
+    load_plan: Optional[LoadPlan] = None,
 ) -> List[LayerDataTuple]:
     """Load registration layers from a brainreg registration directory and
     scale and orient them to sample resolution.
@@ -103,6 +207,14 @@ def load_registration(
         Metadata dictionary containing information about the registration,
         including atlas information. Typically loaded from "brainreg.json"
         exported from brainreg registration.
+    load_deformation_fields : bool, optional
+        If True, also add the deformation fields, by default False.
+    structure : str, optional
+        Acronym of an atlas structure. If given, only the bounding box of
+        the structure is loaded, translated to line up with the sample.
+    load_plan : LoadPlan, optional
+        How to load the registration images, by default planned within the
+        default memory budget.
 
     Returns
     -------
@@ -115,13 +227,21 @@ def load_registration(
           sample resolution.
         - Registered boundaries image layer scaled and oriented at sample
           resolution.
+        - Optionally, the deformation fields scaled and oriented at sample
+          resolution.
     """
-    registration_layers = brainreg_reader(registration_directory)
+    registration_layers = load_brainreg_dir(
+        registration_directory,
+        load_deformation_fields=load_deformation_fields,
+        structure=structure,
+        orientation=metadata["orientation"],
+        load_plan=load_plan,
+    )
     registration_layers = remove_downsampled_images(registration_layers)
     atlas = get_atlas_class(registration_layers)
 
     registration_layers = scale_reorient_layers(
-        registration_layers, atlas, metadata
+        registration_layers, atlas, metadata, reorient=False
     )
     layers.extend(registration_layers)
     return layers
@@ -141,6 +261,9 @@ def select_dialog():
     -------
     None
     """
+    from napari import current_viewer
+    from qtpy.QtWidgets import QFileDialog
+
     brainreg_folder = QFileDialog.getExistingDirectory(
         caption="Select brainreg folder (sample space, sample resolution)"
     )
@@ -0,0 +1,408 @@
+"""Export the layers of a registration session to one OME-Zarr store.
+
+The registered image, atlas annotation, hemispheres, cells and any other
+image, labels and points layers (e.g. as loaded by the brainreg and
+brainmapper readers) are written to one Zarr v3 store::
+
+    session.ome.zarr/
+        Registered image/       multiscale OME-Zarr image
+        labels/
+            allen_mouse_25um/   multiscale OME-Zarr label image
+            Hemispheres/
+        points/
+            Cells/              "data": N x 3 positions, and a
+                                "features/<name>" column for each feature
+
+Images are written with a multiscale pyramid, in compressed chunks, with
+the layers written in parallel. The order, names and display attributes of
+the layers, and their metadata (e.g. the atlas and orientation of the
+registration), are saved in the attributes of the store, so it is reopened
+(by load_session_zarr, or in napari) as the same layers, with the images
+read lazily.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    TypedDict,
+    Union,
+    cast,
+)
+
+import numpy as np
+
+from brainglobe_napari_io.brainreg.writer_labels import (
+    EDITED_CHUNKS_KEY,
+    LABELS_SOURCE_KEY,
+)
+from brainglobe_napari_io.ome_zarr import (
+    DEFAULT_CHUNKS,
+    open_zarr_levels,
+    write_ome_zarr_image,
+)
+from brainglobe_napari_io.profiling import profile, span
+from brainglobe_napari_io.utils import (
+    Layer,
+    as_layer_data_tuples,
+    as_layers,
+)
+
+if TYPE_CHECKING:
+    from napari.types import FullLayerData, LayerDataTuple
+
+PathOrPaths = Union[List[os.PathLike], os.PathLike]
+
+SESSION_KEY = "brainglobe_napari_io"
+SESSION_VERSION = 1
+SESSION_LAYER_TYPES = ("image", "labels", "points")
+# layer attributes that are saved as data, or only apply to the images the
+# layers were loaded from
+UNSAVED_ATTRIBUTES = (
+    "features",
+    "properties",
+    "feature_defaults",
+    "multiscale",
+)
+UNSAVED_METADATA = (LABELS_SOURCE_KEY, EDITED_CHUNKS_KEY)
+
+
+class SessionLayer(TypedDict):
+    """A layer, as saved in the attributes of a session store."""
+
+    path: str
+    layer_type: str
+    attributes: Dict[str, Any]
+
+
+class Session(TypedDict):
+    """The attributes of a session store, saved under SESSION_KEY."""
+
+    version: int
+    layers: List[SessionLayer]
+
+
+def is_session_zarr(path: os.PathLike) -> bool:
+    """Whether a path is to a session store written by export_session_zarr
+    (without importing zarr, as napari checks every path it opens)."""
+    try:
+        with open(Path(path) / "zarr.json") as metadata_file:
+            metadata = json.load(metadata_file)
+    except (OSError, ValueError):
+        return False
+    return SESSION_KEY in metadata.get("attributes", {})
+
+
+def to_json(value: Any) -> Any:
+    """Convert a value to one that can be saved as JSON.
+
+    Numpy arrays and scalars are converted to lists and numbers. Items of
+    dicts that can't be converted (e.g. an atlas object) are left out.
+
+    Raises
+    ------
+    TypeError
+        If the value can't be converted.
+    """
+    if isinstance(value, (str, bool, int, float)) or value is None:
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            raise TypeError("Object arrays can't be saved as JSON")
+        return value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, dict):
+        converted = {}
+        for key, item in value.items():
+            try:
+                converted[str(key)] = to_json(item)
+            except TypeError:
+                pass
+        return converted
+    raise TypeError(f"{type(value).__name__} can't be saved as JSON")
+
+
+def get_saved_attributes(attributes: Dict) -> Dict:
+    """Get the layer attributes to save in the store."""
+    saved = {}
+    for key, value in attributes.items():
+        if key in UNSAVED_ATTRIBUTES:
+            continue
+        if key == "metadata":
+            value = {
+                k: v for k, v in value.items() if k not in UNSAVED_METADATA
+            }
+        try:
+            saved[key] = to_json(value)
+        except TypeError:
+            pass
+    return saved
+
+
+def get_layer_path(name: str, layer_type: str, used: set) -> str:
+    """Get a unique path in the store for a layer, from its name."""
+    base = re.sub(r"[^\w .()-]+", "_", name).strip(" .") or "layer"
+    if layer_type != "image":
+        base = f"{layer_type}/{base}"
+    path = base
+    n = 1
+    while path.lower() in used:
+        n += 1
+        path = f"{base} ({n})"
+    used.add(path.lower())
+    return path
+
+
+def get_feature_columns(features) -> Dict[str, np.ndarray]:
+    """Get the columns of a points layer's features (a DataFrame or a dict
+    of arrays) that can be saved: numbers, booleans and strings."""
+    if features is None:
+        return {}
+    if hasattr(features, "columns"):
+        features = {name: features[name].to_numpy() for name in features}
+    columns = {}
+    for name, values in features.items():
+        values = np.asarray(values)
+        if values.dtype == object:
+            if not all(isinstance(value, str) for value in values):
+                print(f"Not saving feature {name!r}, which isn't numeric")
+                continue
+            values = values.astype(str)
+        columns[str(name)] = values
+    return columns
+
+
+def write_points_table(group, path: str, data, features) -> None:
+    """Write the positions and features of a points layer as a table of
+    arrays."""
+    table = group.create_group(path, overwrite=True)
+    data = np.asarray(data, dtype=np.float64)
+    table.create_array("data", data=data.reshape(len(data), -1))
+    columns = get_feature_columns(features)
+    if columns:
+        features_group = table.create_group("features")
+        for name, values in columns.items():
+            features_group.create_array(name, data=values)
+    table.attrs["columns"] = list(columns)
+
+
+def write_layer(group, path: str, layer: Layer, chunks=DEFAULT_CHUNKS) -> None:
+    """Write the data of a layer to its path in a session store."""
+    data, attributes, layer_type = layer
+    if layer_type == "points":
+        features = attributes.get("features", attributes.get("properties"))
+        write_points_table(group, path, data, features)
+        return
+    if attributes.get("multiscale"):
+        # the full resolution level
+        data = data[0]
+    write_ome_zarr_image(
+        group,
+        path,
+        data,
+        scale=attributes.get("scale"),
+        translate=attributes.get("translate"),
+        labels=layer_type == "labels",
+        chunks=chunks,
+    )
+
+
+@profile("export session")
+def export_session_zarr(
+    path: os.PathLike,
+    layers: List,
+    n_workers: Optional[int] = None,
+    chunks=DEFAULT_CHUNKS,
+) -> Path:
+    """Export image, labels and points layers to one OME-Zarr store.
+
+    The store is written next to the path, and moved into place once
+    complete, replacing any store already there.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path of the store, e.g. "session.ome.zarr".
+    layers : List
+        Layers (e.g. from load_brainreg_dir) or layer data tuples. Layers of
+        other types (e.g. surfaces) are left out.
+    n_workers : int, optional
+        Number of layers to write at once, by default the number of CPUs.
+    chunks : Sequence[int], optional
+        Chunk shape of the images, by default (64, 64, 64).
+
+    Returns
+    -------
+    Path
+        The store.
+    """
+    import zarr
+
+    path = Path(os.path.abspath(path))
+    if path.exists() and not is_session_zarr(path):
+        raise FileExistsError(f"{path} exists, and isn't a session store")
+
+    layers = [
+        layer
+        for layer in as_layers(layers)
+        if layer.layer_type in SESSION_LAYER_TYPES
+    ]
+    used: set = set()
+    paths = [
+        get_layer_path(
+            layer.attributes.get("name", layer.layer_type),
+            layer.layer_type,
+            used,
+        )
+        for layer in layers
+    ]
+
+    temporary_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    shutil.rmtree(temporary_path, ignore_errors=True)
+    try:
+        group = zarr.open_group(str(temporary_path), mode="w")
+        label_names = [
+            p.split("/", 1)[1]
+            for p, layer in zip(paths, layers)
+            if layer.layer_type == "labels"
+        ]
+        if label_names:
+            labels_group = group.create_group("labels")
+            labels_group.attrs["ome"] = {
+                "version": "0.5",
+                "labels": label_names,
+            }
+        if any(layer.layer_type == "points" for layer in layers):
+            group.create_group("points")
+
+        with span("write layers", n_layers=len(layers)):
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                futures = [
+                    executor.submit(write_layer, group, p, layer, chunks)
+                    for p, layer in zip(paths, layers)
+                ]
+                for future in futures:
+                    future.result()
+
+        # written last, so an interrupted export isn't read as a session
+        group.attrs[SESSION_KEY] = {
+            "version": SESSION_VERSION,
+            "layers": [
+                {
+                    "path": p,
+                    "layer_type": layer.layer_type,
+                    "attributes": get_saved_attributes(layer.attributes),
+                }
+                for p, layer in zip(paths, layers)
+            ],
+        }
+        if path.exists():
+            shutil.rmtree(path)
+        os.replace(temporary_path, path)
+    finally:
+        shutil.rmtree(temporary_path, ignore_errors=True)
+    print(f"Exported {len(layers)} layers to {path}")
+    return path
+
+
+@profile("read session")
+def load_session_zarr(path: os.PathLike) -> List[Layer]:
+    """Load a session store written by export_session_zarr, without napari.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to the store.
+
+    Returns
+    -------
+    List[Layer]
+        The layers, in the order they were exported, with their attributes.
+        Images and labels are Zarr arrays (a list of them, from the highest
+        resolution, if there is a pyramid), which are only read as they are
+        viewed. Points are read into memory.
+    """
+    import zarr
+
+    path = Path(os.path.abspath(path))
+    with span("metadata read"):
+        group = zarr.open_group(str(path), mode="r")
+        saved = dict(group.attrs).get(SESSION_KEY)
+    if not isinstance(saved, dict):
+        raise ValueError(f"{path} is not a session store")
+    session = cast(Session, saved)
+
+    layers: List[LayerDataTuple] = []
+    for entry in session["layers"]:
+        attributes = dict(entry["attributes"])
+        data: Any
+        if entry["layer_type"] == "points":
+            with span("points read", file=entry["path"]):
+                table = cast(zarr.Group, group[entry["path"]])
+                data = np.asarray(table["data"])
+                columns = cast(List[str], table.attrs.get("columns", []))
+                if columns:
+                    features = cast(zarr.Group, table["features"])
+                    attributes["features"] = {
+                        name: np.asarray(features[name]) for name in columns
+                    }
+        else:
+            with span("image open", file=entry["path"]):
+                levels = [
+                    array
+                    for array, _ in open_zarr_levels(path / entry["path"])
+                ]
+            if len(levels) > 1:
+                data = levels
+                attributes["multiscale"] = True
+            else:
+                data = levels[0]
+        layers.append((data, attributes, entry["layer_type"]))
+    return as_layers(layers)
+
+
+def session_zarr_read(path: PathOrPaths) -> Optional[Callable]:
+    """napari reader hook for session stores written by
+    export_session_zarr.
+
+    Parameters
+    ----------
+    path : str or list of str
+        Path to file, or list of paths.
+
+    Returns
+    -------
+    function or None
+        If the path is a session store, return a function that accepts the
+        same path, and returns a list of layer data tuples.
+    """
+    if isinstance(path, str) and is_session_zarr(path):
+        return reader_function
+    return None
+
+
+def reader_function(path: os.PathLike) -> List[LayerDataTuple]:
+    """napari adapter for load_session_zarr."""
+    return as_layer_data_tuples(load_session_zarr(path))
+
+
+def write_session_zarr(
+    path: str, layer_data: List[FullLayerData]
+) -> List[str]:
+    """napari writer for image, labels and points layers, exporting them to
+    one OME-Zarr store (see export_session_zarr)."""
+    return [str(export_session_zarr(path, layer_data))]
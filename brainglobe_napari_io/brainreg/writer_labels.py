@@ -0,0 +1,510 @@
+"""Save edits to the registered atlas and hemispheres labels layers.
+
+Registrations can be corrected by painting on the registered atlas and
+hemispheres layers, and saving them back to the brainreg directory. Rather
+than rewriting the whole image for each edit, the image is divided into
+chunks of CHUNK_SHAPE, and only the chunks that were edited are written, each
+to its own file in a sidecar store next to the image (e.g.
+``registered_atlas.tiff.edits``). Which chunks were edited is tracked from
+the layer's paint events (see track_labels_edits). Without tracking (e.g.
+for layers added from the API), every chunk is compared with the saved
+image instead.
+
+The brainreg readers apply saved edits when loading an image, and
+compact_labels_edits writes them into the TIFF and removes the store (also
+available as ``brainglobe-napari-io compact``).
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import weakref
+from itertools import product
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from brainglobe_napari_io.ome_zarr import (
+    find_image,
+    get_image_shape,
+    read_image,
+)
+from brainglobe_napari_io.profiling import profile, span
+from brainglobe_napari_io.utils import (
+    is_brainreg_dir,
+    reorient_region,
+    write_atomically,
+)
+
+CHUNK_SHAPE = (64, 64, 64)
+LABELS_FILES = ("registered_atlas.tiff", "registered_hemispheres.tiff")
+# layer metadata: where the layer was loaded from, and the chunks edited
+LABELS_SOURCE_KEY = "labels_source"
+EDITED_CHUNKS_KEY = "edited_chunks"
+
+ChunkIndex = Tuple[int, ...]
+
+_tracked_viewers: weakref.WeakSet = weakref.WeakSet()
+
+
+def get_edits_dir(path: os.PathLike) -> Path:
+    """Get the sidecar store of edits to an image, which may not exist."""
+    path = Path(path)
+    return path.parent / f"{path.name}.edits"
+
+
+def get_chunk_slices(
+    index: ChunkIndex, shape: Tuple[int, ...]
+) -> Tuple[slice, ...]:
+    """Get the slices of a chunk of an image, cropped to the image."""
+    return tuple(
+        slice(i * size, min((i + 1) * size, length))
+        for i, size, length in zip(index, CHUNK_SHAPE, shape)
+    )
+
+
+def get_chunks_in_box(
+    start: Iterable[int], stop: Iterable[int]
+) -> Iterable[ChunkIndex]:
+    """Get the indices of the chunks overlapping a box."""
+    return product(
+        *(
+            range(int(a) // size, (int(b) - 1) // size + 1)
+            for a, b, size in zip(start, stop, CHUNK_SHAPE)
+        )
+    )
+
+
+def get_overlap(
+    chunk_slices: Tuple[slice, ...], start: np.ndarray, stop: np.ndarray
+) -> Optional[Tuple[Tuple[slice, ...], Tuple[slice, ...]]]:
+    """Get the overlap of a chunk and a box, as slices of the chunk and of
+    the box (or None if they don't overlap)."""
+    chunk_start = np.array([s.start for s in chunk_slices])
+    overlap_start = np.maximum(chunk_start, start)
+    overlap_stop = np.minimum([s.stop for s in chunk_slices], stop)
+    if np.any(overlap_stop <= overlap_start):
+        return None
+
+    def to_slices(offset):
+        return tuple(
+            slice(int(a), int(b))
+            for a, b in zip(overlap_start - offset, overlap_stop - offset)
+        )
+
+    return to_slices(chunk_start), to_slices(np.asarray(start))
+
+
+class LabelsEditStore:
+    """The chunks of an image that have been edited, saved next to it.
+
+    The store is a directory with an ``index.json`` recording the shape and
+    dtype of the image, and the modification time and size of the image when
+    the store was created (so edits to an image that has since been
+    rewritten, e.g. by registering again, are ignored). Each edited chunk is
+    saved as a ``z.y.x.npy`` file.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to the image. If it has a Zarr variant that is read instead
+        (see brainglobe_napari_io.ome_zarr), the store is of that.
+    """
+
+    def __init__(self, path: os.PathLike):
+        self.path = Path(path)
+        self.directory = get_edits_dir(path)
+
+    def read_index(self) -> Optional[Dict]:
+        """Read the index, or None if there is no (valid) store."""
+        try:
+            with open(self.directory / "index.json") as index_file:
+                index = json.load(index_file)
+            stat = os.stat(find_image(self.path))
+        except (OSError, json.JSONDecodeError):
+            return None
+        if index["source"] != [stat.st_mtime_ns, stat.st_size]:
+            print(
+                f"Ignoring edits in {self.directory}, as {self.path.name} "
+                "has changed since they were saved"
+            )
+            return None
+        return index
+
+    def exists(self) -> bool:
+        return self.read_index() is not None
+
+    def create(self, shape: Tuple[int, ...], dtype: np.dtype):
+        """Create an empty store (removing any stale one)."""
+        self.clear()
+        stat = os.stat(find_image(self.path))
+        index = {
+            "shape": [int(length) for length in shape],
+            "dtype": np.dtype(dtype).str,
+            "chunk_shape": list(CHUNK_SHAPE),
+            "source": [stat.st_mtime_ns, stat.st_size],
+        }
+        with write_atomically(self.directory / "index.json") as temp_path:
+            with open(temp_path, "w") as index_file:
+                json.dump(index, index_file)
+
+    def clear(self):
+        """Remove the store."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def get_chunk_path(self, index: ChunkIndex) -> Path:
+        return self.directory / (".".join(str(i) for i in index) + ".npy")
+
+    def chunk_indices(self) -> List[ChunkIndex]:
+        """Get the indices of the edited chunks."""
+        return sorted(
+            tuple(int(i) for i in chunk_path.stem.split("."))
+            for chunk_path in self.directory.glob("*.npy")
+        )
+
+    def read_chunk(self, index: ChunkIndex) -> Optional[np.ndarray]:
+        """Read an edited chunk, or None if it hasn't been edited."""
+        try:
+            return np.load(self.get_chunk_path(index))
+        except FileNotFoundError:
+            return None
+
+    def write_chunk(self, index: ChunkIndex, chunk: np.ndarray):
+        with write_atomically(self.get_chunk_path(index)) as temp_path:
+            with open(temp_path, "wb") as chunk_file:
+                np.save(chunk_file, chunk)
+
+    def apply(
+        self, image: np.ndarray, region: Optional[Dict] = None
+    ) -> np.ndarray:
+        """Apply the edits to an image (or a region of it), as read from the
+        TIFF.
+
+        Parameters
+        ----------
+        image : np.ndarray
+            The image, or the region of it. It is copied if read-only.
+        region : dict, optional
+            The region of the image, see utils.read_tiff.
+
+        Returns
+        -------
+        np.ndarray
+            The edited image.
+        """
+        index = self.read_index()
+        if index is None:
+            return image
+        shape = tuple(index["shape"])
+        start = np.zeros(3, int) if region is None else region["start"]
+        stop = np.asarray(shape if region is None else region["stop"])
+        if not image.flags.writeable:
+            image = np.array(image)
+        for chunk_index in self.chunk_indices():
+            overlap = get_overlap(
+                get_chunk_slices(chunk_index, shape), start, stop
+            )
+            chunk = self.read_chunk(chunk_index)
+            if overlap is not None and chunk is not None:
+                in_chunk, in_image = overlap
+                image[in_image] = chunk[in_chunk]
+        return image
+
+
+def has_labels_edits(path: os.PathLike) -> bool:
+    """Whether there are saved edits to an image."""
+    return get_edits_dir(path).is_dir() and LabelsEditStore(path).exists()
+
+
+def apply_labels_edits(
+    image: np.ndarray, path: os.PathLike, region: Optional[Dict] = None
+) -> np.ndarray:
+    """Apply any saved edits to an image read from a TIFF file (see
+    LabelsEditStore.apply)."""
+    if not get_edits_dir(path).is_dir():
+        return image
+    with span("apply edits", file=Path(path).name):
+        return LabelsEditStore(path).apply(image, region)
+
+
+def get_labels_source(
+    path: os.PathLike,
+    orientation: Optional[str] = None,
+    file_orientation: Optional[str] = None,
+    region: Optional[Dict] = None,
+) -> Dict:
+    """Describe where a labels layer was loaded from, so edits to it can be
+    saved back (stored in the layer metadata under LABELS_SOURCE_KEY).
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to the image.
+    orientation : str, optional
+        Orientation of the layer, if it was reoriented.
+    file_orientation : str, optional
+        Orientation of the image (i.e. of the atlas), if the layer was
+        reoriented.
+    region : dict, optional
+        The region of the image loaded, if cropped.
+    """
+    source: Dict = {"path": str(path)}
+    if orientation != file_orientation:
+        source["orientation"] = orientation
+        source["file_orientation"] = file_orientation
+    if region is not None:
+        source["region"] = region
+    return source
+
+
+def _read_image(path: Path) -> np.ndarray:
+    return read_image(find_image(path))
+
+
+def _get_image_shape(path: Path) -> Tuple[Tuple[int, ...], np.dtype]:
+    return get_image_shape(find_image(path))
+
+
+@profile("save labels edits")
+def save_labels_edits(
+    path: os.PathLike,
+    data: np.ndarray,
+    source: Optional[Dict] = None,
+    edited_chunks: Optional[Set[ChunkIndex]] = None,
+) -> int:
+    """Save the edited chunks of a labels layer to the sidecar store of the
+    image it was loaded from.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to the image, e.g. ``registered_atlas.tiff``.
+    data : np.ndarray
+        The layer data.
+    source : dict, optional
+        Where the layer was loaded from (see get_labels_source), if it was
+        reoriented or cropped.
+    edited_chunks : Set[ChunkIndex], optional
+        The chunks of the layer data (of CHUNK_SHAPE) that may have been
+        edited. By default, every chunk is compared with the saved image.
+
+    Returns
+    -------
+    int
+        The number of chunks written.
+    """
+    import brainglobe_space as bgs
+
+    path = Path(path)
+    shape, dtype = _get_image_shape(path)
+    source = source or {}
+    region = source.get("region")
+    layer_shape = data.shape
+    reoriented = source.get("orientation") != source.get("file_orientation")
+    if reoriented:
+        # a view of the data, in the orientation of the image
+        data = bgs.map_stack_to(
+            source["orientation"], source["file_orientation"], data
+        )
+    start = np.zeros(3, int) if region is None else np.asarray(region["start"])
+    stop = np.asarray(shape) if region is None else np.asarray(region["stop"])
+    if tuple(data.shape) != tuple(stop - start):
+        # e.g. a preview, before the full resolution data has loaded
+        raise ValueError(
+            f"Can't save edits to {path.name}: the layer has shape "
+            f"{layer_shape}, but {tuple(stop - start)} was loaded, so it "
+            "isn't at full resolution (is it still a preview, or was it "
+            "downsampled to fit in memory?). Edits can only be saved once "
+            "the full resolution data has loaded."
+        )
+
+    if edited_chunks is None:
+        chunks = set(get_chunks_in_box(start, stop))
+    else:
+        chunks = set()
+        for chunk_index in edited_chunks:
+            chunk_slices = get_chunk_slices(chunk_index, layer_shape)
+            box = {
+                "start": [s.start for s in chunk_slices],
+                "stop": [s.stop for s in chunk_slices],
+                "shape": layer_shape,
+            }
+            if reoriented:
+                box = reorient_region(
+                    box, source["orientation"], source["file_orientation"]
+                )
+            chunks.update(
+                get_chunks_in_box(
+                    start + np.asarray(box["start"]),
+                    start + np.asarray(box["stop"]),
+                )
+            )
+
+    store = LabelsEditStore(path)
+    if not store.exists():
+        store.create(shape, dtype)
+    image = None
+    n_written = 0
+    for chunk_index in sorted(chunks):
+        chunk_slices = get_chunk_slices(chunk_index, shape)
+        saved = store.read_chunk(chunk_index)
+        if saved is None:
+            if image is None:
+                image = _read_image(path)
+            saved = np.asarray(image[chunk_slices])
+        overlap = get_overlap(chunk_slices, start, stop)
+        if overlap is None:
+            continue
+        in_chunk, in_data = overlap
+        chunk = np.array(saved)
+        chunk[in_chunk] = data[in_data]
+        if not np.array_equal(chunk, saved):
+            store.write_chunk(chunk_index, chunk)
+            n_written += 1
+    return n_written
+
+
+@profile("compact labels edits")
+def compact_labels_edits(path: os.PathLike) -> bool:
+    """Write the saved edits to an image into the TIFF file, and remove the
+    sidecar store.
+
+    If the image was read from a Zarr variant (see
+    brainglobe_napari_io.ome_zarr), the edited image is written as a TIFF
+    file, which is then read in place of the Zarr image.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to the image, e.g. ``registered_atlas.tiff``.
+
+    Returns
+    -------
+    bool
+        True if there were edits to compact.
+    """
+    import tifffile
+
+    path = Path(path)
+    store = LabelsEditStore(path)
+    if not store.exists():
+        store.clear()
+        return False
+    image = store.apply(np.array(_read_image(path)))
+    with write_atomically(path) as temp_path:
+        tifffile.imwrite(temp_path, image, photometric="minisblack")
+    store.clear()
+    return True
+
+
+def compact_brainreg_dir(path: os.PathLike) -> List[Path]:
+    """Compact the edits to every labels image in a brainreg directory (see
+    compact_labels_edits), returning the images that were rewritten."""
+    compacted = []
+    for filename in LABELS_FILES:
+        if compact_labels_edits(Path(path) / filename):
+            compacted.append(Path(path) / filename)
+    return compacted
+
+
+def get_edited_chunks(atoms: Iterable) -> Set[ChunkIndex]:
+    """Get the chunks edited by the history atoms of a napari paint
+    event."""
+    chunks: Set[ChunkIndex] = set()
+    for atom in atoms:
+        if hasattr(atom, "slice_key"):
+            start = [s.start for s in atom.slice_key]
+            stop = [s.stop for s in atom.slice_key]
+        else:
+            indices = atom[0]
+            if len(indices) == 0 or np.size(indices[0]) == 0:
+                continue
+            start = [np.min(axis_indices) for axis_indices in indices]
+            stop = [np.max(axis_indices) + 1 for axis_indices in indices]
+        chunks.update(get_chunks_in_box(start, stop))
+    return chunks
+
+
+def track_labels_edits(layer):
+    """Track the chunks of a labels layer that are edited, so only those
+    are saved.
+
+    The chunks are recorded in the layer metadata under EDITED_CHUNKS_KEY.
+    Chunks stay recorded after saving, as undoing an edit changes them
+    again (without a paint event). If the layer data is replaced, the
+    record is removed, so every chunk is compared when saving.
+    """
+    if EDITED_CHUNKS_KEY in layer.metadata:
+        return
+    layer.metadata[EDITED_CHUNKS_KEY] = set()
+
+    def on_paint(event):
+        edited_chunks = layer.metadata.get(EDITED_CHUNKS_KEY)
+        if edited_chunks is not None:
+            edited_chunks.update(get_edited_chunks(event.value))
+
+    def on_data(event):
+        layer.metadata.pop(EDITED_CHUNKS_KEY, None)
+
+    layer.events.paint.connect(on_paint)
+    layer.events.data.connect(on_data)
+
+
+def track_loaded_labels_edits(layer):
+    """Track edits (see track_labels_edits) to a napari layer, if it is a
+    labels layer loaded from a brainreg directory."""
+    if LABELS_SOURCE_KEY in layer.metadata and hasattr(layer.events, "paint"):
+        track_labels_edits(layer)
+
+
+def track_viewer_labels_edits(viewer):
+    """Track edits (see track_labels_edits) to the labels layers loaded from
+    brainreg directories, in a napari viewer."""
+    if viewer is None or viewer in _tracked_viewers:
+        return
+    _tracked_viewers.add(viewer)
+
+    for layer in viewer.layers:
+        track_loaded_labels_edits(layer)
+    viewer.layers.events.inserted.connect(
+        lambda event: track_loaded_labels_edits(event.value)
+    )
+
+
+@profile("write labels")
+def write_labels(path: str, data: np.ndarray, attributes: Dict) -> List[str]:
+    """napari writer for labels layers.
+
+    Edits to a labels layer loaded from a brainreg directory, saved to the
+    image it was loaded from (e.g. ``registered_atlas.tiff``), are saved as
+    edited chunks (see save_labels_edits). Other layers are written by
+    napari's own labels writer, as they would be without this plugin.
+    """
+    labels_path = Path(path)
+    metadata = attributes.get("metadata", {})
+    source = metadata.get(LABELS_SOURCE_KEY)
+    is_source = source is not None and Path(source["path"]) == labels_path
+    if is_source or (
+        labels_path.name in LABELS_FILES
+        and labels_path.exists()
+        and is_brainreg_dir(labels_path.parent)
+    ):
+        n_written = save_labels_edits(
+            labels_path,
+            data,
+            source if is_source else None,
+            metadata.get(EDITED_CHUNKS_KEY) if is_source else None,
+        )
+        print(
+            f"Saved edits to {labels_path.name} ({n_written} chunks written)"
+        )
+        return [str(labels_path)]
+
+    from napari_builtins.io import napari_write_labels
+
+    with span("save", file=path):
+        written = napari_write_labels(path, data, attributes)
+    return [] if written is None else [written]
@@ -0,0 +1,447 @@
+"""A sidecar index of the cells in a cell file, grouped into spatial blocks.
+
+Loading a region of a brain (e.g. a structure) from a cell file with
+millions of cells would otherwise read and parse every cell, to keep a
+few. The block index is a copy of the positions and types of the cells,
+sorted by the block of a regular grid each cell is in (and then by type),
+with the offset of the cells of each block and type. The cells inside a
+box, or of some types, are read from the few blocks that overlap it, as a
+memory map, so only a small fraction of the file is read.
+
+The index sits next to the cell file, e.g. ``points/cell_classification.xml``
+is indexed in ``points/cell_classification.cell_blocks.npy`` (the cells)
+and ``points/cell_classification.cell_blocks.npz`` (the offsets, and the
+count of each type). It is built the first time a region is loaded, and
+rebuilt if the cell file has changed since. Cell metadata isn't indexed,
+so files with metadata are still read in full.
+
+The block size (in voxels) can be set with the
+BRAINGLOBE_NAPARI_IO_CELL_BLOCK_SIZE environment variable (256 by default),
+and the index turned off (so regions are cropped after reading every cell)
+by setting it to "off".
+"""
+
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from brainglobe_napari_io.cellfinder.cell_files import (
+    BINARY_CELLS_SUFFIX,
+    get_binary_cells_path,
+    get_cell_file_suffix,
+    get_compression,
+    read_cell_positions,
+    read_cells,
+)
+from brainglobe_napari_io.profiling import add_bytes_read, profile, span
+from brainglobe_napari_io.utils import is_up_to_date, write_atomically
+
+CELL_BLOCK_SIZE_ENV_VAR = "BRAINGLOBE_NAPARI_IO_CELL_BLOCK_SIZE"
+DEFAULT_BLOCK_SIZE = 256
+CELLS_SUFFIX = ".cell_blocks.npy"
+OFFSETS_SUFFIX = ".cell_blocks.npz"
+
+
+def get_block_size() -> Optional[float]:
+    """Get the size of the blocks of cell block indexes, in voxels (256 by
+    default), or None if they aren't used."""
+    value = os.environ.get(CELL_BLOCK_SIZE_ENV_VAR, "").lower()
+    if value in ("off", "none", "0"):
+        return None
+    try:
+        block_size = float(value or DEFAULT_BLOCK_SIZE)
+    except ValueError:
+        raise ValueError(
+            f"Invalid {CELL_BLOCK_SIZE_ENV_VAR}: {value!r}, use a size "
+            "in voxels or 'off'"
+        )
+    if block_size <= 0:
+        raise ValueError(f"{CELL_BLOCK_SIZE_ENV_VAR} must be > 0")
+    return block_size
+
+
+def get_cell_blocks_paths(cells_path: os.PathLike) -> Tuple[Path, Path]:
+    """Get the paths of the block index of a cell file: the sorted cells,
+    and the offsets of each block."""
+    base = get_binary_cells_path(cells_path).name[: -len(BINARY_CELLS_SUFFIX)]
+    cells_path = Path(cells_path)
+    return (
+        cells_path.with_name(base + CELLS_SUFFIX),
+        cells_path.with_name(base + OFFSETS_SUFFIX),
+    )
+
+
+def is_cell_blocks_up_to_date(cells_path: os.PathLike) -> bool:
+    """Whether a cell file has a block index, newer than the file."""
+    sorted_cells_path, offsets_path = get_cell_blocks_paths(cells_path)
+    # the offsets are written last, so are newer than the cells
+    return sorted_cells_path.exists() and is_up_to_date(
+        offsets_path, [cells_path, sorted_cells_path]
+    )
+
+
+class CellBlocks:
+    """The cells of a cell file, grouped into spatial blocks.
+
+    Parameters
+    ----------
+    cells : np.ndarray
+        The cells, as a structured array of "z", "y" and "x" positions and
+        "type", sorted by block and type (e.g. a memory map of the sorted
+        cells file).
+    offsets : Dict[str, Any]
+        - "origin", "block_size": the position of the corner of the first
+          block, and the size of the blocks along each axis.
+        - "grid_shape": the number of blocks along each axis.
+        - "types": the sorted cell types.
+        - "offsets": the index of the first cell of each block (in C
+          order) and type, and the total number of cells.
+        - "has_metadata": whether the cells in the file have metadata.
+    """
+
+    def __init__(self, cells: np.ndarray, offsets: Dict[str, Any]):
+        self.cells = cells
+        self.origin = np.asarray(offsets["origin"], dtype=np.float64)
+        self.block_size = np.asarray(offsets["block_size"], dtype=np.float64)
+        self.grid_shape = tuple(int(s) for s in offsets["grid_shape"])
+        self.types = np.asarray(offsets["types"], dtype=int)
+        self.offsets = np.asarray(offsets["offsets"], dtype=np.int64)
+        self.has_metadata = bool(offsets["has_metadata"])
+
+    @classmethod
+    def from_positions(
+        cls,
+        positions: np.ndarray,
+        types: np.ndarray,
+        block_size: float = DEFAULT_BLOCK_SIZE,
+        has_metadata: bool = False,
+    ) -> "CellBlocks":
+        """Group cells into blocks.
+
+        Parameters
+        ----------
+        positions : np.ndarray
+            Nx3 array of (z, y, x) positions.
+        types : np.ndarray
+            Array of the N cell types.
+        block_size : float, optional
+            Size of the blocks along each axis, by default 256.
+        has_metadata : bool, optional
+            Whether the cells have metadata (which isn't indexed).
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        types = np.asarray(types, dtype=int)
+        # positions are stored as float32 if that is exact
+        dtype: type = np.float32
+        if not np.array_equal(positions.astype(np.float32), positions):
+            dtype = np.float64
+        cells = np.empty(
+            len(positions),
+            dtype=[("z", dtype), ("y", dtype), ("x", dtype), ("type", "i1")],
+        )
+        block_sizes = np.full(3, block_size, dtype=np.float64)
+        if len(positions):
+            origin = np.floor(positions.min(axis=0))
+            blocks = ((positions - origin) // block_sizes).astype(np.int64)
+            grid_shape = blocks.max(axis=0) + 1
+        else:
+            origin = np.zeros(3)
+            blocks = np.empty((0, 3), dtype=np.int64)
+            grid_shape = np.ones(3, dtype=np.int64)
+        unique_types, type_indices = np.unique(types, return_inverse=True)
+        n_types = max(len(unique_types), 1)
+        keys = (
+            np.ravel_multi_index(blocks.T, tuple(grid_shape)) * n_types
+            + type_indices.ravel()
+        )
+        order = np.argsort(keys, kind="stable")
+        for axis, name in enumerate("zyx"):
+            cells[name] = positions[order, axis]
+        cells["type"] = types[order]
+        offsets = np.zeros(int(np.prod(grid_shape)) * n_types + 1, np.int64)
+        offsets[1:] = np.cumsum(np.bincount(keys, minlength=len(offsets) - 1))
+        return cls(
+            cells,
+            {
+                "origin": origin,
+                "block_size": block_sizes,
+                "grid_shape": grid_shape,
+                "types": unique_types,
+                "offsets": offsets,
+                "has_metadata": has_metadata,
+            },
+        )
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def get_type_counts(self) -> Dict[int, int]:
+        """Get the number of cells of each type."""
+        per_block = np.diff(self.offsets).reshape(-1, max(len(self.types), 1))
+        counts = per_block.sum(axis=0)
+        return {int(t): int(n) for t, n in zip(self.types, counts)}
+
+    def get_ranges(
+        self,
+        start: Optional[Sequence[float]] = None,
+        stop: Optional[Sequence[float]] = None,
+        types: Optional[Sequence[int]] = None,
+    ) -> np.ndarray:
+        """Get the ranges of sorted cells in the blocks overlapping a box,
+        of some types.
+
+        Returns
+        -------
+        np.ndarray
+            Rx2 array of the start and stop of each range, merged where
+            they are contiguous.
+        """
+        grid_shape = np.asarray(self.grid_shape)
+        first = np.zeros(3, dtype=np.int64)
+        last = grid_shape - 1
+        if start is not None:
+            first = np.floor(
+                (np.asarray(start, dtype=float) - self.origin)
+                / self.block_size
+            ).astype(np.int64)
+        if stop is not None:
+            last = np.floor(
+                (np.asarray(stop, dtype=float) - self.origin) / self.block_size
+            ).astype(np.int64)
+        first, last = np.maximum(first, 0), np.minimum(last, grid_shape - 1)
+        n_types = max(len(self.types), 1)
+        type_indices = np.arange(len(self.types))
+        if types is not None:
+            type_indices = np.flatnonzero(np.isin(self.types, types))
+        if (first > last).any() or not len(type_indices):
+            return np.empty((0, 2), dtype=np.int64)
+
+        blocks = np.ravel_multi_index(
+            np.meshgrid(
+                *(np.arange(a, b + 1) for a, b in zip(first, last)),
+                indexing="ij",
+            ),
+            self.grid_shape,
+        ).ravel()
+        keys = (blocks[:, None] * n_types + type_indices[None, :]).ravel()
+        ranges = np.stack([self.offsets[keys], self.offsets[keys + 1]], 1)
+        ranges = ranges[ranges[:, 1] > ranges[:, 0]]
+        if not len(ranges):
+            return ranges
+        # merge ranges that follow on from each other
+        breaks = np.flatnonzero(ranges[1:, 0] != ranges[:-1, 1]) + 1
+        return np.stack(
+            [
+                ranges[np.concatenate([[0], breaks]), 0],
+                ranges[np.concatenate([breaks - 1, [len(ranges) - 1]]), 1],
+            ],
+            axis=1,
+        )
+
+    def query(
+        self,
+        start: Optional[Sequence[float]] = None,
+        stop: Optional[Sequence[float]] = None,
+        types: Optional[Sequence[int]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the cells inside a box, of some types, reading only the
+        blocks that overlap the box.
+
+        Parameters
+        ----------
+        start, stop : Sequence[float], optional
+            The (inclusive) start and (exclusive) stop of the box along
+            each axis, in the same (z, y, x) coordinates as the cells. By
+            default, the box is unbounded.
+        types : Sequence[int], optional
+            The cell types to get, by default all.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            Nx3 array of (z, y, x) positions, and an array of N cell types,
+            in the order they are stored (by block, then type).
+        """
+        ranges = self.get_ranges(start, stop, types)
+        if len(ranges):
+            cells = np.concatenate([self.cells[a:b] for a, b in ranges])
+        else:
+            cells = self.cells[:0]
+        add_bytes_read(cells.nbytes)
+        positions = np.stack(
+            [cells[name].astype(np.float64) for name in "zyx"], axis=1
+        ).reshape(-1, 3)
+        inside = np.ones(len(cells), dtype=bool)
+        if start is not None:
+            inside &= np.all(positions >= np.asarray(start), axis=1)
+        if stop is not None:
+            inside &= np.all(positions < np.asarray(stop), axis=1)
+        return positions[inside], cells["type"][inside].astype(int)
+
+    def save(self, cells_path: os.PathLike):
+        """Save the index of a cell file next to it (see
+        get_cell_blocks_paths)."""
+        sorted_cells_path, offsets_path = get_cell_blocks_paths(cells_path)
+        with write_atomically(sorted_cells_path) as temporary_path:
+            with open(temporary_path, "wb") as cells_file:
+                np.save(cells_file, np.asarray(self.cells))
+        with write_atomically(offsets_path) as temporary_path:
+            with open(temporary_path, "wb") as offsets_file:
+                np.savez(
+                    offsets_file,
+                    origin=self.origin,
+                    block_size=self.block_size,
+                    grid_shape=np.asarray(self.grid_shape),
+                    types=self.types,
+                    offsets=self.offsets,
+                    has_metadata=self.has_metadata,
+                )
+
+    @classmethod
+    def load(cls, cells_path: os.PathLike) -> "CellBlocks":
+        """Load the saved index of a cell file, with the cells memory
+        mapped."""
+        sorted_cells_path, offsets_path = get_cell_blocks_paths(cells_path)
+        with np.load(offsets_path) as offsets_file:
+            offsets = {key: offsets_file[key] for key in offsets_file.files}
+        add_bytes_read(os.path.getsize(offsets_path))
+        return cls(np.load(sorted_cells_path, mmap_mode="r"), offsets)
+
+
+@profile("cell blocks")
+def get_cell_blocks(
+    cells_path: os.PathLike, block_size: Optional[float] = None
+) -> CellBlocks:
+    """Get the block index of a cell file, building and saving it if there
+    isn't an up-to-date one.
+
+    Parameters
+    ----------
+    cells_path : os.PathLike
+        Path to a cellfinder XML/YAML file (which may be compressed).
+    block_size : float, optional
+        Size of the blocks of a new index, by default from get_block_size.
+
+    Returns
+    -------
+    CellBlocks
+        The index.
+    """
+    if is_cell_blocks_up_to_date(cells_path):
+        try:
+            return CellBlocks.load(cells_path)
+        except (OSError, ValueError, KeyError):
+            print(f"Could not read the cell index of {cells_path}, rebuilding")
+
+    print(f"Indexing the cells of {cells_path}")
+    with span("cell blocks build", file=Path(cells_path).name):
+        binary_path = get_binary_cells_path(cells_path)
+        if get_cell_file_suffix(cells_path) == ".xml" and not is_up_to_date(
+            binary_path, [cells_path]
+        ):
+            # XML cell files have no metadata, and are streamed
+            positions, types = read_cell_positions(cells_path)
+            metadata = None
+        else:
+            positions, types, metadata = read_cells(cells_path)
+        blocks = CellBlocks.from_positions(
+            positions,
+            types,
+            block_size or get_block_size() or DEFAULT_BLOCK_SIZE,
+            has_metadata=metadata is not None,
+        )
+    try:
+        blocks.save(cells_path)
+    except OSError:
+        # e.g. a read-only directory, the index will be rebuilt next time
+        print(f"Could not save the cell index of {cells_path}")
+    return blocks
+
+
+def read_cells_in_box(
+    cells_path: os.PathLike,
+    start: Optional[Sequence[float]] = None,
+    stop: Optional[Sequence[float]] = None,
+    types: Optional[Sequence[int]] = None,
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Read only the cells of a cell file inside a box, or of some types,
+    with its block index.
+
+    Parameters
+    ----------
+    cells_path : os.PathLike
+        Path to a cellfinder XML/YAML file (which may be compressed).
+    start, stop, types
+        As for CellBlocks.query.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray] or None
+        The positions and types of the cells, or None if the index is
+        turned off, or can't be used as the cells have metadata (in which
+        case the whole file should be read).
+    """
+    if get_block_size() is None:
+        return None
+    blocks = get_cell_blocks(cells_path)
+    if blocks.has_metadata:
+        return None
+    with span(
+        "cell blocks query",
+        file=Path(cells_path).name,
+        compressed=get_compression(cells_path) is not None,
+    ):
+        return blocks.query(start, stop, types)
+
+
+def read_cells_strided(
+    cells_path: os.PathLike, step: int
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Read every nth cell of a cell file, without parsing it (e.g. for a
+    preview).
+
+    The cells are read from the file's block index if it is up to date (as
+    a memory map, so only those cells are read, spread over the blocks), or
+    otherwise from the positions and types in its up-to-date binary copy.
+
+    Parameters
+    ----------
+    cells_path : os.PathLike
+        Path to a cellfinder XML/YAML file (which may be compressed).
+    step : int
+        Read every step-th cell.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray] or None
+        The positions and types of the cells, or None if the file has no
+        up-to-date block index or binary copy (in which case reading any of
+        its cells means parsing it).
+    """
+    with span("cells strided read", file=Path(cells_path).name, step=step):
+        if is_cell_blocks_up_to_date(cells_path):
+            try:
+                cells = CellBlocks.load(cells_path).cells[::step]
+            except (OSError, ValueError, KeyError):
+                pass
+            else:
+                cells = np.array(cells)
+                add_bytes_read(cells.nbytes)
+                positions = np.stack(
+                    [cells[name].astype(np.float64) for name in "zyx"],
+                    axis=1,
+                ).reshape(-1, 3)
+                return positions, cells["type"].astype(int)
+
+        binary_path = get_binary_cells_path(cells_path)
+        if is_up_to_date(binary_path, [cells_path]):
+            # the positions and types are read in full (but not parsed), and
+            # the metadata isn't read
+            with np.load(binary_path) as cells_file:
+                positions = cells_file["positions"]
+                types = cells_file["types"]
+            add_bytes_read(positions.nbytes + types.nbytes)
+            return positions[::step], types[::step].astype(int)
+    return None
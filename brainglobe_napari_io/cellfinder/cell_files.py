@@ -0,0 +1,592 @@
+"""Compact binary copies of cellfinder XML/YAML cell files.
+
+Parsing a cell XML file builds a Python object per cell, which takes minutes
+for millions of cells. A binary copy (written by ``brainglobe-napari-io
+convert``) stores the positions and types as arrays, so loads in a fraction
+of a second. The copy sits next to the original, e.g.
+``points/cell_classification.xml`` is converted to
+``points/cell_classification.cells.npz``, and is only used while it is newer
+than the original.
+
+Cell files can also be compressed, with gzip (e.g. ``cells.xml.gz``) or, if
+the zstandard package is installed, Zstandard (e.g. ``cells.xml.zst``),
+which compresses and decompresses much faster. Compressed files are
+decompressed as they are parsed, without writing a temporary file.
+"""
+
+import gzip
+import io
+import json
+import os
+import re
+from contextlib import contextmanager
+from pathlib import Path
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+    cast,
+)
+
+import numpy as np
+
+from brainglobe_napari_io.profiling import add_file_read, span
+from brainglobe_napari_io.utils import is_up_to_date, write_atomically
+
+if TYPE_CHECKING:
+    from brainglobe_utils.cells.cells import Cell
+
+BINARY_CELLS_SUFFIX = ".cells.npz"
+CELL_FILE_SUFFIXES = (".xml", ".yml", ".yaml")
+# compression of cell files, by suffix
+COMPRESSIONS = {".gz": "gzip", ".zst": "zstd"}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+# bytes to compress at once when writing
+WRITE_CHUNK_BYTES = 2**20
+# the brainglobe marker is near the start of a cell file, so only this many
+# characters of a compressed file are decompressed to look for it
+MARKER_SEARCH_CHARS = 2**16
+# the marker of each format, as brainglobe_utils checks for it
+CELL_FILE_MARKERS = {
+    ".xml": re.compile(r"^\s*<CellCounter_Marker_File>\s*$"),
+    ".yml": re.compile(r"^CellCounter_Marker_File *: *true"),
+    ".yaml": re.compile(r"^CellCounter_Marker_File *: *true"),
+}
+
+
+def get_compression(cells_path: os.PathLike) -> Optional[str]:
+    """Get the compression of a cell file from its suffix ("gzip" or
+    "zstd"), or None if it isn't compressed."""
+    return COMPRESSIONS.get(Path(cells_path).suffix.lower())
+
+
+def get_cell_file_suffix(cells_path: os.PathLike) -> str:
+    """Get the suffix of the format of a cell file (e.g. ".xml"), ignoring
+    any compression suffix (e.g. of "cells.xml.gz")."""
+    cells_path = Path(cells_path)
+    if get_compression(cells_path) is not None:
+        cells_path = cells_path.with_suffix("")
+    return cells_path.suffix.lower()
+
+
+def import_zstandard():
+    """Import zstandard, which is needed for .zst cell files."""
+    try:
+        import zstandard
+    except ImportError as error:
+        raise ImportError(
+            "Reading and writing .zst cell files needs the zstandard "
+            "package (pip install zstandard)"
+        ) from error
+    return zstandard
+
+
+@contextmanager
+def open_cell_file(
+    cells_path: os.PathLike,
+    mode: str = "rb",
+    compression: Optional[str] = None,
+) -> Iterator[IO]:
+    """Open a cell file as a binary stream, decompressing (or compressing,
+    in "wb" mode) it on the fly if it is compressed.
+
+    Parameters
+    ----------
+    cells_path : os.PathLike
+        Path to a cell file, e.g. "cells.xml", "cells.xml.gz" or
+        "cells.xml.zst".
+    mode : str, optional
+        "rb" to read or "wb" to write, by default "rb".
+    compression : str, optional
+        "gzip" or "zstd", by default from the suffix of the path.
+    """
+    compression = compression or get_compression(cells_path)
+    if compression is None:
+        with open(cells_path, mode) as cells_file:
+            yield cells_file
+    elif compression == "gzip":
+        with gzip.open(cells_path, mode, compresslevel=GZIP_LEVEL) as file:
+            yield cast(IO[bytes], file)
+    else:
+        zstandard = import_zstandard()
+        with open(cells_path, mode) as raw_file:
+            if mode.startswith("r"):
+                stream = zstandard.ZstdDecompressor().stream_reader(raw_file)
+            else:
+                stream = zstandard.ZstdCompressor(
+                    level=ZSTD_LEVEL
+                ).stream_writer(raw_file)
+            with stream:
+                yield stream
+
+
+def is_cell_file(cells_path: os.PathLike, suffixes: Tuple[str, ...]) -> bool:
+    """Whether a path is a (possibly compressed) cellfinder cell file in one
+    of the formats, from its suffix and the brainglobe marker near its
+    start.
+
+    Parameters
+    ----------
+    cells_path : os.PathLike
+        Path to a file.
+    suffixes : Tuple[str, ...]
+        Suffixes of the formats, e.g. (".yml", ".yaml").
+
+    Returns
+    -------
+    bool
+        True if the file is a cell file.
+    """
+    cells_path = Path(cells_path)
+    if get_cell_file_suffix(cells_path) not in suffixes:
+        return False
+    if get_compression(cells_path) is None:
+        from brainglobe_utils.IO.cells import (
+            is_brainglobe_xml,
+            is_brainglobe_yaml,
+        )
+
+        if get_cell_file_suffix(cells_path) == ".xml":
+            return is_brainglobe_xml(cells_path)
+        return is_brainglobe_yaml(cells_path)
+
+    marker = CELL_FILE_MARKERS[get_cell_file_suffix(cells_path)]
+    try:
+        with open_cell_file(cells_path) as cells_file:
+            text = io.TextIOWrapper(
+                cells_file, encoding="utf-8", errors="replace"
+            )
+            start = text.read(MARKER_SEARCH_CHARS)
+            # so closing the wrapper doesn't close the file twice
+            text.detach()
+    except ImportError as error:
+        print(f"Can't read {cells_path}: {error}")
+        return False
+    except (OSError, EOFError, ValueError):
+        return False
+    return any(marker.match(line) for line in start.splitlines())
+
+
+def get_binary_cells_path(cells_path: os.PathLike) -> Path:
+    """Get the path of the binary copy of a cell file.
+
+    Parameters
+    ----------
+    cells_path : os.PathLike
+        Path to a cellfinder XML/YAML file.
+
+    Returns
+    -------
+    Path
+        Path to its binary copy, which may not exist.
+    """
+    cells_path = Path(cells_path)
+    if get_compression(cells_path) is not None:
+        cells_path = cells_path.with_suffix("")
+    return cells_path.with_name(cells_path.stem + BINARY_CELLS_SUFFIX)
+
+
+def parse_cells(
+    cells_path: os.PathLike,
+) -> Tuple[np.ndarray, np.ndarray, Optional[List[Dict]]]:
+    """Parse a (possibly compressed) cellfinder XML/YAML file.
+
+    Uncompressed files are parsed by brainglobe_utils. Compressed XML files
+    are streamed (see read_new_cells), and compressed YAML files are
+    decompressed into memory and parsed in the same way as
+    brainglobe_utils does.
+
+    Parameters
+    ----------
+    cells_path : os.PathLike
+        Path to a cellfinder XML/YAML file.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, Optional[List[Dict]]]
+        Nx3 array of (z, y, x) positions, an array of N cell types, and the
+        metadata of each cell (or None if no cell has metadata).
+    """
+    if get_compression(cells_path) is None:
+        from brainglobe_utils.IO.cells import get_cells_xml, get_cells_yaml
+
+        # by the lower case suffix, as is_cell_file checks it
+        if get_cell_file_suffix(cells_path) == ".xml":
+            all_cells = get_cells_xml(str(cells_path), cells_only=False)
+        else:
+            all_cells = get_cells_yaml(str(cells_path), cells_only=False)
+        positions = np.array(
+            [(c.z, c.y, c.x) for c in all_cells], dtype=np.float64
+        ).reshape(-1, 3)
+        types = np.array([c.type for c in all_cells], dtype=int)
+        metadata = None
+        if any(c.metadata for c in all_cells):
+            metadata = [c.metadata for c in all_cells]
+        return positions, types, metadata
+
+    if get_cell_file_suffix(cells_path) == ".xml":
+        new_cells = read_new_cells(cells_path)
+        return new_cells.positions, new_cells.types, None
+
+    import ryml
+
+    with open_cell_file(cells_path) as cells_file:
+        tree = ryml.parse_in_arena(cells_file.read())
+    # as brainglobe_utils, via JSON, as ryml doesn't build Python objects
+    # (compute_emit_json_length was renamed in rapidyaml 0.11)
+    compute_json_length = getattr(ryml, "compute_json_length", None)
+    if compute_json_length is None:
+        compute_json_length = ryml.compute_emit_json_length
+    buffer = bytearray(compute_json_length(tree))
+    ryml.emit_json_in_place(tree, buffer)
+    data = json.loads(buffer)
+    if not data or not data.get("CellCounter_Marker_File"):
+        raise ValueError(f"{cells_path} is not a cellfinder YAML file")
+
+    candidates = data["candidate_cells"]
+    positions = np.array(
+        [(c["z"], c["y"], c["x"]) for c in candidates], dtype=np.float64
+    ).reshape(-1, 3)
+    types = np.array([c["type"] for c in candidates], dtype=int)
+    metadata = None
+    if any(c.get("metadata") for c in candidates):
+        metadata = [c.get("metadata") or {} for c in candidates]
+    return positions, types, metadata
+
+
+def serialize_cells(
+    cells: List["Cell"], suffix: str, artifact_keep: bool = True
+) -> bytes:
+    """Serialize cells in a cellfinder format, as
+    brainglobe_utils.IO.cells.save_cells writes them.
+
+    Parameters
+    ----------
+    cells : List[Cell]
+        The cells.
+    suffix : str
+        Suffix of the format, ".xml", ".yml" or ".yaml".
+    artifact_keep : bool, optional
+        As for brainglobe_utils.IO.cells.save_cells, by default True.
+
+    Returns
+    -------
+    bytes
+        The contents of the cell file.
+    """
+    if suffix == ".xml":
+        from brainglobe_utils.IO.cells import make_xml
+
+        return make_xml(cells, "  ", artifact_keep=artifact_keep)
+
+    import brainglobe_utils
+    import ryml
+    from brainglobe_utils.cells.cells import Cell
+
+    dicts = [cell.to_dict() for cell in cells]
+    if artifact_keep:
+        for cell_dict in dicts:
+            if cell_dict.get("type") == Cell.ARTIFACT:
+                cell_dict["type"] = Cell.UNKNOWN
+    else:
+        dicts = [d for d in dicts if d["type"] != Cell.ARTIFACT]
+    data = {
+        "brainglobe_utils_version": brainglobe_utils.__version__,
+        "CellCounter_Marker_File": True,
+        "num_candidates": len(dicts),
+        "candidate_cells": dicts,
+    }
+    # as brainglobe_utils, via JSON, with the JSON styles removed so it is
+    # emitted as block YAML
+    tree = ryml.parse_in_arena(json.dumps(data).encode("utf8"))
+    for node_id, _ in ryml.walk(tree):
+        if tree.is_map(node_id) or tree.is_seq(node_id):
+            tree.set_container_style(node_id, ryml.NOTYPE)
+        if tree.has_key(node_id):
+            tree.set_key_style(node_id, ryml.NOTYPE)
+        if tree.has_val(node_id):
+            tree.set_val_style(node_id, ryml.NOTYPE)
+    buffer = bytearray(ryml.compute_emit_yaml_length(tree))
+    ryml.emit_yaml_in_place(tree, buffer)
+    return bytes(buffer)
+
+
+def write_cells(
+    cells: List["Cell"],
+    cells_path: Union[str, os.PathLike],
+    artifact_keep: bool = True,
+) -> Path:
+    """Save cells to a cellfinder XML/YAML file, compressed if the path has
+    a compression suffix (e.g. "cells.xml.gz").
+
+    The cells are serialized as brainglobe_utils saves them, and streamed
+    through the compressor into the file, so nothing uncompressed is
+    written.
+
+    Parameters
+    ----------
+    cells : List[Cell]
+        The cells.
+    cells_path : str or os.PathLike
+        Path to write to.
+    artifact_keep : bool, optional
+        As for brainglobe_utils.IO.cells.save_cells, by default True.
+
+    Returns
+    -------
+    Path
+        The path written to.
+    """
+    cells_path = Path(cells_path)
+    compression = get_compression(cells_path)
+    if compression == "zstd":
+        # fail before writing anything
+        import_zstandard()
+    contents = memoryview(
+        serialize_cells(cells, get_cell_file_suffix(cells_path), artifact_keep)
+    )
+    with write_atomically(cells_path) as temporary_path:
+        with open_cell_file(temporary_path, "wb", compression) as output:
+            for start in range(0, len(contents), WRITE_CHUNK_BYTES):
+                output.write(contents[start : start + WRITE_CHUNK_BYTES])
+    return cells_path
+
+
+def write_binary_cells(
+    cells_path: Union[str, os.PathLike],
+    output_path: Optional[Union[str, os.PathLike]] = None,
+) -> Path:
+    """Convert a cellfinder XML/YAML file to a binary copy.
+
+    Positions are stored as float32 if that is exact (e.g. for integer
+    positions), and float64 otherwise. Cell metadata, if there is any, is
+    stored as JSON.
+
+    Parameters
+    ----------
+    cells_path : str or os.PathLike
+        Path to a cellfinder XML/YAML file.
+    output_path : str or os.PathLike, optional
+        Path to write to, by default get_binary_cells_path(cells_path).
+
+    Returns
+    -------
+    Path
+        The path written to.
+    """
+    cells_path = Path(cells_path)
+    if output_path is None:
+        output_path = get_binary_cells_path(cells_path)
+    positions, types, metadata = parse_cells(cells_path)
+
+    if np.array_equal(positions.astype(np.float32), positions):
+        positions = positions.astype(np.float32)
+    arrays: Dict[str, Any] = {
+        "positions": positions,
+        "types": types.astype(np.uint8),
+    }
+    if metadata is not None:
+        try:
+            arrays["metadata"] = np.array(json.dumps(metadata))
+        except TypeError as error:
+            raise ValueError(
+                f"The cell metadata in {cells_path} can't be stored in a "
+                f"binary cell file: {error}"
+            ) from error
+
+    with write_atomically(output_path) as temporary_path:
+        with open(temporary_path, "wb") as output_file:
+            np.savez(output_file, **arrays)
+    return Path(output_path)
+
+
+def read_binary_cells(
+    path: os.PathLike,
+) -> Tuple[np.ndarray, np.ndarray, Optional[List[Dict]]]:
+    """Read a binary cell file.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to a binary cell file, written by write_binary_cells.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, Optional[List[Dict]]]
+        Nx3 array of (z, y, x) positions, an array of N cell types, and the
+        metadata of each cell (or None if no cell has metadata).
+    """
+    with np.load(path) as cells_file:
+        positions = cells_file["positions"]
+        types = cells_file["types"].astype(int)
+        metadata = None
+        if "metadata" in cells_file.files:
+            metadata = json.loads(str(cells_file["metadata"]))
+    add_file_read(path)
+    return positions, types, metadata
+
+
+def read_cells(
+    cells_path: os.PathLike,
+) -> Tuple[np.ndarray, np.ndarray, Optional[List[Dict]]]:
+    """Read the cells in a cellfinder XML/YAML file, from its binary copy if
+    that is up to date.
+
+    Parameters
+    ----------
+    cells_path : os.PathLike
+        Path to a cellfinder XML/YAML file.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, Optional[List[Dict]]]
+        Nx3 array of (z, y, x) positions, an array of N cell types, and the
+        metadata of each cell (or None if no cell has metadata).
+    """
+    binary_path = get_binary_cells_path(cells_path)
+    with span("cells parse", file=Path(cells_path).name):
+        if is_up_to_date(binary_path, [cells_path]):
+            return read_binary_cells(binary_path)
+
+        positions, types, metadata = parse_cells(cells_path)
+        add_file_read(cells_path)
+    return positions, types, metadata
+
+
+def read_cell_positions(
+    cells_path: os.PathLike,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Read only the positions and types of the cells in a cellfinder
+    XML/YAML file.
+
+    The binary copy is read if it is up to date. Otherwise, XML files are
+    streamed (see read_new_cells), so no object is built per cell, and the
+    memory used doesn't grow with the size of the file's text.
+
+    Parameters
+    ----------
+    cells_path : os.PathLike
+        Path to a cellfinder XML/YAML file.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Nx3 array of (z, y, x) positions, and an array of N cell types.
+    """
+    binary_path = get_binary_cells_path(cells_path)
+    if is_up_to_date(binary_path, [cells_path]):
+        with span("cells parse", file=Path(cells_path).name):
+            positions, types, _ = read_binary_cells(binary_path)
+        return positions, types
+    if get_cell_file_suffix(cells_path) == ".xml":
+        new_cells = read_new_cells(cells_path)
+        return new_cells.positions, new_cells.types
+    positions, types, _ = read_cells(cells_path)
+    return positions, types
+
+
+class NewCells(NamedTuple):
+    """Cells added to a cell file since it was last read.
+
+    Attributes
+    ----------
+    positions : np.ndarray
+        Nx3 array of (z, y, x) positions of the new cells.
+    types : np.ndarray
+        Array of the types of the N new cells.
+    metadata : list of dict, optional
+        The metadata of each new cell (or None if no cell has metadata).
+    counts : Dict[int, int]
+        The number of cells of each type in the file, including those
+        already read.
+    """
+
+    positions: np.ndarray
+    types: np.ndarray
+    metadata: Optional[List[Dict]]
+    counts: Dict[int, int]
+
+
+def read_new_cells(
+    cells_path: os.PathLike, n_read: Optional[Dict[int, int]] = None
+) -> NewCells:
+    """Read the cells added to a cell file since it was last read.
+
+    brainmapper writes the cells of each type in the order they were found,
+    so cells added to a file come after the cells of the same type that
+    were already there. For XML files (compressed or not), the markers
+    already read are skipped while streaming through the file, so only the
+    new cells are parsed. Other formats are read in full.
+
+    Parameters
+    ----------
+    cells_path : os.PathLike
+        Path to a cellfinder XML/YAML file.
+    n_read : Dict[int, int], optional
+        The number of cells of each type already read (e.g. the counts of
+        the last NewCells). By default, all cells are read.
+
+    Returns
+    -------
+    NewCells
+        The new cells. If the file has fewer cells of a type than n_read,
+        it has been rewritten, and the caller should read it in full.
+    """
+    n_read = n_read or {}
+    if get_cell_file_suffix(cells_path) != ".xml":
+        positions, types, metadata = read_cells(cells_path)
+        counts = {int(t): int(np.sum(types == t)) for t in np.unique(types)}
+        new = np.ones(len(types), dtype=bool)
+        for read_type, n in n_read.items():
+            new[np.flatnonzero(types == read_type)[:n]] = False
+        if metadata is not None:
+            metadata = [m for m, is_new in zip(metadata, new) if is_new]
+        return NewCells(positions[new], types[new], metadata, counts)
+
+    from xml.etree import ElementTree
+
+    type_counts: Dict[int, int] = {}
+    new_positions: List[List[int]] = []
+    new_types: List[int] = []
+    cell_type: Optional[int] = None
+    marker_type = None
+    with span("cells parse", file=Path(cells_path).name):
+        with open_cell_file(cells_path) as cells_file:
+            for event, element in ElementTree.iterparse(
+                cells_file, events=("start", "end")
+            ):
+                if event == "start":
+                    if element.tag == "Marker_Type":
+                        marker_type = element
+                elif element.tag == "Type":
+                    cell_type = int(element.text or 0)
+                elif element.tag == "Marker" and cell_type is not None:
+                    count = type_counts.get(cell_type, 0)
+                    if count >= n_read.get(cell_type, 0):
+                        new_positions.append(
+                            [
+                                int(float(element.findtext(f"Marker{axis}")))
+                                for axis in "ZYX"
+                            ]
+                        )
+                        new_types.append(cell_type)
+                    type_counts[cell_type] = count + 1
+                    # removed from the tree, so memory use doesn't grow
+                    # with the number of cells
+                    if marker_type is not None:
+                        marker_type.remove(element)
+        add_file_read(cells_path)
+    return NewCells(
+        np.array(new_positions, dtype=float).reshape(-1, 3),
+        np.array(new_types, dtype=int),
+        None,
+        type_counts,
+    )
@@ -0,0 +1,283 @@
+"""A spatial index of the points in cell layers.
+
+The index is a KD-tree (scipy.spatial.cKDTree) over the points of one or
+more layers, keeping track of which layer and row each point came from, and
+its type. It is used to find the nearest cells to other points (e.g. from
+the API), and to merge duplicate points when saving layers, i.e. points
+within a tolerance of each other, such as a point added twice or a cell in
+both the "Cells" and "Non cells" layers.
+
+When points are merged, which one is kept depends on the policy:
+
+- "cell": a point classified as a cell is kept over an unknown one (i.e.
+  "CELL wins"), otherwise the first point,
+- "non_cell": an unknown point is kept over a cell, otherwise the first,
+- "first": the first point (in layer order) is kept.
+
+Duplicate points are only merged when saving if the
+BRAINGLOBE_NAPARI_IO_DUPLICATE_TOLERANCE environment variable is set (to a
+distance in voxels, "0" to only merge points at the same position), with
+the policy set by BRAINGLOBE_NAPARI_IO_DUPLICATE_POLICY.
+
+Only 3D points are indexed.
+"""
+
+from __future__ import annotations
+
+import os
+from typing import TYPE_CHECKING, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from brainglobe_napari_io.profiling import span
+
+if TYPE_CHECKING:
+    from napari.types import LayerDataTuple
+
+DUPLICATE_TOLERANCE_ENV_VAR = "BRAINGLOBE_NAPARI_IO_DUPLICATE_TOLERANCE"
+DUPLICATE_POLICY_ENV_VAR = "BRAINGLOBE_NAPARI_IO_DUPLICATE_POLICY"
+DUPLICATE_POLICIES = ("cell", "non_cell", "first")
+
+
+def get_duplicate_tolerance() -> Optional[float]:
+    """Get the tolerance for merging duplicate points when saving, or None
+    if they aren't merged (by default, or if set to "off")."""
+    value = os.environ.get(DUPLICATE_TOLERANCE_ENV_VAR, "").lower()
+    if value in ("off", "none", ""):
+        return None
+    try:
+        tolerance = float(value)
+    except ValueError:
+        raise ValueError(
+            f"Invalid {DUPLICATE_TOLERANCE_ENV_VAR}: {value!r}, use a "
+            "distance in voxels or 'off'"
+        )
+    if tolerance < 0:
+        raise ValueError(f"{DUPLICATE_TOLERANCE_ENV_VAR} must be >= 0")
+    return tolerance
+
+
+def get_duplicate_policy() -> str:
+    """Get the policy for merging duplicate points when saving ("cell" by
+    default)."""
+    policy = os.environ.get(DUPLICATE_POLICY_ENV_VAR, "cell").lower()
+    if policy not in DUPLICATE_POLICIES:
+        raise ValueError(
+            f"Invalid {DUPLICATE_POLICY_ENV_VAR}: {policy!r}, use one of "
+            f"{DUPLICATE_POLICIES}"
+        )
+    return policy
+
+
+def get_point_type(attributes: dict) -> int:
+    """Get the type of the points in a layer (Cell.UNKNOWN if the layer
+    wasn't loaded by brainglobe-napari-io)."""
+    from brainglobe_utils.cells.cells import Cell
+
+    return attributes.get("metadata", {}).get("point_type", Cell.UNKNOWN)
+
+
+class CellIndex:
+    """A spatial index of points, and the layers they came from.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Nx3 array of the points (in napari z, y, x order).
+    types : np.ndarray
+        The type of each point, e.g. Cell.CELL.
+    layer_indices : np.ndarray, optional
+        The layer each point came from, by default 0.
+    rows : np.ndarray, optional
+        The row of each point in its layer, by default its position in
+        positions.
+    """
+
+    def __init__(
+        self,
+        positions: np.ndarray,
+        types: np.ndarray,
+        layer_indices: Optional[np.ndarray] = None,
+        rows: Optional[np.ndarray] = None,
+    ):
+        positions = np.asarray(positions, dtype=float)
+        if positions.size == 0:
+            positions = positions.reshape(0, 3)
+        if positions.ndim != 2 or positions.shape[1] != 3:
+            raise ValueError(
+                f"Points must be an Nx3 array, not {positions.shape}"
+            )
+        self.positions = positions
+        n_points = len(self.positions)
+        self.types = np.broadcast_to(np.asarray(types), (n_points,))
+        self.layer_indices = (
+            np.zeros(n_points, int) if layer_indices is None else layer_indices
+        )
+        self.rows = np.arange(n_points) if rows is None else rows
+        self._tree = None
+
+    @classmethod
+    def from_layers(cls, layers: Sequence[LayerDataTuple]) -> CellIndex:
+        """Index the points layers of a list of layers (e.g. the "Cells" and
+        "Non cells" layers), typed by their "point_type" metadata. Layers
+        whose points aren't 3D are left out."""
+        positions = []
+        types = []
+        layer_indices = []
+        rows = []
+        for layer_index, (data, attributes, layer_type) in enumerate(layers):
+            if layer_type != "points":
+                continue
+            data = np.asarray(data)
+            if data.size == 0:
+                continue
+            if data.ndim != 2 or data.shape[1] != 3:
+                name = attributes.get("name", f"layer {layer_index}")
+                print(f"Not indexing {name!r}, whose points aren't 3D")
+                continue
+            positions.append(data)
+            types.append(np.full(len(data), get_point_type(attributes)))
+            layer_indices.append(np.full(len(data), layer_index))
+            rows.append(np.arange(len(data)))
+        if not positions:
+            return cls(np.empty((0, 3)), np.empty(0, int))
+        return cls(
+            np.concatenate(positions),
+            np.concatenate(types),
+            np.concatenate(layer_indices),
+            np.concatenate(rows),
+        )
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    @property
+    def tree(self):
+        """The KD-tree of the points, built when first used."""
+        if self._tree is None:
+            from scipy.spatial import cKDTree
+
+            with span("build index", n_points=len(self)):
+                self._tree = cKDTree(self.positions)
+        return self._tree
+
+    def nearest(
+        self,
+        points: np.ndarray,
+        k: int = 1,
+        max_distance: float = np.inf,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the nearest indexed points to other points.
+
+        Parameters
+        ----------
+        points : np.ndarray
+            Mx3 array of points (in z, y, x order).
+        k : int, optional
+            Number of nearest points to find for each, by default 1.
+        max_distance : float, optional
+            Only find points within this distance, by default any.
+
+        Returns
+        -------
+        distances : np.ndarray
+            The distance to each nearest point (inf if there is none).
+        indices : np.ndarray
+            The index of each nearest point (len(self) if there is none),
+            e.g. into self.positions, self.types, self.layer_indices and
+            self.rows.
+        """
+        points = np.asarray(points, dtype=float)
+        if len(self) == 0:
+            shape = points.shape[:-1] + ((k,) if k > 1 else ())
+            return np.full(shape, np.inf), np.zeros(shape, int)
+        return self.tree.query(points, k=k, distance_upper_bound=max_distance)
+
+    def get_duplicate_groups(self, tolerance: float = 0) -> np.ndarray:
+        """Group points within a tolerance of each other.
+
+        Points are grouped transitively, i.e. if a is within the tolerance
+        of b, and b of c, all three are in a group.
+
+        Parameters
+        ----------
+        tolerance : float, optional
+            The distance within which points are duplicates, by default 0
+            (points at the same position).
+
+        Returns
+        -------
+        np.ndarray
+            The group of each point, numbered by the first point in each.
+        """
+        if len(self) == 0:
+            return np.empty(0, int)
+        if tolerance == 0:
+            # sort the points, so identical ones are next to each other (a
+            # stable sort, so the first of each run is the first point)
+            order = np.lexsort(self.positions.T[::-1])
+            sorted_positions = self.positions[order]
+            starts = np.ones(len(self), bool)
+            starts[1:] = np.any(
+                sorted_positions[1:] != sorted_positions[:-1], axis=1
+            )
+            groups = np.empty(len(self), int)
+            groups[order] = order[starts][np.cumsum(starts) - 1]
+            return groups
+
+        from scipy.sparse import coo_matrix
+        from scipy.sparse.csgraph import connected_components
+
+        with span("find duplicates", tolerance=tolerance):
+            pairs = self.tree.query_pairs(tolerance, output_type="ndarray")
+            graph = coo_matrix(
+                (np.ones(len(pairs), bool), (pairs[:, 0], pairs[:, 1])),
+                shape=(len(self), len(self)),
+            )
+            _, labels = connected_components(graph, directed=False)
+        # number each group by its first point
+        first = np.full(labels.max() + 1, len(self))
+        np.minimum.at(first, labels, np.arange(len(self)))
+        return first[labels]
+
+    def deduplicate(
+        self, tolerance: float = 0, policy: str = "cell"
+    ) -> np.ndarray:
+        """Choose one point of each group of duplicates.
+
+        Parameters
+        ----------
+        tolerance : float, optional
+            The distance within which points are duplicates, by default 0.
+        policy : str, optional
+            Which point to keep, one of DUPLICATE_POLICIES, by default
+            "cell".
+
+        Returns
+        -------
+        np.ndarray
+            Whether to keep each point.
+        """
+        from brainglobe_utils.cells.cells import Cell
+
+        if policy not in DUPLICATE_POLICIES:
+            raise ValueError(
+                f"Invalid policy {policy!r}, use one of {DUPLICATE_POLICIES}"
+            )
+        groups = self.get_duplicate_groups(tolerance)
+        if policy == "first":
+            preferred = np.zeros(len(self), bool)
+        else:
+            preferred_type = Cell.CELL if policy == "cell" else Cell.UNKNOWN
+            preferred = self.types == preferred_type
+        # sort by group, then preferred points first, then by order
+        order = np.lexsort((np.arange(len(self)), ~preferred, groups))
+        first_in_group = np.ones(len(self), bool)
+        first_in_group[1:] = groups[order][1:] != groups[order][:-1]
+        keep = np.zeros(len(self), bool)
+        keep[order[first_in_group]] = True
+        return keep
+
+    def split_by_layer(self, mask: np.ndarray, n_layers: int) -> List:
+        """Split a mask of the points into a mask of each layer's rows."""
+        return [mask[self.layer_indices == i] for i in range(n_layers)]
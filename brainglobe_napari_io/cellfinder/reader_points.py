@@ -1,6 +1,8 @@
 from pathlib import Path
 
-from brainglobe_utils.IO.cells import is_brainglobe_xml, is_brainglobe_yaml
+from brainglobe_napari_io.cellfinder.cell_files import is_cell_file
+from brainglobe_napari_io.profiling import profile
+from brainglobe_napari_io.utils import as_layer_data_tuples, as_layers
 
 from .utils import load_cells
 
@@ -27,26 +29,33 @@ def cellfinder_read_points(path):
 
 
 def is_cellfinder_xml(path):
-    path = Path(path).resolve()
-    if path.suffix == ".xml":
-        return is_brainglobe_xml(path)
-    return False
+    """Whether a path is a cellfinder XML file, which may be compressed
+    (e.g. "cells.xml.gz", see cellfinder.cell_files)."""
+    return is_cell_file(Path(path).resolve(), (".xml",))
 
 
 def is_cellfinder_yml(path):
-    path = Path(path).resolve()
-    if path.suffix in (".yaml", ".yml"):
-        return is_brainglobe_yaml(path)
-    return False
-
-
-def points_reader(path, point_size=15, opacity=0.6, symbol="ring"):
+    """Whether a path is a cellfinder YAML file, which may be compressed
+    (e.g. "cells.yml.gz", see cellfinder.cell_files)."""
+    return is_cell_file(Path(path).resolve(), (".yaml", ".yml"))
+
+
+def points_reader(
+    path,
+    point_size=15,
+    opacity=0.6,
+    symbol="ring",
+    bounds=None,
+    cell_types=None,
+):
     """Take a path or list of paths and return a list of LayerData tuples.
 
     Readers are expected to return data as a list of tuples, where each tuple
     is (data, [add_kwargs, [layer_type]]), "add_kwargs" and "layer_type" are
     both optional.
 
+    This is a napari adapter for load_points.
+
     Parameters
     ----------
     path : str or list of str
@@ -63,6 +72,54 @@ def points_reader(path, point_size=15, opacity=0.6, symbol="ring"):
         Both "meta", and "layer_type" are optional. napari will default to
         layer_type=="image" if not provided
     """
+    return as_layer_data_tuples(
+        load_points(
+            path,
+            point_size=point_size,
+            opacity=opacity,
+            symbol=symbol,
+            bounds=bounds,
+            cell_types=cell_types,
+        )
+    )
+
+
+@profile("cellfinder read points")
+def load_points(
+    path,
+    point_size=15,
+    opacity=0.6,
+    symbol="ring",
+    bounds=None,
+    cell_types=None,
+):
+    """Load a cellfinder XML/YAML points file, without napari.
+
+    If bounds or cell_types are given, only those cells are read, with the
+    file's block index (see brainglobe_napari_io.cellfinder.cell_blocks).
+
+    Parameters
+    ----------
+    path : str
+        Path to the points file, which may be compressed (e.g.
+        "cells.xml.gz").
+    point_size : int, optional
+        Size of the points, by default 15.
+    opacity : float, optional
+        Opacity of the points, by default 0.6.
+    symbol : str, optional
+        Symbol of the points, by default "ring".
+    bounds : tuple of (start, stop), optional
+        The (inclusive) start and (exclusive) stop of a box, in (z, y, x)
+        voxels. If given, only the cells inside it are loaded.
+    cell_types : list of int, optional
+        If given, only the cells of these types (e.g. Cell.CELL) are loaded.
+
+    Returns
+    -------
+    list of Layer
+        The non-cell and cell points, with their type as a feature.
+    """
     path = Path(path).resolve()
     print("Loading cellfinder XML/YAML points file")
 
@@ -75,5 +132,7 @@ def points_reader(path, point_size=15, opacity=0.6, symbol="ring"):
         symbol,
         "lightgoldenrodyellow",
         "lightskyblue",
+        bounds=bounds,
+        cell_types=cell_types,
     )
-    return layers
+    return as_layers(layers)
@@ -0,0 +1,352 @@
+"""Per-region cell counts, kept up to date while the cells are curated.
+
+The atlas region of each point is looked up in the registered atlas
+annotation once, for every point at the same time. After that, when points
+are added, removed or moved in napari, only the regions of the points that
+changed are looked up, so the counts stay current without recounting every
+cell. The counts can be exported (e.g. to a CSV file) at any time.
+
+A RegionCounts is shared by the points layers of a brainmapper directory
+(e.g. "Cells" and "Non cells"), stored in their metadata under
+REGION_COUNTS_KEY, with a column of counts for each layer (by name).
+"""
+
+from __future__ import annotations
+
+import os
+import weakref
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Union,
+)
+
+import numpy as np
+
+from brainglobe_napari_io.profiling import span
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from napari.types import LayerDataTuple
+
+REGION_COUNTS_KEY = "region_counts"
+# the region of points outside the annotation, or outside the brain
+OUTSIDE_REGION = 0
+
+_tracked_viewers: "weakref.WeakSet" = weakref.WeakSet()
+
+
+def lookup_labels(
+    volume,
+    points: np.ndarray,
+    scale: Union[float, Sequence[float], np.ndarray] = 1,
+    translate: Union[float, Sequence[float], np.ndarray] = 0,
+) -> np.ndarray:
+    """Get the label of a 3D label image (e.g. an atlas annotation) at each
+    of an Nx3 array of points.
+
+    Parameters
+    ----------
+    volume : array-like
+        The label image. Any array that can be indexed by plane (e.g. a
+        memory map or lazily loaded stack) can be used, and only the planes
+        with points are read.
+    points : np.ndarray
+        Nx3 array of points.
+    scale, translate : float or Sequence[float] or np.ndarray, optional
+        How the image is displayed relative to the points (as for napari
+        layers), by default 1 and 0.
+
+    Returns
+    -------
+    np.ndarray
+        The label at each point (OUTSIDE_REGION outside the image).
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    voxels = np.round((points - np.asarray(translate)) / np.asarray(scale))
+    inside = np.all((voxels >= 0) & (voxels < volume.shape), axis=1)
+    voxels = voxels[inside].astype(np.intp)
+    labels = np.full(len(points), OUTSIDE_REGION, dtype=np.int64)
+    if isinstance(volume, np.ndarray):
+        labels[inside] = volume[tuple(voxels.T)]
+        return labels
+
+    inside_labels = np.empty(len(voxels), dtype=np.int64)
+    for z in np.unique(voxels[:, 0]):
+        in_plane = voxels[:, 0] == z
+        plane = np.asarray(volume[z])
+        inside_labels[in_plane] = plane[
+            voxels[in_plane, 1], voxels[in_plane, 2]
+        ]
+    labels[inside] = inside_labels
+    return labels
+
+
+class RegionCounts:
+    """The number of points in each atlas region, for each points layer.
+
+    Parameters
+    ----------
+    annotation : array-like
+        3D atlas annotation (e.g. the registered atlas). Any array that can
+        be indexed by plane (e.g. a memory map or lazily loaded stack) can
+        be used.
+    scale, translate : float or Sequence[float], optional
+        How the annotation is displayed relative to the points (as for
+        napari layers), by default 1 and 0, i.e. the points are annotation
+        voxel coordinates.
+    atlas : BrainGlobeAtlas, optional
+        The atlas, to name the regions when exporting the counts.
+    """
+
+    def __init__(
+        self,
+        annotation,
+        scale: Union[float, Sequence[float]] = 1,
+        translate: Union[float, Sequence[float]] = 0,
+        atlas=None,
+    ):
+        self.annotation = annotation
+        self.scale = np.broadcast_to(np.asarray(scale, dtype=float), (3,))
+        self.translate = np.broadcast_to(
+            np.asarray(translate, dtype=float), (3,)
+        )
+        self.atlas = atlas
+        self._regions: Dict[str, np.ndarray] = {}
+        self._counts: Dict[str, Dict[int, int]] = {}
+
+    @classmethod
+    def from_layers(
+        cls, layers: Sequence[LayerDataTuple]
+    ) -> Optional[RegionCounts]:
+        """Make the counts for the registered atlas annotation in a list of
+        layers (e.g. from load_brainreg_dir), or None if there isn't one."""
+        for data, attributes, layer_type in layers:
+            metadata = attributes.get("metadata", {})
+            if (
+                layer_type == "labels"
+                and "atlas" in metadata
+                and attributes.get("name") == metadata["atlas"]
+            ):
+                return cls(
+                    data,
+                    attributes.get("scale", 1),
+                    attributes.get("translate", 0),
+                    metadata.get("atlas_class"),
+                )
+        return None
+
+    @property
+    def keys(self) -> List[str]:
+        """The names of the counted layers."""
+        return list(self._regions)
+
+    def lookup(self, points: np.ndarray) -> np.ndarray:
+        """Get the region of each of an Nx3 array of points
+        (OUTSIDE_REGION for points outside the annotation)."""
+        return lookup_labels(
+            self.annotation, points, self.scale, self.translate
+        )
+
+    def set_points(self, key: str, points: np.ndarray):
+        """Count (or recount) all the points of a layer."""
+        with span("region lookup", n_points=len(points)):
+            regions = self.lookup(points)
+        self._regions[key] = regions
+        self._counts[key] = {}
+        self._add(key, regions, 1)
+
+    def update(
+        self,
+        key: str,
+        action: str,
+        indices: Optional[Iterable[int]],
+        points: np.ndarray,
+    ):
+        """Update the counts after points of a layer changed.
+
+        Parameters
+        ----------
+        key : str
+            The layer name.
+        action : str
+            "added", "removed" or "changed" (as for napari points data
+            events). Other actions are ignored.
+        indices : Iterable[int], optional
+            The indices of the added (possibly negative), removed (before
+            removal) or changed points. If None, all points are counted
+            again.
+        points : np.ndarray
+            All the points of the layer, after the change.
+        """
+        points = np.asarray(points).reshape(-1, 3)
+        regions = self._regions.get(key)
+        if regions is None or indices is None:
+            self.set_points(key, points)
+            return
+        indices = np.asarray(list(indices), dtype=np.intp)
+
+        if action == "added":
+            indices = indices % max(len(points), 1)
+            added = np.zeros(len(points), bool)
+            added[indices] = True
+            if np.count_nonzero(added) + len(regions) != len(points):
+                self.set_points(key, points)
+                return
+            new_regions = np.empty(len(points), dtype=np.int64)
+            new_regions[~added] = regions
+            new_regions[added] = self.lookup(points[added])
+            self._add(key, new_regions[added], 1)
+            self._regions[key] = new_regions
+        elif action == "removed":
+            if len(regions) - len(np.unique(indices)) != len(points):
+                self.set_points(key, points)
+                return
+            self._add(key, regions[indices], -1)
+            self._regions[key] = np.delete(regions, indices)
+        elif action == "changed":
+            if len(regions) != len(points):
+                self.set_points(key, points)
+                return
+            indices = np.unique(indices)
+            self._add(key, regions[indices], -1)
+            regions[indices] = self.lookup(points[indices])
+            self._add(key, regions[indices], 1)
+
+    def connect(self, layer):
+        """Keep the counts of a napari points layer up to date as its
+        points change."""
+        key = layer.name
+        if len(self._regions.get(key, ())) != len(layer.data):
+            self.set_points(key, layer.data)
+
+        def on_data(event):
+            region_counts = layer.metadata.get(REGION_COUNTS_KEY)
+            if region_counts is not self:
+                # replaced, e.g. by the counts of the full data loaded
+                # after a preview
+                layer.events.data.disconnect(on_data)
+                if region_counts is not None:
+                    region_counts.connect(layer)
+                return
+            self.update(
+                key,
+                str(getattr(event, "action", "changed")),
+                getattr(event, "data_indices", None),
+                layer.data,
+            )
+
+        layer.events.data.connect(on_data)
+
+    def get_counts(self, key: str) -> Dict[int, int]:
+        """Get the number of points of a layer in each region (with any
+        points)."""
+        return dict(self._counts.get(key, {}))
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Get the counts as a table, with a row for each region with any
+        points, and a column of counts for each layer.
+
+        The region id, and if the atlas is known its acronym and name, are
+        in the first columns. Points outside the brain are counted in
+        region OUTSIDE_REGION.
+        """
+        import pandas as pd
+
+        region_ids = sorted(
+            set().union(*(counts for counts in self._counts.values()))
+        )
+        table: Dict[str, list] = {"structure_id": region_ids}
+        structures = getattr(self.atlas, "structures", None)
+        if structures is not None:
+            table["acronym"] = [
+                _get_structure_field(structures, i, "acronym")
+                for i in region_ids
+            ]
+            table["structure_name"] = [
+                _get_structure_field(structures, i, "name") for i in region_ids
+            ]
+        for key, counts in self._counts.items():
+            table[key] = [counts.get(i, 0) for i in region_ids]
+        return pd.DataFrame(table)
+
+    def export(self, path: os.PathLike):
+        """Save the counts (see to_dataframe) to a CSV file."""
+        self.to_dataframe().to_csv(path, index=False)
+
+    def _add(self, key: str, regions: np.ndarray, sign: int):
+        counts = self._counts[key]
+        region_ids, n_points = np.unique(regions, return_counts=True)
+        for region_id, n in zip(region_ids.tolist(), n_points.tolist()):
+            count = counts.get(region_id, 0) + sign * n
+            if count:
+                counts[region_id] = count
+            else:
+                counts.pop(region_id, None)
+
+
+def _get_structure_field(structures, region_id: int, field: str) -> str:
+    if region_id == OUTSIDE_REGION:
+        return "Outside brain" if field == "name" else ""
+    try:
+        return structures[region_id][field]
+    except (KeyError, TypeError):
+        return ""
+
+
+def add_region_counts(
+    layers: List[LayerDataTuple], region_counts: RegionCounts
+) -> List[LayerDataTuple]:
+    """Count the points of the points layers in a list of layers, and add
+    the counts to their metadata (under REGION_COUNTS_KEY)."""
+    new_layers = []
+    for data, attributes, layer_type in layers:
+        if layer_type == "points":
+            region_counts.set_points(attributes["name"], data)
+            attributes = dict(attributes)
+            attributes["metadata"] = {
+                **attributes.get("metadata", {}),
+                REGION_COUNTS_KEY: region_counts,
+            }
+        new_layers.append((data, attributes, layer_type))
+    return new_layers
+
+
+def get_region_counts(layers) -> Optional[RegionCounts]:
+    """Get the region counts of a list of layers (e.g. napari viewer
+    layers), or None if they aren't counted."""
+    for layer in layers:
+        metadata = (
+            layer[1].get("metadata", {})
+            if isinstance(layer, tuple)
+            else layer.metadata
+        )
+        if REGION_COUNTS_KEY in metadata:
+            return metadata[REGION_COUNTS_KEY]
+    return None
+
+
+def track_region_counts(layer):
+    """Keep the region counts of a napari points layer up to date (see
+    RegionCounts.connect), if it has them."""
+    region_counts = layer.metadata.get(REGION_COUNTS_KEY)
+    if region_counts is not None and hasattr(layer.events, "data"):
+        region_counts.connect(layer)
+
+
+def track_viewer_region_counts(viewer):
+    """Keep the region counts of the points layers added to a napari
+    viewer up to date (see RegionCounts.connect)."""
+    if viewer is None or viewer in _tracked_viewers:
+        return
+    _tracked_viewers.add(viewer)
+
+    for layer in viewer.layers:
+        track_region_counts(layer)
+    viewer.layers.events.inserted.connect(
+        lambda event: track_region_counts(event.value)
+    )
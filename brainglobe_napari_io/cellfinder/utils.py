@@ -1,15 +1,33 @@
+from __future__ import annotations
+
 from collections import defaultdict
 from functools import partial
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any, Sequence
 
 import numpy as np
-from brainglobe_utils.cells.cells import Cell
-from brainglobe_utils.IO.cells import get_cells
-from napari.types import LayerDataTuple
+
+from brainglobe_napari_io.cellfinder.cell_blocks import (
+    read_cells_in_box,
+    read_cells_strided,
+)
+from brainglobe_napari_io.cellfinder.cell_files import read_cells
+from brainglobe_napari_io.cellfinder.region_counts import add_region_counts
+from brainglobe_napari_io.profiling import span
+
+if TYPE_CHECKING:
+    from brainglobe_utils.cells.cells import Cell
+    from napari.types import LayerDataTuple
+
+    from brainglobe_napari_io.cellfinder.region_counts import RegionCounts
 
 # empty value we use to indicate metadata item that was not present for a cell
 EMPTY_VALUE = object()
+# metadata key of points layers holding only some of the cells of their file
+# (e.g. a preview), which can't be saved over it without losing the rest
+PARTIAL_KEY = "partial"
+# metadata key of the cell file partial points layers were loaded from
+CELLS_PATH_KEY = "cells_path"
 
 
 def empty_object_array(n):
@@ -33,14 +51,23 @@ def cells_metadata_to_arrays(
     arrays when new points are added/removed in the GUI. Via feature_defaults,
     napari sets new points values to the sentinel value.
     """
-    cells = [c for c in cells if c.type == type]
+    return metadata_to_arrays([c.metadata for c in cells if c.type == type])
+
 
+def metadata_to_arrays(
+    metadata: list[dict],
+) -> tuple[dict[Any, np.ndarray], dict[Any, object]]:
+    """
+    Given the metadata dict of each of a list of cells, returns the
+    features and feature defaults of a points layer of them (see
+    cells_metadata_to_arrays).
+    """
     # any new metadata key we encounter, if we haven't seen it, we create an
     # empty array filled with the sentinel. Only those cells who have values
     # for a given key have a non-sentinel value
-    data: dict = defaultdict(partial(empty_object_array, len(cells)))
-    for i, cell in enumerate(cells):
-        for key, value in cell.metadata.items():
+    data: dict = defaultdict(partial(empty_object_array, len(metadata)))
+    for i, cell_metadata in enumerate(metadata):
+        for key, value in cell_metadata.items():
             data[key][i] = value
 
     defaults = {key: EMPTY_VALUE for key in data.keys()}
@@ -52,6 +79,8 @@ def get_cell_arrays(all_cells: list[Cell]) -> tuple[np.ndarray, np.ndarray]:
     Returns two Nx3 and Mx3 arrays with the z,y,x position of the cells that
     are "UNKNOWN", and "CELL", respectively.
     """
+    from brainglobe_utils.cells.cells import Cell
+
     non_cells = [c for c in all_cells if c.type == Cell.UNKNOWN]
     cells = [c for c in all_cells if c.type == Cell.CELL]
 
@@ -76,6 +105,8 @@ def convert_layer_to_cells(
         metadata.
     :return: The list of cells.
     """
+    from brainglobe_utils.cells.cells import Cell
+
     cells_to_save = []
     if cells:
         cell_type = Cell.CELL
@@ -113,24 +144,163 @@ def load_cells(
     cell_color: str,
     non_cell_color: str,
     channel=None,
+    decimation: int = 1,
+    region_counts: RegionCounts | None = None,
+    bounds: tuple[Sequence[float], Sequence[float]] | None = None,
+    cell_types: Sequence[int] | None = None,
 ) -> list[LayerDataTuple]:
-    all_cells = get_cells(str(classified_cells_path), cells_only=False)
-    cells, non_cells = get_cell_arrays(all_cells)
-    # napari accepts arbitrary features as a dict of arrays, we use that for
-    # letting napari track the metadata of the cells
-    cells_metadata, cells_metadata_defaults = cells_metadata_to_arrays(
-        all_cells, Cell.CELL
-    )
-    non_cells_metadata, non_cells_metadata_defaults = cells_metadata_to_arrays(
-        all_cells, Cell.UNKNOWN
+    """Add the non-cells and cells in a cell file as points layers.
+
+    An up-to-date binary copy of the file (written by brainglobe-napari-io
+    convert) is read instead if there is one. If decimation is more than 1,
+    only every nth cell is kept (e.g. for a preview). These are read from
+    the file's block index or binary copy, without parsing the file (see
+    cell_blocks.read_cells_strided), or if there is neither, the file is
+    parsed, and every nth cell kept. If region_counts is given, the cells in
+    each atlas region are counted, and the counts are added to the layers'
+    metadata (see brainglobe_napari_io.cellfinder.region_counts), unless the
+    layers are decimated.
+
+    If bounds (the inclusive start and exclusive stop of a box, in the
+    coordinates of the cells) or cell_types are given, only the cells inside
+    the box and of those types are kept. If the cells have no metadata,
+    only those cells are read, with the cell file's block index (see
+    brainglobe_napari_io.cellfinder.cell_blocks).
+
+    Layers with only some of the cells are marked as partial (PARTIAL_KEY
+    in their metadata, with the cell file as CELLS_PATH_KEY), and can't be
+    saved over the cell file.
+    """
+    box = None
+    selected = bounds is not None or cell_types is not None
+    if decimation > 1:
+        box = read_cells_strided(classified_cells_path, decimation)
+    elif selected:
+        start, stop = bounds if bounds is not None else (None, None)
+        box = read_cells_in_box(classified_cells_path, start, stop, cell_types)
+        # the box read only has the selected cells
+        selected = box is None
+    if box is not None:
+        (positions, types), metadata = box, None
+    else:
+        positions, types, metadata = read_cells(classified_cells_path)
+        if decimation > 1:
+            positions = positions[::decimation]
+            types = types[::decimation]
+            if metadata is not None:
+                metadata = metadata[::decimation]
+    if selected:
+        positions, types, metadata = select_cells(
+            positions, types, metadata, bounds, cell_types
+        )
+    cell_layers = get_cell_layers(
+        positions,
+        types,
+        metadata,
+        point_size,
+        opacity,
+        symbol,
+        cell_color,
+        non_cell_color,
+        channel=channel,
     )
+    if decimation > 1 or bounds is not None or cell_types is not None:
+        for _, attributes, _ in cell_layers:
+            attributes["metadata"][PARTIAL_KEY] = True
+            attributes["metadata"][CELLS_PATH_KEY] = str(classified_cells_path)
+    if region_counts is not None and decimation == 1:
+        cell_layers = add_region_counts(cell_layers, region_counts)
+    layers.extend(cell_layers)
+    return layers
+
+
+def select_cells(
+    positions: np.ndarray,
+    types: np.ndarray,
+    metadata: list[dict] | None,
+    bounds: tuple[Sequence[float], Sequence[float]] | None = None,
+    cell_types: Sequence[int] | None = None,
+) -> tuple[np.ndarray, np.ndarray, list[dict] | None]:
+    """Keep only the cells (e.g. from read_cells) inside a box and of some
+    types, as for load_cells."""
+    keep = np.ones(len(types), dtype=bool)
+    if bounds is not None:
+        start, stop = bounds
+        positions = np.asarray(positions).reshape(-1, 3)
+        keep &= np.all((positions >= start) & (positions < stop), axis=1)
+    if cell_types is not None:
+        keep &= np.isin(types, cell_types)
+    if metadata is not None:
+        metadata = [m for m, k in zip(metadata, keep) if k]
+    return positions[keep], types[keep], metadata
+
+
+def get_cell_layers(
+    positions: np.ndarray,
+    types: np.ndarray,
+    metadata: list[dict] | None,
+    point_size: int,
+    opacity: float,
+    symbol: str,
+    cell_color: str,
+    non_cell_color: str,
+    channel=None,
+    decimation: int = 1,
+) -> list[LayerDataTuple]:
+    """Get the non-cells and cells layers of cells (e.g. from read_cells).
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Nx3 array of (z, y, x) cell positions.
+    types : np.ndarray
+        Array of the N cell types. Only Cell.UNKNOWN (non-cells) and
+        Cell.CELL (cells) are shown.
+    metadata : list of dict, optional
+        The metadata of each cell, tracked as the features of the layers.
+    point_size, opacity, symbol, cell_color, non_cell_color
+        How to display the points.
+    channel, decimation
+        As for load_cells. Decimated layers are marked as partial.
+
+    Returns
+    -------
+    list[LayerDataTuple]
+        The non-cells layer, then the cells layer.
+    """
+    from brainglobe_utils.cells.cells import Cell
+
+    cells = positions[types == Cell.CELL]
+    non_cells = positions[types == Cell.UNKNOWN]
+    if metadata is None:
+        metadata = [{}] * len(types)
+    # napari accepts arbitrary features as a dict of arrays, we use that
+    # for letting napari track the metadata of the cells
+    with span("feature build", n_cells=len(types)):
+        cells_metadata, cells_metadata_defaults = metadata_to_arrays(
+            [m for m, t in zip(metadata, types) if t == Cell.CELL]
+        )
+        non_cells_metadata, non_cells_metadata_defaults = metadata_to_arrays(
+            [m for m, t in zip(metadata, types) if t == Cell.UNKNOWN]
+        )
+
+    if decimation > 1:
+        cells, non_cells = cells[::decimation], non_cells[::decimation]
+        cells_metadata = {
+            key: values[::decimation] for key, values in cells_metadata.items()
+        }
+        non_cells_metadata = {
+            key: values[::decimation]
+            for key, values in non_cells_metadata.items()
+        }
 
     if channel is not None:
         channel_base = f"channel_{channel}: "
     else:
         channel_base = ""
+    partial_metadata = {PARTIAL_KEY: True} if decimation > 1 else {}
 
-    layers.append(
+    return [
         (
             non_cells,
             {
@@ -142,12 +312,10 @@ def load_cells(
                 "opacity": opacity,
                 "symbol": symbol,
                 "face_color": non_cell_color,
-                "metadata": dict(point_type=Cell.UNKNOWN),
+                "metadata": dict(point_type=Cell.UNKNOWN, **partial_metadata),
             },
             "points",
-        )
-    )
-    layers.append(
+        ),
         (
             cells,
             {
@@ -159,9 +327,8 @@ def load_cells(
                 "opacity": opacity,
                 "symbol": symbol,
                 "face_color": cell_color,
-                "metadata": dict(point_type=Cell.CELL),
+                "metadata": dict(point_type=Cell.CELL, **partial_metadata),
             },
             "points",
-        )
-    )
-    return layers
+        ),
+    ]
@@ -1,19 +1,95 @@
-from typing import List
+import os
+from typing import List, Union
 
+import numpy as np
 from brainglobe_utils.cells.cells import Cell
-from brainglobe_utils.IO.cells import save_cells
 from napari.types import FullLayerData
 from napari.utils.notifications import show_info
 
-from .utils import convert_layer_to_cells
+from brainglobe_napari_io.profiling import profile, span
 
+from .cell_files import write_cells
+from .cell_index import (
+    CellIndex,
+    get_duplicate_policy,
+    get_duplicate_tolerance,
+)
+from .utils import CELLS_PATH_KEY, PARTIAL_KEY, convert_layer_to_cells
 
+
+def select_points(data, features, mask: np.ndarray):
+    """Select some of the points of a layer, and their features."""
+    data = np.asarray(data)[mask]
+    if features is None:
+        return data, None
+    if hasattr(features, "iloc"):
+        return data, features[mask].reset_index(drop=True)
+    return data, {
+        name: np.asarray(arr)[mask] for name, arr in features.items()
+    }
+
+
+def is_same_file(
+    path: Union[str, os.PathLike], other_path: Union[str, os.PathLike]
+) -> bool:
+    """Whether two paths are to the same existing file."""
+    try:
+        return os.path.samefile(path, other_path)
+    except OSError:
+        return False
+
+
+@profile("write points")
 def write_multiple_points(
     path: str, layer_data: List[FullLayerData]
 ) -> List[str]:
+    """Write points layers to a cellfinder XML or YAML file, compressed if
+    the path has a compression suffix (e.g. "cells.xml.gz", see
+    cellfinder.cell_files).
+
+    If BRAINGLOBE_NAPARI_IO_DUPLICATE_TOLERANCE is set, duplicate points
+    (within that distance of each other, in any of the layers) are merged,
+    keeping one according to BRAINGLOBE_NAPARI_IO_DUPLICATE_POLICY (see
+    cellfinder.cell_index). By default, every point is saved.
+
+    Raises
+    ------
+    ValueError
+        If the path is the file a layer holding only some of its cells (e.g.
+        a preview, or the cells in a structure) was loaded from, as saving
+        it would lose the rest. Such layers can be saved to other files.
+    """
+    for _, attributes, _ in layer_data:
+        metadata = attributes.get("metadata", {})
+        if metadata.get(PARTIAL_KEY) and is_same_file(
+            path, metadata.get(CELLS_PATH_KEY, "")
+        ):
+            raise ValueError(
+                f"Can't save {attributes.get('name', 'the layer')!r} over "
+                f"{path}: it holds only some of the cells of the file (was "
+                "it a preview, or loaded for a structure?). Save it to "
+                "another file instead."
+            )
+
+    keep = [None] * len(layer_data)
+    tolerance = get_duplicate_tolerance()
+    if tolerance is not None:
+        index = CellIndex.from_layers(layer_data)
+        with span("deduplicate", n_points=len(index)):
+            keep_points = index.deduplicate(tolerance, get_duplicate_policy())
+        n_merged = len(index) - int(keep_points.sum())
+        if n_merged:
+            show_info(f"Merged {n_merged} duplicate points")
+            keep = index.split_by_layer(keep_points, len(layer_data))
+
     cells_to_save = []
-    for layer in layer_data:
+    for layer, layer_keep in zip(layer_data, keep):
         data, attributes, type = layer
+        if layer_keep is not None:
+            data, features = select_points(
+                data, attributes.get("features"), layer_keep
+            )
+            attributes = {**attributes, "features": features}
         if "point_type" not in attributes["metadata"]:
             # Not a points layer loaded by brainglobe_napari_io
             name = attributes["name"]
@@ -40,7 +116,8 @@ def write_multiple_points(
             )
 
     if cells_to_save:
-        save_cells(cells_to_save, path)
+        with span("save", file=str(path), n_cells=len(cells_to_save)):
+            write_cells(cells_to_save, path)
         return [path]
     else:
         return []
@@ -0,0 +1,203 @@
+"""The brainglobe-napari-io command line tool.
+
+e.g. to pre-convert every output directory under ``/data/brains`` with 8
+processes, each using at most 4 GB of memory::
+
+    brainglobe-napari-io convert /data/brains --workers 8 --memory-limit 4G
+
+to write edits saved from napari into the registration images::
+
+    brainglobe-napari-io compact /data/brains
+
+and to count the cells in each atlas region of every brain::
+
+    brainglobe-napari-io count /data/brains -o counts.npz --hemispheres
+"""
+
+import argparse
+from typing import List, Optional
+
+
+def parse_memory_size(size: str) -> int:
+    """Parse a memory size, e.g. "512M" or "4G", to bytes."""
+    from brainglobe_napari_io import planning
+
+    try:
+        return planning.parse_memory_size(size)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+
+def convert_command(args: argparse.Namespace) -> int:
+    from brainglobe_napari_io.convert import (
+        format_summary,
+        plan_conversions,
+        run_conversions,
+    )
+
+    kinds = tuple(k for k in args.kinds if k not in args.skip)
+    tasks = plan_conversions(args.root, kinds=kinds)
+    if args.dry_run:
+        for task in tasks:
+            status = "up to date" if task.is_up_to_date() else "to convert"
+            print(f"{task.kind}: {task.output} ({status})")
+        return 0
+
+    summary = run_conversions(
+        tasks,
+        n_workers=args.workers,
+        memory_limit=args.memory_limit,
+        force=args.force,
+    )
+    print(format_summary(summary))
+    return 1 if summary["failed"] else 0
+
+
+def compact_command(args: argparse.Namespace) -> int:
+    from brainglobe_napari_io.brainreg.writer_labels import (
+        compact_brainreg_dir,
+    )
+    from brainglobe_napari_io.convert import find_output_dirs
+
+    n_compacted = 0
+    for kind, path in find_output_dirs(args.root):
+        if kind != "brainreg":
+            continue
+        for image_path in compact_brainreg_dir(path):
+            print(f"Compacted edits to {image_path}")
+            n_compacted += 1
+    print(f"Compacted {n_compacted} images")
+    return 0
+
+
+def count_command(args: argparse.Namespace) -> int:
+    from brainglobe_napari_io.brainmapper.cohort_counts import count_cohort
+    from brainglobe_napari_io.convert import find_output_dirs
+
+    paths = [
+        path
+        for kind, path in find_output_dirs(args.root)
+        if kind == "brainmapper" and (path / "registration").exists()
+    ]
+    if not paths:
+        print(f"No registered brainmapper directories found in {args.root}")
+        return 1
+    cohort_counts = count_cohort(
+        paths,
+        args.output,
+        hemispheres=args.hemispheres,
+        n_workers=args.workers,
+    )
+    print(
+        f"Saved {cohort_counts.counts.shape[0]} x "
+        f"{cohort_counts.counts.shape[1]} counts to {args.output}"
+    )
+    return 1 if cohort_counts.errors else 0
+
+
+def get_parser() -> argparse.ArgumentParser:
+    from brainglobe_napari_io.convert import CONVERSION_KINDS
+
+    parser = argparse.ArgumentParser(
+        prog="brainglobe-napari-io",
+        description="Tools for BrainGlobe output directories.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = subparsers.add_parser(
+        "convert",
+        help="Pre-convert output directories to fast-loading files.",
+        description="Find brainreg and brainmapper output directories, and "
+        "write binary cell files, raw data pyramids, reoriented "
+        "registration images and region indexes, which are used when "
+        "loading them.",
+    )
+    convert_parser.add_argument(
+        "root", help="Directory to search for output directories"
+    )
+    convert_parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes (default: the number of CPUs)",
+    )
+    convert_parser.add_argument(
+        "-m",
+        "--memory-limit",
+        type=parse_memory_size,
+        default=None,
+        help="Maximum memory per process, e.g. 4G (default: no limit)",
+    )
+    convert_parser.add_argument(
+        "--skip",
+        nargs="+",
+        choices=CONVERSION_KINDS,
+        default=[],
+        help="Kinds of conversion to skip",
+    )
+    convert_parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Redo conversions that are already up to date",
+    )
+    convert_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="List the conversions without doing them",
+    )
+    convert_parser.set_defaults(
+        function=convert_command, kinds=CONVERSION_KINDS
+    )
+
+    compact_parser = subparsers.add_parser(
+        "compact",
+        help="Write saved labels edits into the registration images.",
+        description="Find brainreg output directories, and write the edits "
+        "to the registered atlas and hemispheres saved from napari into the "
+        "TIFF files, removing the sidecar stores they were saved to.",
+    )
+    compact_parser.add_argument(
+        "root", help="Directory to search for output directories"
+    )
+    compact_parser.set_defaults(function=compact_command)
+
+    count_parser = subparsers.add_parser(
+        "count",
+        help="Count the cells in each atlas region of a cohort of brains.",
+        description="Find registered brainmapper output directories, count "
+        "the cells of each in each atlas region, and save the brains by "
+        "regions matrix to a compressed .npz file.",
+    )
+    count_parser.add_argument(
+        "root", help="Directory to search for output directories"
+    )
+    count_parser.add_argument(
+        "-o",
+        "--output",
+        default="cohort_counts.npz",
+        help="File to save the counts to (default: cohort_counts.npz)",
+    )
+    count_parser.add_argument(
+        "--hemispheres",
+        action="store_true",
+        help="Count the cells in each hemisphere separately",
+    )
+    count_parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes (default: the number of CPUs)",
+    )
+    count_parser.set_defaults(function=count_command)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = get_parser().parse_args(argv)
+    return args.function(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
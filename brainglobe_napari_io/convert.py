@@ -0,0 +1,459 @@
+"""Pre-convert BrainGlobe output directories to fast-loading files.
+
+Walks a directory tree for brainreg and brainmapper output directories, and
+writes (next to the original files):
+
+- binary copies of cell XML/YAML files (see cellfinder.cell_files),
+- multiscale pyramids of the raw data (see brainmapper.pyramids),
+- copies of the registration images reoriented to the sample orientation,
+  which can be memory-mapped when loading in sample space (see
+  utils.read_tiff_reoriented),
+- indexes of the bounding box of each region of the registered atlas, used
+  when loading a structure (see regions.load_bounding_boxes).
+
+The readers use these automatically while they are newer than the files
+they were converted from. Outputs that are already up to date are skipped,
+so conversion can be re-run (or resumed after being interrupted) cheaply.
+Conversions run in parallel, in a pool of processes.
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from brainglobe_napari_io.brainmapper.brainmapper_reader_dir import (
+    get_metadata,
+    get_raw_data_channels,
+    is_brainmapper_dir,
+)
+from brainglobe_napari_io.brainmapper.pyramids import (
+    get_pyramid_dir,
+    is_pyramid_up_to_date,
+)
+from brainglobe_napari_io.brainmapper.raw_planes import (
+    get_plane_paths,
+    resolve_planes_path,
+)
+from brainglobe_napari_io.cellfinder.cell_files import get_binary_cells_path
+from brainglobe_napari_io.regions import get_bounding_box_path
+from brainglobe_napari_io.utils import (
+    get_atlas,
+    get_reoriented_path,
+    is_brainreg_dir,
+    is_up_to_date,
+)
+
+CONVERSION_KINDS = ("cells", "pyramid", "reoriented", "regions")
+# registration images that are reoriented when loading in sample space
+REORIENTED_IMAGES = (
+    "registered_atlas.tiff",
+    "registered_hemispheres.tiff",
+    "boundaries.tiff",
+)
+CELL_FILE_NAMES = ("cell_classification.xml", "cell_classification.yml")
+
+
+class ConversionTask(NamedTuple):
+    """A file (or directory of files) to convert.
+
+    Attributes
+    ----------
+    kind : str
+        The kind of conversion, one of CONVERSION_KINDS.
+    output : str
+        The file or directory to write.
+    source_paths : Tuple[str, ...]
+        The files converted.
+    options : dict
+        Further options of the conversion, e.g. orientations.
+    """
+
+    kind: str
+    output: str
+    source_paths: Tuple[str, ...]
+    options: Dict
+
+    def is_up_to_date(self) -> bool:
+        """Whether the output exists, and is newer than the sources."""
+        if self.kind == "pyramid":
+            return is_pyramid_up_to_date(self.output, self.source_paths)
+        return is_up_to_date(self.output, self.source_paths)
+
+
+def find_output_dirs(
+    root: Union[str, os.PathLike],
+) -> Iterator[Tuple[str, Path]]:
+    """Find the brainreg and brainmapper output directories in a tree.
+
+    Parameters
+    ----------
+    root : str or os.PathLike
+        Directory to search.
+
+    Yields
+    ------
+    Tuple[str, Path]
+        "brainreg" or "brainmapper", and the path of each directory.
+    """
+    for directory, subdirectories, _ in os.walk(Path(root)):
+        # skip hidden directories and our own outputs
+        subdirectories[:] = sorted(
+            d
+            for d in subdirectories
+            if not d.startswith(".")
+            and d != "pyramids"
+            and not d.startswith("reoriented_")
+        )
+        directory_path = Path(directory)
+        if is_brainreg_dir(directory_path):
+            yield "brainreg", directory_path
+        if is_brainmapper_dir(directory_path):
+            yield "brainmapper", directory_path
+
+
+def plan_brainreg_conversions(
+    path: Path, reoriented: bool = True, regions: bool = True
+) -> List[ConversionTask]:
+    """Plan the conversion of a brainreg output directory, i.e. reorienting
+    the registration images to the sample orientation, and indexing the
+    regions of the registered atlas."""
+    tasks: List[ConversionTask] = []
+    if reoriented:
+        with open(path / "brainreg.json") as json_file:
+            metadata = json.load(json_file)
+        atlas_orientation = get_atlas(metadata["atlas"]).orientation
+        orientation = metadata["orientation"]
+        if orientation != atlas_orientation:
+            tasks.extend(
+                ConversionTask(
+                    "reoriented",
+                    str(get_reoriented_path(path / filename, orientation)),
+                    (str(path / filename),),
+                    {
+                        "source_orientation": atlas_orientation,
+                        "target_orientation": orientation,
+                    },
+                )
+                for filename in REORIENTED_IMAGES
+                if (path / filename).exists()
+            )
+    annotation_path = path / "registered_atlas.tiff"
+    if regions and annotation_path.exists():
+        tasks.append(
+            ConversionTask(
+                "regions",
+                str(get_bounding_box_path(annotation_path)),
+                (str(annotation_path),),
+                {},
+            )
+        )
+    return tasks
+
+
+def plan_brainmapper_conversions(
+    path: Path, cells: bool = True, pyramids: bool = True
+) -> List[ConversionTask]:
+    """Plan the conversion of a brainmapper output directory, i.e. of its
+    cell files and raw data."""
+    tasks = []
+    if cells:
+        for cells_path in sorted(path.glob("**/points/*")):
+            if cells_path.name in CELL_FILE_NAMES:
+                tasks.append(
+                    ConversionTask(
+                        "cells",
+                        str(get_binary_cells_path(cells_path)),
+                        (str(cells_path),),
+                        {},
+                    )
+                )
+    if pyramids:
+        metadata = get_metadata(path)
+        for channel in get_raw_data_channels(metadata):
+            planes_path = resolve_planes_path(channel["planes_path"], path)
+            if planes_path is None:
+                print(
+                    f"Could not find raw data: {channel['planes_path']}, "
+                    f"skipping"
+                )
+                continue
+            tasks.append(
+                ConversionTask(
+                    "pyramid",
+                    str(get_pyramid_dir(path, channel["key"])),
+                    tuple(str(p) for p in get_plane_paths(planes_path)),
+                    {},
+                )
+            )
+    return tasks
+
+
+def plan_conversions(
+    root: os.PathLike, kinds: Tuple[str, ...] = CONVERSION_KINDS
+) -> List[ConversionTask]:
+    """Plan the conversion of every output directory in a tree.
+
+    Parameters
+    ----------
+    root : os.PathLike
+        Directory to search for brainreg and brainmapper output.
+    kinds : Tuple[str, ...], optional
+        The kinds of conversion to do, by default all of CONVERSION_KINDS.
+
+    Returns
+    -------
+    List[ConversionTask]
+        Every conversion, whether it is up to date or not.
+    """
+    tasks = []
+    for dir_type, path in find_output_dirs(root):
+        if dir_type == "brainreg":
+            tasks.extend(
+                plan_brainreg_conversions(
+                    path,
+                    reoriented="reoriented" in kinds,
+                    regions="regions" in kinds,
+                )
+            )
+        elif dir_type == "brainmapper":
+            tasks.extend(
+                plan_brainmapper_conversions(
+                    path, cells="cells" in kinds, pyramids="pyramid" in kinds
+                )
+            )
+    return tasks
+
+
+def convert(task: ConversionTask) -> Dict:
+    """Do a conversion.
+
+    Parameters
+    ----------
+    task : ConversionTask
+        The conversion.
+
+    Returns
+    -------
+    dict
+        The "output", the number of bytes read and written, the "duration"
+        in seconds, and the "error" (None if the conversion succeeded).
+    """
+    start = time.perf_counter()
+    result: Dict[str, Any] = {
+        "output": task.output,
+        "kind": task.kind,
+        "bytes_read": sum(_get_size(path) for path in task.source_paths),
+        "bytes_written": 0,
+        "duration": 0.0,
+        "error": None,
+    }
+    try:
+        CONVERTERS[task.kind](task)
+        result["bytes_written"] = _get_size(task.output)
+    except Exception as error:
+        result["error"] = f"{type(error).__name__}: {error}"
+    result["duration"] = time.perf_counter() - start
+    return result
+
+
+def convert_cells(task: ConversionTask):
+    from brainglobe_napari_io.cellfinder.cell_files import write_binary_cells
+
+    write_binary_cells(task.source_paths[0], task.output)
+
+
+def convert_pyramid(task: ConversionTask):
+    from brainglobe_napari_io.brainmapper.pyramids import write_pyramid
+    from brainglobe_napari_io.brainmapper.raw_planes import LazyPlaneStack
+
+    stack = LazyPlaneStack(task.source_paths, cache_size=2, prefetch=1)
+    try:
+        write_pyramid(stack, task.output)
+    finally:
+        stack.close()
+
+
+def convert_reoriented(task: ConversionTask):
+    import brainglobe_space as bgs
+    import numpy as np
+    import tifffile
+
+    from brainglobe_napari_io.utils import write_atomically
+
+    image = bgs.map_stack_to(
+        task.options["source_orientation"],
+        task.options["target_orientation"],
+        tifffile.imread(task.source_paths[0]),
+    )
+    # uncompressed and contiguous, so it can be memory-mapped
+    with write_atomically(task.output) as temporary_path:
+        tifffile.imwrite(
+            temporary_path,
+            np.ascontiguousarray(image),
+            contiguous=True,
+            photometric="minisblack",
+        )
+
+
+def convert_regions(task: ConversionTask):
+    from brainglobe_napari_io.regions import write_bounding_boxes
+
+    write_bounding_boxes(task.source_paths[0], task.output)
+
+
+CONVERTERS: Dict[str, Callable[[ConversionTask], None]] = {
+    "cells": convert_cells,
+    "pyramid": convert_pyramid,
+    "reoriented": convert_reoriented,
+    "regions": convert_regions,
+}
+
+
+def limit_memory(memory_limit: Optional[int]):
+    """Limit the memory a process can allocate (on platforms that support
+    it), so one conversion can't use all of a machine's memory.
+
+    Memory-mapped files don't count towards the limit.
+
+    Parameters
+    ----------
+    memory_limit : int, optional
+        Maximum bytes of memory to allocate. By default, there is no limit.
+    """
+    if memory_limit is None:
+        return
+    try:
+        import resource
+    except ImportError:
+        print("Memory limits aren't supported on this platform, ignoring")
+        return
+    _, hard_limit = resource.getrlimit(resource.RLIMIT_DATA)
+    if hard_limit != resource.RLIM_INFINITY:
+        memory_limit = min(memory_limit, hard_limit)
+    resource.setrlimit(resource.RLIMIT_DATA, (memory_limit, hard_limit))
+
+
+def run_conversions(
+    tasks: List[ConversionTask],
+    n_workers: Optional[int] = None,
+    memory_limit: Optional[int] = None,
+    force: bool = False,
+    progress: Optional[Callable[[str], None]] = print,
+) -> Dict:
+    """Run conversions in a pool of processes, skipping those up to date.
+
+    Parameters
+    ----------
+    tasks : List[ConversionTask]
+        The conversions, e.g. from plan_conversions.
+    n_workers : int, optional
+        Number of processes. By default, the number of CPUs. If 1, the
+        conversions are run in this process (without a memory limit).
+    memory_limit : int, optional
+        Maximum bytes of memory each process can allocate. A conversion
+        that exceeds it fails, without affecting the others.
+    force : bool, optional
+        Whether to redo conversions that are up to date, by default False.
+    progress : Callable[[str], None], optional
+        Function to report each conversion with, by default print. None to
+        not report them.
+
+    Returns
+    -------
+    dict
+        A summary, with the number of conversions "converted", "skipped"
+        (as up to date) and "failed", the total "bytes_read" and
+        "bytes_written", the wall "duration" and the "results" of each
+        conversion (see convert).
+    """
+    start = time.perf_counter()
+    to_run = [task for task in tasks if force or not task.is_up_to_date()]
+    results: List[Dict] = []
+
+    def report(result: Dict):
+        results.append(result)
+        if progress is not None:
+            status = (
+                f"failed, {result['error']}"
+                if result["error"]
+                else f"{result['duration']:.1f}s"
+            )
+            progress(
+                f"[{len(results)}/{len(to_run)}] {result['kind']}: "
+                f"{result['output']} ({status})"
+            )
+
+    if n_workers == 1 or len(to_run) <= 1:
+        for task in to_run:
+            report(convert(task))
+    else:
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=limit_memory,
+            initargs=(memory_limit,),
+        ) as executor:
+            futures = {executor.submit(convert, task): task for task in to_run}
+            for future in as_completed(futures):
+                try:
+                    report(future.result())
+                except BrokenProcessPool as error:
+                    # e.g. a worker was killed for using too much memory
+                    report(
+                        {
+                            "output": futures[future].output,
+                            "kind": futures[future].kind,
+                            "bytes_read": 0,
+                            "bytes_written": 0,
+                            "duration": 0.0,
+                            "error": f"worker process died ({error})",
+                        }
+                    )
+
+    failed = sum(result["error"] is not None for result in results)
+    return {
+        "converted": len(results) - failed,
+        "skipped": len(tasks) - len(to_run),
+        "failed": failed,
+        "bytes_read": sum(result["bytes_read"] for result in results),
+        "bytes_written": sum(result["bytes_written"] for result in results),
+        "duration": time.perf_counter() - start,
+        "results": results,
+    }
+
+
+def format_summary(summary: Dict) -> str:
+    """Describe the outcome and throughput of run_conversions."""
+    duration = max(summary["duration"], 1e-9)
+    return (
+        f"Converted {summary['converted']}, skipped {summary['skipped']} "
+        f"(up to date), failed {summary['failed']}, in {duration:.1f}s\n"
+        f"Read {summary['bytes_read'] / 1e6:.1f} MB "
+        f"({summary['bytes_read'] / 1e6 / duration:.1f} MB/s), "
+        f"wrote {summary['bytes_written'] / 1e6:.1f} MB, "
+        f"{summary['converted'] / duration:.2f} conversions/s"
+    )
+
+
+def _get_size(path: Union[str, os.PathLike]) -> int:
+    """Get the size of a file, or of all the files in a directory."""
+    path = Path(path)
+    try:
+        if path.is_dir():
+            return sum(p.stat().st_size for p in path.iterdir() if p.is_file())
+        return path.stat().st_size
+    except OSError:
+        return 0
@@ -0,0 +1,391 @@
+"""Atlas structure meshes, as napari surface layers.
+
+Rendering the atlas annotation in 3D is slow, and shows the voxels of each
+structure. Instead, the meshes the atlas comes with can be added as surface
+layers, e.g. by setting the BRAINGLOBE_NAPARI_IO_ATLAS_MESHES environment
+variable to a comma-separated list of acronyms ("root,HIP") before opening
+a directory in atlas space, or with::
+
+    from brainglobe_napari_io.api import load_atlas_meshes
+
+    layers = load_atlas_meshes("allen_mouse_25um", ["root", "HIP"])
+
+Meshes are read in a pool of threads, and decimated (by vertex clustering)
+to at most BRAINGLOBE_NAPARI_IO_MESH_VERTICES vertices each (20000 by
+default), so many structures can be shown at once. Each decimated mesh is
+cached as a small .npz file (float32 vertices, and faces with the smallest
+unsigned integer type that fits) in BRAINGLOBE_NAPARI_IO_MESH_CACHE_DIR
+(by default ~/.brainglobe/napari-io/meshes), so later loads skip reading
+and decimating the original mesh.
+
+Vertices are in atlas voxel coordinates, so surfaces line up with the
+annotation, and are reoriented and scaled with the other registration
+layers by brainglobe_napari_io.utils.scale_reorient_layers.
+"""
+
+from __future__ import annotations
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from brainglobe_napari_io.profiling import add_file_read, profile, span
+from brainglobe_napari_io.utils import (
+    Layer,
+    as_layers,
+    get_atlas,
+    is_up_to_date,
+    region_attributes,
+    scale_reorient_layers,
+    write_atomically,
+)
+
+if TYPE_CHECKING:
+    from napari.types import LayerDataTuple
+
+ATLAS_MESHES_ENV_VAR = "BRAINGLOBE_NAPARI_IO_ATLAS_MESHES"
+MESH_VERTICES_ENV_VAR = "BRAINGLOBE_NAPARI_IO_MESH_VERTICES"
+MESH_CACHE_DIR_ENV_VAR = "BRAINGLOBE_NAPARI_IO_MESH_CACHE_DIR"
+DEFAULT_MAX_VERTICES = 20_000
+# colour of structures without one in the atlas
+DEFAULT_COLOR = (0.8, 0.8, 0.8)
+
+
+def get_mesh_structures(
+    structures: Optional[Sequence[str]] = None,
+) -> List[str]:
+    """Get the acronyms of the structures to add meshes of.
+
+    Parameters
+    ----------
+    structures : Sequence[str], optional
+        The acronyms. By default, those in the
+        BRAINGLOBE_NAPARI_IO_ATLAS_MESHES environment variable (separated
+        by commas), or none if it isn't set.
+
+    Returns
+    -------
+    List[str]
+        The acronyms.
+    """
+    if structures is None:
+        structures = os.environ.get(ATLAS_MESHES_ENV_VAR, "").split(",")
+    return [s.strip() for s in structures if s.strip()]
+
+
+def get_max_vertices(max_vertices: Optional[int] = None) -> int:
+    """Get the vertex budget of each mesh, by default from the
+    BRAINGLOBE_NAPARI_IO_MESH_VERTICES environment variable (or 20000)."""
+    if max_vertices is None:
+        env_vertices = os.environ.get(MESH_VERTICES_ENV_VAR, "")
+        try:
+            max_vertices = int(env_vertices or DEFAULT_MAX_VERTICES)
+        except ValueError:
+            raise ValueError(
+                f"Invalid {MESH_VERTICES_ENV_VAR}: {env_vertices!r}, use a "
+                "number of vertices"
+            )
+    if max_vertices < 4:
+        raise ValueError(
+            f"A mesh needs at least 4 vertices, not {max_vertices}"
+        )
+    return int(max_vertices)
+
+
+def get_mesh_cache_dir(atlas_name: str) -> Path:
+    """Get the directory decimated meshes of an atlas are cached in."""
+    directory = os.environ.get(MESH_CACHE_DIR_ENV_VAR)
+    if directory is None:
+        cache_dir = Path.home() / ".brainglobe" / "napari-io" / "meshes"
+    else:
+        cache_dir = Path(directory)
+    return cache_dir / atlas_name
+
+
+def decimate_mesh(
+    vertices: np.ndarray, faces: np.ndarray, max_vertices: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Decimate a triangle mesh to at most max_vertices vertices, by vertex
+    clustering.
+
+    Vertices are grouped by the cell of a regular grid they fall in, and
+    each group is replaced by its mean. The grid is the finest (growing in
+    steps of 25%) that leaves at most max_vertices groups. Triangles that
+    collapse to a line or point, and duplicates, are removed, and the
+    winding of the others is kept.
+
+    Parameters
+    ----------
+    vertices : np.ndarray
+        Nx3 array of vertex positions.
+    faces : np.ndarray
+        Mx3 array of the vertex indices of each triangle.
+    max_vertices : int
+        The maximum number of vertices to keep.
+
+    Returns
+    -------
+    vertices : np.ndarray
+        The decimated vertices.
+    faces : np.ndarray
+        The triangles of the decimated mesh.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int64)
+    if len(vertices) <= max_vertices:
+        return vertices, faces
+
+    origin = vertices.min(axis=0)
+    extent = max(float(np.ptp(vertices, axis=0).max()), 1e-12)
+    # a surface with n vertices is covered by roughly n grid cells, so
+    # start a little finer than that, and coarsen until it fits
+    cell_size = extent / np.sqrt(max_vertices) / 2
+    while True:
+        cells = np.floor((vertices - origin) / cell_size).astype(np.int64)
+        keys = np.ravel_multi_index(cells.T, tuple(cells.max(axis=0) + 1))
+        _, clusters = np.unique(keys, return_inverse=True)
+        clusters = clusters.ravel()
+        n_clusters = int(clusters.max()) + 1
+        if n_clusters <= max_vertices:
+            break
+        cell_size *= 1.25
+
+    counts = np.bincount(clusters, minlength=n_clusters)
+    new_vertices = np.stack(
+        [
+            np.bincount(clusters, vertices[:, axis], n_clusters) / counts
+            for axis in range(vertices.shape[1])
+        ],
+        axis=1,
+    )
+
+    new_faces = clusters[faces]
+    new_faces = new_faces[
+        (new_faces[:, 0] != new_faces[:, 1])
+        & (new_faces[:, 1] != new_faces[:, 2])
+        & (new_faces[:, 0] != new_faces[:, 2])
+    ]
+    _, first = np.unique(np.sort(new_faces, axis=1), axis=0, return_index=True)
+    new_faces = new_faces[np.sort(first)]
+
+    # drop vertices that are no longer part of a triangle
+    used, new_faces = np.unique(new_faces, return_inverse=True)
+    return new_vertices[used], new_faces.reshape(-1, 3)
+
+
+def get_smallest_index_type(n_vertices: int) -> np.dtype:
+    """Get the smallest unsigned integer type that can index n_vertices."""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if n_vertices <= np.iinfo(dtype).max + 1:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+
+def write_mesh_cache(
+    path: os.PathLike, vertices: np.ndarray, faces: np.ndarray
+):
+    """Save a mesh compactly, with float32 vertices and the smallest
+    unsigned integer type for the faces."""
+    with write_atomically(path) as temporary_path:
+        with open(temporary_path, "wb") as mesh_file:
+            np.savez(
+                mesh_file,
+                vertices=np.asarray(vertices, dtype=np.float32),
+                faces=np.asarray(faces).astype(
+                    get_smallest_index_type(len(vertices))
+                ),
+            )
+
+
+def read_mesh_cache(path: os.PathLike) -> Tuple[np.ndarray, np.ndarray]:
+    """Read a mesh saved by write_mesh_cache."""
+    with np.load(path) as mesh_file:
+        vertices, faces = mesh_file["vertices"], mesh_file["faces"]
+    add_file_read(path)
+    return vertices, faces.astype(np.int64)
+
+
+def load_structure_mesh(
+    atlas, structure: str, max_vertices: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Load the decimated mesh of an atlas structure, in um.
+
+    The mesh is read from the cache if it is up to date, and otherwise read
+    from the atlas, decimated and cached.
+
+    Parameters
+    ----------
+    atlas : BrainGlobeAtlas
+        The atlas.
+    structure : str
+        Acronym of the structure.
+    max_vertices : int
+        The maximum number of vertices.
+
+    Returns
+    -------
+    vertices : np.ndarray
+        Nx3 float32 array of vertex positions, in um.
+    faces : np.ndarray
+        Mx3 array of the vertex indices of each triangle.
+    """
+    import meshio
+
+    structure_id = atlas.structures[structure]["id"]
+    mesh_path = atlas.meshfile_from_structure(structure)
+    cache_path = (
+        get_mesh_cache_dir(atlas.atlas_name)
+        / f"{structure_id}_{max_vertices}.npz"
+    )
+    if is_up_to_date(cache_path, [mesh_path]):
+        try:
+            return read_mesh_cache(cache_path)
+        except (OSError, ValueError, KeyError):
+            print(f"Could not read {cache_path}, decimating again")
+
+    with span("mesh read", structure=structure):
+        mesh = meshio.read(mesh_path)
+        add_file_read(mesh_path)
+    with span("mesh decimate", structure=structure):
+        vertices, faces = decimate_mesh(
+            mesh.points[:, :3], mesh.get_cells_type("triangle"), max_vertices
+        )
+    try:
+        write_mesh_cache(cache_path, vertices, faces)
+    except OSError:
+        # e.g. a read-only home directory, the mesh will be decimated again
+        print(f"Could not save decimated mesh to {cache_path}")
+    return vertices.astype(np.float32), faces
+
+
+def get_structure_color(atlas, structure: str) -> Tuple[float, ...]:
+    """Get the colour of an atlas structure, as RGB from 0 to 1."""
+    rgb = atlas.structures[structure].get("rgb_triplet")
+    if rgb is None:
+        return DEFAULT_COLOR
+    return tuple(float(c) / 255 for c in rgb)
+
+
+@profile("load atlas meshes")
+def load_meshes(
+    atlas,
+    structures: Sequence[str],
+    region: Optional[Dict] = None,
+    max_vertices: Optional[int] = None,
+    n_workers: Optional[int] = None,
+) -> List[LayerDataTuple]:
+    """Load the meshes of atlas structures as surface layers, in the atlas
+    orientation and voxel coordinates.
+
+    Parameters
+    ----------
+    atlas : BrainGlobeAtlas
+        The atlas.
+    structures : Sequence[str]
+        Acronyms of the structures.
+    region : dict, optional
+        If the annotation was cropped to a region (see
+        brainglobe_napari_io.regions.get_structure_region), the meshes are
+        translated in the same way, to line up with it.
+    max_vertices : int, optional
+        The maximum number of vertices of each mesh, by default from
+        get_max_vertices.
+    n_workers : int, optional
+        Number of meshes to load at once, by default the number of CPUs.
+
+    Returns
+    -------
+    List[LayerDataTuple]
+        A surface layer for each structure, named by its acronym.
+    """
+    max_vertices = get_max_vertices(max_vertices)
+    for structure in structures:
+        if structure not in atlas.structures:
+            raise ValueError(
+                f"{structure} is not a structure in {atlas.atlas_name}"
+            )
+    print(f"Loading {len(structures)} meshes from {atlas.atlas_name}")
+
+    def load(structure: str) -> Tuple[np.ndarray, np.ndarray]:
+        return load_structure_mesh(atlas, structure, max_vertices)
+
+    n_workers = min(n_workers or os.cpu_count() or 1, len(structures))
+    if n_workers <= 1:
+        meshes = [load(structure) for structure in structures]
+    else:
+        with ThreadPoolExecutor(
+            max_workers=n_workers, thread_name_prefix="meshes"
+        ) as executor:
+            meshes = list(executor.map(load, structures))
+
+    resolution = np.asarray(atlas.resolution, dtype=np.float32)
+    layers: List[LayerDataTuple] = []
+    for structure, (vertices, faces) in zip(structures, meshes):
+        vertices = vertices / resolution
+        if region is not None:
+            vertices -= np.asarray(region["start"], dtype=np.float32)
+        color = get_structure_color(atlas, structure)
+        layers.append(
+            (
+                (vertices, faces),
+                region_attributes(
+                    {
+                        "name": structure,
+                        "opacity": 0.4,
+                        "blending": "translucent",
+                        "shading": "smooth",
+                        "vertex_colors": np.tile(color, (len(vertices), 1)),
+                        "metadata": {
+                            "atlas": atlas.atlas_name,
+                            "structure": structure,
+                            "region": region,
+                        },
+                    },
+                    region,
+                ),
+                "surface",
+            )
+        )
+    return layers
+
+
+def load_atlas_meshes(
+    atlas_name: str,
+    structures: Sequence[str],
+    metadata: Optional[Dict] = None,
+    max_vertices: Optional[int] = None,
+    n_workers: Optional[int] = None,
+) -> List[Layer]:
+    """Load the meshes of atlas structures as surface layers, without
+    napari.
+
+    Parameters
+    ----------
+    atlas_name : str
+        Name of the atlas, e.g. "allen_mouse_25um".
+    structures : Sequence[str]
+        Acronyms of the structures, e.g. ["root", "HIP"].
+    metadata : dict, optional
+        The metadata of a brainreg registration (from brainreg.json, with
+        the "orientation" and "voxel_sizes" of the sample). If given, the
+        meshes are reoriented and scaled to the sample, as the registration
+        layers are in sample space. By default, they are in atlas space.
+    max_vertices, n_workers
+        As for load_meshes.
+
+    Returns
+    -------
+    List[Layer]
+        A surface layer for each structure.
+    """
+    with span("atlas init", atlas=atlas_name):
+        atlas = get_atlas(atlas_name)
+    layers = load_meshes(
+        atlas, structures, max_vertices=max_vertices, n_workers=n_workers
+    )
+    if metadata is not None:
+        layers = scale_reorient_layers(layers, atlas, metadata)
+    return as_layers(layers)
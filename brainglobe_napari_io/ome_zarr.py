@@ -0,0 +1,409 @@
+"""Read registration images stored as OME-Zarr.
+
+Any image in a brainreg directory (e.g. ``registered_atlas.tiff``) can
+instead be stored as a chunked, compressed OME-Zarr image next to it (e.g.
+``registered_atlas.ome.zarr`` or ``registered_atlas.zarr``). The readers use
+the Zarr image if there is no TIFF, or the Zarr image is newer than it, with
+the same layer names, metadata and orientation handling.
+
+Only the chunks of a Zarr image that are needed are read (in parallel), so
+regions are read without the rest of the image, images that don't fit in
+the memory budget are read lazily as they are viewed, and decimated images
+are read from a lower resolution level of a multiscale image if there is
+one (see brainglobe_napari_io.planning).
+
+Both OME-Zarr 0.4 (Zarr v2) and 0.5 (Zarr v3) images are read, as well as
+plain Zarr arrays. Images are written (see write_ome_zarr_image) as
+OME-Zarr 0.5, with a multiscale pyramid, in compressed chunks.
+"""
+
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from brainglobe_napari_io.profiling import add_bytes_read, span
+
+ZARR_SUFFIXES = (".ome.zarr", ".zarr")
+OME_ZARR_VERSION = "0.5"
+DEFAULT_CHUNKS = (64, 64, 64)
+# levels are added until the image is no larger than this along every axis
+MIN_LEVEL_SIZE = 64
+MAX_LEVELS = 8
+BLOSC_LEVEL = 5
+
+
+def is_zarr(path: os.PathLike) -> bool:
+    """Whether a path is to a Zarr image (e.g. "registered_atlas.ome.zarr")."""
+    return Path(path).name.lower().endswith(".zarr")
+
+
+def get_zarr_paths(path: os.PathLike) -> List[Path]:
+    """Get the paths a Zarr variant of an image could have, in order of
+    preference (e.g. "downsampled.ome.zarr", then "downsampled.zarr" for
+    "downsampled.tiff")."""
+    path = Path(path)
+    stem = path.name[: -len(path.suffix)] if path.suffix else path.name
+    return [path.with_name(stem + suffix) for suffix in ZARR_SUFFIXES]
+
+
+def get_tiff_path(zarr_path: os.PathLike, extension: str = ".tiff") -> Path:
+    """Get the path of the TIFF image a Zarr image is a variant of."""
+    zarr_path = Path(zarr_path)
+    name = zarr_path.name
+    for suffix in ZARR_SUFFIXES:
+        if name.lower().endswith(suffix):
+            name = name[: -len(suffix)]
+            break
+    return zarr_path.with_name(name + extension)
+
+
+def find_image(path: os.PathLike) -> Path:
+    """Get the file to read an image from: its Zarr variant if there is one
+    that is newer than the TIFF (or there is no TIFF), otherwise the TIFF.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to an image, e.g. "registered_atlas.tiff", which may not exist.
+
+    Returns
+    -------
+    Path
+        Path to the Zarr variant, or the TIFF path.
+    """
+    from brainglobe_napari_io.utils import is_up_to_date
+
+    path = Path(path)
+    if is_zarr(path):
+        return path
+    for zarr_path in get_zarr_paths(path):
+        if zarr_path.is_dir() and is_up_to_date(zarr_path, [path]):
+            return zarr_path
+    return path
+
+
+def get_multiscales(group) -> Optional[Dict]:
+    """Get the first OME-Zarr multiscales metadata of a Zarr group, or None
+    if it has none."""
+    attributes = dict(group.attrs)
+    # OME-Zarr 0.5 nests the metadata under "ome"
+    attributes = attributes.get("ome", attributes)
+    multiscales = attributes.get("multiscales")
+    if not multiscales:
+        return None
+    return multiscales[0]
+
+
+def get_dataset_scale(dataset: Dict) -> Optional[np.ndarray]:
+    """Get the scale of a multiscales dataset, or None if it has none."""
+    for transformation in dataset.get("coordinateTransformations", []):
+        if transformation.get("type") == "scale":
+            return np.asarray(transformation["scale"], dtype=float)
+    return None
+
+
+def open_zarr_levels(path: os.PathLike) -> List[Tuple[Any, int]]:
+    """Open the resolution levels of a Zarr image.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to an OME-Zarr image, or a plain Zarr array.
+
+    Returns
+    -------
+    List[Tuple[zarr.Array, int]]
+        Each level, from the highest resolution, and how many times smaller
+        it is than the first along each axis (1 for the first, or 0 if it
+        isn't smaller by a whole factor along every axis). The arrays are
+        only read when indexed.
+    """
+    import zarr
+
+    node = zarr.open(str(path), mode="r")
+    if isinstance(node, zarr.Array):
+        return [(node, 1)]
+
+    multiscales = get_multiscales(node)
+    if multiscales is None:
+        raise ValueError(f"{path} is not an OME-Zarr image")
+    datasets = multiscales["datasets"]
+    base_scale = get_dataset_scale(datasets[0])
+    levels: List[Tuple[Any, int]] = []
+    for dataset in datasets:
+        array = node[dataset["path"]]
+        factor = 1
+        scale = get_dataset_scale(dataset)
+        if base_scale is not None and scale is not None:
+            factors = scale / base_scale
+            rounded = np.round(factors)
+            # only the spatial axes (the last three) are decimated
+            if np.allclose(factors, rounded) and len(set(rounded[-3:])) == 1:
+                factor = int(rounded[-1])
+            else:
+                factor = 0
+        elif len(levels):
+            factor = 0
+        levels.append((array, factor))
+    return levels
+
+
+def open_zarr_image(path: os.PathLike):
+    """Open the full resolution level of a Zarr image, which is only read
+    when indexed (e.g. by napari, as it is viewed)."""
+    return open_zarr_levels(path)[0][0]
+
+
+def get_zarr_shape(path: os.PathLike) -> Tuple[Tuple[int, ...], np.dtype]:
+    """Get the shape and data type of a Zarr image, without reading it."""
+    image = open_zarr_image(path)
+    return tuple(int(s) for s in image.shape), np.dtype(image.dtype)
+
+
+def read_zarr_image(
+    path: os.PathLike, region: Optional[Dict] = None
+) -> np.ndarray:
+    """Read a Zarr image, or only a region of it.
+
+    Only the chunks overlapping the region are read and decompressed, in
+    parallel.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to an OME-Zarr image, or a plain Zarr array.
+    region : dict, optional
+        The region to read, with the start (inclusive) and stop (exclusive)
+        along each axis. By default, the whole image is read.
+
+    Returns
+    -------
+    np.ndarray
+        The image, or the region of it.
+    """
+    with span("decode", file=Path(path).name) as decode_span:
+        image = open_zarr_image(path)
+        if region is None:
+            image = image[...]
+        else:
+            image = image[
+                tuple(
+                    slice(int(a), int(b))
+                    for a, b in zip(region["start"], region["stop"])
+                )
+            ]
+        image = np.asarray(image)
+        decode_span.add_bytes_read(image.nbytes)
+    return image
+
+
+def read_zarr_decimated(path: os.PathLike, factor: int) -> np.ndarray:
+    """Read every nth plane, row and column of a Zarr image.
+
+    If the image is multiscale with a level that is n times smaller, that
+    level is read. Otherwise, the full resolution level is read a chunk at a
+    time, keeping every nth voxel.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to an OME-Zarr image, or a plain Zarr array.
+    factor : int
+        The decimation factor.
+
+    Returns
+    -------
+    np.ndarray
+        The decimated image.
+    """
+    with span("decode", file=Path(path).name, decimation=factor):
+        levels = open_zarr_levels(path)
+        for array, level_factor in levels:
+            if level_factor == factor:
+                image = np.asarray(array[...])
+                add_bytes_read(image.nbytes)
+                return image
+        image = np.asarray(levels[0][0][::factor, ::factor, ::factor])
+        add_bytes_read(image.nbytes * factor**3)
+    return image
+
+
+def read_image(path: os.PathLike):
+    """Open an image so it is only read from disk when accessed: a Zarr
+    image (see open_zarr_image), or a memory-mapped TIFF file.
+
+    TIFF files that can't be memory-mapped (e.g. compressed files) are read
+    in full.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to a TIFF file, or a Zarr image.
+
+    Returns
+    -------
+    array-like
+        The image.
+    """
+    if is_zarr(path):
+        return open_zarr_image(path)
+
+    import tifffile
+
+    try:
+        return tifffile.memmap(path, mode="r")
+    except ValueError:
+        return tifffile.imread(path)
+
+
+def get_image_shape(path: os.PathLike) -> Tuple[Tuple[int, ...], np.dtype]:
+    """Get the shape and data type of a TIFF file or Zarr image, without
+    reading it."""
+    if is_zarr(path):
+        return get_zarr_shape(path)
+
+    import tifffile
+
+    with tifffile.TiffFile(path) as tiff:
+        series = tiff.series[0]
+        return tuple(series.shape), series.dtype
+
+
+def get_n_levels(
+    shape: Sequence[int],
+    min_size: int = MIN_LEVEL_SIZE,
+    max_levels: int = MAX_LEVELS,
+) -> int:
+    """Get the number of levels of a pyramid of an image (including the
+    image), halving it until it is no larger than min_size along every
+    spatial axis (the last three), or is one voxel thick."""
+    n_levels = 1
+    largest, smallest = max(shape[-3:]), min(shape[-3:])
+    while largest > min_size and smallest >= 2 and n_levels < max_levels:
+        largest, smallest = largest // 2, smallest // 2
+        n_levels += 1
+    return n_levels
+
+
+def downsample(image: np.ndarray, labels: bool = False) -> np.ndarray:
+    """Halve the size of an image along its spatial axes (the last three).
+
+    Images are downsampled by averaging 2x2x2 blocks of voxels (rounded, for
+    integer images, and dropping any odd last voxel along each axis), and
+    labels by keeping every other voxel, so no new label values are made.
+    """
+    if labels:
+        return np.ascontiguousarray(image[..., ::2, ::2, ::2])
+    shape = image.shape[:-3] + tuple(s // 2 for s in image.shape[-3:])
+    cropped = image[tuple(slice(0, s * 2) for s in shape)]
+    blocks = cropped.reshape(
+        image.shape[:-3] + tuple(x for s in shape[-3:] for x in (s, 2))
+    )
+    mean = blocks.mean(axis=tuple(range(-5, 0, 2)), dtype=np.float64)
+    if np.issubdtype(image.dtype, np.integer):
+        mean = np.rint(mean)
+    return mean.astype(image.dtype)
+
+
+def write_ome_zarr_image(
+    group,
+    name: str,
+    image,
+    scale: Optional[Sequence[float]] = None,
+    translate: Optional[Sequence[float]] = None,
+    labels: bool = False,
+    n_levels: Optional[int] = None,
+    chunks: Sequence[int] = DEFAULT_CHUNKS,
+):
+    """Write an image as a multiscale OME-Zarr 0.5 image.
+
+    Each level is half the size of the last (see downsample), and is written
+    in Blosc/zstd compressed chunks, in parallel.
+
+    Parameters
+    ----------
+    group : zarr.Group
+        The (Zarr v3) group to write the image in.
+    name : str
+        Name of the image in the group.
+    image : array-like
+        The image, with three spatial axes last.
+    scale, translate : Sequence[float], optional
+        The size of each voxel, and position of the first voxel (e.g. of a
+        napari layer), by default 1 and 0.
+    labels : bool, optional
+        Whether the image is a label image, by default False.
+    n_levels : int, optional
+        Number of levels, by default from get_n_levels.
+    chunks : Sequence[int], optional
+        Chunk shape of the spatial axes, by default (64, 64, 64).
+
+    Returns
+    -------
+    zarr.Group
+        The image group.
+    """
+    from zarr.codecs import BloscCodec
+
+    image = np.asarray(image)
+    ndim = image.ndim
+    voxel_size = np.ones(ndim) if scale is None else np.asarray(scale, float)
+    origin = (
+        np.zeros(ndim) if translate is None else np.asarray(translate, float)
+    )
+    if n_levels is None:
+        n_levels = get_n_levels(image.shape) if ndim >= 3 else 1
+
+    image_group = group.create_group(name, overwrite=True)
+    datasets = []
+    with span("encode", file=name, n_levels=n_levels):
+        for level in range(n_levels):
+            if level:
+                image = downsample(image, labels)
+            factor = np.ones(ndim)
+            factor[-3:] = 2**level
+            level_chunks = tuple(image.shape[:-3]) + tuple(
+                min(int(c), int(s)) for c, s in zip(chunks, image.shape[-3:])
+            )
+            image_group.create_array(
+                str(level),
+                data=image,
+                chunks=tuple(max(c, 1) for c in level_chunks),
+                compressors=BloscCodec(
+                    cname="zstd", clevel=BLOSC_LEVEL, shuffle="shuffle"
+                ),
+            )
+            # averaged voxels are centred on the blocks they were made from
+            offset = (
+                np.zeros(ndim) if labels else (factor - 1) / 2 * voxel_size
+            )
+            datasets.append(
+                {
+                    "path": str(level),
+                    "coordinateTransformations": [
+                        {
+                            "type": "scale",
+                            "scale": (voxel_size * factor).tolist(),
+                        },
+                        {
+                            "type": "translation",
+                            "translation": (origin + offset).tolist(),
+                        },
+                    ],
+                }
+            )
+    axis_names = ["c", "z", "y", "x"][-ndim:] if ndim <= 4 else None
+    axes = [
+        {"name": axis, "type": "channel" if axis == "c" else "space"}
+        for axis in axis_names or [f"dim_{i}" for i in range(ndim)]
+    ]
+    metadata: Dict[str, Any] = {
+        "version": OME_ZARR_VERSION,
+        "multiscales": [{"name": name, "axes": axes, "datasets": datasets}],
+    }
+    if labels:
+        metadata["image-label"] = {"version": OME_ZARR_VERSION}
+    image_group.attrs["ome"] = metadata
+    return image_group
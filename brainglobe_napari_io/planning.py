@@ -0,0 +1,672 @@
+"""Plan how to load data within a memory budget.
+
+Before loading, the size of each image (from its TIFF header) and each cell
+file (from its file size) is used to estimate how much memory loading it
+would take. Against a memory budget, each is then planned to be loaded:
+
+- "eager": read into memory,
+- "memmap": memory-mapped (for uncompressed TIFF files), so only the parts
+  being viewed are read, and the operating system can drop them again.
+  The mapping is copy-on-write, so edits (e.g. painting labels) are kept
+  in memory, and never written to the file,
+- "lazy": decoded one plane at a time when viewed, keeping a bounded number
+  of planes in memory (for TIFF files with one page per plane, and raw
+  data). Lazily loaded images are read-only, so labels aren't loaded
+  lazily,
+- "decimated": only every nth plane, row and column of an image is loaded.
+
+Cells are always loaded in full, as they are curated and saved over their
+file.
+
+Smaller items are planned first, so they are loaded eagerly, and larger
+items are loaded with the first of these that fits in the remaining budget.
+
+The budget can be given when loading, set with the
+BRAINGLOBE_NAPARI_IO_MEMORY_BUDGET environment variable (e.g. "8G"), and
+otherwise is half the memory available when loading.
+"""
+
+import os
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+MEMORY_BUDGET_ENV_VAR = "BRAINGLOBE_NAPARI_IO_MEMORY_BUDGET"
+STRATEGIES = ("eager", "memmap", "lazy", "decimated")
+DECIMATION_FACTORS = (2, 4, 8, 16)
+# measured peak memory per cell when loading cells as points layers, most
+# of which is parsing the file, so it is needed however many are shown
+XML_BYTES_PER_CELL = 120
+XML_MEMORY_PER_CELL = 1700
+BINARY_MEMORY_PER_CELL = 48
+# number of planes a lazily loaded image keeps in memory
+LAZY_CACHE_SIZE = 64
+MIN_LAZY_CACHE_SIZE = 2
+
+MEMORY_UNITS = {"K": 1e3, "M": 1e6, "G": 1e9, "T": 1e12}
+
+
+class LayerPlan(NamedTuple):
+    """How to load a file.
+
+    Attributes
+    ----------
+    path : str
+        The file (or for raw data, the directory of planes).
+    kind : str
+        "image", "cells" or "raw data".
+    shape : Tuple[int, ...]
+        Shape of the image, or (number of cells,).
+    eager_memory : int
+        Estimated bytes of memory to load the file eagerly.
+    strategy : str
+        How to load the file, one of STRATEGIES.
+    memory : int
+        Estimated bytes of memory to load the file with the strategy.
+    decimation : int
+        For the "decimated" strategy, load every nth plane/row/column. 1
+        otherwise.
+    cache_size : int
+        For the "lazy" strategy, the number of planes to keep in memory.
+    reduced : bool
+        Whether the file is loaded in a way that uses less memory than
+        usual, to fit in the budget.
+    """
+
+    path: str
+    kind: str
+    shape: Tuple[int, ...]
+    eager_memory: int
+    strategy: str = "eager"
+    memory: int = 0
+    decimation: int = 1
+    cache_size: int = LAZY_CACHE_SIZE
+    reduced: bool = False
+
+
+class LoadPlan(NamedTuple):
+    """How to load each file, within a memory budget.
+
+    Attributes
+    ----------
+    budget : int or None
+        The memory budget in bytes, or None for no limit.
+    layers : List[LayerPlan]
+        How to load each file.
+    """
+
+    budget: Optional[int]
+    layers: List[LayerPlan]
+
+    @property
+    def memory(self) -> int:
+        """Estimated bytes of memory to load everything as planned."""
+        return sum(layer.memory for layer in self.layers)
+
+    @property
+    def fits(self) -> bool:
+        """Whether the estimated memory is within the budget."""
+        return self.budget is None or self.memory <= self.budget
+
+    @property
+    def is_reduced(self) -> bool:
+        """Whether anything is loaded with less memory than usual."""
+        return any(layer.reduced for layer in self.layers)
+
+    def get(self, path: os.PathLike) -> Optional[LayerPlan]:
+        """Get the plan of a file, or None if it isn't planned."""
+        path = os.path.abspath(path)
+        for layer in self.layers:
+            if os.path.abspath(layer.path) == path:
+                return layer
+        return None
+
+
+def parse_memory_size(size: str) -> int:
+    """Parse a memory size, e.g. "512M" or "4G", to bytes."""
+    size = size.strip().upper().removesuffix("B")
+    try:
+        if size and size[-1] in MEMORY_UNITS:
+            return int(float(size[:-1]) * MEMORY_UNITS[size[-1]])
+        return int(size)
+    except ValueError:
+        raise ValueError(f"Invalid memory size: {size!r}, use e.g. 512M or 4G")
+
+
+def get_available_memory() -> Optional[int]:
+    """Get the bytes of memory available to this process, if known."""
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def get_memory_budget(budget: Optional[int] = None) -> Optional[int]:
+    """Get the memory budget to load data within.
+
+    Parameters
+    ----------
+    budget : int, optional
+        The budget in bytes. By default, the budget set by the
+        BRAINGLOBE_NAPARI_IO_MEMORY_BUDGET environment variable, or half the
+        available memory.
+
+    Returns
+    -------
+    int or None
+        The budget in bytes, or None if there is no limit (the environment
+        variable is "0", or the available memory isn't known).
+    """
+    if budget is not None:
+        return int(budget)
+    env_budget = os.environ.get(MEMORY_BUDGET_ENV_VAR, "")
+    if env_budget:
+        budget = parse_memory_size(env_budget)
+        return budget if budget > 0 else None
+    available = get_available_memory()
+    return None if available is None else available // 2
+
+
+def plan_image(
+    path: os.PathLike, allow_lazy: bool = True, allow_decimated: bool = True
+) -> Tuple[LayerPlan, List[LayerPlan]]:
+    """Get the ways an image can be loaded, from its TIFF header.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to a 3D TIFF file, or a Zarr image (see plan_zarr_image).
+    allow_lazy : bool, optional
+        Whether the image can be loaded lazily, by default True. (A lazily
+        loaded image can't be reoriented.)
+    allow_decimated : bool, optional
+        Whether the image can be loaded decimated, by default True.
+
+    Returns
+    -------
+    Tuple[LayerPlan, List[LayerPlan]]
+        Plans to load the image eagerly, and otherwise in order of
+        preference.
+    """
+    import tifffile
+
+    from brainglobe_napari_io.ome_zarr import is_zarr
+
+    if is_zarr(path):
+        return plan_zarr_image(path, allow_lazy, allow_decimated)
+
+    with tifffile.TiffFile(path) as tif:
+        series = tif.series[0]
+        shape = tuple(int(s) for s in series.shape)
+        dtype = np.dtype(series.dtype)
+        memmappable = series.dataoffset is not None
+        paged = (
+            len(shape) == 3
+            and len(tif.pages) == shape[0]
+            and tuple(tif.pages[0].shape) == shape[1:]
+        )
+    eager = LayerPlan(
+        str(path), "image", shape, int(np.prod(shape)) * dtype.itemsize
+    )
+    eager = eager._replace(memory=eager.eager_memory)
+    alternatives = []
+    if memmappable:
+        alternatives.append(eager._replace(strategy="memmap", memory=0))
+    plane_memory = eager.eager_memory // max(shape[0], 1)
+    if paged and allow_lazy:
+        alternatives.extend(
+            eager._replace(
+                strategy="lazy",
+                memory=cache_size * plane_memory,
+                cache_size=cache_size,
+            )
+            for cache_size in (LAZY_CACHE_SIZE, MIN_LAZY_CACHE_SIZE)
+            if cache_size < shape[0]
+        )
+    if not allow_decimated:
+        return eager, alternatives
+    alternatives.extend(
+        eager._replace(
+            strategy="decimated",
+            memory=eager.eager_memory // factor**3
+            # without pages, the whole image is read before decimating
+            + (0 if paged else eager.eager_memory),
+            decimation=factor,
+        )
+        for factor in DECIMATION_FACTORS
+    )
+    return eager, alternatives
+
+
+def plan_zarr_image(
+    path: os.PathLike, allow_lazy: bool = True, allow_decimated: bool = True
+) -> Tuple[LayerPlan, List[LayerPlan]]:
+    """Get the ways a Zarr image can be loaded (see plan_image), from its
+    metadata.
+
+    Zarr images can't be memory-mapped, but can be loaded lazily, reading
+    the chunks of each plane as it is viewed (with a slab of planes as deep
+    as a chunk in memory). Decimated images are read from a lower resolution
+    level of a multiscale image if there is one.
+    """
+    from brainglobe_napari_io.ome_zarr import open_zarr_levels
+
+    levels = open_zarr_levels(path)
+    image = levels[0][0]
+    shape = tuple(int(s) for s in image.shape)
+    dtype = np.dtype(image.dtype)
+    eager = LayerPlan(
+        str(path), "image", shape, int(np.prod(shape)) * dtype.itemsize
+    )
+    eager = eager._replace(memory=eager.eager_memory)
+    alternatives = []
+    plane_memory = eager.eager_memory // max(shape[0], 1)
+    chunk_depth = int(image.chunks[0])
+    if allow_lazy and chunk_depth < shape[0]:
+        alternatives.append(
+            eager._replace(
+                strategy="lazy",
+                memory=chunk_depth * plane_memory,
+                cache_size=chunk_depth,
+            )
+        )
+    if not allow_decimated:
+        return eager, alternatives
+    # without a level that size, the image is read a chunk at a time
+    chunk_memory = int(np.prod(image.chunks)) * dtype.itemsize
+    level_factors = {factor for _, factor in levels[1:]}
+    alternatives.extend(
+        eager._replace(
+            strategy="decimated",
+            memory=eager.eager_memory // factor**3
+            + (0 if factor in level_factors else chunk_memory),
+            decimation=factor,
+        )
+        for factor in DECIMATION_FACTORS
+    )
+    return eager, alternatives
+
+
+def plan_cells(path: os.PathLike) -> Tuple[LayerPlan, List[LayerPlan]]:
+    """Get how a cell file will be loaded, from its size.
+
+    Cells are always loaded in full, as the points layers are curated and
+    saved over the cell file, so loading only some of them would lose the
+    rest. (Nor would it save much memory: parsing the file takes most of
+    it.)
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to a cellfinder XML/YAML file.
+
+    Returns
+    -------
+    Tuple[LayerPlan, List[LayerPlan]]
+        The plan to load the cells eagerly, and no alternatives.
+    """
+    from brainglobe_napari_io.cellfinder.cell_files import (
+        get_binary_cells_path,
+    )
+    from brainglobe_napari_io.utils import is_up_to_date
+
+    binary_path = get_binary_cells_path(path)
+    if is_up_to_date(binary_path, [path]):
+        with np.load(binary_path) as cells_file:
+            n_cells = len(cells_file["types"])
+        memory_per_cell = BINARY_MEMORY_PER_CELL
+    else:
+        n_cells = os.path.getsize(path) // XML_BYTES_PER_CELL
+        memory_per_cell = XML_MEMORY_PER_CELL
+
+    eager = LayerPlan(
+        str(path),
+        "cells",
+        (n_cells,),
+        n_cells * memory_per_cell,
+        memory=n_cells * memory_per_cell,
+    )
+    return eager, []
+
+
+def plan_plane_stack(stack) -> Tuple[LayerPlan, List[LayerPlan]]:
+    """Get the ways raw data can be loaded (always lazily, with a number of
+    planes cached that fits the budget).
+
+    Parameters
+    ----------
+    stack : LazyPlaneStack
+        The raw data.
+
+    Returns
+    -------
+    Tuple[LayerPlan, List[LayerPlan]]
+        Plans to load the raw data with its default cache size, and
+        otherwise in order of preference.
+    """
+    plane_memory = int(np.prod(stack.shape[1:])) * stack.dtype.itemsize
+    path = str(stack.plane_paths[0].parent)
+
+    def plan(cache_size):
+        return LayerPlan(
+            path,
+            "raw data",
+            tuple(stack.shape),
+            len(stack) * plane_memory,
+            strategy="lazy",
+            memory=min(cache_size, len(stack)) * plane_memory,
+            cache_size=cache_size,
+        )
+
+    return plan(stack.cache_size), [
+        plan(cache_size)
+        for cache_size in (16, 4, MIN_LAZY_CACHE_SIZE)
+        if cache_size < stack.cache_size
+    ]
+
+
+def make_plan(
+    options: Sequence[Tuple[LayerPlan, List[LayerPlan]]],
+    budget: Optional[int],
+) -> LoadPlan:
+    """Choose how to load each item within a budget.
+
+    Items are planned from the smallest. Each is loaded eagerly if that
+    fits in the remaining budget, otherwise with the first alternative that
+    does, otherwise with the alternative that uses the least memory.
+
+    Parameters
+    ----------
+    options : Sequence[Tuple[LayerPlan, List[LayerPlan]]]
+        For each item, the plan to load it eagerly and the alternatives in
+        order of preference (e.g. from plan_image).
+    budget : int, optional
+        Memory budget in bytes. None for no limit, so everything is loaded
+        eagerly.
+
+    Returns
+    -------
+    LoadPlan
+        The plan of each item, in the order given.
+    """
+    chosen: Dict[int, LayerPlan] = {}
+    remaining = budget
+    for index in sorted(
+        range(len(options)), key=lambda i: options[i][0].memory
+    ):
+        eager, alternatives = options[index]
+        if remaining is None:
+            chosen[index] = eager
+            continue
+        candidates = [eager] + alternatives
+        fitting = [plan for plan in candidates if plan.memory <= remaining]
+        if fitting:
+            plan = fitting[0]
+        else:
+            plan = min(candidates, key=lambda plan: plan.memory)
+        if plan is not eager:
+            plan = plan._replace(reduced=True)
+        chosen[index] = plan
+        remaining = max(remaining - plan.memory, 0)
+    return LoadPlan(budget, [chosen[i] for i in range(len(options))])
+
+
+REGISTRATION_IMAGES = (
+    "downsampled.tiff",
+    "registered_hemispheres.tiff",
+    "registered_atlas.tiff",
+    "boundaries.tiff",
+)
+
+
+def get_registration_image_source(
+    path: os.PathLike, atlas, orientation: Optional[str]
+) -> Tuple[Path, bool]:
+    """Get the file to read a registration image in an orientation from.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to the registration image.
+    atlas : BrainGlobeAtlas
+        The atlas registered to (whose orientation the image is in).
+    orientation : str, optional
+        Orientation to read the image in. By default, the atlas orientation.
+
+    Returns
+    -------
+    Tuple[Path, bool]
+        The up-to-date reoriented copy of the image if there is one,
+        otherwise the image (or its Zarr variant, see
+        brainglobe_napari_io.ome_zarr), and whether it still needs
+        reorienting.
+    """
+    from brainglobe_napari_io.ome_zarr import find_image
+    from brainglobe_napari_io.utils import get_reoriented_path, is_up_to_date
+
+    path = Path(path)
+    source = find_image(path)
+    if orientation is None or orientation == atlas.orientation:
+        return source, False
+    reoriented_path = get_reoriented_path(path, orientation)
+    if is_up_to_date(reoriented_path, [path, source]):
+        return reoriented_path, False
+    return source, True
+
+
+def get_brainreg_options(
+    path: os.PathLike, orientation: Optional[str] = None, atlas=None
+) -> List[Tuple[LayerPlan, List[LayerPlan]]]:
+    """Get the ways each registration image in a brainreg directory can be
+    loaded (see plan_image). Images that need reorienting, and the labels
+    images, can't be loaded lazily, and the labels images are never
+    decimated, as edits to them are saved over the image."""
+    from brainglobe_napari_io.brainreg.writer_labels import LABELS_FILES
+
+    path = Path(path)
+    if atlas is None:
+        import json
+
+        from brainglobe_napari_io.utils import get_atlas
+
+        with open(path / "brainreg.json") as json_file:
+            atlas = get_atlas(json.load(json_file)["atlas"])
+
+    options = []
+    for filename in REGISTRATION_IMAGES:
+        source, reorient = get_registration_image_source(
+            path / filename, atlas, orientation
+        )
+        # labels are edited in napari, and lazily loaded images are
+        # read-only
+        is_labels = filename in LABELS_FILES
+        allow_lazy = not reorient and not is_labels
+        options.append(
+            plan_image(
+                source, allow_lazy=allow_lazy, allow_decimated=not is_labels
+            )
+        )
+    return options
+
+
+def plan_brainreg_dir(
+    path: os.PathLike,
+    memory_budget: Optional[int] = None,
+    orientation: Optional[str] = None,
+    atlas=None,
+) -> LoadPlan:
+    """Plan how to load the registration images of a brainreg directory.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to the brainreg directory.
+    memory_budget : int, optional
+        Memory budget in bytes, by default from get_memory_budget.
+    orientation : str, optional
+        Orientation the images will be loaded in, by default the atlas
+        orientation.
+    atlas : BrainGlobeAtlas, optional
+        The atlas registered to, by default loaded from the directory's
+        metadata.
+
+    Returns
+    -------
+    LoadPlan
+        How to load each registration image.
+    """
+    return make_plan(
+        get_brainreg_options(path, orientation, atlas),
+        get_memory_budget(memory_budget),
+    )
+
+
+def plan_brainmapper_dir(
+    path: os.PathLike,
+    memory_budget: Optional[int] = None,
+    load_raw_data: bool = False,
+) -> LoadPlan:
+    """Plan how to load a brainmapper output directory.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to the brainmapper output directory.
+    memory_budget : int, optional
+        Memory budget in bytes, by default from get_memory_budget.
+    load_raw_data : bool, optional
+        Whether the raw data will be loaded, by default False.
+
+    Returns
+    -------
+    LoadPlan
+        How to load each cell file, registration image and (optionally) raw
+        data channel.
+    """
+    from brainglobe_napari_io.brainmapper.brainmapper_reader_dir import (
+        get_cell_file_paths,
+        get_metadata,
+        get_raw_data_channels,
+    )
+    from brainglobe_napari_io.brainmapper.raw_planes import load_plane_stack
+
+    path = Path(os.path.abspath(path))
+    metadata = get_metadata(path)
+
+    options = []
+    if load_raw_data:
+        for channel in get_raw_data_channels(metadata):
+            stack = load_plane_stack(channel["planes_path"], path)
+            if stack is not None:
+                options.append(plan_plane_stack(stack))
+    registration_directory = path / "registration"
+    if registration_directory.exists():
+        options.extend(
+            get_brainreg_options(
+                registration_directory, metadata["orientation"]
+            )
+        )
+    for cells_path, _ in get_cell_file_paths(path, metadata):
+        if cells_path.exists():
+            options.append(plan_cells(cells_path))
+    return make_plan(options, get_memory_budget(memory_budget))
+
+
+def format_plan(plan: LoadPlan) -> str:
+    """Describe a plan, e.g. to show the user before loading."""
+    budget = "no limit" if plan.budget is None else _mb(plan.budget)
+    lines = [
+        f"Estimated memory: {_mb(plan.memory)} (budget {budget})"
+        + ("" if plan.fits else ", OVER BUDGET")
+        + (", * reduced to fit the budget" if plan.is_reduced else "")
+    ]
+    for layer in plan.layers:
+        strategy = layer.strategy + ("*" if layer.reduced else "")
+        if layer.strategy == "decimated":
+            strategy += f" (every {layer.decimation})"
+        elif layer.strategy == "lazy":
+            strategy += f" ({layer.cache_size} planes cached)"
+        lines.append(
+            f"  {Path(layer.path).name}: {layer.kind} "
+            f"{'x'.join(str(s) for s in layer.shape)}, {strategy}, "
+            f"{_mb(layer.memory)} (eagerly {_mb(layer.eager_memory)})"
+        )
+    return "\n".join(lines)
+
+
+def report_plan(plan: LoadPlan):
+    """Print a plan: in full if anything is loaded with less memory than
+    usual, otherwise just the estimated memory."""
+    if not plan.is_reduced and plan.fits:
+        print(format_plan(plan).splitlines()[0])
+    else:
+        print(format_plan(plan))
+
+
+def read_tiff_planned(
+    path: os.PathLike, layer_plan: Optional[LayerPlan] = None
+):
+    """Read a 3D TIFF file (or Zarr image) as planned.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to the TIFF file, or a Zarr image.
+    layer_plan : LayerPlan, optional
+        How to read the file, by default eagerly.
+
+    Returns
+    -------
+    array-like
+        The image: a numpy array, (copy-on-write) memory-mapped array,
+        LazyPageStack or (for lazily loaded Zarr images) Zarr array.
+        Decimated images are smaller by layer_plan.decimation along each
+        axis.
+    """
+    import tifffile
+
+    from brainglobe_napari_io import ome_zarr
+    from brainglobe_napari_io.profiling import add_bytes_read, span
+    from brainglobe_napari_io.utils import read_tiff
+
+    if layer_plan is None or layer_plan.strategy == "eager":
+        return read_tiff(path)
+    strategy = layer_plan.strategy
+    if ome_zarr.is_zarr(path):
+        if strategy == "decimated":
+            return ome_zarr.read_zarr_decimated(path, layer_plan.decimation)
+        return ome_zarr.open_zarr_image(path)
+    if strategy == "memmap":
+        return tifffile.memmap(path, mode="c")
+    if strategy == "lazy":
+        from brainglobe_napari_io.brainmapper.raw_planes import LazyPageStack
+
+        return LazyPageStack(path, cache_size=layer_plan.cache_size)
+
+    factor = layer_plan.decimation
+    with span("decode", file=Path(path).name, decimation=factor):
+        with tifffile.TiffFile(path) as tif:
+            if tif.series[0].dataoffset is not None:
+                # uncompressed, so only the strided voxels need reading
+                image = tifffile.memmap(path, mode="r")[::factor]
+            elif len(tif.pages) == layer_plan.shape[0] > 1:
+                image = tif.asarray(
+                    key=range(0, len(tif.pages), factor), series=0
+                ).reshape(-1, *tif.pages[0].shape)
+            else:
+                image = tif.asarray()[::factor]
+        image = np.ascontiguousarray(image[:, ::factor, ::factor])
+        add_bytes_read(image.nbytes * factor**3)
+    return image
+
+
+def _mb(n_bytes: int) -> str:
+    return f"{n_bytes / 1e6:.1f} MB"
@@ -0,0 +1,312 @@
+"""Optional timing and memory profiling of reading and writing.
+
+Readers and writers wrap each stage of their work (e.g. reading metadata,
+loading the atlas, decoding each file) in nested spans. When profiling is
+enabled, each span records its wall time, the bytes read from disk within
+it, and its peak memory use (relative to the memory in use when it
+started). Spans are logged to the "brainglobe_napari_io.profiling" logger,
+and optionally appended to a JSON-lines file.
+
+Profiling is off by default, when spans cost a single check of a global
+flag. It can be enabled by setting the BRAINGLOBE_NAPARI_IO_PROFILE
+environment variable (to anything but "" or "0"), with
+BRAINGLOBE_NAPARI_IO_PROFILE_OUTPUT optionally giving a JSON-lines file to
+write to, or with enable_profiling.
+"""
+
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Union
+
+PROFILE_ENV_VAR = "BRAINGLOBE_NAPARI_IO_PROFILE"
+PROFILE_OUTPUT_ENV_VAR = "BRAINGLOBE_NAPARI_IO_PROFILE_OUTPUT"
+
+logger = logging.getLogger(__name__)
+
+_enabled = False
+_trace_memory = False
+_started_tracemalloc = False
+_output_path: Optional[str] = None
+_output_lock = threading.Lock()
+_local = threading.local()
+# lists collecting span records, see profiling()
+_collectors: List[List[Dict[str, Any]]] = []
+
+
+class Span:
+    """A profiled stage of work, used as a context manager.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage, e.g. "atlas init".
+    **attributes
+        Extra information to record with the span (e.g. the file being
+        read). Values must be JSON serialisable.
+    """
+
+    def __init__(self, name: str, **attributes: Any):
+        self.name = name
+        self.attributes = attributes
+        self.bytes_read = 0
+        self.record: Optional[Dict[str, Any]] = None
+        self._parent: Optional["Span"] = None
+        self._start_time = 0.0
+        self._start_memory = 0
+        self._peak_memory = 0
+
+    def __enter__(self) -> "Span":
+        stack = _span_stack()
+        self._parent = stack[-1] if stack else None
+        stack.append(self)
+        if _trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if self._parent is not None:
+                self._parent._peak_memory = max(
+                    self._parent._peak_memory, peak
+                )
+            tracemalloc.reset_peak()
+            self._start_memory = self._peak_memory = current
+        self._start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self._start_time
+        peak_memory_delta = None
+        if _trace_memory and tracemalloc.is_tracing():
+            _, peak = tracemalloc.get_traced_memory()
+            self._peak_memory = max(self._peak_memory, peak)
+            peak_memory_delta = self._peak_memory - self._start_memory
+            tracemalloc.reset_peak()
+
+        stack = _span_stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        if self._parent is not None:
+            self._parent.bytes_read += self.bytes_read
+            self._parent._peak_memory = max(
+                self._parent._peak_memory, self._peak_memory
+            )
+
+        self.record = {
+            "name": self.name,
+            "path": "/".join(span.name for span in stack + [self]),
+            "depth": len(stack),
+            "thread": threading.current_thread().name,
+            "wall_time": duration,
+            "bytes_read": self.bytes_read,
+            "peak_memory_delta": peak_memory_delta,
+            "error": None if exc_type is None else exc_type.__name__,
+            **self.attributes,
+        }
+        _emit(self.record)
+        return False
+
+    def add_bytes_read(self, n_bytes: int):
+        """Record that some bytes were read from disk within this span."""
+        self.bytes_read += int(n_bytes)
+
+
+class _DisabledSpan:
+    """Stand-in for Span when profiling is disabled, that does nothing."""
+
+    def __enter__(self) -> "_DisabledSpan":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def add_bytes_read(self, n_bytes: int):
+        pass
+
+
+_DISABLED_SPAN = _DisabledSpan()
+
+
+def span(name: str, **attributes: Any):
+    """Profile a stage of work.
+
+    Use as a context manager, e.g.::
+
+        with span("atlas init", atlas=atlas_name):
+            atlas = get_atlas(atlas_name)
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage.
+    **attributes
+        Extra information to record with the span.
+
+    Returns
+    -------
+    Span
+        A context manager that records the span if profiling is enabled,
+        and does nothing otherwise.
+    """
+    if not _enabled:
+        return _DISABLED_SPAN
+    return Span(name, **attributes)
+
+
+def profile(name: str) -> Callable:
+    """Decorator to profile every call of a function as a span.
+
+    Parameters
+    ----------
+    name : str
+        Name of the span.
+    """
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with Span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def add_bytes_read(n_bytes: int):
+    """Record that some bytes were read from disk within the current span.
+
+    Parameters
+    ----------
+    n_bytes : int
+        Number of bytes read.
+    """
+    if _enabled:
+        stack = _span_stack()
+        if stack:
+            stack[-1].add_bytes_read(n_bytes)
+
+
+def add_file_read(path: os.PathLike):
+    """Record that a whole file was read within the current span.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to the file.
+    """
+    if _enabled:
+        try:
+            add_bytes_read(os.path.getsize(path))
+        except OSError:
+            pass
+
+
+def enable_profiling(
+    output_path: Optional[Union[str, os.PathLike]] = None,
+    trace_memory: bool = True,
+):
+    """Start profiling readers and writers.
+
+    Parameters
+    ----------
+    output_path : str or os.PathLike, optional
+        JSON-lines file to append a record of each span to. By default,
+        spans are only logged.
+    trace_memory : bool, optional
+        Whether to record the peak memory use of each span, with
+        tracemalloc. This slows down Python code that allocates a lot of
+        objects, by default True.
+    """
+    global _enabled, _trace_memory, _started_tracemalloc, _output_path
+    _output_path = None if output_path is None else os.fspath(output_path)
+    _trace_memory = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracemalloc = True
+    _enabled = True
+
+
+def disable_profiling():
+    """Stop profiling readers and writers."""
+    global _enabled, _trace_memory, _started_tracemalloc, _output_path
+    _enabled = False
+    _trace_memory = False
+    _output_path = None
+    if _started_tracemalloc:
+        tracemalloc.stop()
+        _started_tracemalloc = False
+
+
+def is_profiling() -> bool:
+    """Whether profiling is enabled."""
+    return _enabled
+
+
+@contextmanager
+def profiling(
+    output_path: Optional[Union[str, os.PathLike]] = None,
+    trace_memory: bool = True,
+):
+    """Context manager to profile readers and writers within a block.
+
+    The spans recorded within the block are also collected in the yielded
+    list.
+
+    Parameters
+    ----------
+    output_path : str or os.PathLike, optional
+        JSON-lines file to append a record of each span to.
+    trace_memory : bool, optional
+        Whether to record the peak memory use of each span, by default True.
+    """
+    records: List[Dict[str, Any]] = []
+    previous = (_enabled, _output_path, _trace_memory)
+    enable_profiling(output_path, trace_memory=trace_memory)
+    _collectors.append(records)
+    try:
+        yield records
+    finally:
+        _collectors.remove(records)
+        was_enabled, previous_output_path, previous_trace_memory = previous
+        if was_enabled:
+            enable_profiling(
+                previous_output_path, trace_memory=previous_trace_memory
+            )
+        else:
+            disable_profiling()
+
+
+def _span_stack() -> List[Span]:
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _emit(record: Dict[str, Any]):
+    for collector in _collectors:
+        collector.append(record)
+    if logger.isEnabledFor(logging.INFO):
+        memory = record["peak_memory_delta"]
+        logger.info(
+            "%s%s: %.3fs, %d bytes read%s",
+            "  " * record["depth"],
+            record["name"],
+            record["wall_time"],
+            record["bytes_read"],
+            "" if memory is None else f", peak memory +{memory} bytes",
+        )
+    if _output_path is not None:
+        line = json.dumps(record, default=str)
+        with _output_lock:
+            with open(_output_path, "a") as output:
+                output.write(line + "\n")
+
+
+if os.environ.get(PROFILE_ENV_VAR, "") not in ("", "0"):
+    enable_profiling(os.environ.get(PROFILE_OUTPUT_ENV_VAR) or None)
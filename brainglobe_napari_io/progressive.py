@@ -0,0 +1,363 @@
+"""Progressive loading: show a coarse preview, then the full data.
+
+When a large directory is opened in napari, nothing is shown until every
+image is decoded. Instead, the readers can first return a preview, with
+every image decimated (so only every nth plane, row and column is read) and
+every nth cell (read from the cell file's block index or binary copy,
+without parsing the file, if it has one), and then load the full data in a
+background thread, replacing the data of each preview layer when it has
+loaded. Each preview layer is tagged with the load it came from, so the
+full data replaces that layer even if napari has renamed it (e.g. "Cells
+[1]", when another directory with the same layer names is open).
+
+Preview points layers are marked as partial, so they can't be saved over
+their cell file before the full data has loaded.
+
+Previews are only used in napari, and only when a preview would be much
+smaller than the full data.
+"""
+
+from __future__ import annotations
+
+import sys
+import uuid
+from functools import partial
+from typing import TYPE_CHECKING, Callable, List, Optional, Sequence
+
+import numpy as np
+
+from brainglobe_napari_io.planning import LoadPlan
+from brainglobe_napari_io.readahead import read_ahead_plan
+from brainglobe_napari_io.utils import (
+    Layer,
+    as_layer_data_tuples,
+    as_layers,
+)
+
+if TYPE_CHECKING:
+    from napari.types import LayerDataTuple
+
+# enough to decode each image within about a second
+PREVIEW_VOXELS = 2**21
+PREVIEW_POINTS = 10_000
+# metadata key tagging preview layers with their load and layer name
+PREVIEW_KEY = "preview_of"
+# metadata key tagging the layers returned by a reader, until napari adds
+# them to the viewer (see track_when_added)
+READ_KEY = "read_by"
+
+
+def get_preview_step(
+    shape: Sequence[int], max_voxels: int = PREVIEW_VOXELS
+) -> int:
+    """Get the smallest power of 2 step along each axis of an image, for a
+    strided preview of it to have at most max_voxels voxels."""
+    step = 1
+    while np.prod([-(-size // step) for size in shape]) > max_voxels:
+        step *= 2
+    return step
+
+
+def get_preview_plan(
+    plan: LoadPlan,
+    max_voxels: int = PREVIEW_VOXELS,
+    max_points: int = PREVIEW_POINTS,
+) -> LoadPlan:
+    """Plan to load a preview, with each image decimated to at most
+    max_voxels voxels.
+
+    Parameters
+    ----------
+    plan : LoadPlan
+        The plan to load the full data.
+    max_voxels : int, optional
+        Maximum number of voxels in each preview image.
+    max_points : int, optional
+        Maximum number of cells in each preview points layer. Cell files
+        with more are decimated, so only every nth cell is read.
+
+    Returns
+    -------
+    LoadPlan
+        The preview plan, equal to plan if the preview would be the same as
+        the full data.
+    """
+    layers = []
+    for layer in plan.layers:
+        if layer.kind == "image":
+            step = get_preview_step(layer.shape, max_voxels)
+            if step > layer.decimation:
+                layer = layer._replace(
+                    strategy="decimated",
+                    memory=layer.eager_memory // step**3,
+                    decimation=step,
+                    reduced=True,
+                )
+        elif layer.kind == "cells" and layer.shape[0] > max_points:
+            step = -(-layer.shape[0] // max_points)
+            layer = layer._replace(
+                strategy="decimated",
+                memory=layer.memory // step,
+                decimation=step,
+                reduced=True,
+            )
+        layers.append(layer)
+    return plan._replace(layers=layers)
+
+
+def subsample_points(
+    layers: List[Layer], max_points: int = PREVIEW_POINTS, seed: int = 0
+) -> List[Layer]:
+    """Randomly subsample each points layer with more than max_points
+    points (and its features), keeping the points in order. Subsampled
+    layers are marked as partial (see cellfinder.utils.PARTIAL_KEY)."""
+    from brainglobe_napari_io.cellfinder.utils import PARTIAL_KEY
+
+    rng = np.random.default_rng(seed)
+    subsampled = []
+    for layer in layers:
+        if layer.layer_type == "points" and len(layer.data) > max_points:
+            keep = np.sort(
+                rng.choice(len(layer.data), max_points, replace=False)
+            )
+            attributes = dict(layer.attributes)
+            if "features" in attributes:
+                attributes["features"] = {
+                    key: np.asarray(values)[keep]
+                    for key, values in attributes["features"].items()
+                }
+            attributes["metadata"] = {
+                **attributes.get("metadata", {}),
+                PARTIAL_KEY: True,
+            }
+            layer = Layer(layer.data[keep], attributes, layer.layer_type)
+        subsampled.append(layer)
+    return subsampled
+
+
+def get_current_viewer():
+    """Get the current napari viewer, or None if there isn't one (without
+    importing napari if it hasn't been)."""
+    if "napari" not in sys.modules:
+        return None
+    from napari import current_viewer
+
+    return current_viewer()
+
+
+def get_preview_tag(load_id: str, name: Optional[str]) -> str:
+    """Get the tag of a preview layer (see PREVIEW_KEY)."""
+    return f"{load_id}/{name}"
+
+
+def tag_preview_layers(layers: List[Layer], load_id: str) -> List[Layer]:
+    """Tag preview layers with their load and name, so the full layers
+    can find them in the viewer (see update_layers)."""
+    return [
+        Layer(
+            layer.data,
+            {
+                **layer.attributes,
+                "metadata": {
+                    **layer.attributes.get("metadata", {}),
+                    PREVIEW_KEY: get_preview_tag(load_id, layer.name),
+                },
+            },
+            layer.layer_type,
+        )
+        for layer in layers
+    ]
+
+
+def update_layers(viewer, layers: List[Layer], load_id: str):
+    """Replace the data (and scale, features and metadata) of the viewer's
+    preview layers of a load with those of the full layers with the same
+    names. Preview layers the user has since removed are skipped."""
+    from brainglobe_napari_io.cellfinder.region_counts import REGION_COUNTS_KEY
+    from brainglobe_napari_io.cellfinder.utils import (
+        CELLS_PATH_KEY,
+        PARTIAL_KEY,
+    )
+
+    previews = {
+        viewer_layer.metadata[PREVIEW_KEY]: viewer_layer
+        for viewer_layer in viewer.layers
+        if PREVIEW_KEY in viewer_layer.metadata
+    }
+    for layer in layers:
+        viewer_layer = previews.get(get_preview_tag(load_id, layer.name))
+        if viewer_layer is None:
+            continue
+        viewer_layer.metadata.pop(PREVIEW_KEY)
+        # preview cells aren't counted, so the counts of the full data
+        # start being kept up to date here
+        counted = REGION_COUNTS_KEY in viewer_layer.metadata
+        # before the data, so handlers of the data event see the metadata
+        # of the full data (e.g. its region counts)
+        viewer_layer.metadata.pop(PARTIAL_KEY, None)
+        viewer_layer.metadata.pop(CELLS_PATH_KEY, None)
+        viewer_layer.metadata.update(layer.attributes.get("metadata", {}))
+        viewer_layer.data = layer.data
+        viewer_layer.scale = layer.scale
+        if layer.layer_type == "points" and "features" in layer.attributes:
+            viewer_layer.features = layer.attributes["features"]
+        region_counts = viewer_layer.metadata.get(REGION_COUNTS_KEY)
+        if not counted and region_counts is not None:
+            region_counts.connect(viewer_layer)
+        viewer_layer.refresh()
+
+
+def load_progressively(
+    load_preview: Callable[[], List[Layer]],
+    load_full: Callable[[], List[Layer]],
+    viewer=None,
+) -> List[LayerDataTuple]:
+    """Load a preview, and load the full data in a background thread.
+
+    Parameters
+    ----------
+    load_preview : Callable[[], List[Layer]]
+        Loads the preview layers.
+    load_full : Callable[[], List[Layer]]
+        Loads the full layers, with the same names as the preview layers.
+    viewer : napari.Viewer, optional
+        The viewer the layers will be added to, by default the current
+        viewer.
+
+    Returns
+    -------
+    List[LayerDataTuple]
+        The preview layers, to be returned by a napari reader. Once the
+        full layers are loaded, their data replaces the preview data in the
+        viewer. If they can't be loaded, an error is shown, and the preview
+        layers are left as they are (preview points layers stay partial, so
+        they can't be saved over their cell file).
+    """
+    from napari.qt.threading import create_worker
+
+    viewer = viewer or get_current_viewer()
+    load_id = uuid.uuid4().hex
+    preview = tag_preview_layers(load_preview(), load_id)
+
+    def on_loaded(layers: List[Layer]):
+        update_layers(viewer, layers, load_id)
+        print("Loaded full resolution data")
+
+    def on_error(error: Exception):
+        from napari.utils.notifications import show_error
+
+        show_error(
+            f"Couldn't load the full resolution data, only a preview is "
+            f"shown: {error}"
+        )
+
+    # connected here, so errors aren't re-raised in the event loop instead
+    create_worker(
+        load_full,
+        _connect={"returned": on_loaded, "errored": on_error},
+    )
+    print("Loaded preview, loading full resolution data in the background")
+    return as_layer_data_tuples(preview)
+
+
+def read_progressively(
+    load: Callable[..., List[Layer]], plan: Callable[[], LoadPlan]
+) -> List[LayerDataTuple]:
+    """Read data for a napari reader, with a preview first if it would be
+    much smaller than the full data and there is a viewer to show it in.
+
+    Parameters
+    ----------
+    load : Callable[..., List[Layer]]
+        Loads the layers. Called with a load_plan keyword argument: the
+        preview plan (whose points are then subsampled, if it loaded more
+        than PREVIEW_POINTS) or the full plan, or
+        without, if there is no preview, to plan and load the full data.
+    plan : Callable[[], LoadPlan]
+        Plans to load the full data.
+
+    Returns
+    -------
+    List[LayerDataTuple]
+        The preview layers (see load_progressively), or the full layers.
+    """
+    viewer = get_current_viewer()
+    if viewer is not None:
+        full_plan = plan()
+        preview_plan = get_preview_plan(
+            full_plan, PREVIEW_VOXELS, PREVIEW_POINTS
+        )
+        if preview_plan != full_plan:
+            # the files of the full data are read ahead (if on) while the
+            # preview loads
+            read_ahead_plan(full_plan)
+            return load_progressively(
+                lambda: subsample_points(
+                    load(load_plan=preview_plan), PREVIEW_POINTS
+                ),
+                partial(load, load_plan=full_plan),
+                viewer,
+            )
+    return as_layer_data_tuples(load())
+
+
+def track_when_added(
+    layer_data: List[LayerDataTuple],
+    trackers: Sequence[Callable],
+    viewer=None,
+) -> List[LayerDataTuple]:
+    """Track the layers returned by a napari reader (e.g. with
+    track_loaded_labels_edits), once they are added to the viewer.
+
+    Only the layers read are tracked, and only if they are added, so
+    reading has no other effect on the viewer.
+
+    Parameters
+    ----------
+    layer_data : List[LayerDataTuple]
+        The layers the reader returns.
+    trackers : Sequence[Callable]
+        Called with each napari layer, once it is added.
+    viewer : napari.Viewer, optional
+        The viewer the layers will be added to, by default the current
+        viewer.
+
+    Returns
+    -------
+    List[LayerDataTuple]
+        The layers, tagged (see READ_KEY) so they are found once added.
+    """
+    viewer = viewer or get_current_viewer()
+    if viewer is None or not layer_data:
+        return layer_data
+    read_id = uuid.uuid4().hex
+    layers = as_layers(layer_data)
+    n_pending = len(layers)
+
+    def on_inserted(event):
+        nonlocal n_pending
+        layer = event.value
+        if layer.metadata.get(READ_KEY) != read_id:
+            return
+        layer.metadata.pop(READ_KEY)
+        for track in trackers:
+            track(layer)
+        n_pending -= 1
+        if n_pending == 0:
+            viewer.layers.events.inserted.disconnect(on_inserted)
+
+    viewer.layers.events.inserted.connect(on_inserted)
+    return as_layer_data_tuples(
+        Layer(
+            layer.data,
+            {
+                **layer.attributes,
+                "metadata": {
+                    **layer.attributes.get("metadata", {}),
+                    READ_KEY: read_id,
+                },
+            },
+            layer.layer_type,
+        )
+        for layer in layers
+    )
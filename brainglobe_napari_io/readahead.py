@@ -0,0 +1,272 @@
+"""Read files ahead of loading them, for high-latency storage.
+
+On network filesystems (e.g. NFS), every open and read waits on the server,
+so reading the files of a directory one after another, in the small reads
+decoders make, is slow. Once a directory has been classified and planned
+(see brainglobe_napari_io.planning), the files that will be read in full
+are read ahead in the background: concurrently, each from start to end in
+large reads. The data isn't kept, but is then in the operating system's
+file cache, so the reads of the decoders (e.g. tifffile) don't wait on the
+server.
+
+Reading ahead is off by default, as it only helps on high-latency storage.
+Set the BRAINGLOBE_NAPARI_IO_READAHEAD environment variable to the most to
+read ahead per directory (e.g. "4G"), which should be less than the memory
+available to the file cache.
+"""
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+from brainglobe_napari_io.planning import LoadPlan, parse_memory_size
+
+READAHEAD_ENV_VAR = "BRAINGLOBE_NAPARI_IO_READAHEAD"
+N_READAHEAD_THREADS = 8
+READ_SIZE = 8 * 2**20
+
+# files being read ahead, so the same file isn't read ahead twice at once
+# (e.g. when a preview and the full data are planned)
+_in_flight: Dict[str, "ReadAhead"] = {}
+_in_flight_lock = threading.Lock()
+
+
+def get_readahead_budget(budget: Optional[int] = None) -> Optional[int]:
+    """Get the most bytes to read ahead.
+
+    Parameters
+    ----------
+    budget : int, optional
+        The budget in bytes. By default, the budget set by the
+        BRAINGLOBE_NAPARI_IO_READAHEAD environment variable.
+
+    Returns
+    -------
+    int or None
+        The budget in bytes, or None if reading ahead is off (the
+        environment variable isn't set, or is "0").
+    """
+    if budget is None:
+        env_budget = os.environ.get(READAHEAD_ENV_VAR, "")
+        if not env_budget:
+            return None
+        budget = parse_memory_size(env_budget)
+    return int(budget) if budget > 0 else None
+
+
+def get_file_paths(path: Union[str, os.PathLike]) -> List[Path]:
+    """Get the files to read to read a path in full: the file, or every file
+    of a directory (e.g. a Zarr image)."""
+    root = Path(path)
+    if not root.is_dir():
+        return [root]
+    paths: List[Path] = []
+    for directory, _, filenames in os.walk(root):
+        paths.extend(Path(directory) / filename for filename in filenames)
+    return sorted(paths)
+
+
+def get_readahead_paths(plan: LoadPlan) -> List[Path]:
+    """Get the files a plan reads in full, in the order they are planned.
+
+    These are the images loaded eagerly (memory-mapped, lazily loaded and
+    decimated images only have parts read, and are left out), and the cell
+    files, which are parsed in full (or their binary copy, if up to date).
+    """
+    from brainglobe_napari_io.cellfinder.cell_files import (
+        get_binary_cells_path,
+    )
+    from brainglobe_napari_io.utils import is_up_to_date
+
+    paths: List[Path] = []
+    for layer_plan in plan.layers:
+        if layer_plan.kind == "cells":
+            cells_path = Path(layer_plan.path)
+            binary_path = get_binary_cells_path(cells_path)
+            if is_up_to_date(binary_path, [cells_path]):
+                paths.append(binary_path)
+            else:
+                paths.append(cells_path)
+        elif layer_plan.kind == "image" and layer_plan.strategy == "eager":
+            paths.append(Path(layer_plan.path))
+    return paths
+
+
+class ReadAhead:
+    """Read files in the background, concurrently, each in large sequential
+    reads, until a budget of bytes has been read.
+
+    Files are started in order, so if the budget runs out, the last files
+    are read in part (from the start, where their headers are) or not at
+    all. Files that can't be read are skipped.
+
+    Parameters
+    ----------
+    paths : Sequence[str or os.PathLike]
+        The files to read.
+    budget : int, optional
+        Most bytes to read, by default no limit.
+    n_threads : int, optional
+        Number of files to read at once, by default 8.
+    read_size : int, optional
+        Bytes per read, by default 8 MiB.
+    opener : Callable, optional
+        Opens a file for reading, called as ``opener(path, "rb")``, by
+        default open.
+    """
+
+    def __init__(
+        self,
+        paths: Sequence[Union[str, os.PathLike]],
+        budget: Optional[int] = None,
+        n_threads: int = N_READAHEAD_THREADS,
+        read_size: int = READ_SIZE,
+        opener: Callable = open,
+    ):
+        self.paths = [Path(path) for path in paths]
+        self.budget = budget
+        self.read_size = read_size
+        self.opener = opener
+        self.bytes_read = 0
+        self._remaining = budget
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._futures: List[Future] = []
+        if not self.paths:
+            return
+        executor = ThreadPoolExecutor(
+            max_workers=min(n_threads, len(self.paths)),
+            thread_name_prefix="readahead",
+        )
+        self._futures = [
+            executor.submit(self._read, path) for path in self.paths
+        ]
+        # the threads exit once every file is read
+        executor.shutdown(wait=False)
+
+    def _reserve(self, n_bytes: int) -> int:
+        """Take up to n_bytes from the remaining budget."""
+        with self._lock:
+            if self._remaining is None:
+                return n_bytes
+            n_bytes = min(n_bytes, self._remaining)
+            self._remaining -= n_bytes
+            return n_bytes
+
+    def _read(self, path: Path):
+        try:
+            if self._cancelled.is_set():
+                return
+            to_read = self._reserve(os.path.getsize(path))
+            if to_read <= 0:
+                return
+            buffer = bytearray(min(self.read_size, to_read))
+            with self.opener(path, "rb") as file:
+                while to_read > 0 and not self._cancelled.is_set():
+                    view = memoryview(buffer)[: min(len(buffer), to_read)]
+                    n_read = file.readinto(view)
+                    if not n_read:
+                        break
+                    to_read -= n_read
+                    with self._lock:
+                        self.bytes_read += n_read
+        except OSError:
+            pass
+        finally:
+            with _in_flight_lock:
+                if _in_flight.get(str(path)) is self:
+                    del _in_flight[str(path)]
+
+    @property
+    def done(self) -> bool:
+        """Whether every file has been read (or skipped)."""
+        return all(future.done() for future in self._futures)
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        """Wait for every file to be read.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Most seconds to wait, by default no limit.
+
+        Returns
+        -------
+        int
+            Bytes read.
+        """
+        wait(self._futures, timeout=timeout)
+        return self.bytes_read
+
+    def cancel(self):
+        """Stop reading, after the reads in progress."""
+        self._cancelled.set()
+        for future in self._futures:
+            future.cancel()
+        with _in_flight_lock:
+            for path in self.paths:
+                if _in_flight.get(str(path)) is self:
+                    del _in_flight[str(path)]
+
+
+def read_ahead(
+    paths: Sequence[Union[str, os.PathLike]],
+    budget: Optional[int] = None,
+    opener: Callable = open,
+) -> Optional[ReadAhead]:
+    """Start reading files ahead of loading them, if reading ahead is on.
+
+    Files already being read ahead are left out.
+
+    Parameters
+    ----------
+    paths : Sequence[str or os.PathLike]
+        The files (or directories, e.g. Zarr images, whose files are all
+        read), in the order they will be loaded.
+    budget : int, optional
+        Most bytes to read, by default from get_readahead_budget.
+    opener : Callable, optional
+        Opens a file for reading (see ReadAhead), by default open.
+
+    Returns
+    -------
+    ReadAhead or None
+        The files being read, or None if reading ahead is off or there is
+        nothing to read.
+    """
+    budget = get_readahead_budget(budget)
+    if budget is None:
+        return None
+    with _in_flight_lock:
+        file_paths = list(
+            dict.fromkeys(
+                file_path
+                for path in paths
+                for file_path in map(
+                    os.path.abspath, get_file_paths(os.path.abspath(path))
+                )
+                if file_path not in _in_flight
+            )
+        )
+        if not file_paths:
+            return None
+        readahead = ReadAhead(file_paths, budget, opener=opener)
+        for file_path in readahead.paths:
+            _in_flight.setdefault(str(file_path), readahead)
+    print(
+        f"Reading ahead up to {budget / 1e6:.1f} MB of {len(file_paths)} "
+        "files"
+    )
+    return readahead
+
+
+def read_ahead_plan(
+    plan: LoadPlan, budget: Optional[int] = None, opener: Callable = open
+) -> Optional[ReadAhead]:
+    """Start reading the files a plan reads in full (see
+    get_readahead_paths) ahead of loading them, if reading ahead is on."""
+    if get_readahead_budget(budget) is None:
+        return None
+    return read_ahead(get_readahead_paths(plan), budget, opener)
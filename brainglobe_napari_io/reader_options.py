@@ -0,0 +1,135 @@
+"""Options of the napari readers, set with environment variables.
+
+napari calls the readers with only the path, so their options are read from
+environment variables (as are the atlas meshes, see
+brainglobe_napari_io.meshes):
+
+- BRAINGLOBE_NAPARI_IO_STRUCTURE: the acronym of an atlas structure (e.g.
+  "HIP"), to load only the part of the data in it,
+- BRAINGLOBE_NAPARI_IO_LOAD_DEFORMATION_FIELDS: "1" to also load the
+  deformation fields of brainreg directories,
+- BRAINGLOBE_NAPARI_IO_LOAD_RAW_DATA: "1" to also load the raw data of
+  brainmapper directories.
+
+They can be set before starting napari, or from napari with File -> IO
+Utilities -> Reader Options (see options_dialog), which sets them for the
+rest of the session. Options passed to the readers directly (e.g. by
+scripts) take precedence.
+"""
+
+import os
+from typing import Optional
+
+STRUCTURE_ENV_VAR = "BRAINGLOBE_NAPARI_IO_STRUCTURE"
+LOAD_DEFORMATION_FIELDS_ENV_VAR = (
+    "BRAINGLOBE_NAPARI_IO_LOAD_DEFORMATION_FIELDS"
+)
+LOAD_RAW_DATA_ENV_VAR = "BRAINGLOBE_NAPARI_IO_LOAD_RAW_DATA"
+
+TRUE_VALUES = ("1", "true", "yes", "on")
+FALSE_VALUES = ("", "0", "false", "no", "off")
+
+
+def get_flag(env_var: str, value: Optional[bool] = None) -> bool:
+    """Get an on/off option, by default from an environment variable (off
+    if it isn't set).
+
+    Raises
+    ------
+    ValueError
+        If the environment variable isn't "1"/"0" (or "true"/"false",
+        "yes"/"no", "on"/"off").
+    """
+    if value is not None:
+        return bool(value)
+    env_value = os.environ.get(env_var, "").strip().lower()
+    if env_value in TRUE_VALUES:
+        return True
+    if env_value in FALSE_VALUES:
+        return False
+    raise ValueError(f"Invalid {env_var}: {env_value!r}, use 1 or 0")
+
+
+def get_structure(structure: Optional[str] = None) -> Optional[str]:
+    """Get the acronym of the structure to load, by default from the
+    BRAINGLOBE_NAPARI_IO_STRUCTURE environment variable (or None, to load
+    everything, if it isn't set)."""
+    if structure is None:
+        structure = os.environ.get(STRUCTURE_ENV_VAR, "")
+    return structure.strip() or None
+
+
+def get_load_deformation_fields(value: Optional[bool] = None) -> bool:
+    """Whether to load the deformation fields of brainreg directories, by
+    default from BRAINGLOBE_NAPARI_IO_LOAD_DEFORMATION_FIELDS."""
+    return get_flag(LOAD_DEFORMATION_FIELDS_ENV_VAR, value)
+
+
+def get_load_raw_data(value: Optional[bool] = None) -> bool:
+    """Whether to load the raw data of brainmapper directories, by default
+    from BRAINGLOBE_NAPARI_IO_LOAD_RAW_DATA."""
+    return get_flag(LOAD_RAW_DATA_ENV_VAR, value)
+
+
+def set_reader_options(
+    structure: Optional[str] = None,
+    load_deformation_fields: bool = False,
+    load_raw_data: bool = False,
+    atlas_meshes: Optional[str] = None,
+):
+    """Set the options of the readers (and the atlas meshes to add, see
+    brainglobe_napari_io.meshes) for the rest of the session, by setting
+    their environment variables."""
+    from brainglobe_napari_io.meshes import ATLAS_MESHES_ENV_VAR
+
+    os.environ[STRUCTURE_ENV_VAR] = (structure or "").strip()
+    os.environ[LOAD_DEFORMATION_FIELDS_ENV_VAR] = (
+        "1" if load_deformation_fields else "0"
+    )
+    os.environ[LOAD_RAW_DATA_ENV_VAR] = "1" if load_raw_data else "0"
+    os.environ[ATLAS_MESHES_ENV_VAR] = (atlas_meshes or "").strip()
+
+
+def options_dialog():
+    """Open a dialog to set the options of the readers, used when
+    directories are next opened in napari.
+
+    This function is called via the IO Utilities submenu in Napari.
+    """
+    from qtpy.QtWidgets import (
+        QCheckBox,
+        QDialog,
+        QDialogButtonBox,
+        QFormLayout,
+        QLineEdit,
+    )
+
+    from brainglobe_napari_io.meshes import get_mesh_structures
+
+    dialog = QDialog()
+    dialog.setWindowTitle("BrainGlobe reader options")
+    layout = QFormLayout(dialog)
+    structure = QLineEdit(get_structure() or "")
+    structure.setPlaceholderText("e.g. HIP, empty to load everything")
+    layout.addRow("Only load structure", structure)
+    atlas_meshes = QLineEdit(",".join(get_mesh_structures()))
+    atlas_meshes.setPlaceholderText("e.g. root,HIP")
+    layout.addRow("Atlas meshes (atlas space)", atlas_meshes)
+    load_deformation_fields = QCheckBox()
+    load_deformation_fields.setChecked(get_load_deformation_fields())
+    layout.addRow("Load deformation fields", load_deformation_fields)
+    load_raw_data = QCheckBox()
+    load_raw_data.setChecked(get_load_raw_data())
+    layout.addRow("Load brainmapper raw data", load_raw_data)
+    buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+    buttons.accepted.connect(dialog.accept)
+    buttons.rejected.connect(dialog.reject)
+    layout.addRow(buttons)
+
+    if dialog.exec_():
+        set_reader_options(
+            structure.text(),
+            load_deformation_fields.isChecked(),
+            load_raw_data.isChecked(),
+            atlas_meshes.text(),
+        )
@@ -0,0 +1,376 @@
+from __future__ import annotations
+
+import hashlib
+import os
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    cast,
+)
+
+import numpy as np
+
+from brainglobe_napari_io.profiling import profile
+
+if TYPE_CHECKING:
+    from napari.types import LayerDataTuple
+
+BOUNDING_BOX_SUFFIX = "_bounding_boxes.npz"
+REGION_CACHE_DIR_ENV_VAR = "BRAINGLOBE_NAPARI_IO_REGION_CACHE_DIR"
+
+# bounding boxes of atlas annotations, keyed by atlas name
+_atlas_bounding_boxes: Dict[str, Dict[str, np.ndarray]] = {}
+
+
+def compute_bounding_boxes(volume) -> Dict[str, np.ndarray]:
+    """Compute the bounding box of every label in an annotation volume.
+
+    The volume is processed one plane at a time, so it can be a memory map
+    (or any other lazily loaded 3D array) without being read into memory
+    all at once.
+
+    Parameters
+    ----------
+    volume : array-like
+        3D label image, e.g. a registered atlas annotation.
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        - "labels": the N unique labels, sorted.
+        - "starts", "stops": Nx3 arrays of the (inclusive) start and
+          (exclusive) stop of each label's bounding box, along each axis.
+        - "shape": the shape of the volume.
+    """
+    rows: List[np.ndarray] = []
+    for z in range(volume.shape[0]):
+        plane = np.asarray(volume[z])
+        labels, inverse = np.unique(plane, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        order = np.argsort(inverse, kind="stable")
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(inverse))[:-1]))
+        y, x = np.unravel_index(order, plane.shape)
+        plane_rows = np.empty((len(labels), 7), dtype=np.int64)
+        plane_rows[:, 0] = labels
+        plane_rows[:, 1] = z
+        plane_rows[:, 2] = np.minimum.reduceat(y, offsets)
+        plane_rows[:, 3] = np.minimum.reduceat(x, offsets)
+        plane_rows[:, 4] = z + 1
+        plane_rows[:, 5] = np.maximum.reduceat(y, offsets) + 1
+        plane_rows[:, 6] = np.maximum.reduceat(x, offsets) + 1
+        rows.append(plane_rows)
+
+    if not rows:
+        return {
+            "labels": np.empty(0, dtype=np.int64),
+            "starts": np.empty((0, 3), dtype=np.int64),
+            "stops": np.empty((0, 3), dtype=np.int64),
+            "shape": np.asarray(volume.shape, dtype=np.int64),
+        }
+
+    # merge the boxes of each label across planes
+    all_rows = np.concatenate(rows)
+    all_rows = all_rows[np.argsort(all_rows[:, 0], kind="stable")]
+    labels, offsets = np.unique(all_rows[:, 0], return_index=True)
+    return {
+        "labels": labels,
+        "starts": np.minimum.reduceat(all_rows[:, 1:4], offsets, axis=0),
+        "stops": np.maximum.reduceat(all_rows[:, 4:7], offsets, axis=0),
+        "shape": np.asarray(volume.shape, dtype=np.int64),
+    }
+
+
+def get_bounding_box_path(annotation_path: Union[str, os.PathLike]) -> Path:
+    """Path of the bounding box index stored next to an annotation image
+    (written by the convert command, see write_bounding_boxes)."""
+    annotation_path = Path(annotation_path)
+    return annotation_path.with_name(
+        annotation_path.name.split(".")[0] + BOUNDING_BOX_SUFFIX
+    )
+
+
+def get_region_cache_dir() -> Path:
+    """Get the directory the bounding box indexes computed when reading
+    are cached in, from the BRAINGLOBE_NAPARI_IO_REGION_CACHE_DIR
+    environment variable (by default ~/.brainglobe/napari-io/regions)."""
+    directory = os.environ.get(REGION_CACHE_DIR_ENV_VAR)
+    if directory is None:
+        return Path.home() / ".brainglobe" / "napari-io" / "regions"
+    return Path(directory)
+
+
+def get_bounding_box_cache_path(annotation_path: os.PathLike) -> Path:
+    """Path of the bounding box index of an annotation image in the cache
+    directory (see get_region_cache_dir), unique to the image."""
+    annotation_path = Path(os.path.abspath(annotation_path))
+    key = hashlib.sha1(str(annotation_path).encode()).hexdigest()[:16]
+    return get_region_cache_dir() / (
+        f"{annotation_path.name.split('.')[0]}_{key}{BOUNDING_BOX_SUFFIX}"
+    )
+
+
+def save_bounding_boxes(
+    boxes: Dict[str, np.ndarray], index_path: Union[str, os.PathLike]
+) -> None:
+    """Save a bounding box index, as returned by compute_bounding_boxes."""
+    from brainglobe_napari_io.utils import write_atomically
+
+    with write_atomically(index_path) as temporary_path:
+        # an open file, so np.savez doesn't add a suffix
+        with open(temporary_path, "wb") as index_file:
+            np.savez(index_file, **cast(Dict[str, Any], boxes))
+
+
+def read_annotation(annotation_path: Union[str, os.PathLike]):
+    """Read an annotation TIFF (or its Zarr variant) to index its regions."""
+    from brainglobe_napari_io import ome_zarr
+
+    source = ome_zarr.find_image(Path(annotation_path))
+    print(f"Indexing the regions of {source}")
+    if ome_zarr.is_zarr(source):
+        # read at once, rather than decompressing each chunk for every plane
+        return ome_zarr.read_zarr_image(source)
+    return ome_zarr.read_image(source)
+
+
+def write_bounding_boxes(
+    annotation_path: Union[str, os.PathLike],
+    index_path: Optional[Union[str, os.PathLike]] = None,
+) -> Path:
+    """Compute the bounding box index of an annotation TIFF, and save it
+    next to the annotation, so reading regions of it doesn't need the
+    cache (see load_bounding_boxes).
+
+    Parameters
+    ----------
+    annotation_path : str or os.PathLike
+        Path to the annotation TIFF.
+    index_path : str or os.PathLike, optional
+        Path to save the index to, by default next to the annotation (see
+        get_bounding_box_path).
+
+    Returns
+    -------
+    Path
+        The index.
+    """
+    if index_path is None:
+        index_path = get_bounding_box_path(annotation_path)
+    save_bounding_boxes(
+        compute_bounding_boxes(read_annotation(annotation_path)), index_path
+    )
+    return Path(index_path)
+
+
+@profile("load bounding boxes")
+def load_bounding_boxes(annotation_path: os.PathLike) -> Dict[str, np.ndarray]:
+    """Load the bounding box index of an annotation TIFF, e.g. the
+    registered_atlas.tiff in a brainreg directory (or its Zarr variant, see
+    brainglobe_napari_io.ome_zarr).
+
+    The index saved next to the annotation by the convert command (see
+    write_bounding_boxes) is used if there is one. Otherwise, the index is
+    computed on first use, and saved in the cache directory (see
+    get_region_cache_dir), so it only needs computing once, and nothing is
+    written to the directory being read. It is recomputed if the
+    annotation has changed since.
+
+    Parameters
+    ----------
+    annotation_path : os.PathLike
+        Path to the annotation TIFF.
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        The bounding box index, as returned by compute_bounding_boxes.
+    """
+    from brainglobe_napari_io import ome_zarr
+    from brainglobe_napari_io.utils import is_up_to_date
+
+    source = ome_zarr.find_image(annotation_path)
+    cache_path = get_bounding_box_cache_path(annotation_path)
+    for index_path in (get_bounding_box_path(annotation_path), cache_path):
+        if index_path.exists() and is_up_to_date(index_path, [source]):
+            try:
+                with np.load(index_path) as index:
+                    return {key: index[key] for key in index.files}
+            except (OSError, ValueError, KeyError):
+                print(f"Could not read {index_path}, recomputing")
+
+    boxes = compute_bounding_boxes(read_annotation(annotation_path))
+    try:
+        save_bounding_boxes(boxes, cache_path)
+    except OSError:
+        # the index will be recomputed next time
+        print(f"Could not save region index to {cache_path}")
+    return boxes
+
+
+def get_atlas_bounding_boxes(atlas) -> Dict[str, np.ndarray]:
+    """Get the bounding box index of an atlas annotation.
+
+    The index is computed once per atlas, and kept in memory.
+
+    Parameters
+    ----------
+    atlas : BrainGlobeAtlas
+        The atlas.
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        The bounding box index, as returned by compute_bounding_boxes.
+    """
+    if atlas.atlas_name not in _atlas_bounding_boxes:
+        _atlas_bounding_boxes[atlas.atlas_name] = compute_bounding_boxes(
+            atlas.annotation
+        )
+    return _atlas_bounding_boxes[atlas.atlas_name]
+
+
+def get_structure_ids(atlas, structure: str) -> List[int]:
+    """Get the annotation values of a structure and all its descendants.
+
+    Parameters
+    ----------
+    atlas : BrainGlobeAtlas
+        The atlas.
+    structure : str
+        Acronym of the structure, e.g. "HIP".
+
+    Returns
+    -------
+    List[int]
+        The ids of the structure and of every structure within it.
+    """
+    try:
+        structure_id = atlas.structures[structure]["id"]
+    except KeyError:
+        raise ValueError(
+            f"{structure} is not a structure in {atlas.atlas_name}"
+        )
+    descendants = atlas.get_structure_descendants(structure)
+    return [structure_id] + [
+        atlas.structures[acronym]["id"] for acronym in descendants
+    ]
+
+
+def get_structure_region(
+    boxes: Dict[str, np.ndarray], atlas, structure: str
+) -> Dict:
+    """Get the bounding box of a structure (including all its descendants).
+
+    Parameters
+    ----------
+    boxes : Dict[str, np.ndarray]
+        Bounding box index of the annotation, as returned by
+        compute_bounding_boxes.
+    atlas : BrainGlobeAtlas
+        The atlas the annotation belongs to.
+    structure : str
+        Acronym of the structure, e.g. "HIP".
+
+    Returns
+    -------
+    Dict
+        The region, with the structure acronym ("structure"), the start
+        (inclusive) and stop (exclusive) of its bounding box ("start",
+        "stop") and the shape of the whole annotation ("shape").
+
+    Raises
+    ------
+    ValueError
+        If the structure isn't in the atlas, or isn't in the annotation.
+    """
+    ids = get_structure_ids(atlas, structure)
+    present = np.isin(boxes["labels"], ids)
+    if not present.any():
+        raise ValueError(f"{structure} is not in the annotation")
+    return {
+        "structure": structure,
+        "start": tuple(int(s) for s in boxes["starts"][present].min(axis=0)),
+        "stop": tuple(int(s) for s in boxes["stops"][present].max(axis=0)),
+        "shape": tuple(int(s) for s in boxes["shape"]),
+    }
+
+
+def crop_points_layers(
+    layers: List[LayerDataTuple],
+    start: Sequence[float],
+    stop: Sequence[float],
+    metadata_keys: Tuple[str, ...] = (),
+) -> List[LayerDataTuple]:
+    """Remove the points outside a box from points layers.
+
+    Features of the removed points (and optionally per-point arrays in the
+    layer metadata) are removed too. Other layers are returned unchanged.
+
+    Parameters
+    ----------
+    layers : List[LayerDataTuple]
+        Layers to crop.
+    start, stop : Sequence[float]
+        The (inclusive) start and (exclusive) stop of the box, in the
+        coordinates of the points.
+    metadata_keys : Tuple[str, ...], optional
+        Keys of per-point arrays in the layer metadata to crop too.
+
+    Returns
+    -------
+    List[LayerDataTuple]
+        The cropped layers.
+    """
+    new_layers = []
+    for data, attributes, layer_type in layers:
+        if layer_type != "points":
+            new_layers.append((data, attributes, layer_type))
+            continue
+
+        points = np.asarray(data).reshape(-1, 3)
+        inside = np.all((points >= start) & (points < stop), axis=1)
+        attributes = dict(attributes)
+        if attributes.get("features"):
+            attributes["features"] = {
+                key: values[inside]
+                for key, values in attributes["features"].items()
+            }
+        if metadata_keys and "metadata" in attributes:
+            attributes["metadata"] = {
+                key: value[inside] if key in metadata_keys else value
+                for key, value in attributes["metadata"].items()
+            }
+        new_layers.append((points[inside], attributes, layer_type))
+    return new_layers
+
+
+def get_layers_region(
+    layers: List[LayerDataTuple],
+) -> Optional[Tuple[List[float], List[float]]]:
+    """Get the box (in world coordinates) covered by cropped image layers.
+
+    Parameters
+    ----------
+    layers : List[LayerDataTuple]
+        Layers, e.g. from a brainreg reader with a structure given.
+
+    Returns
+    -------
+    Tuple[List[float], List[float]] or None
+        The start and stop of the first cropped (translated) image or labels
+        layer, or None if no layer is cropped.
+    """
+    for data, attributes, layer_type in layers:
+        if layer_type in ("image", "labels") and "translate" in attributes:
+            start = np.asarray(attributes["translate"], dtype=float)
+            scale = np.asarray(attributes.get("scale", 1), dtype=float)
+            stop = start + np.asarray(data.shape) * scale
+            return start.tolist(), stop.tolist()
+    return None
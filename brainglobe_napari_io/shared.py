@@ -0,0 +1,331 @@
+"""Share decoded volumes between processes.
+
+When several worker processes load the same atlas annotation or
+registration images, each decodes its own copy, multiplying memory use by
+the number of workers. In shared mode, the first process to load a volume
+decodes it into shared memory, and the others attach to it by name without
+copying.
+
+Shared mode is enabled with the BRAINGLOBE_NAPARI_IO_SHARED_MEMORY
+environment variable:
+
+- "shm": POSIX shared memory (multiprocessing.shared_memory),
+- "file": a memory-mapped scratch file (in BRAINGLOBE_NAPARI_IO_SHARED_DIR,
+  by default /dev/shm if it exists, otherwise the temporary directory).
+
+A volume is named from a key and the paths, modification times and sizes
+of the files it was decoded from, so a changed file is decoded again. Each
+volume's shape, dtype and the processes using it are recorded in a small
+JSON file in the scratch directory, updated under a file lock. When the
+last process using a volume releases it (or exits), it is deleted. Shared
+volumes are read-only.
+
+File locks need fcntl, so shared mode is not available on Windows, where
+volumes are loaded as usual.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, Sequence
+
+import numpy as np
+
+SHARED_MEMORY_ENV_VAR = "BRAINGLOBE_NAPARI_IO_SHARED_MEMORY"
+SHARED_DIR_ENV_VAR = "BRAINGLOBE_NAPARI_IO_SHARED_DIR"
+SHARED_MODES = ("shm", "file")
+NAME_PREFIX = "bgnio_"
+
+# the shared memory or memory-mapped file of each volume this process uses
+_attached: Dict[str, object] = {}
+
+
+def get_shared_mode() -> Optional[str]:
+    """Get the shared mode ("shm" or "file"), or None if volumes aren't
+    shared."""
+    mode = os.environ.get(SHARED_MEMORY_ENV_VAR, "").lower()
+    if not mode or mode in ("0", "off", "false"):
+        return None
+    if mode not in SHARED_MODES:
+        raise ValueError(
+            f"Invalid {SHARED_MEMORY_ENV_VAR}: {mode!r}, use one of "
+            f"{SHARED_MODES}"
+        )
+    try:
+        import fcntl  # noqa: F401
+    except ImportError:
+        return None
+    return mode
+
+
+def get_scratch_dir() -> Path:
+    """Get the directory for the records (and scratch files) of shared
+    volumes."""
+    configured = os.environ.get(SHARED_DIR_ENV_VAR)
+    if configured is not None:
+        directory = Path(configured)
+    else:
+        base = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        directory = (
+            Path(base or tempfile.gettempdir()) / "brainglobe_napari_io"
+        )
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def get_shared_name(key: str, source_paths: Sequence[os.PathLike]) -> str:
+    """Get the name of a shared volume, from a key and the state of the
+    files it is decoded from."""
+    identity = [key]
+    for path in source_paths:
+        stat = os.stat(path)
+        identity.append(
+            f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}"
+        )
+    digest = hashlib.sha1("\n".join(identity).encode()).hexdigest()
+    return NAME_PREFIX + digest[:20]
+
+
+def get_shared_array(
+    key: str,
+    load: Callable[[], np.ndarray],
+    source_paths: Sequence[os.PathLike] = (),
+    mode: Optional[str] = None,
+) -> np.ndarray:
+    """Get a volume from shared memory, decoding it if no process has yet.
+
+    Parameters
+    ----------
+    key : str
+        Identifies the volume, e.g. "tiff" or "annotation of
+        allen_mouse_25um".
+    load : Callable[[], np.ndarray]
+        Decodes the volume, if it isn't shared yet.
+    source_paths : Sequence[os.PathLike], optional
+        Files the volume is decoded from. If any changes, the volume is
+        decoded again.
+    mode : str, optional
+        "shm" or "file", by default from get_shared_mode. If shared mode is
+        off, the volume is just loaded.
+
+    Returns
+    -------
+    np.ndarray
+        The volume (read-only), backed by shared memory.
+    """
+    mode = mode or get_shared_mode()
+    if mode is None:
+        return load()
+
+    name = get_shared_name(key, source_paths)
+    with _locked(name):
+        record = _read_record(name)
+        array = None
+        if record is not None and name in _attached:
+            array = _view(_attached[name], record)
+        elif record is not None:
+            array = _attach(name, record)
+        if record is None or array is None:
+            record = _create(name, load(), mode)
+            array = _view(_attached[name], record)
+        holders = _live_holders(record)
+        if os.getpid() not in holders:
+            holders.append(os.getpid())
+        _write_record(name, dict(record, holders=holders))
+    return array
+
+
+def release_shared_array(name: str):
+    """Stop using a shared volume in this process, deleting it if no other
+    process is using it."""
+    segment = _attached.pop(name, None)
+    with _locked(name):
+        record = _read_record(name)
+        if record is None:
+            return
+        holders = [pid for pid in _live_holders(record) if pid != os.getpid()]
+        if holders:
+            _write_record(name, dict(record, holders=holders))
+        else:
+            _delete(name, record)
+    if segment is not None and hasattr(segment, "close"):
+        try:
+            segment.close()
+        except BufferError:
+            # arrays viewing it still exist, it is unmapped when they are
+            pass
+
+
+@atexit.register
+def release_shared_arrays():
+    """Release every shared volume this process uses."""
+    for name in list(_attached):
+        release_shared_array(name)
+
+
+def _get_record_path(name: str) -> Path:
+    return get_scratch_dir() / f"{name}.json"
+
+
+def _get_scratch_path(name: str) -> Path:
+    return get_scratch_dir() / f"{name}.raw"
+
+
+def _get_lock_path(name: str) -> Path:
+    return get_scratch_dir() / f"{name}.lock"
+
+
+@contextmanager
+def _locked(name: str) -> Iterator[None]:
+    import fcntl
+
+    lock_path = _get_lock_path(name)
+    while True:
+        lock_file = open(lock_path, "a")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        # the lock file is deleted with the volume, so a process that was
+        # waiting for it locks again, on the file now at the path
+        try:
+            if os.path.samestat(
+                os.fstat(lock_file.fileno()), os.stat(lock_path)
+            ):
+                break
+        except FileNotFoundError:
+            pass
+        lock_file.close()
+    try:
+        yield
+    finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+
+def _read_record(name: str) -> Optional[Dict]:
+    try:
+        with open(_get_record_path(name)) as record_file:
+            return json.load(record_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _write_record(name: str, record: Dict):
+    from brainglobe_napari_io.utils import write_atomically
+
+    with write_atomically(_get_record_path(name)) as temporary_path:
+        with open(temporary_path, "w") as record_file:
+            json.dump(record, record_file)
+
+
+def _live_holders(record: Dict):
+    holders = []
+    for pid in record.get("holders", []):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            continue
+        except PermissionError:
+            pass
+        holders.append(pid)
+    return holders
+
+
+def _shared_memory(name: str, size: int = 0):
+    from multiprocessing import resource_tracker, shared_memory
+
+    # lifetime is managed by the records, not by the resource tracker
+    # (which would delete the segment when the first process exits)
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(
+            name=name, create=size > 0, size=size, track=False
+        )
+    segment = shared_memory.SharedMemory(name=name, create=size > 0, size=size)
+    # POSIX shared memory is registered by its name with a leading slash
+    resource_tracker.unregister(f"/{segment.name}", "shared_memory")
+    return segment
+
+
+def _create(name: str, array: np.ndarray, mode: str) -> Dict:
+    array = np.ascontiguousarray(array)
+    record = {
+        "mode": mode,
+        "shape": list(array.shape),
+        "dtype": array.dtype.str,
+        "holders": [],
+    }
+    if mode == "shm":
+        try:
+            segment = _shared_memory(name, max(array.nbytes, 1))
+        except FileExistsError:
+            # left over from a process that exited without releasing it
+            _delete_segment(name, record)
+            segment = _shared_memory(name, max(array.nbytes, 1))
+        target = np.ndarray(array.shape, array.dtype, buffer=segment.buf)
+    else:
+        segment = np.memmap(
+            _get_scratch_path(name),
+            dtype=array.dtype,
+            mode="w+",
+            shape=array.shape or (1,),
+        )
+        target = segment.reshape(array.shape)
+    target[...] = array
+    if mode == "file":
+        segment.flush()
+    _attached[name] = segment
+    return record
+
+
+def _attach(name: str, record: Dict) -> Optional[np.ndarray]:
+    try:
+        if record["mode"] == "shm":
+            segment = _shared_memory(name)
+        else:
+            segment = np.memmap(
+                _get_scratch_path(name),
+                dtype=np.dtype(record["dtype"]),
+                mode="r",
+                shape=tuple(record["shape"]) or (1,),
+            )
+    except (FileNotFoundError, ValueError):
+        return None
+    _attached[name] = segment
+    return _view(segment, record)
+
+
+def _view(segment, record: Dict) -> np.ndarray:
+    shape = tuple(record["shape"])
+    dtype = np.dtype(record["dtype"])
+    if isinstance(segment, np.memmap):
+        array = segment.reshape(shape).view()
+    else:
+        array = np.ndarray(shape, dtype, buffer=segment.buf)
+    array.flags.writeable = False
+    return array
+
+
+def _delete_segment(name: str, record: Dict):
+    if record["mode"] == "shm":
+        from multiprocessing import shared_memory
+
+        try:
+            segment = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            return
+        segment.close()
+        # also unregisters it from the resource tracker
+        segment.unlink()
+    else:
+        _get_scratch_path(name).unlink(missing_ok=True)
+
+
+def _delete(name: str, record: Dict):
+    """Delete a volume, with its record and lock file (called holding the
+    lock)."""
+    _delete_segment(name, record)
+    _get_record_path(name).unlink(missing_ok=True)
+    _get_lock_path(name).unlink(missing_ok=True)
@@ -1,11 +1,194 @@
+from __future__ import annotations
+
 import os
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Tuple
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+
+from brainglobe_napari_io.ome_zarr import (
+    find_image,
+    get_tiff_path,
+    is_zarr,
+    read_zarr_image,
+)
+from brainglobe_napari_io.profiling import add_file_read, span
+from brainglobe_napari_io.shared import get_shared_array, get_shared_mode
+
+# napari imports this package to find readers for every file that is opened,
+# so slow imports (napari, brainglobe_atlasapi, tifffile etc.) are deferred
+# until they are needed
+if TYPE_CHECKING:
+    from brainglobe_atlasapi.bg_atlas import BrainGlobeAtlas
+    from napari.types import LayerDataTuple
+
+
+class Layer(NamedTuple):
+    """A loaded layer: its data, and how to display it.
+
+    This has the same fields as a napari LayerDataTuple (so can be returned
+    by a napari reader as is), but needs neither napari nor Qt.
+
+    Attributes
+    ----------
+    data : array-like
+        The layer data, e.g. an image, an Nx3 array of points or the
+        (vertices, faces) of a surface.
+    attributes : dict
+        Keyword arguments for the napari viewer.add_* method, e.g. "name",
+        "scale", "translate" and "metadata".
+    layer_type : str
+        Type of the layer, "image", "labels", "points" or "surface".
+    """
+
+    data: Any
+    attributes: Dict
+    layer_type: str = "image"
+
+    @property
+    def name(self) -> Optional[str]:
+        return self.attributes.get("name")
+
+    @property
+    def metadata(self) -> Dict:
+        return self.attributes.get("metadata", {})
+
+    @property
+    def scale(self) -> np.ndarray:
+        """The size of a voxel (or point unit) in world coordinates."""
+        return np.asarray(self.attributes.get("scale", [1] * self.ndim))
+
+    @property
+    def translate(self) -> np.ndarray:
+        """The world position of the origin of the data."""
+        return np.asarray(self.attributes.get("translate", [0] * self.ndim))
+
+    @property
+    def ndim(self) -> int:
+        if self.layer_type == "points":
+            return np.shape(self.data)[1]
+        if self.layer_type == "surface":
+            return np.shape(self.data[0])[1]
+        if self.attributes.get("multiscale"):
+            return len(self.data[0].shape)
+        return len(self.data.shape)
+
+
+def as_layers(layer_data: Iterable[Sequence]) -> List[Layer]:
+    """Convert layer data tuples to Layers.
+
+    Parameters
+    ----------
+    layer_data : iterable of tuples
+        (data, attributes, layer_type) tuples, where attributes and
+        layer_type are optional, as returned by a napari reader.
+
+    Returns
+    -------
+    List[Layer]
+        The layers.
+    """
+    layers = []
+    for layer in layer_data:
+        if isinstance(layer, Layer):
+            layers.append(layer)
+        else:
+            layers.append(
+                Layer(
+                    layer[0],
+                    layer[1] if len(layer) > 1 else {},
+                    layer[2] if len(layer) > 2 else "image",
+                )
+            )
+    return layers
+
+
+def as_layer_data_tuples(layers: Iterable[Layer]) -> List[LayerDataTuple]:
+    """Convert Layers to the layer data tuples napari readers return.
+
+    Parameters
+    ----------
+    layers : iterable of Layer
+        The layers.
 
-import brainglobe_space as bgs
-import tifffile
-from brainglobe_atlasapi.bg_atlas import BrainGlobeAtlas
-from napari.types import LayerDataTuple
+    Returns
+    -------
+    List[LayerDataTuple]
+        A (data, attributes, layer_type) tuple for each layer.
+    """
+    return [tuple(layer) for layer in layers]
+
+
+def get_layer(layers: Iterable[Sequence], name: str) -> Layer:
+    """Get a layer by name.
+
+    Parameters
+    ----------
+    layers : iterable of Layer or LayerDataTuple
+        The layers to search.
+    name : str
+        Name of the layer, e.g. "Registered image".
+
+    Returns
+    -------
+    Layer
+        The first layer with the name.
+    """
+    for layer in as_layers(layers):
+        if layer.name == name:
+            return layer
+    raise KeyError(f"No layer named {name!r}")
+
+
+def open_with_reader(get_reader: Callable, path: str, viewer=None) -> bool:
+    """Open a path in napari with one of this plugin's readers.
+
+    This is for readers that accept the same directories as another reader
+    of this plugin, so are only used via the IO Utilities submenu, rather
+    than registered with napari (which would try the other reader first).
+
+    Parameters
+    ----------
+    get_reader : Callable
+        The napari_get_reader hook specification of the reader.
+    path : str
+        Path to open.
+    viewer : napari.Viewer, optional
+        The viewer to add the layers to, by default the current viewer.
+
+    Returns
+    -------
+    bool
+        Whether the reader accepted the path (if not, this is shown in
+        napari).
+    """
+    from napari import current_viewer
+    from napari.layers import Layer as NapariLayer
+    from napari.utils.notifications import show_info
+
+    reader = get_reader(path)
+    if reader is None:
+        show_info(f"{path} can't be opened with {get_reader.__name__}")
+        return False
+    viewer = viewer or current_viewer()
+    for layer in as_layers(reader(path)):
+        viewer.add_layer(NapariLayer.create(*layer))
+    return True
 
 
 def is_brainreg_dir(path: os.PathLike) -> bool:
@@ -36,9 +219,13 @@ def load_additional_downsampled_channels(
     extension: str = ".tiff",
     search_string: str = "downsampled_",
     exclusion_string: str = "downsampled_standard",
+    region: Optional[Dict] = None,
 ) -> List[LayerDataTuple]:
     """Load additional downsampled channels from a registration directory.
 
+    Channels stored as Zarr images (see brainglobe_napari_io.ome_zarr) are
+    loaded too.
+
     Parameters
     ----------
     path : Path
@@ -51,6 +238,9 @@ def load_additional_downsampled_channels(
         String to search for in the filenames of the downsampled images.
     exclusion_string : str, optional
         String to exclude from the filenames of the downsampled images.
+    region : dict, optional
+        If given, only load this region of each image (see
+        brainglobe_napari_io.regions.get_structure_region).
 
     Returns
     -------
@@ -58,7 +248,16 @@ def load_additional_downsampled_channels(
         Updated list of layers with the additional downsampled channels added.
     """
 
+    found = set()
     for file in path.iterdir():
+        if is_zarr(file):
+            # read (by read_tiff) in place of the TIFF file
+            file = get_tiff_path(file, extension)
+            if file.exists():
+                continue
+        if file.name in found:
+            continue
+        found.add(file.name)
         if (
             (file.suffix == extension)
             and file.name.startswith(search_string)
@@ -73,8 +272,10 @@ def load_additional_downsampled_channels(
             )
             layers.append(
                 (
-                    tifffile.imread(file),
-                    {"name": name, "visible": False},
+                    read_tiff(file, region),
+                    region_attributes(
+                        {"name": name, "visible": False}, region
+                    ),
                     "image",
                 )
             )
@@ -82,6 +283,264 @@ def load_additional_downsampled_channels(
     return layers
 
 
+def read_tiff(
+    path: os.PathLike, region: Optional[Dict] = None, shared: bool = True
+) -> np.ndarray:
+    """Read a TIFF file, or only a region of it.
+
+    If the TIFF file has an up-to-date Zarr variant (see
+    brainglobe_napari_io.ome_zarr), that is read instead.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to a 3D TIFF file.
+    region : dict, optional
+        The region to read, with the start (inclusive) and stop (exclusive)
+        along each axis. By default, the whole image is read.
+    shared : bool, optional
+        Whether to read the whole image from shared memory in shared mode
+        (see brainglobe_napari_io.shared), which makes it read-only. Pass
+        False for images that may be edited, e.g. labels layers. By default
+        True.
+
+    Returns
+    -------
+    np.ndarray
+        The image, or the region of it.
+    """
+    import tifffile
+
+    source = find_image(path)
+    if is_zarr(source):
+        return read_zarr_image(source, region)
+
+    with span("decode", file=Path(path).name) as decode_span:
+        if region is None and shared:
+            image = get_shared_array(
+                "tiff", lambda: tifffile.imread(path), [path]
+            )
+            add_file_read(path)
+        elif region is None:
+            image = tifffile.imread(path)
+            add_file_read(path)
+        else:
+            image = read_tiff_region(path, region["start"], region["stop"])
+            decode_span.add_bytes_read(image.nbytes)
+    return image
+
+
+def get_reoriented_path(path: os.PathLike, orientation: str) -> Path:
+    """Get the path of a copy of a registration image reoriented to the
+    sample orientation (written by brainglobe-napari-io convert).
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to an image in a brainreg registration directory.
+    orientation : str
+        The orientation of the copy, e.g. "psl".
+
+    Returns
+    -------
+    Path
+        Path to the reoriented copy, which may not exist.
+    """
+    path = Path(path)
+    return path.parent / f"reoriented_{orientation}" / path.name
+
+
+def read_tiff_reoriented(
+    path: os.PathLike,
+    source_orientation: str,
+    target_orientation: str,
+    region: Optional[Dict] = None,
+    shared: bool = True,
+) -> np.ndarray:
+    """Read an image (or a region of it) in another orientation.
+
+    If there is an up-to-date reoriented copy of the image (see
+    get_reoriented_path), it is memory-mapped (copy-on-write, so edits are
+    kept in memory). Otherwise, the image is read and reoriented.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to a 3D TIFF file.
+    source_orientation : str
+        The orientation of the image, e.g. "asr".
+    target_orientation : str
+        The orientation to return the image in.
+    region : dict, optional
+        The region to read (in the source orientation). By default, the
+        whole image is read.
+    shared : bool, optional
+        Whether to read the image from shared memory in shared mode, see
+        read_tiff.
+
+    Returns
+    -------
+    np.ndarray
+        The image, or the region of it, in the target orientation.
+    """
+    import brainglobe_space as bgs
+
+    reoriented_path = get_reoriented_path(path, target_orientation)
+    if is_up_to_date(reoriented_path, [path, find_image(path)]):
+        import tifffile
+
+        try:
+            # copy-on-write, so labels can be edited without writing to
+            # the file
+            reoriented = tifffile.memmap(reoriented_path, mode="c")
+        except ValueError:
+            pass
+        else:
+            if region is None:
+                return reoriented
+            region = reorient_region(
+                region, source_orientation, target_orientation
+            )
+            return np.array(
+                reoriented[
+                    tuple(
+                        slice(int(a), int(b))
+                        for a, b in zip(region["start"], region["stop"])
+                    )
+                ]
+            )
+
+    return bgs.map_stack_to(
+        source_orientation,
+        target_orientation,
+        read_tiff(path, region, shared=shared),
+    )
+
+
+def is_up_to_date(
+    output_path: Union[str, os.PathLike],
+    source_paths: Sequence[Union[str, os.PathLike]],
+) -> bool:
+    """Whether a file derived from others exists and is newer than all of
+    them.
+
+    Parameters
+    ----------
+    output_path : str or os.PathLike
+        Path to the derived file.
+    source_paths : Sequence[str or os.PathLike]
+        Paths to the files it was derived from. Missing files are ignored.
+
+    Returns
+    -------
+    bool
+        True if the derived file is up to date.
+    """
+    try:
+        output_time = os.stat(output_path).st_mtime
+    except OSError:
+        return False
+    for source_path in source_paths:
+        try:
+            if os.stat(source_path).st_mtime > output_time:
+                return False
+        except OSError:
+            pass
+    return True
+
+
+@contextmanager
+def write_atomically(path: Union[str, os.PathLike]) -> Iterator[Path]:
+    """Context manager giving a temporary path to write a file to, which is
+    moved to the path once the block completes.
+
+    This means a file is never left half-written (e.g. if conversion is
+    interrupted), so can be assumed complete if it exists.
+
+    Parameters
+    ----------
+    path : str or os.PathLike
+        The path to write to. Its directory is created if needed.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        yield temporary_path
+        os.replace(temporary_path, path)
+    finally:
+        if temporary_path.exists():
+            temporary_path.unlink()
+
+
+def read_tiff_region(
+    path: os.PathLike, start: Sequence[int], stop: Sequence[int]
+) -> np.ndarray:
+    """Read a box from a 3D TIFF file, without reading the rest of it.
+
+    Uncompressed files are memory-mapped, so only the box is read. Files
+    with one (compressed) page per plane only have the planes in the box
+    decoded. Otherwise, the whole file is read and cropped.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Path to a 3D TIFF file.
+    start, stop : Sequence[int]
+        The start (inclusive) and stop (exclusive) of the box, along each
+        axis.
+
+    Returns
+    -------
+    np.ndarray
+        The box.
+    """
+    import tifffile
+
+    key = tuple(slice(int(a), int(b)) for a, b in zip(start, stop))
+    try:
+        return np.array(tifffile.memmap(path, mode="r")[key])
+    except ValueError:
+        pass
+
+    with tifffile.TiffFile(path) as tiff:
+        pages = tiff.pages
+        planes = range(*key[0].indices(len(pages)))
+        if len(pages) > 1 and len(planes) and pages[0].ndim == 2:
+            return np.stack([pages[z].asarray()[key[1:]] for z in planes])
+        return tiff.asarray()[key]
+
+
+def region_attributes(attributes: Dict, region: Optional[Dict]) -> Dict:
+    """Set the translation of a layer cropped to a region, so it lines up
+    with uncropped layers."""
+    if region is not None:
+        attributes["translate"] = tuple(float(s) for s in region["start"])
+    return attributes
+
+
+@lru_cache(maxsize=4)
+def get_atlas(atlas_name: str) -> BrainGlobeAtlas:
+    """Get a BrainGlobeAtlas by name.
+
+    Atlases are cached, so that opening several directories registered to
+    the same atlas only loads its images (e.g. the annotation) once.
+
+    Parameters
+    ----------
+    atlas_name : str
+        Name of the atlas, e.g. "allen_mouse_25um".
+
+    Returns
+    -------
+    BrainGlobeAtlas
+        The atlas.
+    """
+    from brainglobe_atlasapi.bg_atlas import BrainGlobeAtlas
+
+    return BrainGlobeAtlas(atlas_name)
+
+
 def get_atlas_class(layers: List[LayerDataTuple]) -> str:
     """Get the atlas class from layers metadata.
 
@@ -103,8 +562,29 @@ def get_atlas_class(layers: List[LayerDataTuple]) -> str:
     return ""
 
 
+def get_atlas_annotation(atlas: BrainGlobeAtlas) -> np.ndarray:
+    """Get the annotation of an atlas, from shared memory in shared mode
+    (see brainglobe_napari_io.shared)."""
+    if get_shared_mode() is None:
+        return atlas.annotation
+
+    root_dir = getattr(atlas, "root_dir", None)
+    annotation = get_shared_array(
+        f"annotation of {atlas.atlas_name}",
+        lambda: atlas.annotation,
+        [root_dir] if root_dir is not None else [],
+    )
+    if hasattr(atlas, "_annotation"):
+        # so the atlas's own copy is the shared one
+        atlas._annotation = annotation
+    return annotation
+
+
 def load_atlas(
-    atlas: BrainGlobeAtlas, layers: List[LayerDataTuple]
+    atlas: BrainGlobeAtlas,
+    layers: List[LayerDataTuple],
+    region: Optional[Dict] = None,
+    meshes: Optional[Sequence[str]] = None,
 ) -> List[LayerDataTuple]:
     """Load a BrainGlobeAtlas into the layers list.
 
@@ -114,6 +594,14 @@ def load_atlas(
         The atlas to be loaded.
     layers : List[LayerDataTuple]
         List of LayerData tuples to which the atlas will be added.
+    region : dict, optional
+        If given, only add this region of the annotation (see
+        brainglobe_napari_io.regions.get_structure_region).
+    meshes : Sequence[str], optional
+        Acronyms of structures whose meshes are added as surface layers,
+        after the annotation (see brainglobe_napari_io.meshes). By default,
+        those in the BRAINGLOBE_NAPARI_IO_ATLAS_MESHES environment variable
+        (none if it isn't set).
 
     Returns
     -------
@@ -121,25 +609,47 @@ def load_atlas(
     List[LayerDataTuple]
         Updated list of layers with the atlas added.
     """
-    atlas_image = atlas.annotation
+    with span("atlas annotation", atlas=atlas.atlas_name):
+        atlas_image = get_atlas_annotation(atlas)
+        if region is None and not atlas_image.flags.writeable:
+            # shared volumes are read-only, and labels layers are edited
+            atlas_image = np.array(atlas_image)
+        elif region is not None:
+            atlas_image = np.array(
+                atlas_image[
+                    tuple(
+                        slice(a, b)
+                        for a, b in zip(region["start"], region["stop"])
+                    )
+                ]
+            )
     layers.append(
         (
             atlas_image,
-            {
-                "name": atlas.atlas_name,
-                "visible": False,
-                "blending": "additive",
-                "opacity": 0.3,
-            },
+            region_attributes(
+                {
+                    "name": atlas.atlas_name,
+                    "visible": False,
+                    "blending": "additive",
+                    "opacity": 0.3,
+                },
+                region,
+            ),
             "labels",
         )
     )
 
+    from brainglobe_napari_io.meshes import get_mesh_structures, load_meshes
+
+    meshes = get_mesh_structures(meshes)
+    if meshes:
+        layers.extend(load_meshes(atlas, meshes, region=region))
+
     return layers
 
 
 def scale_reorient_layers(
-    layers: List[LayerDataTuple], atlas, metadata
+    layers: List[LayerDataTuple], atlas, metadata, reorient: bool = True
 ) -> List[LayerDataTuple]:
     """Scale and reorient the registration layers to match
     sample scale and orientation.
@@ -157,6 +667,10 @@ def scale_reorient_layers(
         Metadata dictionary containing information about the registration,
         including atlas information. Typically loaded from "brainreg.json"
         exported from brainreg registration.
+    reorient : bool, optional
+        Whether to reorient the layers, by default True. Set to False if
+        they were loaded in the sample orientation (see
+        brainglobe_napari_io.brainreg.reader_dir.load_brainreg_dir).
 
     Returns
     -------
@@ -164,11 +678,83 @@ def scale_reorient_layers(
         A list of LayerData tuples containing the scaled and reoriented layers.
     """
 
-    layers = reorient_registration_layers(layers, atlas, metadata)
-    layers = scale_registration_layers(layers, atlas, metadata)
+    region = get_region(layers)
+    if reorient:
+        with span("reorient"):
+            layers = reorient_registration_layers(layers, atlas, metadata)
+    with span("scale"):
+        layers = scale_registration_layers(layers, atlas, metadata)
+    if region is not None:
+        translate = reorient_region(
+            region, atlas.orientation, metadata["orientation"]
+        )["start"] * np.asarray(get_scale(atlas, metadata))
+        for layer in layers:
+            if "translate" in layer[1]:
+                layer[1]["translate"] = tuple(translate)
     return layers
 
 
+def get_region(layers: List[LayerDataTuple]) -> Optional[Dict]:
+    """Get the region that layers were cropped to from their metadata.
+
+    Parameters
+    ----------
+    layers : List[LayerDataTuple]
+        List of LayerData tuples containing metadata.
+
+    Returns
+    -------
+    dict or None
+        The region (see brainglobe_napari_io.regions.get_structure_region),
+        or None if the layers weren't cropped.
+    """
+    for layer in layers:
+        if "metadata" in layer[1].keys():
+            return layer[1]["metadata"].get("region")
+    return None
+
+
+def reorient_region(
+    region: Dict, source_orientation: str, target_orientation: str
+) -> Dict:
+    """Reorient a region in the same way as a stack is reoriented by
+    brainglobe_space.map_stack_to.
+
+    Parameters
+    ----------
+    region : dict
+        The region, with the start and stop of its box and the shape of the
+        whole stack it is within.
+    source_orientation : str
+        The orientation of the stack, e.g. "asr".
+    target_orientation : str
+        The orientation to map the region to.
+
+    Returns
+    -------
+    dict
+        The region in the target orientation, with the start and stop
+        as arrays.
+    """
+    corners = reorient_points(
+        np.array([region["start"], np.asarray(region["stop"]) - 1]),
+        source_orientation,
+        target_orientation,
+        region["shape"],
+    )
+    import brainglobe_space as bgs
+
+    order, _, _, _ = bgs.AnatomicalSpace(source_orientation).map_to(
+        target_orientation
+    )
+    return {
+        **region,
+        "start": corners.min(axis=0).astype(int),
+        "stop": corners.max(axis=0).astype(int) + 1,
+        "shape": tuple(np.asarray(region["shape"])[list(order)]),
+    }
+
+
 def reorient_registration_layers(
     layers: List[LayerDataTuple], atlas, metadata
 ) -> List[LayerDataTuple]:
@@ -199,15 +785,27 @@ def reorient_registration_layers(
     raw_data_orientation = metadata["orientation"]
     new_layers = []
     for layer in layers:
+        shape = None
+        if len(layer) > 2 and layer[2] == "surface":
+            # the vertices index the annotation, or the region of it
+            region = get_region([layer])
+            shape = (
+                tuple(np.subtract(region["stop"], region["start"]))
+                if region is not None
+                else tuple(atlas.shape)
+            )
         new_layer = reorient_registration_layer(
-            layer, atlas_orientation, raw_data_orientation
+            layer, atlas_orientation, raw_data_orientation, shape
         )
         new_layers.append(new_layer)
     return new_layers
 
 
 def reorient_registration_layer(
-    layer: LayerDataTuple, atlas_orientation, raw_data_orientation
+    layer: LayerDataTuple,
+    atlas_orientation,
+    raw_data_orientation,
+    shape: Optional[Tuple[int, ...]] = None,
 ) -> LayerDataTuple:
     """Reorient a single registration layer to match the sample orientation.
 
@@ -219,6 +817,9 @@ def reorient_registration_layer(
         The orientation of the atlas.
     raw_data_orientation : str
         The orientation of the raw data from the metadata.
+    shape : Tuple[int, ...], optional
+        For a surface layer, the shape of the stack its vertices index (so
+        it is reoriented in the same way as the stack).
 
     Returns
     -------
@@ -226,14 +827,120 @@ def reorient_registration_layer(
         A LayerData tuple containing the reoriented layer.
     """
 
+    import brainglobe_space as bgs
+
     layer = list(layer)
-    layer[0] = bgs.map_stack_to(
-        atlas_orientation, raw_data_orientation, layer[0]
-    )
+    if len(layer) > 2 and layer[2] == "surface":
+        if shape is None:
+            raise ValueError(
+                "The shape of the stack a surface layer is in is needed to "
+                "reorient it"
+            )
+        vertices, faces, *values = layer[0]
+        layer[0] = (
+            *reorient_mesh(
+                vertices, faces, atlas_orientation, raw_data_orientation, shape
+            ),
+            *values,
+        )
+    else:
+        layer[0] = bgs.map_stack_to(
+            atlas_orientation, raw_data_orientation, layer[0]
+        )
     layer = tuple(layer)
     return layer
 
 
+def reorient_points(
+    points: np.ndarray,
+    source_orientation: str,
+    target_orientation: str,
+    source_shape: Tuple[int, ...],
+) -> np.ndarray:
+    """Reorient points in the same way a stack is reoriented by
+    brainglobe_space.map_stack_to, so points and images stay aligned.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Nx3 array of points, as indices into a stack in the source
+        orientation.
+    source_orientation : str
+        The orientation of the source stack, e.g. "asr".
+    target_orientation : str
+        The orientation to map the points to.
+    source_shape : Tuple[int, ...]
+        The shape of the source stack.
+
+    Returns
+    -------
+    np.ndarray
+        Nx3 array of the points as indices into the reoriented stack.
+    """
+    import brainglobe_space as bgs
+
+    order, flips, _, _ = bgs.AnatomicalSpace(source_orientation).map_to(
+        target_orientation
+    )
+    points = np.asarray(points, dtype=float)[:, list(order)]
+    target_shape = np.asarray(source_shape)[list(order)]
+    for axis, flip in enumerate(flips):
+        if flip:
+            points[:, axis] = target_shape[axis] - 1 - points[:, axis]
+    return points
+
+
+def reorient_mesh(
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    source_orientation: str,
+    target_orientation: str,
+    source_shape: Tuple[int, ...],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Reorient a triangle mesh in the same way a stack is reoriented by
+    brainglobe_space.map_stack_to.
+
+    Parameters
+    ----------
+    vertices : np.ndarray
+        Nx3 array of vertices, in voxel coordinates of a stack in the source
+        orientation.
+    faces : np.ndarray
+        Mx3 array of the vertex indices of each triangle.
+    source_orientation : str
+        The orientation of the source stack, e.g. "asr".
+    target_orientation : str
+        The orientation to map the mesh to.
+    source_shape : Tuple[int, ...]
+        The shape of the source stack.
+
+    Returns
+    -------
+    vertices : np.ndarray
+        The reoriented vertices (with the same dtype).
+    faces : np.ndarray
+        The faces, with their winding reversed if the reorientation mirrors
+        the mesh, so they still face outwards.
+    """
+    import brainglobe_space as bgs
+
+    order, flips, _, _ = bgs.AnatomicalSpace(source_orientation).map_to(
+        target_orientation
+    )
+    new_vertices = reorient_points(
+        vertices, source_orientation, target_orientation, source_shape
+    ).astype(np.asarray(vertices).dtype)
+    # an odd number of swapped axes and flips is a reflection
+    n_swaps = sum(
+        order[i] > order[j]
+        for i in range(len(order))
+        for j in range(i + 1, len(order))
+    )
+    if (n_swaps + sum(flips)) % 2:
+        faces = np.asarray(faces)[:, ::-1]
+    return new_vertices, faces
+
+
 def scale_registration_layers(
     layers: List[LayerDataTuple], atlas, metadata
 ) -> List[LayerDataTuple]:
@@ -287,6 +994,8 @@ def get_scale(
         A tuple containing the scaling factors for each axis
         to match the sample resolution.
     """
+    import brainglobe_space as bgs
+
     source_space = bgs.AnatomicalSpace(metadata["orientation"])
     scaling = []
     for idx, axis in enumerate(atlas.space.axes_order):
@@ -321,6 +1030,9 @@ def scale_registration_layer(layer: LayerDataTuple, scale) -> LayerDataTuple:
         A LayerData tuple containing the scaled layer.
     """
     layer = list(layer)
+    # keep any existing scale, e.g. of a decimated image
+    if "scale" in layer[1]:
+        scale = tuple(np.multiply(layer[1]["scale"], scale))
     layer[1]["scale"] = scale
     layer = tuple(layer)
     return layer
@@ -0,0 +1,116 @@
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import (
+    StandInAtlas,
+    make_brainmapper_dir,
+    use_stand_in_atlas,
+)
+from brainglobe_napari_io import api
+from brainglobe_napari_io.brainmapper import brainmapper_reader_dir
+from brainglobe_napari_io.regions import REGION_CACHE_DIR_ENV_VAR
+
+
+@pytest.fixture
+def atlas():
+    atlas = StandInAtlas(atlas_name="test_api_atlas", shape=(16, 12, 20))
+    with use_stand_in_atlas(atlas):
+        yield atlas
+
+
+@pytest.fixture
+def brainmapper_dir(tmp_path, atlas):
+    return make_brainmapper_dir(tmp_path / "brainmapper", atlas, n_cells=40)
+
+
+def test_reader_is_adapter_of_api(brainmapper_dir):
+    layers = api.load_brainmapper_dir(brainmapper_dir, structure="S2")
+    layer_data = brainmapper_reader_dir.reader_function(
+        brainmapper_dir, structure="S2"
+    )
+    assert all(isinstance(layer, api.Layer) for layer in layers)
+    assert [layer.name for layer in layers] == [
+        attributes["name"] for _, attributes, _ in layer_data
+    ]
+    for layer, (data, attributes, layer_type) in zip(layers, layer_data):
+        np.testing.assert_array_equal(layer.data, data)
+        assert layer.layer_type == layer_type
+        np.testing.assert_array_equal(
+            layer.scale, attributes.get("scale", layer.scale)
+        )
+
+
+def test_load_brainreg_dir_sample_space(brainmapper_dir, atlas):
+    layers = api.load_brainreg_dir_sample_space(
+        brainmapper_dir / "registration"
+    )
+    annotation = api.get_layer(layers, atlas.atlas_name)
+    assert annotation.layer_type == "labels"
+    # the synthetic raw data has 2 voxels per atlas voxel
+    np.testing.assert_array_equal(annotation.scale, [2, 2, 2])
+
+
+def test_load_structure_in_other_orientation(
+    brainmapper_dir, atlas, tmp_path, monkeypatch
+):
+    monkeypatch.setenv(REGION_CACHE_DIR_ENV_VAR, str(tmp_path / "cache"))
+    registration_dir = brainmapper_dir / "registration"
+    full = api.load_brainreg_dir(registration_dir, orientation="psl")
+    cropped = api.load_brainreg_dir(
+        registration_dir, structure="S2", orientation="psl"
+    )
+    for name in ("Registered image", "Hemispheres", atlas.atlas_name):
+        layer = api.get_layer(cropped, name)
+        full_data = api.get_layer(full, name).data
+        assert layer.data.shape != full_data.shape
+        # the translation is of the reoriented region
+        start = np.asarray(layer.attributes["translate"], dtype=int)
+        box = tuple(
+            slice(s, s + size) for s, size in zip(start, layer.data.shape)
+        )
+        np.testing.assert_array_equal(layer.data, full_data[box])
+
+
+def test_api_does_not_import_napari(brainmapper_dir):
+    points_path = brainmapper_dir / "points" / "cell_classification.xml"
+    script = (
+        "import sys\n"
+        "from brainglobe_napari_io import api\n"
+        f"layers = api.load_points({str(points_path)!r})\n"
+        "assert [layer.name for layer in layers] == ['Non cells', 'Cells']\n"
+        "print([m for m in ('napari', 'qtpy') if m in sys.modules])\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip().splitlines()[-1] == "[]"
+
+
+def test_structure_cells_are_read_with_block_index(
+    brainmapper_dir, monkeypatch
+):
+    from brainglobe_napari_io.cellfinder import cell_blocks
+
+    layers = api.load_brainmapper_dir(brainmapper_dir, structure="S2")
+    points_path = brainmapper_dir / "points" / "cell_classification.xml"
+    assert cell_blocks.is_cell_blocks_up_to_date(points_path)
+
+    monkeypatch.setenv(cell_blocks.CELL_BLOCK_SIZE_ENV_VAR, "off")
+    expected = api.load_brainmapper_dir(brainmapper_dir, structure="S2")
+    for name in ("Cells", "Non cells"):
+        cells = api.get_layer(layers, name)
+        expected_cells = api.get_layer(expected, name)
+        assert 0 < len(cells.data)
+        np.testing.assert_array_equal(
+            np.unique(cells.data, axis=0),
+            np.unique(expected_cells.data, axis=0),
+        )
+        assert cells.metadata["region_counts"].get_counts(
+            name
+        ) == expected_cells.metadata["region_counts"].get_counts(name)
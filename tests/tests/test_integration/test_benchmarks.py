@@ -0,0 +1,33 @@
+from benchmarks.run import get_manifest_functions, run_benchmarks
+
+
+def test_benchmarks_run(tmp_path):
+    # a tiny dataset, so the benchmarks are checked to work, not timed
+    results = run_benchmarks(
+        tmp_path, atlas_shape=(16, 12, 20), n_cells=50, repeat=1
+    )
+    names = [result["name"] for result in results]
+    assert names == list(get_manifest_functions("readers")) + [
+        "brainglobe-napari-io.cellfinder_write_multiple_points",
+        "brainglobe-napari-io.brainreg_write_labels",
+        "brainglobe-napari-io.write_session_zarr",
+    ]
+    for result in results:
+        assert result["wall_time"] > 0
+        assert result["peak_memory"] > 0
+        assert result["stages"]
+
+
+def test_benchmarks_select(tmp_path):
+    results = run_benchmarks(
+        tmp_path,
+        atlas_shape=(16, 12, 20),
+        n_cells=50,
+        n_channels=2,
+        repeat=1,
+        select="brainmapper_read_dir",
+    )
+    assert [result["name"] for result in results] == [
+        "brainglobe-napari-io.brainmapper_read_dir",
+        "brainglobe-napari-io.brainmapper_read_dir_atlas_space",
+    ]
@@ -0,0 +1,137 @@
+import json
+import pathlib
+import shutil
+
+import npe2
+import numpy as np
+import pytest
+import tifffile
+from napari.components import ViewerModel
+
+from brainglobe_napari_io.brainmapper import cube_reader
+from brainglobe_napari_io.brainmapper.cubes import CellCubes
+
+brainmapper_dir = (
+    pathlib.Path(__file__).parent.parent.parent / "data" / "brainmapper_output"
+)
+
+
+@pytest.fixture
+def brainmapper_dir_with_raw_data(tmp_path):
+    with open(brainmapper_dir / "brainmapper.json") as json_file:
+        metadata = json.load(json_file)
+
+    rng = np.random.default_rng(0)
+    for channel in ("signal", "background"):
+        planes_dir = tmp_path / channel
+        planes_dir.mkdir()
+        for idx in range(15):
+            tifffile.imwrite(
+                planes_dir / f"{idx}.tif",
+                rng.integers(0, 100, (64, 64), dtype=np.uint16),
+            )
+
+    metadata["signal_planes_paths"] = [str(tmp_path / "signal")]
+    metadata["background_planes_path"] = [str(tmp_path / "background")]
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+    with open(output_dir / "brainmapper.json", "w") as json_file:
+        json.dump(metadata, json_file)
+    shutil.copytree(brainmapper_dir / "points", output_dir / "points")
+    return output_dir
+
+
+def test_brainmapper_read_cubes():
+    assert (
+        cube_reader.brainmapper_read_cubes(str(brainmapper_dir))
+        == cube_reader.reader_function
+    )
+    assert cube_reader.brainmapper_read_cubes(brainmapper_dir) is None
+    assert (
+        cube_reader.brainmapper_read_cubes(str(brainmapper_dir.parent)) is None
+    )
+
+
+def test_load_cubes(brainmapper_dir_with_raw_data):
+    layers = cube_reader.reader_function(brainmapper_dir_with_raw_data)
+    assert [layer[1]["name"] for layer in layers] == [
+        "Signal cubes",
+        "Background cubes",
+        "Cell centres",
+    ]
+    assert [layer[2] for layer in layers] == ["image", "image", "points"]
+
+    # cube size from metadata, converted to raw voxels
+    expected_shape = (125, 20, 22, 22)
+    for layer in layers[:2]:
+        assert isinstance(layer[0], CellCubes)
+        assert layer[0].shape == expected_shape
+        assert layer[0][0].shape == expected_shape[1:]
+
+    positions = layers[0][1]["metadata"]["cell_positions"]
+    assert np.all(np.diff(positions[:, 0]) >= 0)
+    assert layers[2][0].shape == (125, 4)
+    assert layers[2][1]["features"]["is_cell"].sum() == 103
+
+
+def test_load_cubes_single_type(brainmapper_dir_with_raw_data):
+    layers = cube_reader.reader_function(
+        brainmapper_dir_with_raw_data, cell_type=1
+    )
+    assert layers[0][0].shape[0] == 22
+
+
+def test_cube_reader_is_only_in_the_menu():
+    # napari opens brainmapper directories with brainmapper_read_dir
+    manifest = npe2.PluginManifest.from_distribution("brainglobe-napari-io")
+    readers = [reader.command for reader in manifest.contributions.readers]
+    assert "brainglobe-napari-io.brainmapper_read_cubes" not in readers
+    assert "brainglobe-napari-io.brainmapper_read_dir" in readers
+
+
+def test_menu_opens_cubes(mocker, brainmapper_dir_with_raw_data):
+    # a viewer model, as image layers can't be drawn without OpenGL
+    viewer = ViewerModel()
+    mocker.patch("napari.current_viewer", return_value=viewer)
+    mocker.patch(
+        "qtpy.QtWidgets.QFileDialog.getExistingDirectory",
+        return_value=str(brainmapper_dir_with_raw_data),
+    )
+
+    cube_reader.select_dialog()
+
+    assert [layer.name for layer in viewer.layers] == [
+        "Signal cubes",
+        "Background cubes",
+        "Cell centres",
+    ]
+
+
+def test_menu_shows_unrecognised_folder(mocker):
+    viewer = ViewerModel()
+    mocker.patch("napari.current_viewer", return_value=viewer)
+    mocker.patch(
+        "qtpy.QtWidgets.QFileDialog.getExistingDirectory",
+        return_value=str(brainmapper_dir.parent),
+    )
+    show_info = mocker.patch("napari.utils.notifications.show_info")
+
+    cube_reader.select_dialog()
+
+    show_info.assert_called_once()
+    assert len(viewer.layers) == 0
+
+
+def test_menu_exits_gracefully(make_napari_viewer_proxy, mocker):
+    make_napari_viewer_proxy()
+    mocker.patch(
+        "qtpy.QtWidgets.QFileDialog.getExistingDirectory",
+        return_value="",
+    )
+    mock_reader_hook = mocker.patch(
+        "brainglobe_napari_io.brainmapper.cube_reader.brainmapper_read_cubes"
+    )
+
+    cube_reader.select_dialog()
+
+    mock_reader_hook.assert_not_called()
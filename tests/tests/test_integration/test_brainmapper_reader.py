@@ -1,9 +1,14 @@
 import json
 import pathlib
+import shutil
 
+import numpy as np
 import pytest
+import tifffile
 
 from brainglobe_napari_io.brainmapper import brainmapper_reader_dir
+from brainglobe_napari_io.brainmapper.raw_planes import LazyPlaneStack
+from brainglobe_napari_io.reader_options import LOAD_RAW_DATA_ENV_VAR
 
 brainmapper_dir = (
     pathlib.Path(__file__).parent.parent.parent / "data" / "brainmapper_output"
@@ -95,3 +100,68 @@ def test_load_registration(metadata):
     for idx, layer in enumerate(layers):
         assert layer[0].shape == DOWNSAMPLED_IMAGE_SIZE
         assert layer[1]["name"] == layer_names[idx]
+
+
+@pytest.fixture
+def brainmapper_dir_with_raw_data(tmp_path, metadata):
+    rng = np.random.default_rng(0)
+    for channel in ("signal", "background"):
+        planes_dir = tmp_path / channel
+        planes_dir.mkdir()
+        for idx in range(5):
+            tifffile.imwrite(
+                planes_dir / f"{idx}.tif",
+                rng.integers(0, 100, (20, 30), dtype=np.uint16),
+            )
+
+    metadata["signal_planes_paths"] = [str(tmp_path / "signal")]
+    metadata["background_planes_path"] = ["background"]
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+    with open(output_dir / "brainmapper.json", "w") as json_file:
+        json.dump(metadata, json_file)
+    shutil.copytree(brainmapper_dir / "points", output_dir / "points")
+    # relative paths are resolved relative to the output directory
+    shutil.move(tmp_path / "background", output_dir / "background")
+    return output_dir
+
+
+def test_load_brainmapper_dir_raw_data(brainmapper_dir_with_raw_data):
+    layers = brainmapper_reader_dir.reader_function(
+        brainmapper_dir_with_raw_data, load_raw_data=True
+    )
+    assert [layer[1]["name"] for layer in layers] == [
+        "Signal",
+        "Background",
+        "Non cells",
+        "Cells",
+    ]
+    for layer in layers[:2]:
+        assert isinstance(layer[0], LazyPlaneStack)
+        assert layer[0].shape == (5, 20, 30)
+        assert layer[2] == "image"
+
+
+def test_load_brainmapper_dir_raw_data_from_environment(
+    brainmapper_dir_with_raw_data, monkeypatch
+):
+    # as napari calls it, with the option set from the environment
+    monkeypatch.setenv(LOAD_RAW_DATA_ENV_VAR, "1")
+    layers = brainmapper_reader_dir.reader_function(
+        brainmapper_dir_with_raw_data
+    )
+    assert [layer[1]["name"] for layer in layers][:2] == [
+        "Signal",
+        "Background",
+    ]
+
+
+def test_load_brainmapper_dir_missing_raw_data(tmp_path, metadata):
+    with open(tmp_path / "brainmapper.json", "w") as json_file:
+        json.dump(metadata, json_file)
+    shutil.copytree(brainmapper_dir / "points", tmp_path / "points")
+
+    layers = brainmapper_reader_dir.reader_function(
+        tmp_path, load_raw_data=True
+    )
+    assert [layer[1]["name"] for layer in layers] == ["Non cells", "Cells"]
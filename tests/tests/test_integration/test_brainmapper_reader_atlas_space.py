@@ -0,0 +1,152 @@
+import json
+import pathlib
+from types import SimpleNamespace
+
+import npe2
+import numpy as np
+import pandas as pd
+import pytest
+from napari.components import ViewerModel
+
+from brainglobe_napari_io.brainmapper import brainmapper_reader_dir_atlas_space
+
+brainmapper_dir = (
+    pathlib.Path(__file__).parent.parent.parent / "data" / "brainmapper_output"
+)
+ATLAS_SHAPE = (13, 8, 11)
+
+
+@pytest.fixture
+def brainmapper_dir_with_analysis(tmp_path):
+    with open(brainmapper_dir / "brainmapper.json") as json_file:
+        metadata = json.load(json_file)
+    with open(tmp_path / "brainmapper.json", "w") as json_file:
+        json.dump(metadata, json_file)
+
+    analysis_directory = tmp_path / "analysis"
+    analysis_directory.mkdir()
+    pd.DataFrame(
+        {
+            **{f"coordinate_raw_axis_{axis}": [1, 2, 3] for axis in range(3)},
+            **{
+                f"coordinate_atlas_axis_{axis}": [4, 5, 6] for axis in range(3)
+            },
+            "structure_name": ["Thalamus", "Thalamus", "Hippocampus"],
+            "hemisphere": ["left", "right", "left"],
+        }
+    ).to_csv(analysis_directory / "all_points.csv", index=False)
+    return tmp_path
+
+
+@pytest.fixture
+def atlas(mocker):
+    atlas = SimpleNamespace(
+        atlas_name="test_atlas",
+        annotation=np.zeros(ATLAS_SHAPE, dtype=np.uint32),
+    )
+    mocker.patch(
+        "brainglobe_napari_io.brainmapper."
+        "brainmapper_reader_dir_atlas_space.get_atlas",
+        return_value=atlas,
+    )
+    return atlas
+
+
+def test_brainmapper_read_dir_atlas_space(brainmapper_dir_with_analysis):
+    reader = brainmapper_reader_dir_atlas_space
+    assert (
+        reader.brainmapper_read_dir_atlas_space(
+            str(brainmapper_dir_with_analysis)
+        )
+        == reader.reader_function
+    )
+    assert (
+        reader.brainmapper_read_dir_atlas_space(brainmapper_dir_with_analysis)
+        is None
+    )
+    # no analysis output
+    assert (
+        reader.brainmapper_read_dir_atlas_space(str(brainmapper_dir)) is None
+    )
+
+
+def test_load_brainmapper_dir_atlas_space(
+    brainmapper_dir_with_analysis, atlas
+):
+    layers = brainmapper_reader_dir_atlas_space.reader_function(
+        brainmapper_dir_with_analysis
+    )
+    assert [layer[1]["name"] for layer in layers] == [
+        "test_atlas",
+        "Cells (atlas space)",
+    ]
+    assert [layer[2] for layer in layers] == ["labels", "points"]
+    assert layers[0][0] is atlas.annotation
+
+    cells = layers[1]
+    np.testing.assert_array_equal(cells[0][:, 0], [4, 5, 6])
+    assert list(cells[1]["features"]["structure_name"]) == [
+        "Thalamus",
+        "Thalamus",
+        "Hippocampus",
+    ]
+    assert cells[1]["metadata"]["raw_coordinates"].shape == (3, 3)
+
+
+def test_load_brainmapper_dir_atlas_space_structure(
+    brainmapper_dir_with_analysis, atlas
+):
+    atlas.annotation[4:6, 4:6, 4:6] = 2
+    atlas.structures = {"HIP": {"id": 2}}
+    atlas.get_structure_descendants = lambda acronym: []
+
+    layers = brainmapper_reader_dir_atlas_space.reader_function(
+        brainmapper_dir_with_analysis, structure="HIP"
+    )
+    annotation, cells = layers
+    assert annotation[0].shape == (2, 2, 2)
+    assert annotation[1]["translate"] == (4, 4, 4)
+    # only the cells within the bounding box are kept
+    np.testing.assert_array_equal(cells[0][:, 0], [4, 5])
+    assert list(cells[1]["features"]["hemisphere"]) == ["left", "right"]
+    assert cells[1]["metadata"]["raw_coordinates"].shape == (2, 3)
+
+
+def test_atlas_space_reader_is_only_in_the_menu():
+    # napari opens brainmapper directories with brainmapper_read_dir
+    manifest = npe2.PluginManifest.from_distribution("brainglobe-napari-io")
+    readers = [reader.command for reader in manifest.contributions.readers]
+    assert (
+        "brainglobe-napari-io.brainmapper_read_dir_atlas_space" not in readers
+    )
+
+
+def test_menu_opens_atlas_space(mocker, brainmapper_dir_with_analysis, atlas):
+    viewer = ViewerModel()
+    mocker.patch("napari.current_viewer", return_value=viewer)
+    mocker.patch(
+        "qtpy.QtWidgets.QFileDialog.getExistingDirectory",
+        return_value=str(brainmapper_dir_with_analysis),
+    )
+
+    brainmapper_reader_dir_atlas_space.select_dialog()
+
+    assert [layer.name for layer in viewer.layers] == [
+        "test_atlas",
+        "Cells (atlas space)",
+    ]
+
+
+def test_menu_shows_folder_without_analysis(mocker):
+    viewer = ViewerModel()
+    mocker.patch("napari.current_viewer", return_value=viewer)
+    mocker.patch(
+        "qtpy.QtWidgets.QFileDialog.getExistingDirectory",
+        return_value=str(brainmapper_dir),
+    )
+    show_info = mocker.patch("napari.utils.notifications.show_info")
+
+    brainmapper_reader_dir_atlas_space.select_dialog()
+
+    show_info.assert_called_once()
+    assert len(viewer.layers) == 0
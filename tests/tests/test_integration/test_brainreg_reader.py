@@ -1,6 +1,20 @@
 import pathlib
+import shutil
+from types import SimpleNamespace
+
+import numpy as np
+import tifffile
 
 from brainglobe_napari_io.brainreg import reader_dir
+from brainglobe_napari_io.reader_options import (
+    LOAD_DEFORMATION_FIELDS_ENV_VAR,
+    STRUCTURE_ENV_VAR,
+)
+from brainglobe_napari_io.regions import (
+    REGION_CACHE_DIR_ENV_VAR,
+    get_bounding_box_cache_path,
+    get_bounding_box_path,
+)
 
 brainreg_dir = (
     pathlib.Path(__file__).parent.parent.parent
@@ -41,7 +55,7 @@ def test_load_brainreg_dir():
 def test_menu_calls_expected_reader(make_napari_viewer_proxy, mocker):
     make_napari_viewer_proxy()
     mocker.patch(
-        "brainglobe_napari_io.brainreg.reader_dir.QFileDialog.getExistingDirectory",
+        "qtpy.QtWidgets.QFileDialog.getExistingDirectory",
         return_value=brainreg_dir,
     )
     mock_reader_hook = mocker.patch(
@@ -57,7 +71,7 @@ def test_menu_calls_expected_reader(make_napari_viewer_proxy, mocker):
 def test_menu_exits_gracefully(make_napari_viewer_proxy, mocker):
     make_napari_viewer_proxy()
     mocker.patch(
-        "brainglobe_napari_io.brainreg.reader_dir.QFileDialog.getExistingDirectory",
+        "qtpy.QtWidgets.QFileDialog.getExistingDirectory",
         return_value="",
     )
     mock_reader_hook = mocker.patch(
@@ -67,3 +81,91 @@ def test_menu_exits_gracefully(make_napari_viewer_proxy, mocker):
     reader_dir.select_dialog()
 
     mock_reader_hook.assert_not_called()
+
+
+def test_load_brainreg_dir_deformation_fields(tmp_path, mocker, monkeypatch):
+    mocker.patch(
+        "brainglobe_napari_io.brainreg.reader_dir.get_atlas",
+        return_value=object(),
+    )
+    registration_dir = tmp_path / "registration"
+    shutil.copytree(brainreg_dir, registration_dir)
+    if not (registration_dir / "registered_atlas.tiff").exists():
+        tifffile.imwrite(
+            registration_dir / "registered_atlas.tiff",
+            np.zeros((135, 77, 108), dtype=np.uint32),
+        )
+    for axis in range(3):
+        tifffile.imwrite(
+            registration_dir / f"deformation_field_{axis}.tiff",
+            np.zeros((135, 77, 108), dtype=np.float32),
+        )
+
+    layers = reader_dir.reader_function(
+        registration_dir, load_deformation_fields=True
+    )
+    assert len(layers) == 8
+    # as napari calls it, with the option set from the environment
+    monkeypatch.setenv(LOAD_DEFORMATION_FIELDS_ENV_VAR, "1")
+    assert len(reader_dir.reader_function(registration_dir)) == 8
+    assert (
+        len(
+            reader_dir.reader_function(
+                registration_dir, load_deformation_fields=False
+            )
+        )
+        == 5
+    )
+    assert [layer[1]["name"] for layer in layers[5:]] == [
+        "Deformation field 0",
+        "Deformation field 1",
+        "Deformation field 2",
+    ]
+    for layer in layers[5:]:
+        assert isinstance(layer[0], np.memmap)
+        assert layer[0].shape == (135, 77, 108)
+
+
+def test_load_brainreg_dir_structure(tmp_path, mocker, monkeypatch):
+    atlas = SimpleNamespace(
+        atlas_name="allen_mouse_100um",
+        structures={"CH": {"id": 1}, "HIP": {"id": 2}},
+        get_structure_descendants={"CH": ["HIP"], "HIP": []}.__getitem__,
+    )
+    mocker.patch(
+        "brainglobe_napari_io.brainreg.reader_dir.get_atlas",
+        return_value=atlas,
+    )
+    monkeypatch.setenv(REGION_CACHE_DIR_ENV_VAR, str(tmp_path / "cache"))
+    registration_dir = tmp_path / "registration"
+    shutil.copytree(brainreg_dir, registration_dir)
+    annotation = np.zeros((135, 77, 108), dtype=np.uint32)
+    annotation[10:20, 30:40, 50:60] = 2
+    annotation[5, 35, 55] = 1
+    tifffile.imwrite(registration_dir / "registered_atlas.tiff", annotation)
+
+    layers = reader_dir.reader_function(registration_dir, structure="HIP")
+    assert len(layers) == 5
+    # the region index is cached, rather than written to the directory
+    annotation_path = registration_dir / "registered_atlas.tiff"
+    assert get_bounding_box_cache_path(annotation_path).exists()
+    assert not get_bounding_box_path(annotation_path).exists()
+    full_image = tifffile.imread(registration_dir / "downsampled.tiff")
+    np.testing.assert_array_equal(
+        layers[1][0], full_image[10:20, 30:40, 50:60]
+    )
+    np.testing.assert_array_equal(layers[3][0], 2)
+    for layer in layers:
+        assert layer[0].shape == (10, 10, 10)
+        assert layer[1]["translate"] == (10, 30, 50)
+    assert layers[3][1]["metadata"]["region"]["stop"] == (20, 40, 60)
+
+    # the bounding box of a structure includes its descendants
+    layers = reader_dir.reader_function(registration_dir, structure="CH")
+    assert layers[3][0].shape == (15, 10, 10)
+    assert layers[3][1]["translate"] == (5, 30, 50)
+
+    # as napari calls it, with the structure set from the environment
+    monkeypatch.setenv(STRUCTURE_ENV_VAR, "HIP")
+    layers = reader_dir.reader_function(registration_dir)
+    assert layers[3][0].shape == (10, 10, 10)
@@ -47,7 +47,7 @@ def test_load_brainreg_dir():
 def test_menu_calls_expected_reader(make_napari_viewer_proxy, mocker):
     make_napari_viewer_proxy()
     mocker.patch(
-        "brainglobe_napari_io.brainreg.reader_dir_atlas_space.QFileDialog.getExistingDirectory",
+        "qtpy.QtWidgets.QFileDialog.getExistingDirectory",
         return_value=brainreg_dir,
     )
     mock_reader_hook = mocker.patch(
@@ -63,7 +63,7 @@ def test_menu_calls_expected_reader(make_napari_viewer_proxy, mocker):
 def test_menu_exits_gracefully(make_napari_viewer_proxy, mocker):
     make_napari_viewer_proxy()
     mocker.patch(
-        "brainglobe_napari_io.brainreg.reader_dir_atlas_space.QFileDialog.getExistingDirectory",
+        "qtpy.QtWidgets.QFileDialog.getExistingDirectory",
         return_value="",
     )
     mock_reader_hook = mocker.patch(
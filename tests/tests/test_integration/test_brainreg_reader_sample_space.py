@@ -1,4 +1,11 @@
+import json
 import pathlib
+import shutil
+from types import SimpleNamespace
+
+import brainglobe_space as bgs
+import numpy as np
+import tifffile
 
 from brainglobe_napari_io.brainreg import reader_dir_sample_space
 
@@ -49,7 +56,7 @@ def test_load_brainreg_dir():
 def test_menu_calls_expected_reader(make_napari_viewer_proxy, mocker):
     make_napari_viewer_proxy()
     mocker.patch(
-        "brainglobe_napari_io.brainreg.reader_dir_sample_space.QFileDialog.getExistingDirectory",
+        "qtpy.QtWidgets.QFileDialog.getExistingDirectory",
         return_value=brainreg_dir,
     )
     mock_reader_hook = mocker.patch(
@@ -65,7 +72,7 @@ def test_menu_calls_expected_reader(make_napari_viewer_proxy, mocker):
 def test_menu_exits_gracefully(make_napari_viewer_proxy, mocker):
     make_napari_viewer_proxy()
     mocker.patch(
-        "brainglobe_napari_io.brainreg.reader_dir_sample_space.QFileDialog.getExistingDirectory",
+        "qtpy.QtWidgets.QFileDialog.getExistingDirectory",
         return_value="",
     )
     mock_reader_hook = mocker.patch(
@@ -75,3 +82,46 @@ def test_menu_exits_gracefully(make_napari_viewer_proxy, mocker):
     reader_dir_sample_space.select_dialog()
 
     mock_reader_hook.assert_not_called()
+
+
+def test_load_brainreg_dir_structure(tmp_path, mocker):
+    atlas = SimpleNamespace(
+        atlas_name="allen_mouse_100um",
+        orientation="asr",
+        resolution=(100, 100, 100),
+        space=bgs.AnatomicalSpace("asr"),
+        structures={"HIP": {"id": 2}},
+        get_structure_descendants=lambda acronym: [],
+    )
+    for module in ("reader_dir", "reader_dir_sample_space"):
+        mocker.patch(
+            f"brainglobe_napari_io.brainreg.{module}.get_atlas",
+            return_value=atlas,
+        )
+    registration_dir = tmp_path / "registration"
+    shutil.copytree(brainreg_dir, registration_dir)
+    annotation = np.zeros(DOWNSAMPLED_IMAGE_SIZE, dtype=np.uint32)
+    annotation[10:20, 30:40, 50:60] = 2
+    tifffile.imwrite(registration_dir / "registered_atlas.tiff", annotation)
+    # reorient the sample, so the region must be moved to line up
+    with open(registration_dir / "brainreg.json") as json_file:
+        metadata = json.load(json_file)
+    metadata["orientation"] = "psl"
+    with open(registration_dir / "brainreg.json", "w") as json_file:
+        json.dump(metadata, json_file)
+
+    full_layers = reader_dir_sample_space.reader_function(registration_dir)
+    layers = reader_dir_sample_space.reader_function(
+        registration_dir, structure="HIP"
+    )
+    assert len(layers) == len(full_layers) == 3
+    for layer, full_layer in zip(layers, full_layers):
+        assert layer[1]["scale"] == LAYER_SCALE
+        start = np.asarray(layer[1]["translate"]) / LAYER_SCALE
+        start = start.astype(int)
+        stop = start + layer[0].shape
+        np.testing.assert_array_equal(
+            layer[0],
+            full_layer[0][tuple(slice(a, b) for a, b in zip(start, stop))],
+        )
+    np.testing.assert_array_equal(layers[1][0], 2)
@@ -1,3 +1,4 @@
+import gzip
 import pathlib
 
 import numpy as np
@@ -45,5 +46,19 @@ def test_reader_xml(filename):
         assert isinstance(layer[2], str)
 
 
+@pytest.mark.parametrize("filename", [xml_file, yml_file])
+def test_reader_compressed(tmp_path, filename):
+    compressed_path = tmp_path / f"{filename.name}.gz"
+    with gzip.open(compressed_path, "wb") as compressed_file:
+        compressed_file.write(filename.read_bytes())
+    assert (
+        reader_points.cellfinder_read_points(str(compressed_path)) is not None
+    )
+    layers = reader_points.points_reader(compressed_path)
+    expected = reader_points.points_reader(filename)
+    for layer, expected_layer in zip(layers, expected):
+        np.testing.assert_array_equal(layer[0], expected_layer[0])
+
+
 def test_reader_no_match():
     assert reader_points.cellfinder_read_points(broken_xml) is None
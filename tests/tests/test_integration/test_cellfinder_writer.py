@@ -11,15 +11,16 @@ xml_dir = pathlib.Path(__file__).parent.parent.parent / "data" / "xml"
 yml_dir = pathlib.Path(__file__).parent.parent.parent / "data" / "yml"
 
 
+@pytest.mark.parametrize("compression", ["", ".gz"])
 @pytest.mark.parametrize("suffix", [".xml", ".yml"])
-def test_points_roundrip(tmp_path, suffix):
+def test_points_roundrip(tmp_path, suffix, compression):
     # Check that a read in XML/YAML file can also be written back out
     d = xml_dir if suffix == ".xml" else yml_dir
     validate_file = d / f"cell_classification{suffix}"
     layers = reader_points.points_reader(validate_file)
     assert len(layers) == 2
 
-    test_path = str(tmp_path / f"points{suffix}")
+    test_path = str(tmp_path / f"points{suffix}{compression}")
     paths = writer_points.write_multiple_points(test_path, layers)
     assert len(paths) == 1
     assert isinstance(paths[0], str)
@@ -29,6 +30,12 @@ def test_points_roundrip(tmp_path, suffix):
         assert reader_points.is_cellfinder_yml(paths[0])
 
     cells_validate = get_cells(validate_file)
+    if compression:
+        # as read back by the reader
+        test_path = tmp_path / f"points{suffix}"
+        writer_points.write_multiple_points(
+            str(test_path), reader_points.points_reader(paths[0])
+        )
     cells_test = get_cells(test_path)
     assert len(cells_test) == len(cells_validate)
     assert len(cells_test) == len(set(cells_test))
@@ -82,3 +89,60 @@ def test_points_write_no_points(tmp_path, suffix):
         "points",
     )
     assert writer_points.write_multiple_points(path, [points]) == []
+
+
+def test_points_write_merges_duplicates(tmp_path, monkeypatch):
+    path = str(tmp_path / "points.yml")
+    non_cells = (
+        np.array([[1, 2, 3], [4, 5, 6]]),
+        {
+            "metadata": {"point_type": Cell.UNKNOWN},
+            "features": {"score": np.array([0.1, 0.2], dtype=object)},
+        },
+        "points",
+    )
+    cells = (
+        np.array([[4, 5, 6], [7, 8, 9], [7, 8, 9]]),
+        {
+            "metadata": {"point_type": Cell.CELL},
+            "features": {"score": np.array([0.3, 0.4, 0.5], dtype=object)},
+        },
+        "points",
+    )
+    # by default, every point is saved
+    monkeypatch.delenv("BRAINGLOBE_NAPARI_IO_DUPLICATE_TOLERANCE", False)
+    writer_points.write_multiple_points(path, [non_cells, cells])
+    assert len(get_cells(path)) == 5
+
+    monkeypatch.setenv("BRAINGLOBE_NAPARI_IO_DUPLICATE_TOLERANCE", "0")
+    writer_points.write_multiple_points(path, [non_cells, cells])
+    saved = sorted(get_cells(path), key=lambda cell: cell.x)
+    assert [(cell.x, cell.type) for cell in saved] == [
+        (3, Cell.UNKNOWN),
+        (6, Cell.CELL),
+        (9, Cell.CELL),
+    ]
+    assert [cell.metadata["score"] for cell in saved] == [0.1, 0.3, 0.4]
+
+    monkeypatch.setenv("BRAINGLOBE_NAPARI_IO_DUPLICATE_TOLERANCE", "off")
+    writer_points.write_multiple_points(path, [non_cells, cells])
+    assert len(get_cells(path)) == 5
+
+
+def test_points_write_partial_layer(tmp_path):
+    # a layer with only some of the cells of a file (e.g. those in a
+    # structure) isn't saved over it
+    path = tmp_path / "points.xml"
+    path.write_bytes((xml_dir / "cell_classification.xml").read_bytes())
+    layers = reader_points.points_reader(
+        path, bounds=((0, 0, 0), (10**6, 10**6, 10**6))
+    )
+    contents = path.read_bytes()
+    with pytest.raises(ValueError, match="only some of the cells"):
+        writer_points.write_multiple_points(str(path), layers)
+    assert path.read_bytes() == contents
+
+    # but can be saved to another file
+    other_path = tmp_path / "structure_points.xml"
+    writer_points.write_multiple_points(str(other_path), layers)
+    assert len(get_cells(other_path)) == sum(len(layer[0]) for layer in layers)
@@ -0,0 +1,106 @@
+import json
+
+import numpy as np
+import pytest
+import tifffile
+
+from benchmarks.synthetic import (
+    StandInAtlas,
+    make_brainreg_dir,
+    use_stand_in_atlas,
+)
+from brainglobe_napari_io import api
+from brainglobe_napari_io.brainreg import cohort
+
+ATLAS_NAME = "test_cohort_atlas"
+
+
+@pytest.fixture
+def atlas():
+    atlas = StandInAtlas(atlas_name=ATLAS_NAME, shape=(8, 12, 10))
+    with use_stand_in_atlas(atlas):
+        yield atlas
+
+
+@pytest.fixture
+def brainreg_dirs(tmp_path, atlas):
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(3):
+        path = make_brainreg_dir(
+            tmp_path / f"brain_{i}",
+            atlas,
+            (10, 10, 10),
+            deformation_fields=False,
+        )
+        image = rng.integers(1, 1000, atlas.shape, dtype=np.uint16)
+        # outside the imaged sample
+        image[: i * 2] = 0
+        tifffile.imwrite(path / "downsampled_standard.tiff", image)
+        paths.append(path)
+    return paths
+
+
+def read_images(paths):
+    return np.stack(
+        [
+            tifffile.imread(path / "downsampled_standard.tiff").astype(float)
+            for path in paths
+        ]
+    )
+
+
+def test_load_cohort_average(brainreg_dirs):
+    layers = api.load_cohort_average(brainreg_dirs, n_workers=2)
+    assert [layer.name for layer in layers] == [
+        "Cohort mean",
+        "Cohort std",
+        "Cohort count",
+        ATLAS_NAME,
+    ]
+    images = read_images(brainreg_dirs)
+    mean = api.get_layer(layers, "Cohort mean")
+    np.testing.assert_allclose(mean.data, images.mean(axis=0), rtol=1e-6)
+    np.testing.assert_allclose(
+        api.get_layer(layers, "Cohort std").data,
+        images.std(axis=0),
+        rtol=1e-5,
+    )
+    assert mean.metadata["atlas"] == ATLAS_NAME
+    assert mean.metadata["cohort"] == [str(path) for path in brainreg_dirs]
+
+
+def test_load_cohort_average_ignoring_zeros(brainreg_dirs):
+    layers = api.load_cohort_average(brainreg_dirs, ignore_zeros=True)
+    count = api.get_layer(layers, "Cohort count").data
+    assert (count[:2] == 1).all()
+    assert (count[4:] == 3).all()
+
+    images = read_images(brainreg_dirs)
+    images[images == 0] = np.nan
+    np.testing.assert_allclose(
+        api.get_layer(layers, "Cohort mean").data,
+        np.nanmean(images, axis=0),
+        rtol=1e-6,
+    )
+
+
+def test_different_atlases_are_not_averaged(brainreg_dirs):
+    with open(brainreg_dirs[0] / "brainreg.json") as json_file:
+        metadata = json.load(json_file)
+    metadata["atlas"] = "other_atlas"
+    with open(brainreg_dirs[0] / "brainreg.json", "w") as json_file:
+        json.dump(metadata, json_file)
+    with pytest.raises(ValueError, match="different atlases"):
+        api.load_cohort_average(brainreg_dirs)
+
+
+def test_reader(brainreg_dirs):
+    paths = [str(path) for path in brainreg_dirs]
+    assert cohort.brainreg_read_cohort(paths[0]) is None
+    assert cohort.brainreg_read_cohort(paths[:1]) is None
+    reader = cohort.brainreg_read_cohort(paths)
+    layer_data = reader(paths)
+    assert [attributes["name"] for _, attributes, _ in layer_data][0] == (
+        "Cohort mean"
+    )
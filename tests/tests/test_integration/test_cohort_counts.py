@@ -0,0 +1,122 @@
+import json
+
+import numpy as np
+import pytest
+import tifffile
+
+from benchmarks.synthetic import (
+    StandInAtlas,
+    make_brainmapper_dir,
+    use_stand_in_atlas,
+)
+from brainglobe_napari_io import api, cli
+from brainglobe_napari_io.brainmapper import cohort_counts
+from brainglobe_napari_io.cellfinder.region_counts import get_region_counts
+
+
+@pytest.fixture
+def atlas():
+    atlas = StandInAtlas(atlas_name="test_cohort_counts_atlas")
+    with use_stand_in_atlas(atlas):
+        yield atlas
+
+
+@pytest.fixture
+def brain_paths(tmp_path, atlas):
+    paths = [
+        make_brainmapper_dir(
+            tmp_path / "cohort" / f"brain_{i}", atlas, n_cells=60, seed=i
+        )
+        for i in range(3)
+    ]
+    # in a different orientation to the atlas
+    with open(paths[1] / "brainmapper.json") as metadata_file:
+        metadata = json.load(metadata_file)
+    metadata["orientation"] = "psl"
+    with open(paths[1] / "brainmapper.json", "w") as metadata_file:
+        json.dump(metadata, metadata_file)
+    return paths
+
+
+def get_expected_counts(path):
+    # as counted when the brain is opened in napari
+    layers = api.load_brainmapper_dir(path)
+    return get_region_counts(layers).get_counts("Cells")
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_count_cohort(brain_paths, n_workers):
+    counts = api.count_cohort(brain_paths, n_workers=n_workers)
+    assert list(counts.brains) == [str(path) for path in brain_paths]
+    assert not counts.errors
+    assert (counts.hemispheres == cohort_counts.BOTH_HEMISPHERES).all()
+    for row, path in enumerate(brain_paths):
+        expected = get_expected_counts(path)
+        actual = {
+            int(structure_id): int(count)
+            for structure_id, count in zip(
+                counts.structure_ids, counts.counts[row]
+            )
+            if count
+        }
+        assert actual == expected
+
+    table = counts.to_dataframe()
+    assert table.shape == (3, len(counts.structure_ids))
+    assert "S1" in table.columns
+
+
+def test_count_hemispheres(brain_paths):
+    counts = api.count_cohort(brain_paths, hemispheres=True, n_workers=1)
+    total = api.count_cohort(brain_paths, n_workers=1)
+    assert set(counts.hemispheres) <= {0, 1, 2}
+    assert "S1 (left)" in counts.get_column_names()
+    for structure_id in total.structure_ids:
+        columns = counts.structure_ids == structure_id
+        np.testing.assert_array_equal(
+            counts.counts[:, columns].sum(axis=1),
+            total.counts[:, total.structure_ids == structure_id][:, 0],
+        )
+
+
+def test_labels_edits_are_counted(brain_paths):
+    # edits saved in napari, to a brain in a different orientation
+    atlas_path = brain_paths[1] / "registration" / "registered_atlas.tiff"
+    annotation = tifffile.imread(atlas_path)
+    annotation[annotation > 0] = annotation.max()
+    before = api.count_cohort(brain_paths[1:2], n_workers=1)
+    assert api.save_labels_edits(atlas_path, annotation) > 0
+
+    counts = api.count_cohort(brain_paths[1:2], n_workers=1)
+    actual = {
+        int(structure_id): int(count)
+        for structure_id, count in zip(counts.structure_ids, counts.counts[0])
+        if count
+    }
+    assert actual == get_expected_counts(brain_paths[1])
+    assert len(counts.structure_ids) < len(before.structure_ids)
+
+
+def test_failed_brain_is_reported(brain_paths):
+    (brain_paths[0] / "registration" / "brainreg.json").unlink()
+    counts = api.count_cohort(brain_paths, n_workers=1, progress=None)
+    assert list(counts.errors) == [str(brain_paths[0])]
+    assert "FileNotFoundError" in counts.errors[str(brain_paths[0])]
+    assert list(counts.brains) == [str(path) for path in brain_paths[1:]]
+
+
+def test_count_command(brain_paths, tmp_path):
+    output_path = tmp_path / "counts.npz"
+    root = str(brain_paths[0].parent)
+    assert (
+        cli.main(["count", root, "-o", str(output_path), "--workers", "1"])
+        == 0
+    )
+    counts = api.read_cohort_counts(output_path)
+    expected = api.count_cohort(brain_paths, n_workers=1, progress=None)
+    for field in cohort_counts.CohortCounts._fields[:-1]:
+        np.testing.assert_array_equal(
+            getattr(counts, field), getattr(expected, field)
+        )
+
+    assert cli.main(["count", str(tmp_path / "empty")]) == 1
@@ -0,0 +1,138 @@
+import json
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import (
+    StandInAtlas,
+    make_brainmapper_dir,
+    use_stand_in_atlas,
+)
+from brainglobe_napari_io import api, cli, convert
+from brainglobe_napari_io.regions import (
+    REGION_CACHE_DIR_ENV_VAR,
+    get_bounding_box_cache_path,
+    get_bounding_box_path,
+)
+
+
+@pytest.fixture
+def atlas():
+    atlas = StandInAtlas(atlas_name="test_convert_atlas", shape=(6, 300, 8))
+    with use_stand_in_atlas(atlas):
+        yield atlas
+
+
+@pytest.fixture
+def brains_dir(tmp_path, atlas):
+    """Two brainmapper directories, with raw data large enough to have a
+    pyramid level, in a different orientation to the atlas."""
+    for brain in ("brain_1", "brain_2"):
+        path = make_brainmapper_dir(
+            tmp_path / "brains" / brain, atlas, n_cells=30
+        )
+        for metadata_path in (
+            path / "brainmapper.json",
+            path / "registration" / "brainreg.json",
+        ):
+            with open(metadata_path) as metadata_file:
+                metadata = json.load(metadata_file)
+            metadata["orientation"] = "psl"
+            with open(metadata_path, "w") as metadata_file:
+                json.dump(metadata, metadata_file)
+    return tmp_path / "brains"
+
+
+def test_find_output_dirs(brains_dir):
+    assert [
+        (dir_type, path.relative_to(brains_dir).as_posix())
+        for dir_type, path in convert.find_output_dirs(brains_dir)
+    ] == [
+        ("brainmapper", "brain_1"),
+        ("brainreg", "brain_1/registration"),
+        ("brainmapper", "brain_2"),
+        ("brainreg", "brain_2/registration"),
+    ]
+
+
+def test_plan_conversions(brains_dir):
+    tasks = convert.plan_conversions(brains_dir)
+    # per brain: a cell file, signal and background pyramids, three
+    # reoriented registration images and the index of the atlas regions
+    assert [task.kind for task in tasks] == 2 * (
+        ["cells"] + 2 * ["pyramid"] + 3 * ["reoriented"] + ["regions"]
+    )
+    assert not any(task.is_up_to_date() for task in tasks)
+    tasks = convert.plan_conversions(brains_dir, kinds=("cells",))
+    assert [task.kind for task in tasks] == ["cells", "cells"]
+
+
+def test_convert_command(brains_dir, capsys, tmp_path, monkeypatch):
+    monkeypatch.setenv(REGION_CACHE_DIR_ENV_VAR, str(tmp_path / "cache"))
+    brain_dir = brains_dir / "brain_1"
+    expected = api.load_brainmapper_dir(brain_dir, load_raw_data=True)
+
+    assert cli.main(["convert", str(brains_dir), "--workers", "1"]) == 0
+    assert "Converted 14, skipped 0 (up to date), failed 0" in (
+        capsys.readouterr().out
+    )
+    assert all(
+        task.is_up_to_date() for task in convert.plan_conversions(brains_dir)
+    )
+
+    layers = api.load_brainmapper_dir(brain_dir, load_raw_data=True)
+    assert [layer.name for layer in layers] == [
+        layer.name for layer in expected
+    ]
+    signal = api.get_layer(layers, "Signal")
+    assert signal.attributes["multiscale"]
+    assert signal.data[1].shape == (12, 300, 8)
+    for layer, expected_layer in zip(layers[2:], expected[2:]):
+        assert isinstance(layer.data, np.memmap) == (
+            layer.layer_type != "points"
+        )
+        np.testing.assert_array_equal(layer.data, expected_layer.data)
+        assert layer.scale.tolist() == expected_layer.scale.tolist()
+
+    # structures are loaded with the region index written next to the atlas
+    annotation_path = brain_dir / "registration" / "registered_atlas.tiff"
+    assert get_bounding_box_path(annotation_path).exists()
+    api.load_brainmapper_dir(brain_dir, structure="S2")
+    assert not get_bounding_box_cache_path(annotation_path).exists()
+
+    # converting again does nothing, as everything is up to date
+    assert cli.main(["convert", str(brains_dir), "--workers", "1"]) == 0
+    assert "Converted 0, skipped 14" in capsys.readouterr().out
+
+
+def test_run_conversions_in_process_pool(brains_dir):
+    tasks = convert.plan_conversions(brains_dir, kinds=("cells", "pyramid"))
+    summary = convert.run_conversions(
+        tasks, n_workers=2, memory_limit=2 * 10**9, progress=None
+    )
+    assert summary["converted"] == len(tasks) == 6
+    assert summary["failed"] == 0
+    assert summary["bytes_read"] > summary["bytes_written"] > 0
+    assert "conversions/s" in convert.format_summary(summary)
+
+
+def test_failed_conversion(brains_dir):
+    (task,) = [
+        task
+        for task in convert.plan_conversions(brains_dir, kinds=("cells",))
+        if "brain_1" in task.output
+    ]
+    with open(task.source_paths[0], "w") as cells_file:
+        cells_file.write("not xml")
+    summary = convert.run_conversions([task], progress=None)
+    assert summary["failed"] == 1
+    assert summary["results"][0]["error"]
+    assert not task.is_up_to_date()
+
+
+def test_parse_memory_size():
+    assert cli.parse_memory_size("4G") == 4 * 10**9
+    assert cli.parse_memory_size("512mb") == 512 * 10**6
+    assert cli.parse_memory_size("1000") == 1000
+    with pytest.raises(Exception, match="Invalid memory size"):
+        cli.parse_memory_size("lots")
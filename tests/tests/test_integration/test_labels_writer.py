@@ -0,0 +1,210 @@
+import os
+
+import npe2
+import numpy as np
+import pytest
+import tifffile
+
+from benchmarks.synthetic import (
+    StandInAtlas,
+    make_brainreg_dir,
+    use_stand_in_atlas,
+)
+from brainglobe_napari_io import api, cli, planning, shared
+from brainglobe_napari_io.brainreg import writer_labels
+
+ATLAS_NAME = "test_labels_atlas"
+
+
+@pytest.fixture
+def brainreg_dir(tmp_path, monkeypatch):
+    # small chunks, so the test atlas has several
+    monkeypatch.setattr(writer_labels, "CHUNK_SHAPE", (4, 16, 16))
+    atlas = StandInAtlas(atlas_name=ATLAS_NAME, shape=(8, 40, 32))
+    with use_stand_in_atlas(atlas):
+        yield make_brainreg_dir(
+            tmp_path / "brainreg",
+            atlas,
+            (10, 10, 10),
+            deformation_fields=False,
+        )
+
+
+def get_atlas_layer(path, **kwargs):
+    return api.get_layer(api.load_brainreg_dir(path, **kwargs), ATLAS_NAME)
+
+
+def save(path, layer):
+    return writer_labels.write_labels(
+        str(path / "registered_atlas.tiff"),
+        layer.data,
+        layer.attributes,
+    )
+
+
+@pytest.mark.parametrize("tracked", [True, False])
+def test_save_edits(brainreg_dir, tracked):
+    tiff_path = brainreg_dir / "registered_atlas.tiff"
+    tiff_state = os.stat(tiff_path).st_mtime_ns
+    layer = get_atlas_layer(brainreg_dir)
+    layer.data[5, 20, 20] = 1234
+    if tracked:
+        layer.metadata[writer_labels.EDITED_CHUNKS_KEY] = {(1, 1, 1)}
+
+    assert save(brainreg_dir, layer) == [str(tiff_path)]
+    store = writer_labels.LabelsEditStore(tiff_path)
+    assert store.chunk_indices() == [(1, 1, 1)]
+    assert os.stat(tiff_path).st_mtime_ns == tiff_state
+
+    # the edit is loaded, but nothing else changed
+    expected = tifffile.imread(tiff_path)
+    expected[5, 20, 20] = 1234
+    np.testing.assert_array_equal(get_atlas_layer(brainreg_dir).data, expected)
+
+    # saving again writes nothing, as nothing has changed
+    assert writer_labels.save_labels_edits(tiff_path, layer.data) == 0
+
+
+def test_save_edits_reoriented_and_cropped(brainreg_dir):
+    tiff_path = brainreg_dir / "registered_atlas.tiff"
+    layer = get_atlas_layer(brainreg_dir, orientation="psl")
+    source = layer.metadata[writer_labels.LABELS_SOURCE_KEY]
+    assert source["orientation"] == "psl"
+    edited = np.array(layer.data)
+    edited[1, 2, 3] = 1234
+    writer_labels.save_labels_edits(tiff_path, edited, source, {(0, 0, 0)})
+
+    # the edit is at the same place when loaded in the atlas orientation
+    expected = api.get_layer(
+        api.load_brainreg_dir(brainreg_dir, orientation="psl"), ATLAS_NAME
+    ).data
+    np.testing.assert_array_equal(expected, edited)
+    atlas_layer = get_atlas_layer(brainreg_dir)
+    assert np.count_nonzero(atlas_layer.data == 1234) == 1
+
+    # a region of the image
+    region = {"start": np.array([2, 10, 10]), "stop": np.array([6, 30, 20])}
+    cropped = np.array(atlas_layer.data[2:6, 10:30, 10:20])
+    cropped[0, 0, 0] = 4321
+    source = writer_labels.get_labels_source(tiff_path, region=region)
+    writer_labels.save_labels_edits(tiff_path, cropped, source, {(0, 0, 0)})
+    assert get_atlas_layer(brainreg_dir).data[2, 10, 10] == 4321
+    assert np.count_nonzero(get_atlas_layer(brainreg_dir).data == 1234) == 1
+
+
+def test_save_decimated_layer(brainreg_dir):
+    layer = get_atlas_layer(brainreg_dir)
+    decimated = layer._replace(data=layer.data[::2, ::2, ::2])
+    with pytest.raises(ValueError, match="full resolution"):
+        save(brainreg_dir, decimated)
+
+
+def test_labels_are_never_decimated(brainreg_dir):
+    atlas = StandInAtlas(atlas_name=ATLAS_NAME)
+    options = planning.get_brainreg_options(brainreg_dir, atlas=atlas)
+    decimated = {
+        os.path.basename(eager.path)
+        for eager, alternatives in options
+        if any(plan.strategy == "decimated" for plan in alternatives)
+    }
+    assert "downsampled.tiff" in decimated
+    assert not decimated & set(writer_labels.LABELS_FILES)
+
+
+def test_compact(brainreg_dir):
+    tiff_path = brainreg_dir / "registered_atlas.tiff"
+    layer = get_atlas_layer(brainreg_dir)
+    layer.data[0, 0, 0] = 1234
+    save(brainreg_dir, layer)
+
+    assert cli.main(["compact", str(brainreg_dir.parent)]) == 0
+    assert not writer_labels.get_edits_dir(tiff_path).exists()
+    np.testing.assert_array_equal(tifffile.imread(tiff_path), layer.data)
+    assert not writer_labels.compact_labels_edits(tiff_path)
+
+
+def test_stale_edits_are_ignored(brainreg_dir):
+    tiff_path = brainreg_dir / "registered_atlas.tiff"
+    layer = get_atlas_layer(brainreg_dir)
+    layer.data[0, 0, 0] = 1234
+    save(brainreg_dir, layer)
+
+    # registered again
+    tifffile.imwrite(tiff_path, np.zeros((8, 40, 32), np.int32))
+    assert not writer_labels.has_labels_edits(tiff_path)
+    assert not get_atlas_layer(brainreg_dir).data.any()
+
+
+def test_write_other_path(tmp_path):
+    data = np.arange(24, dtype=np.uint16).reshape(2, 3, 4)
+    path = tmp_path / "labels.tiff"
+    assert writer_labels.write_labels(str(path), data, {}) == [str(path)]
+    # as napari's labels writer writes it
+    np.testing.assert_array_equal(tifffile.imread(path), data)
+    assert tifffile.imread(path).dtype == np.uint32
+
+
+def test_only_brainreg_labels_extension_is_claimed():
+    # .tif labels layers are left to napari's labels writer
+    manifest = npe2.PluginManifest.from_distribution("brainglobe-napari-io")
+    (writer,) = [
+        writer
+        for writer in manifest.contributions.writers
+        if writer.command == "brainglobe-napari-io.brainreg_write_labels"
+    ]
+    assert writer.filename_extensions == [".tiff"]
+
+
+def test_track_edits(brainreg_dir, monkeypatch):
+    from napari.components import ViewerModel
+
+    viewer = ViewerModel()
+    writer_labels.track_viewer_labels_edits(viewer)
+    layer = get_atlas_layer(brainreg_dir)
+    labels_layer = viewer.add_labels(np.array(layer.data), **layer.attributes)
+    hemispheres = api.get_layer(
+        api.load_brainreg_dir(brainreg_dir), "Hemispheres"
+    )
+    assert writer_labels.LABELS_SOURCE_KEY in hemispheres.metadata
+
+    labels_layer.n_edit_dimensions = 3
+    labels_layer.brush_size = 1
+    labels_layer.paint((5, 20, 20), 1234)
+    edited_chunks = labels_layer.metadata[writer_labels.EDITED_CHUNKS_KEY]
+    assert edited_chunks == {(1, 1, 1)}
+
+    data, attributes, _ = labels_layer.as_layer_data_tuple()
+    save(brainreg_dir, api.Layer(data, attributes, "labels"))
+    store = writer_labels.LabelsEditStore(
+        brainreg_dir / "registered_atlas.tiff"
+    )
+    assert store.chunk_indices() == [(1, 1, 1)]
+
+    # replacing the data means every chunk is compared
+    labels_layer.data = np.zeros_like(labels_layer.data)
+    assert writer_labels.EDITED_CHUNKS_KEY not in labels_layer.metadata
+
+
+@pytest.mark.parametrize("shared_mode", shared.SHARED_MODES)
+def test_paint_in_shared_mode(
+    brainreg_dir, tmp_path, monkeypatch, shared_mode
+):
+    from napari.layers import Labels
+
+    monkeypatch.setenv(shared.SHARED_DIR_ENV_VAR, str(tmp_path / "scratch"))
+    monkeypatch.setenv(shared.SHARED_MEMORY_ENV_VAR, shared_mode)
+    try:
+        layers = api.load_brainreg_dir(brainreg_dir)
+        # images are shared, and read-only
+        registered = api.get_layer(layers, "Registered image")
+        assert not registered.data.flags.writeable
+
+        for name in (ATLAS_NAME, "Hemispheres"):
+            layer = api.get_layer(layers, name)
+            labels_layer = Labels(layer.data, **layer.attributes)
+            labels_layer.n_edit_dimensions = 3
+            labels_layer.brush_size = 1
+            labels_layer.paint((5, 20, 20), 7)
+            assert labels_layer.data[5, 20, 20] == 7
+    finally:
+        shared.release_shared_arrays()
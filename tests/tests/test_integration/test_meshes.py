@@ -0,0 +1,126 @@
+import json
+
+import numpy as np
+import pytest
+from napari.components import ViewerModel
+
+from benchmarks.synthetic import (
+    StandInAtlas,
+    make_brainreg_dir,
+    use_stand_in_atlas,
+)
+from brainglobe_napari_io import api, meshes
+
+ATLAS_NAME = "test_meshes_atlas"
+MAX_VERTICES = 200
+
+
+@pytest.fixture
+def atlas(tmp_path, monkeypatch):
+    monkeypatch.setenv(meshes.MESH_CACHE_DIR_ENV_VAR, str(tmp_path / "cache"))
+    monkeypatch.setenv(meshes.MESH_VERTICES_ENV_VAR, str(MAX_VERTICES))
+    monkeypatch.delenv(meshes.ATLAS_MESHES_ENV_VAR, raising=False)
+    atlas = StandInAtlas(
+        atlas_name=ATLAS_NAME, mesh_directory=tmp_path / "meshes"
+    )
+    with use_stand_in_atlas(atlas):
+        yield atlas
+
+
+@pytest.fixture
+def brainreg_dir(tmp_path, atlas):
+    return make_brainreg_dir(
+        tmp_path / "brainreg", atlas, (5, 2, 2), deformation_fields=False
+    )
+
+
+def get_box_centre(annotation, structure_id):
+    voxels = np.argwhere(annotation == structure_id)
+    return (voxels.min(axis=0) + voxels.max(axis=0)) / 2
+
+
+def test_atlas_space_meshes(brainreg_dir, atlas):
+    layers = api.load_brainreg_dir_atlas_space(
+        brainreg_dir, meshes=["S2", "S5"]
+    )
+    surfaces = [layer for layer in layers if layer.layer_type == "surface"]
+    assert [layer.name for layer in surfaces] == ["S2", "S5"]
+    for layer in surfaces:
+        vertices, faces = layer.data
+        assert 0 < len(vertices) <= MAX_VERTICES
+        assert faces.max() < len(vertices)
+        # in atlas voxels, around the structure
+        structure_id = atlas.structures[layer.name]["id"]
+        np.testing.assert_allclose(
+            (vertices.min(axis=0) + vertices.max(axis=0)) / 2,
+            get_box_centre(atlas.annotation, structure_id),
+            atol=1,
+        )
+    assert len(list((meshes.get_mesh_cache_dir(ATLAS_NAME)).iterdir())) == 2
+
+    viewer = ViewerModel()
+    for data, attributes, layer_type in api.as_layer_data_tuples(layers):
+        getattr(viewer, f"add_{layer_type}")(data, **attributes)
+    assert viewer.layers["S2"].data[0].shape[1] == 3
+
+
+def test_meshes_are_cached(brainreg_dir, monkeypatch):
+    (layer,) = api.load_atlas_meshes(ATLAS_NAME, ["S3"])
+
+    def fail(path):
+        raise AssertionError(f"{path} read again")
+
+    monkeypatch.setattr("meshio.read", fail)
+    (cached,) = api.load_atlas_meshes(ATLAS_NAME, ["S3"])
+    np.testing.assert_array_equal(cached.data[0], layer.data[0])
+    np.testing.assert_array_equal(cached.data[1], layer.data[1])
+
+
+def test_meshes_from_environment(brainreg_dir, monkeypatch):
+    monkeypatch.setenv(meshes.ATLAS_MESHES_ENV_VAR, "root,S1")
+    layers = api.load_brainreg_dir_atlas_space(brainreg_dir)
+    assert [
+        layer.name for layer in layers if layer.layer_type == "surface"
+    ] == [
+        "root",
+        "S1",
+    ]
+    with pytest.raises(ValueError, match="not a structure"):
+        api.load_brainreg_dir_atlas_space(brainreg_dir, meshes=["HIP"])
+
+
+def test_meshes_in_region(brainreg_dir):
+    whole = api.get_layer(
+        api.load_brainreg_dir_atlas_space(brainreg_dir, meshes=["S4"]), "S4"
+    )
+    cropped = api.get_layer(
+        api.load_brainreg_dir_atlas_space(
+            brainreg_dir, structure="S4", meshes=["S4"]
+        ),
+        "S4",
+    )
+    np.testing.assert_allclose(
+        cropped.data[0] + cropped.translate, whole.data[0], atol=1e-4
+    )
+
+
+@pytest.mark.parametrize("orientation", ["asr", "psl"])
+def test_sample_space_meshes(brainreg_dir, atlas, orientation):
+    with open(brainreg_dir / "brainreg.json") as json_file:
+        metadata = json.load(json_file)
+    metadata["orientation"] = orientation
+    with open(brainreg_dir / "brainreg.json", "w") as json_file:
+        json.dump(metadata, json_file)
+
+    annotation = api.get_layer(
+        api.load_brainreg_dir_sample_space(brainreg_dir), ATLAS_NAME
+    )
+    (surface,) = api.load_atlas_meshes(ATLAS_NAME, ["S2"], metadata)
+    np.testing.assert_allclose(surface.scale, annotation.scale)
+    # the mesh is where the structure is in the reoriented annotation
+    vertices = surface.data[0]
+    np.testing.assert_allclose(
+        (vertices.min(axis=0) + vertices.max(axis=0)) / 2,
+        get_box_centre(annotation.data, atlas.structures["S2"]["id"]),
+        atol=1,
+    )
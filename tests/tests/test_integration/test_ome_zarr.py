@@ -0,0 +1,124 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import (
+    StandInAtlas,
+    convert_brainreg_dir_to_zarr,
+    make_brainreg_dir,
+    use_stand_in_atlas,
+)
+from brainglobe_napari_io import api, planning
+
+ATLAS_NAME = "test_ome_zarr_atlas"
+
+
+@pytest.fixture
+def atlas():
+    atlas = StandInAtlas(atlas_name=ATLAS_NAME, shape=(12, 20, 16))
+    with use_stand_in_atlas(atlas):
+        yield atlas
+
+
+@pytest.fixture
+def tiff_dir(tmp_path, atlas):
+    return make_brainreg_dir(
+        tmp_path / "tiff", atlas, (10, 10, 10), n_channels=2
+    )
+
+
+@pytest.fixture(params=[2, 3])
+def zarr_dir(request, tiff_dir, tmp_path):
+    path = tmp_path / f"zarr_v{request.param}"
+    shutil.copytree(tiff_dir, path)
+    convert_brainreg_dir_to_zarr(path, zarr_format=request.param)
+    assert not list(path.glob("*.tiff"))
+    return path
+
+
+def assert_same_layers(layers, expected):
+    assert [(layer.name, layer.layer_type) for layer in layers] == [
+        (layer.name, layer.layer_type) for layer in expected
+    ]
+    for layer, expected_layer in zip(layers, expected):
+        np.testing.assert_array_equal(
+            np.asarray(layer.data), np.asarray(expected_layer.data)
+        )
+        for key in ("scale", "translate"):
+            np.testing.assert_array_equal(
+                layer.attributes.get(key), expected_layer.attributes.get(key)
+            )
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"orientation": "psl"},
+        {"structure": "S2"},
+        {"load_deformation_fields": True},
+    ],
+)
+def test_load_brainreg_dir(zarr_dir, tiff_dir, kwargs):
+    assert_same_layers(
+        api.load_brainreg_dir(zarr_dir, **kwargs),
+        api.load_brainreg_dir(tiff_dir, **kwargs),
+    )
+
+
+@pytest.mark.parametrize("structure", [None, "S2"])
+def test_load_brainreg_dir_atlas_space(zarr_dir, tiff_dir, structure):
+    layers = api.load_brainreg_dir_atlas_space(zarr_dir, structure=structure)
+    assert "channel_1 (downsampled)" in [layer.name for layer in layers][0]
+    assert_same_layers(
+        layers,
+        api.load_brainreg_dir_atlas_space(tiff_dir, structure=structure),
+    )
+
+
+def test_load_brainreg_dir_sample_space(zarr_dir, tiff_dir):
+    assert_same_layers(
+        api.load_brainreg_dir_sample_space(
+            zarr_dir, load_deformation_fields=True
+        ),
+        api.load_brainreg_dir_sample_space(
+            tiff_dir, load_deformation_fields=True
+        ),
+    )
+
+
+def test_zarr_images_are_read_lazily(zarr_dir, tiff_dir):
+    options = planning.get_brainreg_options(zarr_dir)
+    # labels are never loaded lazily, as they are edited
+    plan = api.LoadPlan(
+        None,
+        [
+            next((p for p in alternatives if p.strategy == "lazy"), eager)
+            for eager, alternatives in options
+        ],
+    )
+    layers = api.load_brainreg_dir(zarr_dir, load_plan=plan)
+    registered = api.get_layer(layers, "Registered image")
+    assert not isinstance(registered.data, np.ndarray)
+    assert_same_layers(layers, api.load_brainreg_dir(tiff_dir))
+
+
+def test_labels_edits_to_zarr_images(zarr_dir):
+    layers = api.load_brainreg_dir(zarr_dir)
+    annotation = np.array(api.get_layer(layers, ATLAS_NAME).data)
+    annotation[:2] = 7
+    path = zarr_dir / "registered_atlas.tiff"
+    assert api.save_labels_edits(path, annotation) > 0
+    np.testing.assert_array_equal(
+        api.get_layer(api.load_brainreg_dir(zarr_dir), ATLAS_NAME).data,
+        annotation,
+    )
+
+    # compacting writes a TIFF file, which is then read instead
+    assert api.compact_labels_edits(path)
+    assert path.exists()
+    np.testing.assert_array_equal(
+        api.get_layer(api.load_brainreg_dir(zarr_dir), ATLAS_NAME).data,
+        annotation,
+    )
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+import tifffile
+
+from benchmarks.synthetic import (
+    StandInAtlas,
+    make_brainmapper_dir,
+    use_stand_in_atlas,
+)
+from brainglobe_napari_io import api, planning
+from brainglobe_napari_io.brainreg.writer_labels import LABELS_FILES
+
+
+@pytest.fixture
+def brainmapper_dir(tmp_path):
+    atlas = StandInAtlas(atlas_name="test_planning_atlas", shape=(8, 40, 32))
+    with use_stand_in_atlas(atlas):
+        yield make_brainmapper_dir(
+            tmp_path / "brainmapper", atlas, n_cells=200
+        )
+
+
+def test_plan_brainmapper_dir(brainmapper_dir):
+    plan = planning.plan_brainmapper_dir(
+        brainmapper_dir, memory_budget=None, load_raw_data=True
+    )
+    kinds = [layer.kind for layer in plan.layers]
+    assert kinds.count("raw data") == 2
+    assert kinds.count("image") == len(planning.REGISTRATION_IMAGES)
+    assert kinds.count("cells") == 1
+
+
+def test_load_brainmapper_dir_within_budget(brainmapper_dir, capsys):
+    expected = api.load_brainmapper_dir(brainmapper_dir, memory_budget=10**9)
+    assert "reduced" not in capsys.readouterr().out
+
+    layers = api.load_brainmapper_dir(brainmapper_dir, memory_budget=1)
+    assert "OVER BUDGET" in capsys.readouterr().out
+    assert [layer.name for layer in layers] == [
+        layer.name for layer in expected
+    ]
+
+    # uncompressed registration images are memory-mapped
+    atlas_layer = api.get_layer(layers, "test_planning_atlas")
+    expected_atlas = api.get_layer(expected, "test_planning_atlas").data
+    assert isinstance(atlas_layer.data, np.memmap)
+    np.testing.assert_array_equal(atlas_layer.data, expected_atlas)
+
+    # copy-on-write, so labels can be painted without changing the file
+    atlas_layer.data[0] = 0
+    np.testing.assert_array_equal(
+        tifffile.imread(
+            brainmapper_dir / "registration" / "registered_atlas.tiff"
+        ),
+        expected_atlas,
+    )
+
+    # cells are always loaded in full, as they are saved over the cell file
+    cells = api.get_layer(layers, "Cells")
+    expected_cells = api.get_layer(expected, "Cells")
+    np.testing.assert_array_equal(cells.data, expected_cells.data)
+    assert "partial" not in cells.metadata
+    assert "region_counts" in cells.metadata
+
+
+def test_labels_not_planned_lazily(brainmapper_dir):
+    registration_dir = brainmapper_dir / "registration"
+    for filename in planning.REGISTRATION_IMAGES:
+        image = tifffile.imread(registration_dir / filename)
+        tifffile.imwrite(
+            registration_dir / filename, image, compression="zlib"
+        )
+    options = planning.get_brainreg_options(registration_dir)
+    for filename, (_, alternatives) in zip(
+        planning.REGISTRATION_IMAGES, options
+    ):
+        strategies = {plan.strategy for plan in alternatives}
+        # lazily loaded images are read-only, so labels couldn't be edited
+        lazy = filename not in LABELS_FILES
+        assert ("lazy" in strategies) == lazy
+
+
+def test_load_brainreg_dir_decimated(brainmapper_dir):
+    registration_dir = brainmapper_dir / "registration"
+    for filename in planning.REGISTRATION_IMAGES:
+        image = tifffile.imread(registration_dir / filename)
+        tifffile.imwrite(
+            registration_dir / filename, image, compression="zlib"
+        )
+    expected = api.load_brainreg_dir(registration_dir, memory_budget=10**9)
+    layers = api.load_brainreg_dir(registration_dir, memory_budget=1)
+
+    # compressed images can't be memory-mapped, and the budget is too small
+    # to cache even a few planes, so they are decimated (except labels,
+    # which are edited at full resolution)
+    factor = planning.DECIMATION_FACTORS[-1]
+    for layer, expected_layer in zip(layers, expected):
+        if layer.layer_type == "labels":
+            np.testing.assert_array_equal(layer.data, expected_layer.data)
+            assert "scale" not in layer.attributes
+            continue
+        np.testing.assert_array_equal(
+            layer.data, expected_layer.data[::factor, ::factor, ::factor]
+        )
+        np.testing.assert_array_equal(layer.scale, (factor,) * 3)
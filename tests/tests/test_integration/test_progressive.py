@@ -0,0 +1,152 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import (
+    StandInAtlas,
+    make_brainmapper_dir,
+    use_stand_in_atlas,
+)
+from brainglobe_napari_io import api, progressive
+from brainglobe_napari_io.brainmapper import brainmapper_reader_dir
+from brainglobe_napari_io.brainreg.writer_labels import EDITED_CHUNKS_KEY
+from brainglobe_napari_io.cellfinder.cell_files import write_binary_cells
+from brainglobe_napari_io.cellfinder.region_counts import (
+    REGION_COUNTS_KEY,
+    get_region_counts,
+)
+from brainglobe_napari_io.cellfinder.utils import PARTIAL_KEY
+from brainglobe_napari_io.utils import Layer, as_layer_data_tuples
+
+ATLAS_NAME = "test_progressive_atlas"
+
+
+@pytest.fixture
+def brainmapper_dir(tmp_path):
+    atlas = StandInAtlas(atlas_name=ATLAS_NAME, shape=(8, 40, 32))
+    with use_stand_in_atlas(atlas):
+        yield make_brainmapper_dir(
+            tmp_path / "brainmapper", atlas, n_cells=200
+        )
+
+
+def add_layers(viewer, layer_data):
+    for data, attributes, layer_type in layer_data:
+        getattr(viewer, f"add_{layer_type}")(data, **attributes)
+
+
+def test_reader_without_viewer_loads_full_data(brainmapper_dir):
+    layer_data = brainmapper_reader_dir.reader_function(brainmapper_dir)
+    expected = api.load_brainmapper_dir(brainmapper_dir)
+    for (data, _, _), expected_layer in zip(layer_data, expected):
+        np.testing.assert_array_equal(data, expected_layer.data)
+
+
+@pytest.mark.parametrize("binary", [True, False])
+def test_reader_shows_preview_then_full_data(
+    brainmapper_dir, qtbot, monkeypatch, binary
+):
+    from napari.components import ViewerModel
+
+    monkeypatch.setattr(progressive, "PREVIEW_VOXELS", 1000)
+    monkeypatch.setattr(progressive, "PREVIEW_POINTS", 10)
+    if binary:
+        # so the preview cells are read without parsing the cell file
+        for cells_path in (brainmapper_dir / "points").glob("*.xml"):
+            write_binary_cells(cells_path)
+    expected = api.load_brainmapper_dir(brainmapper_dir)
+    # a viewer without a canvas, as there may be no OpenGL
+    viewer = ViewerModel()
+    monkeypatch.setattr(progressive, "get_current_viewer", lambda: viewer)
+
+    layer_data = brainmapper_reader_dir.reader_function(brainmapper_dir)
+    add_layers(viewer, layer_data)
+    atlas_layer = viewer.layers["test_progressive_atlas"]
+    assert atlas_layer.data.size <= 1000
+    # every 20th cell of 200
+    n_preview = sum(
+        len(viewer.layers[name].data) for name in ("Cells", "Non cells")
+    )
+    assert n_preview == 10
+    assert viewer.layers["Cells"].metadata[PARTIAL_KEY]
+
+    expected_cells = api.get_layer(expected, "Cells")
+    qtbot.waitUntil(
+        lambda: len(viewer.layers["Cells"].data) == len(expected_cells.data),
+        timeout=10000,
+    )
+    expected_atlas_layer = api.get_layer(expected, "test_progressive_atlas")
+    np.testing.assert_array_equal(
+        np.asarray(atlas_layer.data), np.asarray(expected_atlas_layer.data)
+    )
+    np.testing.assert_allclose(atlas_layer.scale, expected_atlas_layer.scale)
+    np.testing.assert_array_equal(
+        viewer.layers["Cells"].data, expected_cells.data
+    )
+    assert PARTIAL_KEY not in viewer.layers["Cells"].metadata
+
+    # the cells are counted in the full atlas, not the preview
+    region_counts = viewer.layers["Cells"].metadata[REGION_COUNTS_KEY]
+    expected_counts = get_region_counts(expected).get_counts("Cells")
+    assert region_counts.get_counts("Cells") == expected_counts
+    viewer.layers["Cells"].data = viewer.layers["Cells"].data[:5]
+    assert sum(region_counts.get_counts("Cells").values()) == 5
+
+
+def test_only_added_layers_are_tracked(brainmapper_dir, monkeypatch):
+    from napari.components import ViewerModel
+
+    viewer = ViewerModel()
+    monkeypatch.setattr(progressive, "get_current_viewer", lambda: viewer)
+    layer_data = brainmapper_reader_dir.reader_function(brainmapper_dir)
+    atlas_data, atlas_attributes, _ = next(
+        data for data in layer_data if data[1]["name"] == ATLAS_NAME
+    )
+    # a labels layer from elsewhere, added before the layers read
+    metadata = dict(atlas_attributes["metadata"])
+    metadata.pop(progressive.READ_KEY)
+    other = viewer.add_labels(
+        np.array(atlas_data), name="Other", metadata=metadata
+    )
+    assert EDITED_CHUNKS_KEY not in other.metadata
+
+    add_layers(viewer, layer_data)
+    assert EDITED_CHUNKS_KEY in viewer.layers[ATLAS_NAME].metadata
+    assert EDITED_CHUNKS_KEY not in other.metadata
+    assert not any(
+        progressive.READ_KEY in layer.metadata for layer in viewer.layers
+    )
+
+
+def test_full_data_replaces_the_preview_of_its_load():
+    from napari.components import ViewerModel
+
+    viewer = ViewerModel()
+    for load_id in ("first", "second"):
+        preview = progressive.tag_preview_layers(
+            [Layer(np.zeros((2, 3)), {"name": "Cells"}, "points")], load_id
+        )
+        add_layers(viewer, as_layer_data_tuples(preview))
+    # napari renames the second layer
+    assert [layer.name for layer in viewer.layers] == ["Cells", "Cells [1]"]
+
+    full = [Layer(np.ones((5, 3)), {"name": "Cells"}, "points")]
+    progressive.update_layers(viewer, full, "second")
+    assert len(viewer.layers["Cells"].data) == 2
+    assert len(viewer.layers["Cells [1]"].data) == 5
+    assert progressive.PREVIEW_KEY not in viewer.layers["Cells [1]"].metadata
+
+
+def test_failed_full_load_is_shown(qtbot, mocker):
+    from napari.components import ViewerModel
+
+    show_error = mocker.patch("napari.utils.notifications.show_error")
+
+    def load_full():
+        raise OSError("disconnected")
+
+    preview = [Layer(np.zeros((2, 3)), {"name": "Cells"}, "points")]
+    progressive.load_progressively(
+        lambda: preview, load_full, viewer=ViewerModel()
+    )
+    qtbot.waitUntil(lambda: show_error.called, timeout=10000)
+    assert "disconnected" in show_error.call_args.args[0]
@@ -0,0 +1,51 @@
+import pytest
+
+from benchmarks.synthetic import (
+    StandInAtlas,
+    make_brainmapper_dir,
+    use_stand_in_atlas,
+)
+from brainglobe_napari_io import api, readahead
+
+
+@pytest.fixture
+def atlas():
+    atlas = StandInAtlas(atlas_name="test_readahead_atlas", shape=(16, 12, 20))
+    with use_stand_in_atlas(atlas):
+        yield atlas
+
+
+@pytest.fixture
+def brainmapper_dir(tmp_path, atlas):
+    return make_brainmapper_dir(tmp_path / "brainmapper", atlas, n_cells=40)
+
+
+def test_brainmapper_reader_reads_plan_ahead(
+    brainmapper_dir, monkeypatch, capsys
+):
+    expected = api.load_brainmapper_dir(brainmapper_dir)
+    assert "Reading ahead" not in capsys.readouterr().out
+
+    paths = readahead.get_readahead_paths(
+        api.plan_brainmapper_dir(brainmapper_dir)
+    )
+    # the registration images and the cells
+    assert len(paths) == 5
+    monkeypatch.setenv(readahead.READAHEAD_ENV_VAR, "1G")
+    layers = api.load_brainmapper_dir(brainmapper_dir)
+    assert f"of {len(paths)} files" in capsys.readouterr().out
+    assert [layer.name for layer in layers] == [
+        layer.name for layer in expected
+    ]
+
+
+def test_atlas_space_reader_reads_ahead(brainmapper_dir, monkeypatch, capsys):
+    monkeypatch.setenv(readahead.READAHEAD_ENV_VAR, "1G")
+    api.load_brainreg_dir_atlas_space(brainmapper_dir / "registration")
+    assert "of 1 files" in capsys.readouterr().out
+
+    # only part of each image is read for a structure
+    api.load_brainreg_dir_atlas_space(
+        brainmapper_dir / "registration", structure="S2"
+    )
+    assert "Reading ahead" not in capsys.readouterr().out
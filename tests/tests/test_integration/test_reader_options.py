@@ -0,0 +1,48 @@
+import os
+
+import pytest
+from qtpy.QtWidgets import QCheckBox, QDialog, QLineEdit
+
+from brainglobe_napari_io import reader_options
+from brainglobe_napari_io.meshes import ATLAS_MESHES_ENV_VAR
+
+
+@pytest.fixture(autouse=True)
+def environment(monkeypatch):
+    for env_var in (
+        reader_options.STRUCTURE_ENV_VAR,
+        reader_options.LOAD_DEFORMATION_FIELDS_ENV_VAR,
+        reader_options.LOAD_RAW_DATA_ENV_VAR,
+        ATLAS_MESHES_ENV_VAR,
+    ):
+        monkeypatch.delenv(env_var, raising=False)
+
+
+def test_options_dialog_sets_options(make_napari_viewer_proxy, mocker):
+    make_napari_viewer_proxy()
+
+    def fill_in(dialog):
+        structure, atlas_meshes = dialog.findChildren(QLineEdit)
+        structure.setText("HIP")
+        atlas_meshes.setText("root")
+        for check_box in dialog.findChildren(QCheckBox):
+            check_box.setChecked(True)
+        return QDialog.Accepted
+
+    mocker.patch.object(QDialog, "exec_", new=fill_in)
+    reader_options.options_dialog()
+
+    assert reader_options.get_structure() == "HIP"
+    assert reader_options.get_load_deformation_fields() is True
+    assert reader_options.get_load_raw_data() is True
+    assert os.environ[ATLAS_MESHES_ENV_VAR] == "root"
+
+
+def test_options_dialog_cancelled(make_napari_viewer_proxy, mocker):
+    make_napari_viewer_proxy()
+    mocker.patch.object(QDialog, "exec_", return_value=QDialog.Rejected)
+
+    reader_options.options_dialog()
+
+    assert reader_options.STRUCTURE_ENV_VAR not in os.environ
+    assert reader_options.LOAD_RAW_DATA_ENV_VAR not in os.environ
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import (
+    StandInAtlas,
+    make_brainmapper_dir,
+    use_stand_in_atlas,
+)
+from brainglobe_napari_io import api
+from brainglobe_napari_io.cellfinder.region_counts import (
+    REGION_COUNTS_KEY,
+    get_region_counts,
+    track_viewer_region_counts,
+)
+
+ATLAS_NAME = "test_region_counts_atlas"
+
+
+@pytest.fixture
+def brainmapper_dir(tmp_path):
+    atlas = StandInAtlas(atlas_name=ATLAS_NAME, shape=(16, 12, 20))
+    with use_stand_in_atlas(atlas):
+        yield make_brainmapper_dir(
+            tmp_path / "brainmapper", atlas, n_cells=100
+        )
+
+
+def recount(layers, name):
+    # count from scratch, in the atlas layer's voxels
+    atlas_layer = api.get_layer(layers, ATLAS_NAME)
+    points = np.asarray(api.get_layer(layers, name).data)
+    voxels = np.round(
+        (points - atlas_layer.translate) / atlas_layer.scale
+    ).astype(int)
+    inside = np.all((voxels >= 0) & (voxels < atlas_layer.data.shape), axis=1)
+    regions = np.zeros(len(points), int)
+    regions[inside] = np.asarray(atlas_layer.data)[tuple(voxels[inside].T)]
+    ids, counts = np.unique(regions, return_counts=True)
+    return dict(zip(ids.tolist(), counts.tolist()))
+
+
+def test_load_brainmapper_dir_counts_cells(brainmapper_dir):
+    layers = api.load_brainmapper_dir(brainmapper_dir)
+    region_counts = get_region_counts(layers)
+    assert region_counts is not None
+    assert (
+        api.get_layer(layers, "Cells").metadata[REGION_COUNTS_KEY]
+        is api.get_layer(layers, "Non cells").metadata[REGION_COUNTS_KEY]
+    )
+    for name in ("Cells", "Non cells"):
+        assert region_counts.get_counts(name) == recount(layers, name)
+    assert sum(region_counts.get_counts("Cells").values()) == 50
+
+    # only the cells within the structure are counted
+    layers = api.load_brainmapper_dir(brainmapper_dir, structure="S2")
+    region_counts = get_region_counts(layers)
+    n_cells = len(api.get_layer(layers, "Cells").data)
+    assert sum(region_counts.get_counts("Cells").values()) == n_cells
+    assert region_counts.get_counts("Cells") == recount(layers, "Cells")
+
+
+def test_counts_follow_curation(brainmapper_dir, tmp_path):
+    from napari.components import ViewerModel
+
+    layers = api.load_brainmapper_dir(brainmapper_dir)
+    viewer = ViewerModel()
+    track_viewer_region_counts(viewer)
+    for data, attributes, layer_type in layers:
+        getattr(viewer, f"add_{layer_type}")(data, **attributes)
+    cells = viewer.layers["Cells"]
+    region_counts = cells.metadata[REGION_COUNTS_KEY]
+
+    def check():
+        expected = recount(
+            [api.Layer(cells.data, {"name": "Cells"}, "points"), *layers],
+            "Cells",
+        )
+        assert region_counts.get_counts("Cells") == expected
+
+    # a point added in a region
+    atlas_layer = viewer.layers[ATLAS_NAME]
+    centre = np.array(atlas_layer.data.shape) // 2 * atlas_layer.scale
+    cells.add(centre)
+    check()
+
+    cells.selected_data = {0, 3}
+    cells.remove_selected()
+    check()
+
+    # moved outside the brain, then every point replaced
+    data = cells.data.copy()
+    data[1] = [0, 0, 0]
+    cells.data = data
+    check()
+    cells.data = cells.data[::2]
+    check()
+
+    # non-cells are still counted as loaded
+    assert region_counts.get_counts("Non cells") == recount(
+        layers, "Non cells"
+    )
+    region_counts.export(tmp_path / "counts.csv")
+    assert (tmp_path / "counts.csv").exists()
@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import (
+    StandInAtlas,
+    make_brainmapper_dir,
+    make_brainreg_dir,
+    use_stand_in_atlas,
+)
+from brainglobe_napari_io import api
+from brainglobe_napari_io.brainreg import session_zarr
+
+ATLAS_NAME = "test_session_zarr_atlas"
+
+
+@pytest.fixture
+def atlas():
+    atlas = StandInAtlas(atlas_name=ATLAS_NAME, shape=(80, 48, 72))
+    with use_stand_in_atlas(atlas):
+        yield atlas
+
+
+@pytest.fixture
+def brainreg_dir(tmp_path, atlas):
+    return make_brainreg_dir(tmp_path / "brainreg", atlas, (10, 10, 10))
+
+
+@pytest.fixture
+def brainmapper_dir(tmp_path, atlas):
+    return make_brainmapper_dir(tmp_path / "brainmapper", atlas, n_cells=40)
+
+
+def assert_same_layers(layers, expected):
+    assert [(layer.name, layer.layer_type) for layer in layers] == [
+        (layer.name, layer.layer_type) for layer in expected
+    ]
+    for layer, expected_layer in zip(layers, expected):
+        data = (
+            layer.data[0] if layer.attributes.get("multiscale") else layer.data
+        )
+        np.testing.assert_array_equal(
+            np.asarray(data), np.asarray(expected_layer.data)
+        )
+        np.testing.assert_allclose(layer.scale, expected_layer.scale)
+        np.testing.assert_allclose(layer.translate, expected_layer.translate)
+
+
+def test_export_brainreg_session(tmp_path, brainreg_dir):
+    layers = api.load_brainreg_dir(brainreg_dir, orientation="psl")
+    path = api.export_session_zarr(
+        tmp_path / "session.ome.zarr", layers, chunks=(16, 16, 16)
+    )
+    assert session_zarr.is_session_zarr(path)
+    assert not session_zarr.is_session_zarr(brainreg_dir)
+
+    loaded = api.load_session_zarr(path)
+    assert_same_layers(loaded, layers)
+    for layer, expected in zip(loaded, layers):
+        assert layer.metadata.get("orientation") == expected.metadata.get(
+            "orientation"
+        )
+    annotation = api.get_layer(loaded, ATLAS_NAME)
+    assert annotation.layer_type == "labels"
+    assert annotation.metadata["atlas"] == ATLAS_NAME
+    # images are read lazily, from a pyramid
+    assert annotation.attributes["multiscale"]
+    assert not isinstance(annotation.data[0], np.ndarray)
+    assert annotation.data[1].shape == tuple(
+        s // 2 for s in annotation.data[0].shape
+    )
+    assert sorted(p.name for p in (path / "labels").iterdir()) == [
+        "Hemispheres",
+        ATLAS_NAME,
+        "zarr.json",
+    ]
+
+    # exporting again replaces the store
+    api.export_session_zarr(path, layers[:1])
+    assert len(api.load_session_zarr(path)) == 1
+
+
+def test_export_brainmapper_session(tmp_path, brainmapper_dir):
+    layers = api.load_brainmapper_dir(brainmapper_dir)
+    path = api.export_session_zarr(tmp_path / "session.zarr", layers)
+    loaded = api.load_session_zarr(path)
+    points = [layer for layer in layers if layer.layer_type == "points"]
+    assert points
+    assert_same_layers(
+        loaded,
+        [layer for layer in layers if layer.layer_type != "surface"],
+    )
+    for layer in points:
+        loaded_layer = api.get_layer(loaded, layer.name)
+        assert loaded_layer.attributes["symbol"] == layer.attributes["symbol"]
+        for name, values in layer.attributes.get("features", {}).items():
+            np.testing.assert_array_equal(
+                loaded_layer.attributes["features"][name], values
+            )
+
+
+def test_existing_path_is_not_replaced(tmp_path, brainreg_dir):
+    with pytest.raises(FileExistsError):
+        api.export_session_zarr(
+            brainreg_dir, api.load_brainreg_dir(brainreg_dir)
+        )
+
+
+def test_napari_reader_and_writer(tmp_path, brainreg_dir):
+    from napari.components import ViewerModel
+
+    viewer = ViewerModel()
+    for data, attributes, layer_type in api.as_layer_data_tuples(
+        api.load_brainreg_dir(brainreg_dir)
+    ):
+        getattr(viewer, f"add_{layer_type}")(data, **attributes)
+    viewer.add_points(
+        [[1, 2, 3], [4, 5, 6]],
+        name="Points",
+        features={"label": ["a", "b"], "value": [1.5, 2.5]},
+    )
+    path = str(tmp_path / "session.ome.zarr")
+    layer_data = [layer.as_layer_data_tuple() for layer in viewer.layers]
+    assert session_zarr.write_session_zarr(path, layer_data) == [path]
+
+    reader = session_zarr.session_zarr_read(path)
+    assert reader is session_zarr.reader_function
+    loaded = reader(path)
+    assert [attributes["name"] for _, attributes, _ in loaded] == [
+        layer.name for layer in viewer.layers
+    ]
+    data, attributes, layer_type = loaded[-1]
+    assert layer_type == "points"
+    np.testing.assert_array_equal(data, [[1, 2, 3], [4, 5, 6]])
+    np.testing.assert_array_equal(attributes["features"]["label"], ["a", "b"])
+    viewer.add_points(data, **attributes)
@@ -0,0 +1,93 @@
+import shutil
+
+import numpy as np
+import pytest
+from brainglobe_utils.cells.cells import Cell
+from brainglobe_utils.IO.cells import get_cells, save_cells
+
+from benchmarks.synthetic import (
+    StandInAtlas,
+    make_brainmapper_dir,
+    use_stand_in_atlas,
+)
+from brainglobe_napari_io import api
+from brainglobe_napari_io.brainmapper import watch
+from brainglobe_napari_io.cellfinder.cell_files import read_new_cells
+
+
+@pytest.fixture
+def brainmapper_dir(tmp_path):
+    atlas = StandInAtlas(atlas_name="test_watch_atlas", shape=(8, 40, 32))
+    with use_stand_in_atlas(atlas):
+        yield make_brainmapper_dir(tmp_path / "brainmapper", atlas, n_cells=20)
+
+
+def add_cells(cells_path, new_cells):
+    cells = get_cells(str(cells_path), cells_only=False) + new_cells
+    save_cells(cells, str(cells_path))
+
+
+@pytest.mark.parametrize("suffix", [".xml", ".yml"])
+def test_read_new_cells(tmp_path, suffix):
+    cells_path = tmp_path / f"cells{suffix}"
+    cells = [Cell([i, i, i], Cell.UNKNOWN + i % 2) for i in range(1, 7)]
+    save_cells(cells, str(cells_path))
+
+    all_cells = read_new_cells(cells_path)
+    assert len(all_cells.types) == 6
+    assert all_cells.counts == {Cell.UNKNOWN: 3, Cell.CELL: 3}
+
+    add_cells(cells_path, [Cell([10, 10, 10], Cell.CELL)])
+    new_cells = read_new_cells(cells_path, all_cells.counts)
+    np.testing.assert_array_equal(new_cells.positions, [[10, 10, 10]])
+    np.testing.assert_array_equal(new_cells.types, [Cell.CELL])
+    assert new_cells.counts == {Cell.UNKNOWN: 3, Cell.CELL: 4}
+
+
+def test_watcher(brainmapper_dir):
+    registration_dir = brainmapper_dir / "registration"
+    shutil.move(registration_dir, brainmapper_dir.parent / "registration")
+    watcher = watch.BrainmapperWatcher(brainmapper_dir, settle_time=0)
+
+    # the cells are loaded, then nothing changes
+    updates = watcher.update()
+    assert [update.layer.name for update in updates] == ["Non cells", "Cells"]
+    assert not any(update.append for update in updates)
+    assert watcher.update() == []
+
+    # only new cells are loaded
+    cells_path = brainmapper_dir / "points" / "cell_classification.xml"
+    add_cells(cells_path, [Cell([5, 6, 7], Cell.CELL)])
+    updates = watcher.update()
+    assert all(update.append for update in updates)
+    non_cells, cells = (update.layer for update in updates)
+    assert len(non_cells.data) == 0
+    np.testing.assert_array_equal(cells.data, [[7, 6, 5]])
+
+    # the registration is added once it has been written
+    shutil.move(brainmapper_dir.parent / "registration", registration_dir)
+    updates = watcher.update()
+    assert {update.layer.name for update in updates} == {
+        "Hemispheres",
+        "test_watch_atlas",
+        "Boundaries",
+    }
+
+
+def test_apply_updates(brainmapper_dir):
+    from napari.components import ViewerModel
+
+    viewer = ViewerModel()
+    watcher = watch.BrainmapperWatcher(brainmapper_dir, settle_time=0)
+    watch.apply_updates(viewer, watcher.update())
+    expected = api.load_brainmapper_dir(brainmapper_dir)
+    assert [layer.name for layer in viewer.layers] == [
+        layer.name for layer in expected
+    ]
+
+    cells_path = brainmapper_dir / "points" / "cell_classification.xml"
+    add_cells(cells_path, [Cell([5, 6, 7], Cell.CELL)])
+    watch.apply_updates(viewer, watcher.update())
+    cells = viewer.layers["Cells"].data
+    assert len(cells) == len(api.get_layer(expected, "Cells").data) + 1
+    np.testing.assert_array_equal(cells[-1], [7, 6, 5])
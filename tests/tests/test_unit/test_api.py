@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from brainglobe_napari_io.api import (
+    Layer,
+    as_layer_data_tuples,
+    as_layers,
+    get_layer,
+)
+
+
+def test_layer_properties():
+    image = Layer(
+        np.zeros((2, 3, 4)),
+        {"name": "image", "scale": [2, 2, 2], "metadata": {"a": 1}},
+    )
+    assert image.layer_type == "image"
+    assert image.name == "image"
+    assert image.metadata == {"a": 1}
+    np.testing.assert_array_equal(image.scale, [2, 2, 2])
+    np.testing.assert_array_equal(image.translate, [0, 0, 0])
+
+    points = Layer(np.zeros((5, 3)), {"translate": [1, 2, 3]}, "points")
+    assert points.ndim == 3
+    assert points.name is None
+    np.testing.assert_array_equal(points.scale, [1, 1, 1])
+    np.testing.assert_array_equal(points.translate, [1, 2, 3])
+
+
+def test_layer_conversion():
+    data = np.zeros((2, 2))
+    layers = as_layers(
+        [(data,), (data, {"name": "b"}), (data, {"name": "c"}, "labels")]
+    )
+    assert [layer.layer_type for layer in layers] == [
+        "image",
+        "image",
+        "labels",
+    ]
+    assert layers[0].attributes == {}
+
+    layer_data = as_layer_data_tuples(layers)
+    assert all(type(layer) is tuple for layer in layer_data)
+    assert layer_data[2] == (data, {"name": "c"}, "labels")
+    assert as_layers(layers)[2] is layers[2]
+
+
+def test_get_layer():
+    layers = [(np.zeros(1), {"name": "a"}), (np.ones(1), {"name": "b"})]
+    assert get_layer(layers, "b").data[0] == 1
+    with pytest.raises(KeyError, match="No layer named 'c'"):
+        get_layer(layers, "c")
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from brainglobe_napari_io.brainmapper.atlas_points import (
+    find_atlas_points_file,
+    read_atlas_points,
+)
+
+STRUCTURES = ["Primary motor area", "Hippocampus, CA1", "Thalamus"]
+
+
+@pytest.fixture
+def points_csv(tmp_path):
+    rng = np.random.default_rng(0)
+    n_points = 1000
+    df = pd.DataFrame(
+        {
+            **{
+                f"coordinate_raw_axis_{axis}": rng.integers(0, 5000, n_points)
+                for axis in range(3)
+            },
+            **{
+                f"coordinate_atlas_axis_{axis}": rng.integers(0, 100, n_points)
+                for axis in range(3)
+            },
+            "structure_name": rng.choice(STRUCTURES, n_points),
+            "hemisphere": rng.choice(["left", "right"], n_points),
+        }
+    )
+    # cells outside the brain have no region
+    df.loc[[3, 500], "structure_name"] = None
+    analysis_directory = tmp_path / "analysis"
+    analysis_directory.mkdir()
+    path = analysis_directory / "all_points.csv"
+    df.to_csv(path, index=False)
+    return path, df
+
+
+def test_find_atlas_points_file(points_csv, tmp_path):
+    path, _ = points_csv
+    assert find_atlas_points_file(tmp_path) == path
+    assert find_atlas_points_file(tmp_path / "analysis") is None
+
+
+@pytest.mark.parametrize("chunk_size", [7, 100_000])
+def test_read_atlas_points(points_csv, chunk_size):
+    path, df = points_csv
+    points = read_atlas_points(path, chunk_size=chunk_size)
+
+    assert points["atlas_coordinates"].dtype == np.float32
+    assert points["raw_coordinates"].shape == (1000, 3)
+    np.testing.assert_array_equal(
+        points["atlas_coordinates"],
+        df[[f"coordinate_atlas_axis_{axis}" for axis in range(3)]],
+    )
+    for column in ("structure_name", "hemisphere"):
+        assert isinstance(points[column], pd.Categorical)
+        assert [None if pd.isna(v) else v for v in points[column]] == [
+            None if pd.isna(v) else v for v in df[column]
+        ]
+    assert set(points["structure_name"].categories) == set(STRUCTURES)
+    assert points["structure_name"].isna().sum() == 2
+
+
+def test_read_atlas_points_empty(tmp_path):
+    path = tmp_path / "all_points.csv"
+    path.write_text(
+        ",".join(
+            [f"coordinate_raw_axis_{axis}" for axis in range(3)]
+            + [f"coordinate_atlas_axis_{axis}" for axis in range(3)]
+            + ["structure_name", "hemisphere"]
+        )
+        + "\n"
+    )
+    points = read_atlas_points(path)
+    assert points["atlas_coordinates"].shape == (0, 3)
+    assert len(points["structure_name"]) == 0
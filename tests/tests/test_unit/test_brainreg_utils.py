@@ -1,5 +1,11 @@
+import os
 import pathlib
 
+import brainglobe_space as bgs
+import numpy as np
+import pytest
+import tifffile
+
 from brainglobe_napari_io import utils
 
 brainreg_dir = (
@@ -20,3 +26,91 @@ def test_load_additional_downsampled_channels():
     layers = utils.load_additional_downsampled_channels(brainreg_dir, [])
     assert len(layers) == 1
     assert layers[0][1]["name"] == "brain (downsampled)"
+
+
+@pytest.mark.parametrize("target_orientation", ["asr", "psl", "ial", "rsa"])
+def test_reorient_points(target_orientation):
+    stack = np.arange(4 * 5 * 6).reshape(4, 5, 6)
+    reoriented = bgs.map_stack_to("asr", target_orientation, stack)
+    points = np.array([[0, 0, 0], [1, 2, 3], [3, 4, 5]])
+
+    new_points = utils.reorient_points(
+        points, "asr", target_orientation, stack.shape
+    ).astype(int)
+    for point, new_point in zip(points, new_points):
+        assert stack[tuple(point)] == reoriented[tuple(new_point)]
+
+
+@pytest.mark.parametrize("target_orientation", ["asr", "psl", "ial", "rsa"])
+def test_reorient_mesh(target_orientation):
+    # a tetrahedron with outward-facing triangles
+    vertices = np.array([[0, 0, 0], [3, 0, 0], [0, 4, 0], [0, 0, 5]], float)
+    faces = np.array([[0, 2, 1], [0, 1, 3], [0, 3, 2], [1, 2, 3]])
+
+    new_vertices, new_faces = utils.reorient_mesh(
+        vertices, faces, "asr", target_orientation, (4, 5, 6)
+    )
+    np.testing.assert_array_equal(
+        new_vertices,
+        utils.reorient_points(vertices, "asr", target_orientation, (4, 5, 6)),
+    )
+    a, b, c = (new_vertices[new_faces[:, i]] for i in range(3))
+    signed_volume = np.einsum("ij,ij->i", a, np.cross(b, c)).sum() / 6
+    assert signed_volume == pytest.approx(10)
+
+
+def test_is_up_to_date(tmp_path):
+    source = tmp_path / "source.tiff"
+    output = tmp_path / "output.tiff"
+    source.write_text("source")
+    assert not utils.is_up_to_date(output, [source])
+    output.write_text("output")
+    os.utime(source, (0, 0))
+    assert utils.is_up_to_date(output, [source, tmp_path / "missing"])
+    os.utime(output, (0, 0))
+    os.utime(source, (10, 10))
+    assert not utils.is_up_to_date(output, [source])
+
+
+def test_write_atomically(tmp_path):
+    path = tmp_path / "new_dir" / "file.txt"
+    with pytest.raises(RuntimeError):
+        with utils.write_atomically(path) as temporary_path:
+            temporary_path.write_text("partial")
+            raise RuntimeError
+    assert not path.exists()
+    assert list(path.parent.iterdir()) == []
+
+    with utils.write_atomically(path) as temporary_path:
+        temporary_path.write_text("complete")
+    assert path.read_text() == "complete"
+    assert list(path.parent.iterdir()) == [path]
+
+
+@pytest.mark.parametrize("converted", [False, True])
+def test_read_tiff_reoriented(tmp_path, converted):
+    image = np.arange(4 * 5 * 6, dtype=np.uint16).reshape(4, 5, 6)
+    path = tmp_path / "registered_atlas.tiff"
+    tifffile.imwrite(path, image)
+    expected = bgs.map_stack_to("asr", "psl", image)
+    if converted:
+        reoriented_path = utils.get_reoriented_path(path, "psl")
+        reoriented_path.parent.mkdir()
+        tifffile.imwrite(reoriented_path, expected)
+
+    reoriented = utils.read_tiff_reoriented(path, "asr", "psl")
+    assert isinstance(reoriented, np.memmap) == converted
+    np.testing.assert_array_equal(reoriented, expected)
+    # writable (e.g. to paint labels), without changing the files
+    reoriented[0] = 0
+    if converted:
+        np.testing.assert_array_equal(
+            tifffile.imread(reoriented_path), expected
+        )
+
+    region = {"start": (1, 2, 3), "stop": (3, 4, 6), "shape": image.shape}
+    expected_region = bgs.map_stack_to("asr", "psl", image[1:3, 2:4, 3:6])
+    np.testing.assert_array_equal(
+        utils.read_tiff_reoriented(path, "asr", "psl", region),
+        expected_region,
+    )
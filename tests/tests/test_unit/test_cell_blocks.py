@@ -0,0 +1,187 @@
+import os
+import pathlib
+
+import numpy as np
+import pytest
+from brainglobe_utils.cells.cells import Cell
+from brainglobe_utils.IO.cells import save_cells
+
+from brainglobe_napari_io.cellfinder import cell_blocks, utils
+
+xml_file = (
+    pathlib.Path(__file__).parent.parent.parent
+    / "data"
+    / "xml"
+    / "cell_classification.xml"
+)
+
+
+@pytest.fixture
+def cells():
+    rng = np.random.default_rng(0)
+    positions = rng.integers(0, 1000, (2000, 3)).astype(float)
+    types = rng.choice([Cell.UNKNOWN, Cell.CELL, Cell.ARTIFACT], 2000)
+    return positions, types
+
+
+def brute_force(positions, types, start, stop, cell_types):
+    keep = np.all((positions >= start) & (positions < stop), axis=1)
+    if cell_types is not None:
+        keep &= np.isin(types, cell_types)
+    return positions[keep], types[keep]
+
+
+def assert_same_cells(actual, expected):
+    # the block index doesn't keep the order of the file
+    actual = np.column_stack(actual)
+    expected = np.column_stack(expected)
+    np.testing.assert_array_equal(
+        actual[np.lexsort(actual.T[::-1])],
+        expected[np.lexsort(expected.T[::-1])],
+    )
+
+
+@pytest.mark.parametrize(
+    "start, stop, cell_types",
+    [
+        ((0, 0, 0), (1000, 1000, 1000), None),
+        ((100, 250, 600), (300, 700, 900), None),
+        ((100, 250, 600), (300, 700, 900), [Cell.CELL]),
+        ((-50, -50, -50), (10, 10, 10), [Cell.CELL, Cell.UNKNOWN]),
+        ((2000, 0, 0), (3000, 10, 10), None),
+    ],
+)
+def test_query_matches_brute_force(cells, start, stop, cell_types):
+    positions, types = cells
+    blocks = cell_blocks.CellBlocks.from_positions(positions, types, 128)
+    assert len(blocks) == len(positions)
+    assert_same_cells(
+        blocks.query(start, stop, cell_types),
+        brute_force(positions, types, start, stop, cell_types),
+    )
+
+
+def test_query_reads_only_overlapping_blocks(cells):
+    positions, types = cells
+    blocks = cell_blocks.CellBlocks.from_positions(positions, types, 100)
+    ranges = blocks.get_ranges((0, 0, 0), (99, 99, 99), [Cell.CELL])
+    n_read = int(np.sum(ranges[:, 1] - ranges[:, 0]))
+    assert 0 < n_read < len(positions) / 100
+    # contiguous ranges are merged
+    assert len(blocks.get_ranges()) == 1
+
+
+def test_type_counts(cells):
+    positions, types = cells
+    blocks = cell_blocks.CellBlocks.from_positions(positions, types)
+    assert blocks.get_type_counts() == {
+        int(t): int(np.sum(types == t)) for t in np.unique(types)
+    }
+
+
+def test_empty_cells():
+    blocks = cell_blocks.CellBlocks.from_positions(np.empty((0, 3)), [])
+    positions, types = blocks.query((0, 0, 0), (10, 10, 10))
+    assert positions.shape == (0, 3)
+    assert len(types) == 0
+
+
+def test_fractional_positions_are_kept_exactly():
+    positions = np.array([[0.1, 2.5, 3.0], [1e9 + 0.5, 2, 3]])
+    blocks = cell_blocks.CellBlocks.from_positions(positions, [1, 2])
+    assert blocks.cells["z"].dtype == np.float64
+    assert_same_cells(blocks.query(), (positions, [1, 2]))
+
+
+def test_get_cell_blocks_paths():
+    assert cell_blocks.get_cell_blocks_paths(
+        "points/cell_classification.xml.gz"
+    ) == (
+        pathlib.Path("points/cell_classification.cell_blocks.npy"),
+        pathlib.Path("points/cell_classification.cell_blocks.npz"),
+    )
+
+
+def test_index_is_saved_and_invalidated(tmp_path):
+    path = tmp_path / "cells.xml"
+    save_cells(
+        [Cell((1, 2, 3), Cell.CELL), Cell((400, 5, 6), Cell.UNKNOWN)],
+        str(path),
+    )
+    blocks = cell_blocks.get_cell_blocks(path)
+    assert cell_blocks.is_cell_blocks_up_to_date(path)
+    assert not blocks.has_metadata
+    assert isinstance(cell_blocks.get_cell_blocks(path).cells, np.memmap)
+
+    # make sure the changed cell file is newer than the index
+    for index_path in cell_blocks.get_cell_blocks_paths(path):
+        mtime = os.path.getmtime(index_path) - 10
+        os.utime(index_path, (mtime, mtime))
+    save_cells([Cell((7, 8, 9), Cell.CELL)], str(path))
+    assert not cell_blocks.is_cell_blocks_up_to_date(path)
+    positions, types = cell_blocks.read_cells_in_box(path)
+    np.testing.assert_array_equal(positions, [[9, 8, 7]])
+    assert cell_blocks.is_cell_blocks_up_to_date(path)
+
+
+def test_cells_with_metadata_are_not_indexed(tmp_path):
+    path = tmp_path / "cells.yml"
+    save_cells([Cell((1, 2, 3), Cell.CELL, {"a": 1})], str(path))
+    assert cell_blocks.read_cells_in_box(path, (0, 0, 0), (5, 5, 5)) is None
+
+
+def test_block_size_env_var(monkeypatch):
+    assert cell_blocks.get_block_size() == cell_blocks.DEFAULT_BLOCK_SIZE
+    monkeypatch.setenv(cell_blocks.CELL_BLOCK_SIZE_ENV_VAR, "64")
+    assert cell_blocks.get_block_size() == 64
+    monkeypatch.setenv(cell_blocks.CELL_BLOCK_SIZE_ENV_VAR, "off")
+    assert cell_blocks.get_block_size() is None
+    assert cell_blocks.read_cells_in_box(xml_file) is None
+    monkeypatch.setenv(cell_blocks.CELL_BLOCK_SIZE_ENV_VAR, "big")
+    with pytest.raises(ValueError, match="Invalid"):
+        cell_blocks.get_block_size()
+
+
+@pytest.mark.parametrize("block_size", ["off", "50"])
+def test_load_cells_in_box(tmp_path, monkeypatch, block_size):
+    monkeypatch.setenv(cell_blocks.CELL_BLOCK_SIZE_ENV_VAR, block_size)
+    path = tmp_path / xml_file.name
+    path.write_bytes(xml_file.read_bytes())
+    positions, types, _ = utils.read_cells(path)
+    start = positions.min(axis=0)
+    stop = (positions.min(axis=0) + positions.max(axis=0)) / 2
+    layers = utils.load_cells(
+        [],
+        path,
+        15,
+        0.6,
+        "ring",
+        "lightgoldenrodyellow",
+        "lightskyblue",
+        bounds=(start, stop),
+        cell_types=[Cell.CELL],
+    )
+    expected, _ = brute_force(positions, types, start, stop, [Cell.CELL])
+    assert len(layers[0][0]) == 0
+    assert_same_cells((layers[1][0],), (expected,))
+    assert 0 < len(expected) < np.sum(types == Cell.CELL)
+
+
+def test_read_cells_strided(tmp_path):
+    from brainglobe_napari_io.cellfinder.cell_files import write_binary_cells
+
+    path = tmp_path / xml_file.name
+    path.write_bytes(xml_file.read_bytes())
+    positions, types, _ = utils.read_cells(path)
+    # reading any cells would mean parsing the file
+    assert cell_blocks.read_cells_strided(path, 4) is None
+
+    write_binary_cells(path)
+    strided = cell_blocks.read_cells_strided(path, 4)
+    np.testing.assert_array_equal(strided[0], positions[::4])
+    np.testing.assert_array_equal(strided[1], types[::4])
+
+    blocks = cell_blocks.get_cell_blocks(path)
+    strided = cell_blocks.read_cells_strided(path, 4)
+    assert len(strided[0]) == len(positions[::4])
+    np.testing.assert_array_equal(strided[1], blocks.cells["type"][::4])
@@ -0,0 +1,222 @@
+import os
+import pathlib
+
+import numpy as np
+import pytest
+from brainglobe_utils.cells.cells import Cell
+from brainglobe_utils.IO.cells import get_cells, save_cells
+
+from brainglobe_napari_io.cellfinder import cell_files, utils
+
+xml_file = (
+    pathlib.Path(__file__).parent.parent.parent
+    / "data"
+    / "xml"
+    / "cell_classification.xml"
+)
+
+try:
+    import zstandard  # noqa: F401
+
+    HAS_ZSTANDARD = True
+except ImportError:
+    HAS_ZSTANDARD = False
+needs_zstandard = pytest.mark.skipif(
+    not HAS_ZSTANDARD, reason="zstandard is not installed"
+)
+
+
+def test_get_binary_cells_path():
+    assert cell_files.get_binary_cells_path(
+        "points/cell_classification.xml"
+    ) == pathlib.Path("points/cell_classification.cells.npz")
+    assert cell_files.get_binary_cells_path(
+        "points/cell_classification.xml.gz"
+    ) == pathlib.Path("points/cell_classification.cells.npz")
+
+
+def test_get_cell_file_suffix():
+    assert cell_files.get_cell_file_suffix("cells.xml") == ".xml"
+    assert cell_files.get_cell_file_suffix("cells.yml.gz") == ".yml"
+    assert cell_files.get_cell_file_suffix("cells.XML.zst") == ".xml"
+    assert cell_files.get_compression("cells.xml.gz") == "gzip"
+    assert cell_files.get_compression("cells.xml.zst") == "zstd"
+    assert cell_files.get_compression("cells.xml") is None
+
+
+@pytest.mark.parametrize(
+    "compression", ["gz", pytest.param("zst", marks=needs_zstandard)]
+)
+@pytest.mark.parametrize("suffix", [".xml", ".yml"])
+def test_compressed_cells_round_trip(tmp_path, suffix, compression):
+    cells = [
+        Cell((1, 2, 3), Cell.CELL, {"a": 1}),
+        Cell((4, 5, 6), Cell.UNKNOWN, {"a": 2}),
+        Cell((7, 8, 9), Cell.CELL, {"a": 3}),
+    ]
+    path = tmp_path / f"cells{suffix}.{compression}"
+    assert cell_files.write_cells(cells, path) == path
+    assert list(tmp_path.iterdir()) == [path]
+    with cell_files.open_cell_file(path) as cells_file:
+        assert b"CellCounter_Marker_File" in cells_file.read()
+    assert cell_files.is_cell_file(path, (suffix,))
+    assert not cell_files.is_cell_file(path, (".yaml",))
+
+    uncompressed_path = tmp_path / f"cells{suffix}"
+    cell_files.write_cells(cells, uncompressed_path)
+    assert path.stat().st_size < uncompressed_path.stat().st_size
+    expected = cell_files.parse_cells(uncompressed_path)
+    positions, types, metadata = cell_files.read_cells(path)
+    np.testing.assert_array_equal(positions, expected[0])
+    np.testing.assert_array_equal(types, expected[1])
+    assert metadata == expected[2]
+
+    cell_files.write_binary_cells(path)
+    binary_positions, _, _ = cell_files.read_binary_cells(
+        tmp_path / "cells.cells.npz"
+    )
+    np.testing.assert_array_equal(binary_positions, expected[0])
+
+
+@pytest.mark.parametrize("suffix", [".xml", ".yml"])
+def test_write_cells_as_brainglobe_utils(tmp_path, suffix):
+    def make_cells():
+        # saving artifacts changes their type
+        return [
+            Cell((1, 2, 3), Cell.CELL, {"a": 1}),
+            Cell((4, 5, 6), Cell.ARTIFACT),
+        ]
+
+    expected_path = tmp_path / f"expected{suffix}"
+    save_cells(make_cells(), expected_path)
+    path = cell_files.write_cells(make_cells(), tmp_path / f"cells{suffix}")
+    assert path.read_bytes() == expected_path.read_bytes()
+
+
+@pytest.mark.parametrize("name", ["CELLS.XML", "CELLS.XML.GZ"])
+def test_upper_case_suffix(tmp_path, name):
+    path = cell_files.write_cells(
+        [Cell((1, 2, 3), Cell.CELL)], tmp_path / name
+    )
+    assert cell_files.is_cell_file(path, (".xml",))
+    positions, _, _ = cell_files.parse_cells(path)
+    np.testing.assert_array_equal(positions, [[3, 2, 1]])
+
+
+def test_read_new_cells_compressed(tmp_path):
+    path = tmp_path / "cells.xml.gz"
+    cell_files.write_cells(
+        [Cell((i, i, i), Cell.CELL) for i in range(5)], path
+    )
+    new_cells = cell_files.read_new_cells(path, {Cell.CELL: 3})
+    np.testing.assert_array_equal(new_cells.positions, [[3] * 3, [4] * 3])
+    assert new_cells.counts == {Cell.CELL: 5}
+
+
+def test_is_cell_file_corrupt(tmp_path):
+    path = tmp_path / "cells.xml.gz"
+    path.write_bytes(b"not gzip")
+    assert not cell_files.is_cell_file(path, (".xml",))
+
+
+def test_is_cell_file_only_reads_the_start(tmp_path):
+    path = tmp_path / "other.xml.gz"
+    with cell_files.open_cell_file(path, "wb") as other_file:
+        other_file.write(b"<other>\n" * cell_files.MARKER_SEARCH_CHARS)
+        # too far in to be looked for
+        other_file.write(b"<CellCounter_Marker_File>\n")
+    assert not cell_files.is_cell_file(path, (".xml",))
+
+
+def test_is_cell_file_zstd(tmp_path):
+    pytest.importorskip("zstandard")
+    cells = [Cell((1, 2, 3), Cell.CELL)]
+    xml_path = cell_files.write_cells(cells, tmp_path / "cells.xml.zst")
+    assert cell_files.is_cell_file(xml_path, (".xml",))
+
+    # the marker of the format of the suffix is looked for
+    yml_path = tmp_path / "cells.yml.zst"
+    os.rename(xml_path, yml_path)
+    assert not cell_files.is_cell_file(yml_path, (".yml",))
+
+
+def test_binary_cells_round_trip(tmp_path):
+    output_path = cell_files.write_binary_cells(
+        xml_file, tmp_path / "cells.cells.npz"
+    )
+    positions, types, metadata = cell_files.read_binary_cells(output_path)
+
+    cells = get_cells(str(xml_file), cells_only=False)
+    np.testing.assert_array_equal(positions, [(c.z, c.y, c.x) for c in cells])
+    assert positions.dtype == np.float32
+    np.testing.assert_array_equal(types, [c.type for c in cells])
+    assert metadata is None
+
+
+def test_binary_cells_metadata(tmp_path):
+    cells_path = tmp_path / "cell_classification.yml"
+    save_cells(
+        [
+            Cell([1, 2, 3], Cell.CELL, metadata={"score": 0.5}),
+            Cell([4, 5, 6], Cell.UNKNOWN),
+        ],
+        str(cells_path),
+    )
+    cell_files.write_binary_cells(cells_path)
+    positions, types, metadata = cell_files.read_cells(cells_path)
+    np.testing.assert_array_equal(positions, [(3, 2, 1), (6, 5, 4)])
+    np.testing.assert_array_equal(types, [Cell.CELL, Cell.UNKNOWN])
+    assert metadata == [{"score": 0.5}, {}]
+
+
+def test_read_cells_uses_up_to_date_binary(tmp_path, mocker):
+    cells_path = tmp_path / "cell_classification.xml"
+    cells_path.write_bytes(xml_file.read_bytes())
+    parse = mocker.spy(cell_files, "read_binary_cells")
+
+    expected = cell_files.read_cells(cells_path)
+    assert parse.call_count == 0
+
+    binary_path = cell_files.write_binary_cells(cells_path)
+    positions, types, _ = cell_files.read_cells(cells_path)
+    assert parse.call_count == 1
+    np.testing.assert_array_equal(positions, expected[0])
+    np.testing.assert_array_equal(types, expected[1])
+
+    # once the original is changed, the binary copy is out of date
+    os.utime(binary_path, (0, 0))
+    cell_files.read_cells(cells_path)
+    assert parse.call_count == 1
+
+
+def test_load_cells_from_binary(tmp_path):
+    cells_path = tmp_path / "cell_classification.xml"
+    cells_path.write_bytes(xml_file.read_bytes())
+    expected = utils.load_cells([], cells_path, 1, 1, "disk", "a", "b")
+    cell_files.write_binary_cells(cells_path)
+    layers = utils.load_cells([], cells_path, 1, 1, "disk", "a", "b")
+
+    for (data, attributes, _), (expected_data, expected_attributes, _) in zip(
+        layers, expected
+    ):
+        np.testing.assert_array_equal(data, expected_data)
+        assert attributes["name"] == expected_attributes["name"]
+        assert attributes["features"].keys() == (
+            expected_attributes["features"].keys()
+        )
+
+
+def test_read_cell_positions(tmp_path):
+    expected_positions, expected_types, _ = cell_files.read_cells(xml_file)
+    positions, types = cell_files.read_cell_positions(xml_file)
+    np.testing.assert_array_equal(positions, expected_positions)
+    np.testing.assert_array_equal(types, expected_types)
+    assert len(positions) > 0
+
+    # from an up-to-date binary copy
+    cells_path = tmp_path / "cell_classification.xml"
+    cells_path.write_bytes(xml_file.read_bytes())
+    cell_files.write_binary_cells(cells_path)
+    positions, types = cell_files.read_cell_positions(cells_path)
+    np.testing.assert_array_equal(positions, expected_positions)
+    np.testing.assert_array_equal(types, expected_types)
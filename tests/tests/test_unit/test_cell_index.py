@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+from brainglobe_utils.cells.cells import Cell
+
+from brainglobe_napari_io.cellfinder import cell_index
+from brainglobe_napari_io.cellfinder.cell_index import CellIndex
+
+
+def points_layer(data, point_type=None):
+    metadata = {} if point_type is None else {"point_type": point_type}
+    return np.asarray(data, dtype=float), {"metadata": metadata}, "points"
+
+
+@pytest.fixture
+def layers():
+    return [
+        points_layer([[0, 0, 0], [10, 10, 10], [20, 20, 20]], Cell.UNKNOWN),
+        points_layer([[10, 10, 10], [20.5, 20, 20], [30, 30, 30]], Cell.CELL),
+        points_layer([[0, 0, 0], [0, 0, 0]]),
+    ]
+
+
+def test_from_layers(layers):
+    image = (np.zeros((4, 4, 4)), {}, "image")
+    index = CellIndex.from_layers([*layers, image])
+    assert len(index) == 8
+    np.testing.assert_array_equal(
+        index.layer_indices, [0, 0, 0, 1, 1, 1, 2, 2]
+    )
+    np.testing.assert_array_equal(index.rows, [0, 1, 2, 0, 1, 2, 0, 1])
+    assert list(index.types[:3]) == [Cell.UNKNOWN] * 3
+    assert list(index.types[3:6]) == [Cell.CELL] * 3
+    assert list(index.types[6:]) == [Cell.UNKNOWN] * 2
+
+
+@pytest.mark.parametrize(
+    "tolerance, policy, expected",
+    [
+        # only identical positions are merged, and cells are kept
+        (0, "cell", [1, 0, 1, 1, 1, 1, 0, 0]),
+        # the point 0.5 away is merged too
+        (1, "cell", [1, 0, 0, 1, 1, 1, 0, 0]),
+        (1, "non_cell", [1, 1, 1, 0, 0, 1, 0, 0]),
+        (0, "first", [1, 1, 1, 0, 1, 1, 0, 0]),
+    ],
+)
+def test_deduplicate(layers, tolerance, policy, expected):
+    index = CellIndex.from_layers(layers)
+    keep = index.deduplicate(tolerance, policy)
+    np.testing.assert_array_equal(keep, np.array(expected, bool))
+
+
+def test_duplicate_groups_are_transitive():
+    index = CellIndex(np.array([[0, 0, 0], [0, 0, 1], [0, 0, 2]]), 1)
+    np.testing.assert_array_equal(index.get_duplicate_groups(1), [0, 0, 0])
+    np.testing.assert_array_equal(index.get_duplicate_groups(0), [0, 1, 2])
+
+
+def test_nearest(layers):
+    index = CellIndex.from_layers(layers[:2])
+    distances, indices = index.nearest(
+        [[11, 10, 10], [100, 100, 100]], max_distance=5
+    )
+    assert distances[0] == 1
+    assert index.positions[indices[0]].tolist() == [10, 10, 10]
+    assert distances[1] == np.inf
+    assert indices[1] == len(index)
+
+
+def test_empty_index():
+    index = CellIndex.from_layers([points_layer(np.empty((0, 3)))])
+    assert len(index) == 0
+    assert len(index.deduplicate(1)) == 0
+    distances, _ = index.nearest([[0, 0, 0]])
+    assert distances[0] == np.inf
+
+
+def test_points_must_be_3d():
+    with pytest.raises(ValueError, match="Nx3"):
+        CellIndex(np.zeros((4, 2)), 1)
+    # 2D layers are left out
+    layers = [
+        points_layer(np.zeros((4, 2))),
+        points_layer(np.ones((2, 3))),
+    ]
+    index = CellIndex.from_layers(layers)
+    assert len(index) == 2
+    np.testing.assert_array_equal(index.layer_indices, [1, 1])
+
+
+def test_duplicates_are_only_merged_if_set(monkeypatch):
+    monkeypatch.delenv(cell_index.DUPLICATE_TOLERANCE_ENV_VAR, False)
+    assert cell_index.get_duplicate_tolerance() is None
+    monkeypatch.setenv(cell_index.DUPLICATE_TOLERANCE_ENV_VAR, "0")
+    assert cell_index.get_duplicate_tolerance() == 0
+
+
+def test_invalid_settings(monkeypatch):
+    monkeypatch.setenv(cell_index.DUPLICATE_TOLERANCE_ENV_VAR, "off")
+    assert cell_index.get_duplicate_tolerance() is None
+    monkeypatch.setenv(cell_index.DUPLICATE_TOLERANCE_ENV_VAR, "-1")
+    with pytest.raises(ValueError):
+        cell_index.get_duplicate_tolerance()
+    monkeypatch.setenv(cell_index.DUPLICATE_POLICY_ENV_VAR, "random")
+    with pytest.raises(ValueError):
+        cell_index.get_duplicate_policy()
+    with pytest.raises(ValueError):
+        CellIndex(np.zeros((1, 3)), 1).deduplicate(policy="random")
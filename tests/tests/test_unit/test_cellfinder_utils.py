@@ -60,6 +60,41 @@ def test_load_cells(cell_layers):
     assert len(cell_layers[1][0]) == 103
 
 
+def test_load_cells_decimated(tmp_path):
+    from brainglobe_napari_io.cellfinder.cell_files import write_binary_cells
+
+    path = tmp_path / xml_file.name
+    path.write_bytes(xml_file.read_bytes())
+
+    def load():
+        return utils.load_cells(
+            [],
+            path,
+            1,
+            1,
+            "disk",
+            "lightgoldenrodyellow",
+            "lightskyblue",
+            decimation=4,
+        )
+
+    positions, types, _ = utils.read_cells(path)
+    # without a binary copy or index, the file is parsed, and with one
+    # only every nth cell is read
+    for binary in (False, True):
+        if binary:
+            write_binary_cells(path)
+        non_cells, cells = load()
+        np.testing.assert_array_equal(
+            cells[0], positions[::4][types[::4] == Cell.CELL]
+        )
+        np.testing.assert_array_equal(
+            non_cells[0], positions[::4][types[::4] == Cell.UNKNOWN]
+        )
+        assert len(cells[0]) > 0
+        assert cells[1]["metadata"][utils.PARTIAL_KEY]
+
+
 def test_load_cells_with_channel(cell_layers_channel_6):
     assert len(cell_layers_channel_6) == 2
     assert cell_layers_channel_6[0][1]["name"] == "channel_6: Non cells"
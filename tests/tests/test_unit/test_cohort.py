@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+import tifffile
+
+from brainglobe_napari_io.brainreg import cohort
+
+
+@pytest.fixture
+def images():
+    rng = np.random.default_rng(0)
+    # a large offset, where summing squares loses precision
+    images = 1e8 + rng.normal(0, 1, (5, 7, 4, 6))
+    images[0, 0, 0, 0] = np.nan
+    return images
+
+
+def test_statistics_match_numpy(images):
+    statistics = cohort.CohortStatistics(images.shape[1:])
+    for image in images:
+        statistics.add(image)
+
+    np.testing.assert_array_equal(
+        statistics.count, np.sum(~np.isnan(images), axis=0)
+    )
+    np.testing.assert_allclose(
+        statistics.mean, np.nanmean(images, axis=0), rtol=1e-12
+    )
+    for ddof in (0, 1):
+        np.testing.assert_allclose(
+            statistics.std(ddof),
+            np.nanstd(images, axis=0, ddof=ddof),
+            rtol=1e-6,
+        )
+
+
+def test_statistics_ignore_zeros():
+    statistics = cohort.CohortStatistics((3,))
+    for image in ([0, 2, 0], [4, 4, 0]):
+        statistics.add(np.array(image, float), ignore_zeros=True)
+    np.testing.assert_array_equal(statistics.count, [1, 2, 0])
+    np.testing.assert_array_equal(statistics.mean[:2], [4, 3])
+    np.testing.assert_array_equal(statistics.std(1)[1:], [np.sqrt(2), np.nan])
+
+
+@pytest.mark.parametrize("n_workers", [1, 3])
+def test_average_cohort_in_chunks(tmp_path, n_workers):
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 1000, (4, 7, 4, 6), dtype=np.uint16)
+    paths = []
+    for i, image in enumerate(images):
+        paths.append(tmp_path / f"{i}.tiff")
+        tifffile.imwrite(paths[-1], image)
+
+    result = cohort.average_cohort(
+        paths, ddof=1, n_workers=n_workers, chunk_planes=2
+    )
+    np.testing.assert_allclose(result["mean"], images.mean(axis=0))
+    np.testing.assert_allclose(
+        result["std"], images.std(axis=0, ddof=1), rtol=1e-5
+    )
+    assert (result["count"] == 4).all()
+
+    tifffile.imwrite(paths[-1], images[-1, :3])
+    with pytest.raises(ValueError, match="shape"):
+        cohort.average_cohort(paths)
+
+
+@pytest.mark.parametrize("storage", ["zarr", "compressed"])
+def test_average_cohort_reads_other_storage(tmp_path, storage, capsys):
+    from benchmarks.synthetic import write_ome_zarr
+
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 1000, (3, 7, 4, 6), dtype=np.uint16)
+    paths = []
+    for i, image in enumerate(images):
+        paths.append(tmp_path / f"{i}.tiff")
+        if storage == "zarr":
+            # the Zarr variant is read instead of the TIFF
+            tifffile.imwrite(paths[-1], np.zeros_like(image))
+            write_ome_zarr(tmp_path / f"{i}.ome.zarr", image)
+        else:
+            # one compressed (volumetric) page, so it can only be decoded
+            # whole
+            tifffile.imwrite(
+                paths[-1], image, compression="zlib", tile=(8, 16, 16)
+            )
+            with tifffile.TiffFile(paths[-1]) as tif:
+                assert len(tif.pages) == 1
+
+    result = cohort.average_cohort(paths, n_workers=2, chunk_planes=2)
+    np.testing.assert_allclose(result["mean"], images.mean(axis=0))
+    # each compressed image is decoded once, not once per chunk
+    n_decoded = 3 if storage == "compressed" else 0
+    assert capsys.readouterr().out.count("Decoding") == n_decoded
+
+
+def test_get_chunk_planes():
+    assert cohort.get_chunk_planes((100, 64, 64), 64 * 64 * 8 * 10) == 10
+    assert cohort.get_chunk_planes((100, 64, 64), 1) == 1
+    assert cohort.get_chunk_planes((5, 64, 64)) == 5
@@ -0,0 +1,148 @@
+import threading
+from concurrent.futures import Future, wait
+
+import numpy as np
+import pytest
+
+from brainglobe_napari_io.brainmapper import cubes as cubes_module
+from brainglobe_napari_io.brainmapper.cubes import (
+    CellCubes,
+    get_cube_shape,
+    sort_cells,
+)
+
+CUBE_SHAPE = (4, 6, 6)
+
+
+class CountingStack:
+    """A 3D array exposing get_plane, counting how often each plane is read."""
+
+    def __init__(self, data):
+        self.data = data
+        self.shape = data.shape
+        self.dtype = data.dtype
+        self.reads = np.zeros(data.shape[0], dtype=int)
+
+    def get_plane(self, z):
+        self.reads[z] += 1
+        return self.data[z]
+
+
+@pytest.fixture
+def stack():
+    rng = np.random.default_rng(0)
+    return CountingStack(rng.integers(1, 1000, (30, 40, 50), dtype=np.uint16))
+
+
+def expected_cube(data, position):
+    padded = np.pad(data, [(s, s) for s in CUBE_SHAPE])
+    start = np.array(position) - np.array(CUBE_SHAPE) // 2
+    start += np.array(CUBE_SHAPE)
+    return padded[tuple(slice(s, s + n) for s, n in zip(start, CUBE_SHAPE))]
+
+
+def test_get_cube_shape():
+    metadata = {
+        "cube_depth": 20,
+        "cube_height": 50,
+        "cube_width": 50,
+        "voxel_sizes": ["5", "2", "2"],
+        "network_voxel_sizes": [5, 1, 1],
+    }
+    assert get_cube_shape(metadata) == (20, 25, 25)
+
+
+def test_sort_cells():
+    positions = np.array([[5, 1, 1], [1, 9, 9], [1, 2, 3], [1, 2, 1]])
+    np.testing.assert_array_equal(sort_cells(positions), [3, 2, 1, 0])
+
+
+def test_cell_cubes(stack):
+    positions = np.array([[10, 20, 25], [0, 0, 0], [29, 39, 49], [11, 5, 7]])
+    cubes = CellCubes(stack, positions, CUBE_SHAPE, batch_size=2)
+    assert cubes.shape == (4, *CUBE_SHAPE)
+    assert cubes.ndim == 4
+
+    for idx, position in enumerate(positions):
+        np.testing.assert_array_equal(
+            cubes[idx], expected_cube(stack.data, position)
+        )
+    np.testing.assert_array_equal(
+        cubes[1:3, 2], np.stack([cubes[1][2], cubes[2][2]])
+    )
+    assert cubes[2:2].shape == (0, *CUBE_SHAPE)
+
+    with pytest.raises(IndexError):
+        cubes[4]
+
+
+def test_cell_cubes_reads_each_plane_once_per_batch(stack):
+    positions = np.array([[10, 20, 20], [11, 10, 30], [12, 30, 10]])
+    cubes = CellCubes(stack, positions, CUBE_SHAPE, batch_size=3)
+    cubes.extract_batch([0, 1, 2])
+    assert stack.reads.max() == 1
+    # the batch covers planes 8 to 13
+    assert stack.reads.sum() == 6
+
+    # cached cubes don't re-read the raw data
+    for idx in range(3):
+        cubes[idx]
+    assert stack.reads.sum() == 6
+
+
+def test_cell_cubes_prefetches_next_batch(stack):
+    positions = np.array([[z, 20, 20] for z in range(2, 28)])
+    cubes = CellCubes(stack, positions, CUBE_SHAPE, batch_size=4)
+    cubes[0]
+    cubes[2]
+    wait(set(cubes._pending.values()))
+    assert set(cubes._cache) == set(range(8))
+    cubes.close()
+
+
+def test_cell_cubes_share_prefetch_threads(stack):
+    positions = np.array([[z, 20, 20] for z in range(2, 28)])
+    n_threads = threading.active_count()
+    all_cubes = [
+        CellCubes(stack, positions, CUBE_SHAPE, batch_size=4)
+        for _ in range(2 * cubes_module.N_PREFETCH_THREADS)
+    ]
+    for cubes in all_cubes:
+        cubes[2]
+    # without closing the cubes
+    assert (
+        threading.active_count() <= n_threads + cubes_module.N_PREFETCH_THREADS
+    )
+    for cubes in all_cubes:
+        cubes.close()
+        assert not cubes._pending
+
+
+def test_cancelled_batch_is_extracted(stack):
+    positions = np.array([[z, 20, 20] for z in range(2, 28)])
+    cubes = CellCubes(stack, positions, CUBE_SHAPE, batch_size=4)
+    # a batch queued to be extracted, and cancelled (e.g. by close)
+    pending: Future = Future()
+    pending.cancel()
+    pending.set_running_or_notify_cancel()
+    for idx in range(4, 8):
+        cubes._pending[idx] = pending
+    np.testing.assert_array_equal(
+        cubes[5], expected_cube(stack.data, positions[5])
+    )
+    cubes.close()
+
+
+def test_prefetch_threads_are_reset_in_forked_process():
+    executor = cubes_module.get_prefetch_executor()
+    cubes_module._reset_prefetch_executor()
+    assert cubes_module.get_prefetch_executor() is not executor
+    executor.shutdown()
+
+
+def test_cell_cubes_cache_is_bounded(stack):
+    positions = np.array([[z, 20, 20] for z in range(2, 28)])
+    cubes = CellCubes(stack, positions, CUBE_SHAPE, batch_size=2, cache_size=4)
+    for idx in range(len(positions)):
+        cubes.extract_batch([idx])
+    assert len(cubes._cache) == 4
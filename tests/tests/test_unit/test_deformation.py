@@ -0,0 +1,158 @@
+from types import SimpleNamespace
+
+import brainglobe_space as bgs
+import numpy as np
+import pytest
+import tifffile
+
+from benchmarks.synthetic import write_ome_zarr
+from brainglobe_napari_io.brainreg import deformation
+
+SHAPE = (10, 12, 14)
+RESOLUTION = (25.0, 25.0, 25.0)
+
+
+@pytest.fixture
+def identity_fields():
+    # each field gives the position along its axis in mm, so maps each
+    # downsampled voxel onto the same atlas voxel
+    grid = np.indices(SHAPE).astype(np.float32)
+    return [grid[axis] * RESOLUTION[axis] / 1000 for axis in range(3)]
+
+
+@pytest.fixture
+def brainreg_dir(tmp_path, identity_fields):
+    for axis, field in enumerate(identity_fields):
+        tifffile.imwrite(tmp_path / f"deformation_field_{axis}.tiff", field)
+    return tmp_path
+
+
+def test_load_deformation_fields(brainreg_dir, identity_fields):
+    assert deformation.has_deformation_fields(brainreg_dir)
+    assert not deformation.has_deformation_fields(brainreg_dir.parent)
+
+    fields = deformation.load_deformation_fields(brainreg_dir)
+    for field, expected in zip(fields, identity_fields):
+        assert isinstance(field, np.memmap)
+        np.testing.assert_array_equal(field, expected)
+
+
+def test_memmap_tiff_compressed(tmp_path):
+    path = tmp_path / "compressed.tiff"
+    data = np.arange(24, dtype=np.uint16).reshape(2, 3, 4)
+    tifffile.imwrite(path, data, compression="zlib")
+    np.testing.assert_array_equal(deformation.memmap_tiff(path), data)
+
+
+def test_load_deformation_field_layers(brainreg_dir):
+    layers = deformation.load_deformation_field_layers(brainreg_dir, [])
+    assert [layer[1]["name"] for layer in layers] == [
+        "Deformation field 0",
+        "Deformation field 1",
+        "Deformation field 2",
+    ]
+    assert all(layer[0].shape == SHAPE for layer in layers)
+    assert (
+        deformation.load_deformation_field_layers(brainreg_dir.parent, [])
+        == []
+    )
+
+
+def test_sample_trilinear():
+    # trilinear interpolation is exact for a function linear along each axis
+    grid = np.indices(SHAPE).astype(float)
+    volume = 2 * grid[0] - 3 * grid[1] + 0.5 * grid[2] + grid[0] * grid[2]
+    rng = np.random.default_rng(0)
+    points = rng.random((500, 3)) * (np.array(SHAPE) - 1)
+    points[0] = np.array(SHAPE) - 1
+
+    expected = (
+        2 * points[:, 0]
+        - 3 * points[:, 1]
+        + 0.5 * points[:, 2]
+        + points[:, 0] * points[:, 2]
+    )
+    values = deformation.sample_trilinear([volume, volume], points)
+    np.testing.assert_allclose(values[:, 0], expected)
+    np.testing.assert_allclose(values[:, 1], expected)
+
+    outside = np.array([[-0.1, 0, 0], [0, SHAPE[1] - 0.9, 0]])
+    assert np.isnan(deformation.sample_trilinear([volume], outside)).all()
+
+
+@pytest.mark.parametrize("chunk_size", [7, 1000])
+def test_transform_points_downsampled_to_atlas(identity_fields, chunk_size):
+    rng = np.random.default_rng(0)
+    points = rng.random((100, 3)) * (np.array(SHAPE) - 1)
+    transformed = deformation.transform_points_downsampled_to_atlas(
+        points, identity_fields, RESOLUTION, chunk_size=chunk_size
+    )
+    np.testing.assert_allclose(transformed, points, rtol=1e-5)
+
+
+@pytest.mark.parametrize("chunk_size", [7, 1000])
+def test_transform_points_with_zarr_fields(
+    tmp_path, identity_fields, chunk_size
+):
+    for axis, field in enumerate(identity_fields):
+        write_ome_zarr(tmp_path / f"deformation_field_{axis}.zarr", field)
+    fields = deformation.load_deformation_fields(tmp_path)
+    assert not any(isinstance(field, np.ndarray) for field in fields)
+
+    rng = np.random.default_rng(0)
+    points = rng.random((100, 3)) * (np.array(SHAPE) - 1)
+    points[0] = [-1, 0, 0]
+    transformed = deformation.transform_points_downsampled_to_atlas(
+        points, fields, RESOLUTION, chunk_size=chunk_size
+    )
+    assert np.isnan(transformed[0]).all()
+    np.testing.assert_allclose(transformed[1:], points[1:], rtol=1e-5)
+
+
+@pytest.mark.parametrize("raw_orientation", ["asr", "psl", "ial", "sal"])
+def test_transform_points_sample_to_atlas(identity_fields, raw_orientation):
+    atlas = SimpleNamespace(orientation="asr", resolution=RESOLUTION)
+    metadata = {"orientation": raw_orientation}
+    scale = (2.0, 4.0, 5.0)
+
+    # find where some downsampled voxels are displayed in sample space, by
+    # reorienting and scaling a volume in the same way as the readers
+    volume = np.arange(np.prod(SHAPE)).reshape(SHAPE)
+    reoriented = bgs.map_stack_to("asr", raw_orientation, volume)
+    voxels = np.array([[0, 0, 0], [3, 4, 5], [9, 11, 13], [9, 0, 2]])
+    sample_points = np.array(
+        [
+            np.argwhere(reoriented == volume[tuple(voxel)])[0] * scale
+            for voxel in voxels
+        ]
+    )
+
+    transformed = deformation.transform_points_sample_to_atlas(
+        sample_points, identity_fields, atlas, metadata, scale
+    )
+    np.testing.assert_allclose(transformed, voxels, atol=1e-4)
+
+
+def test_cell_layers_to_atlas_space(identity_fields):
+    atlas = SimpleNamespace(orientation="asr", resolution=RESOLUTION)
+    layers = [
+        (
+            np.array([[1.0, 2.0, 3.0], [100.0, 2.0, 3.0]]),
+            {"name": "Cells", "features": {"a": np.array([1, 2])}},
+            "points",
+        ),
+        (np.array([]), {"name": "Non cells", "features": {}}, "points"),
+    ]
+    new_layers = deformation.cell_layers_to_atlas_space(
+        layers, identity_fields, atlas, {"orientation": "asr"}, (1, 1, 1)
+    )
+    assert [layer[1]["name"] for layer in new_layers] == [
+        "Cells (atlas space)",
+        "Non cells (atlas space)",
+    ]
+    # the point outside the registered image is dropped
+    np.testing.assert_allclose(new_layers[0][0], [[1, 2, 3]], atol=1e-4)
+    np.testing.assert_array_equal(new_layers[0][1]["features"]["a"], [1])
+    assert new_layers[1][0].shape == (0, 3)
+    # the original layers are unchanged
+    assert layers[0][1]["name"] == "Cells"
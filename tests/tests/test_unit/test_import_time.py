@@ -0,0 +1,72 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+# napari imports the reader modules to call their probe functions (e.g.
+# brainreg_read_dir) whenever a file is opened, so they must import quickly
+READER_MODULES = [
+    "brainglobe_napari_io.api",
+    "brainglobe_napari_io.brainreg.reader_dir",
+    "brainglobe_napari_io.brainreg.reader_dir_atlas_space",
+    "brainglobe_napari_io.brainreg.reader_dir_sample_space",
+    "brainglobe_napari_io.brainmapper.brainmapper_reader_dir",
+    "brainglobe_napari_io.brainmapper.brainmapper_reader_dir_atlas_space",
+    "brainglobe_napari_io.brainmapper.cube_reader",
+    "brainglobe_napari_io.cellfinder.reader_points",
+]
+HEAVY_MODULES = [
+    "napari",
+    "qtpy",
+    "tifffile",
+    "brainglobe_atlasapi",
+    "brainglobe_space",
+    "brainglobe_utils",
+    "pandas",
+]
+# seconds, well above the ~0.15s this takes, but well below the ~2.5s of
+# importing napari and brainglobe_atlasapi
+IMPORT_TIME_BUDGET = 1.0
+
+IMPORT_SCRIPT = """
+import json, sys, time
+import numpy
+start = time.perf_counter()
+import {module}
+duration = time.perf_counter() - start
+print(json.dumps({{
+    "duration": duration,
+    "imported": [m for m in {heavy_modules!r} if m in sys.modules],
+}}))
+"""
+
+
+def import_in_subprocess(module):
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            IMPORT_SCRIPT.format(module=module, heavy_modules=HEAVY_MODULES),
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize("module", READER_MODULES)
+def test_reader_modules_do_not_import_heavy_dependencies(module):
+    assert import_in_subprocess(module)["imported"] == []
+
+
+def test_reader_dir_import_time():
+    # take the fastest of a few imports, to reduce noise
+    duration = min(
+        import_in_subprocess("brainglobe_napari_io.brainreg.reader_dir")[
+            "duration"
+        ]
+        for _ in range(3)
+    )
+    assert duration < IMPORT_TIME_BUDGET
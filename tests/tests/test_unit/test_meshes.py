@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import make_ellipsoid_mesh
+from brainglobe_napari_io import meshes
+
+
+def signed_volume(vertices, faces):
+    a, b, c = (vertices[faces[:, i]] for i in range(3))
+    return np.einsum("ij,ij->i", a, np.cross(b, c)).sum() / 6
+
+
+@pytest.mark.parametrize("max_vertices", [50, 300])
+def test_decimate_mesh(max_vertices):
+    vertices, faces = make_ellipsoid_mesh((10, 20, 30), (4, 6, 8), 40, 80)
+    new_vertices, new_faces = meshes.decimate_mesh(
+        vertices, faces, max_vertices
+    )
+    assert len(new_vertices) <= max_vertices
+    # not decimated much further than needed
+    assert len(new_vertices) > max_vertices / 4
+    assert new_faces.min() == 0
+    assert new_faces.max() == len(new_vertices) - 1
+    assert (np.diff(np.sort(new_faces, axis=1), axis=1) > 0).all()
+    assert len(np.unique(np.sort(new_faces, axis=1), axis=0)) == len(new_faces)
+    # the winding is kept, and the shape roughly (averaging vertices
+    # shrinks it a little)
+    volume = signed_volume(vertices, faces)
+    assert 0.6 * volume < signed_volume(new_vertices, new_faces) < volume
+
+
+def test_small_mesh_is_not_decimated():
+    vertices, faces = make_ellipsoid_mesh((0, 0, 0), (1, 1, 1), 4, 6)
+    new_vertices, new_faces = meshes.decimate_mesh(vertices, faces, 1000)
+    np.testing.assert_array_equal(new_vertices, vertices)
+    np.testing.assert_array_equal(new_faces, faces)
+
+
+def test_mesh_cache(tmp_path):
+    vertices, faces = make_ellipsoid_mesh((0, 0, 0), (1, 2, 3), 10, 20)
+    path = tmp_path / "mesh.npz"
+    meshes.write_mesh_cache(path, vertices, faces)
+    with np.load(path) as mesh_file:
+        assert mesh_file["vertices"].dtype == np.float32
+        assert mesh_file["faces"].dtype == np.uint8
+
+    cached_vertices, cached_faces = meshes.read_mesh_cache(path)
+    np.testing.assert_allclose(cached_vertices, vertices, rtol=1e-6)
+    np.testing.assert_array_equal(cached_faces, faces)
+
+
+def test_get_smallest_index_type():
+    assert meshes.get_smallest_index_type(256) == np.uint8
+    assert meshes.get_smallest_index_type(257) == np.uint16
+    assert meshes.get_smallest_index_type(70_000) == np.uint32
+
+
+def test_settings(monkeypatch):
+    monkeypatch.delenv(meshes.ATLAS_MESHES_ENV_VAR, raising=False)
+    monkeypatch.delenv(meshes.MESH_VERTICES_ENV_VAR, raising=False)
+    assert meshes.get_mesh_structures() == []
+    assert meshes.get_mesh_structures(["HIP"]) == ["HIP"]
+    assert meshes.get_max_vertices() == meshes.DEFAULT_MAX_VERTICES
+
+    monkeypatch.setenv(meshes.ATLAS_MESHES_ENV_VAR, "root, HIP,")
+    monkeypatch.setenv(meshes.MESH_VERTICES_ENV_VAR, "500")
+    assert meshes.get_mesh_structures() == ["root", "HIP"]
+    assert meshes.get_max_vertices() == 500
+    assert meshes.get_max_vertices(100) == 100
+
+    monkeypatch.setenv(meshes.MESH_VERTICES_ENV_VAR, "many")
+    with pytest.raises(ValueError, match="MESH_VERTICES"):
+        meshes.get_max_vertices()
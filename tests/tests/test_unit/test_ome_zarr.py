@@ -0,0 +1,153 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+import tifffile
+
+from benchmarks.synthetic import write_ome_zarr
+from brainglobe_napari_io import ome_zarr, planning
+from brainglobe_napari_io.utils import read_tiff
+
+
+@pytest.fixture
+def image():
+    return np.arange(20 * 18 * 16, dtype=np.uint16).reshape(20, 18, 16)
+
+
+def test_get_zarr_paths():
+    assert ome_zarr.get_zarr_paths("reg/registered_atlas.tiff") == [
+        Path("reg/registered_atlas.ome.zarr"),
+        Path("reg/registered_atlas.zarr"),
+    ]
+    assert ome_zarr.get_tiff_path("reg/downsampled.ome.zarr") == Path(
+        "reg/downsampled.tiff"
+    )
+    assert ome_zarr.get_tiff_path("reg/downsampled.zarr") == Path(
+        "reg/downsampled.tiff"
+    )
+    assert ome_zarr.is_zarr("reg/downsampled.OME.zarr")
+    assert not ome_zarr.is_zarr("reg/downsampled.tiff")
+
+
+def test_find_image(tmp_path, image):
+    tiff_path = tmp_path / "downsampled.tiff"
+    assert ome_zarr.find_image(tiff_path) == tiff_path
+
+    zarr_path = write_ome_zarr(tmp_path / "downsampled.zarr", image)
+    assert ome_zarr.find_image(tiff_path) == zarr_path
+
+    # a newer TIFF file is read instead of the Zarr image
+    tifffile.imwrite(tiff_path, image)
+    mtime = os.path.getmtime(zarr_path) + 10
+    os.utime(tiff_path, (mtime, mtime))
+    assert ome_zarr.find_image(tiff_path) == tiff_path
+
+
+@pytest.mark.parametrize("zarr_format", [2, 3])
+def test_read_zarr_image(tmp_path, image, zarr_format):
+    path = write_ome_zarr(
+        tmp_path / "image.ome.zarr", image, zarr_format=zarr_format
+    )
+    levels = ome_zarr.open_zarr_levels(path)
+    assert [factor for _, factor in levels] == [1, 2]
+    np.testing.assert_array_equal(ome_zarr.read_zarr_image(path), image)
+    region = {"start": (2, 3, 4), "stop": (10, 12, 9)}
+    np.testing.assert_array_equal(
+        ome_zarr.read_zarr_image(path, region), image[2:10, 3:12, 4:9]
+    )
+    assert ome_zarr.get_image_shape(path) == (image.shape, image.dtype)
+
+
+@pytest.mark.parametrize("n_levels", [1, 2])
+def test_read_zarr_decimated(tmp_path, image, n_levels):
+    path = write_ome_zarr(
+        tmp_path / "image.ome.zarr", image, n_levels=n_levels
+    )
+    for factor in (2, 4):
+        np.testing.assert_array_equal(
+            ome_zarr.read_zarr_decimated(path, factor),
+            image[::factor, ::factor, ::factor],
+        )
+
+
+def test_plain_zarr_array(tmp_path, image):
+    import zarr
+
+    path = tmp_path / "image.zarr"
+    zarr.create_array(str(path), data=image, chunks=(4, 18, 16))
+    assert ome_zarr.open_zarr_levels(path)[0][1] == 1
+    np.testing.assert_array_equal(read_tiff(tmp_path / "image.tiff"), image)
+
+
+def test_group_without_multiscales_is_rejected(tmp_path):
+    import zarr
+
+    zarr.open_group(str(tmp_path / "image.zarr"), mode="w")
+    with pytest.raises(ValueError, match="not an OME-Zarr image"):
+        ome_zarr.open_zarr_levels(tmp_path / "image.zarr")
+
+
+def test_plan_zarr_image(tmp_path, image):
+    path = write_ome_zarr(tmp_path / "image.ome.zarr", image, chunks=(4, 8, 8))
+    eager, alternatives = planning.plan_image(path)
+    assert eager.eager_memory == image.nbytes
+    assert "memmap" not in [plan.strategy for plan in alternatives]
+    lazy = next(plan for plan in alternatives if plan.strategy == "lazy")
+    assert lazy.memory == 4 * image[0].nbytes
+    lazy_image = planning.read_tiff_planned(path, lazy)
+    assert not isinstance(lazy_image, np.ndarray)
+    np.testing.assert_array_equal(lazy_image[5], image[5])
+
+    decimated = next(p for p in alternatives if p.decimation == 2)
+    assert decimated.memory == image.nbytes // 8
+    np.testing.assert_array_equal(
+        planning.read_tiff_planned(path, decimated), image[::2, ::2, ::2]
+    )
+    _, alternatives = planning.plan_image(path, allow_lazy=False)
+    assert "lazy" not in [plan.strategy for plan in alternatives]
+
+
+def test_get_n_levels():
+    assert ome_zarr.get_n_levels((64, 64, 64)) == 1
+    assert ome_zarr.get_n_levels((65, 64, 64)) == 2
+    assert ome_zarr.get_n_levels((1000, 1000, 1000)) == 5
+    assert ome_zarr.get_n_levels((1000, 1000, 3)) == 2
+    assert ome_zarr.get_n_levels((1000, 1000, 1)) == 1
+
+
+def test_downsample(image):
+    downsampled = ome_zarr.downsample(image)
+    assert downsampled.shape == (10, 9, 8)
+    assert downsampled.dtype == image.dtype
+    assert downsampled[0, 0, 0] == np.rint(image[:2, :2, :2].mean())
+    np.testing.assert_array_equal(
+        ome_zarr.downsample(image, labels=True), image[::2, ::2, ::2]
+    )
+
+
+@pytest.mark.parametrize("labels", [False, True])
+def test_write_ome_zarr_image(tmp_path, image, labels):
+    import zarr
+
+    group = zarr.open_group(str(tmp_path / "images.zarr"), mode="w")
+    ome_zarr.write_ome_zarr_image(
+        group,
+        "image",
+        image,
+        scale=(2, 3, 4),
+        translate=(10, 0, 0),
+        labels=labels,
+        n_levels=2,
+        chunks=(8, 8, 8),
+    )
+    path = tmp_path / "images.zarr" / "image"
+    levels = ome_zarr.open_zarr_levels(path)
+    assert [factor for _, factor in levels] == [1, 2]
+    assert levels[0][0].chunks == (8, 8, 8)
+    np.testing.assert_array_equal(ome_zarr.read_zarr_image(path), image)
+    datasets = ome_zarr.get_multiscales(zarr.open_group(str(path)))["datasets"]
+    transforms = datasets[1]["coordinateTransformations"]
+    assert transforms[0]["scale"] == [4, 6, 8]
+    offset = [0, 0, 0] if labels else [1, 1.5, 2]
+    assert transforms[1]["translation"] == [10 + offset[0]] + offset[1:]
@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+import tifffile
+
+from brainglobe_napari_io import planning
+from brainglobe_napari_io.brainmapper.raw_planes import LazyPageStack
+
+SHAPE = (16, 20, 24)
+
+
+@pytest.fixture
+def image():
+    return np.arange(np.prod(SHAPE), dtype=np.uint16).reshape(SHAPE)
+
+
+@pytest.fixture
+def uncompressed_path(tmp_path, image):
+    path = tmp_path / "uncompressed.tiff"
+    tifffile.imwrite(path, image, photometric="minisblack")
+    return path
+
+
+@pytest.fixture
+def compressed_path(tmp_path, image):
+    path = tmp_path / "compressed.tiff"
+    tifffile.imwrite(path, image, photometric="minisblack", compression="zlib")
+    return path
+
+
+def test_parse_memory_size():
+    assert planning.parse_memory_size("1.5G") == 1.5e9
+    assert planning.parse_memory_size("100") == 100
+    with pytest.raises(ValueError):
+        planning.parse_memory_size("lots")
+
+
+def test_get_memory_budget(monkeypatch):
+    monkeypatch.setenv(planning.MEMORY_BUDGET_ENV_VAR, "2G")
+    assert planning.get_memory_budget(1000) == 1000
+    assert planning.get_memory_budget() == 2e9
+    monkeypatch.setenv(planning.MEMORY_BUDGET_ENV_VAR, "0")
+    assert planning.get_memory_budget() is None
+
+    monkeypatch.delenv(planning.MEMORY_BUDGET_ENV_VAR)
+    monkeypatch.setattr(planning, "get_available_memory", lambda: 8000)
+    assert planning.get_memory_budget() == 4000
+
+
+def test_plan_image(uncompressed_path, compressed_path, image):
+    eager, alternatives = planning.plan_image(uncompressed_path)
+    assert eager.shape == SHAPE
+    assert eager.memory == eager.eager_memory == image.nbytes
+    assert alternatives[0].strategy == "memmap"
+
+    eager, alternatives = planning.plan_image(compressed_path)
+    strategies = [plan.strategy for plan in alternatives]
+    assert "memmap" not in strategies
+    assert strategies[0] == "lazy"
+
+    _, alternatives = planning.plan_image(compressed_path, allow_lazy=False)
+    assert {plan.strategy for plan in alternatives} == {"decimated"}
+    assert [plan.decimation for plan in alternatives] == list(
+        planning.DECIMATION_FACTORS
+    )
+
+
+def test_make_plan(uncompressed_path, compressed_path, image):
+    options = [
+        planning.plan_image(compressed_path),
+        planning.plan_image(uncompressed_path),
+    ]
+    assert planning.make_plan(options, None).is_reduced is False
+
+    # only one image fits eagerly
+    plan = planning.make_plan(options, int(image.nbytes * 1.5))
+    assert [layer.strategy for layer in plan.layers] == ["eager", "memmap"]
+    assert plan.layers[1].reduced
+    assert plan.fits
+
+    plan = planning.make_plan(options, image.nbytes // 4)
+    assert plan.layers[0].strategy == "lazy"
+    assert plan.get(compressed_path) == plan.layers[0]
+    assert plan.get("missing.tiff") is None
+
+    plan = planning.make_plan([planning.plan_image(compressed_path)], 1)
+    assert plan.layers[0].strategy == "decimated"
+    assert not plan.fits
+    assert "OVER BUDGET" in planning.format_plan(plan)
+
+
+def test_plan_cells(tmp_path):
+    from brainglobe_utils.cells.cells import Cell
+    from brainglobe_utils.IO.cells import save_cells
+
+    from brainglobe_napari_io.cellfinder.cell_files import write_binary_cells
+
+    cells_path = tmp_path / "cells.xml"
+    save_cells(
+        [Cell([i, i, i], Cell.CELL) for i in range(1, 101)], str(cells_path)
+    )
+    eager, alternatives = planning.plan_cells(cells_path)
+    assert eager.kind == "cells"
+    assert eager.shape[0] > 0
+    # cells are never decimated, as they are saved over the cell file
+    assert alternatives == []
+
+    write_binary_cells(cells_path)
+    eager, _ = planning.plan_cells(cells_path)
+    assert eager.shape == (100,)
+    assert eager.memory == 100 * planning.BINARY_MEMORY_PER_CELL
+
+
+@pytest.mark.parametrize(
+    "strategy, expected_type",
+    [("eager", np.ndarray), ("memmap", np.memmap), ("lazy", LazyPageStack)],
+)
+def test_read_tiff_planned(compressed_path, strategy, expected_type, image):
+    path = compressed_path
+    if strategy == "memmap":
+        path = path.with_name("uncompressed.tiff")
+        tifffile.imwrite(path, image, photometric="minisblack")
+    eager, _ = planning.plan_image(path)
+    loaded = planning.read_tiff_planned(
+        path, eager._replace(strategy=strategy)
+    )
+    assert isinstance(loaded, expected_type)
+    np.testing.assert_array_equal(np.asarray(loaded), image)
+
+
+def test_read_tiff_planned_decimated(compressed_path, image):
+    eager, _ = planning.plan_image(compressed_path)
+    loaded = planning.read_tiff_planned(
+        compressed_path, eager._replace(strategy="decimated", decimation=4)
+    )
+    np.testing.assert_array_equal(loaded, image[::4, ::4, ::4])
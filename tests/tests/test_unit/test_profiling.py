@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import pathlib
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from brainglobe_napari_io import profiling
+from brainglobe_napari_io.cellfinder import reader_points
+
+xml_file = (
+    pathlib.Path(__file__).parent.parent.parent
+    / "data"
+    / "xml"
+    / "cell_classification.xml"
+)
+
+
+@pytest.fixture(autouse=True)
+def no_profiling():
+    profiling.disable_profiling()
+    yield
+    profiling.disable_profiling()
+
+
+def test_disabled_spans_do_nothing():
+    assert not profiling.is_profiling()
+    with profiling.span("stage") as span:
+        span.add_bytes_read(10)
+    assert span is profiling.span("other stage")
+    profiling.add_bytes_read(10)
+
+
+def test_nested_spans():
+    with profiling.profiling() as records:
+        with profiling.span("outer", path_name="outer.tiff"):
+            profiling.add_bytes_read(100)
+            with profiling.span("inner") as inner:
+                inner.add_bytes_read(50)
+                data = np.ones(2_000_000, dtype=np.uint8)
+                del data
+    assert not profiling.is_profiling()
+
+    inner, outer = records
+    assert inner["path"] == "outer/inner"
+    assert inner["depth"] == 1
+    assert inner["bytes_read"] == 50
+    assert inner["peak_memory_delta"] >= 2_000_000
+
+    assert outer["path"] == "outer"
+    assert outer["depth"] == 0
+    assert outer["path_name"] == "outer.tiff"
+    assert outer["bytes_read"] == 150
+    assert outer["peak_memory_delta"] >= 2_000_000
+    assert outer["wall_time"] >= inner["wall_time"]
+    assert outer["error"] is None
+
+
+def test_span_records_errors():
+    with profiling.profiling() as records:
+        with pytest.raises(ValueError):
+            with profiling.span("failing"):
+                raise ValueError
+    assert records[0]["error"] == "ValueError"
+
+
+def test_profile_decorator():
+    @profiling.profile("double")
+    def double(x):
+        return 2 * x
+
+    assert double(2) == 4
+    with profiling.profiling(trace_memory=False) as records:
+        assert double(3) == 6
+    assert records[0]["name"] == "double"
+    assert records[0]["peak_memory_delta"] is None
+
+
+def test_json_lines_output(tmp_path):
+    output_path = tmp_path / "profile.jsonl"
+    with profiling.profiling(output_path):
+        with profiling.span("first"):
+            pass
+        with profiling.span("second"):
+            pass
+    with open(output_path) as output:
+        records = [json.loads(line) for line in output]
+    assert [record["name"] for record in records] == ["first", "second"]
+
+
+def test_logging(caplog):
+    with caplog.at_level(logging.INFO, logger="brainglobe_napari_io"):
+        with profiling.profiling():
+            with profiling.span("logged"):
+                pass
+    assert "logged:" in caplog.text
+
+
+def test_enable_with_environment_variable(tmp_path):
+    output_path = tmp_path / "profile.jsonl"
+    env = {
+        **os.environ,
+        profiling.PROFILE_ENV_VAR: "1",
+        profiling.PROFILE_OUTPUT_ENV_VAR: str(output_path),
+    }
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "from brainglobe_napari_io import profiling\n"
+            "assert profiling.is_profiling()\n"
+            "with profiling.span('stage'):\n"
+            "    pass\n",
+        ],
+        env=env,
+        check=True,
+    )
+    with open(output_path) as output:
+        assert json.loads(output.readline())["name"] == "stage"
+
+
+def test_reader_spans():
+    with profiling.profiling() as records:
+        reader_points.points_reader(str(xml_file))
+    spans = {record["name"]: record for record in records}
+    assert list(spans) == [
+        "cells parse",
+        "feature build",
+        "cellfinder read points",
+    ]
+    assert spans["cells parse"]["bytes_read"] == os.path.getsize(xml_file)
+    assert spans["feature build"]["path"] == (
+        "cellfinder read points/feature build"
+    )
+    assert spans["cellfinder read points"]["bytes_read"] == os.path.getsize(
+        xml_file
+    )
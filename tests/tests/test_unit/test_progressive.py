@@ -0,0 +1,52 @@
+import numpy as np
+
+from brainglobe_napari_io import progressive
+from brainglobe_napari_io.cellfinder.utils import PARTIAL_KEY
+from brainglobe_napari_io.planning import LayerPlan, LoadPlan
+from brainglobe_napari_io.utils import Layer
+
+
+def test_get_preview_step():
+    assert progressive.get_preview_step((10, 10, 10), 1000) == 1
+    assert progressive.get_preview_step((10, 10, 10), 999) == 2
+    assert progressive.get_preview_step((100, 1000, 1000), 2**21) == 4
+
+
+def test_get_preview_plan():
+    image = LayerPlan("atlas.tiff", "image", (64, 64, 64), 64**3, memory=0)
+    cells = LayerPlan("cells.xml", "cells", (100,), 100, memory=100)
+    plan = LoadPlan(None, [image, cells])
+
+    assert progressive.get_preview_plan(plan, 64**3, 100) == plan
+
+    preview_plan = progressive.get_preview_plan(plan, 16**3, 10)
+    assert preview_plan.layers[0].strategy == "decimated"
+    assert preview_plan.layers[0].decimation == 4
+    # only every nth cell is read
+    assert preview_plan.layers[1].strategy == "decimated"
+    assert preview_plan.layers[1].decimation == 10
+    assert preview_plan.layers[1].reduced
+    assert preview_plan.is_reduced
+
+
+def test_subsample_points():
+    points = np.arange(30).reshape(10, 3)
+    layers = [
+        Layer(np.zeros((4, 4, 4)), {"name": "Image"}),
+        Layer(
+            points,
+            {"name": "Cells", "features": {"id": np.arange(10)}},
+            "points",
+        ),
+    ]
+    image, cells = progressive.subsample_points(layers, max_points=4)
+    assert image is layers[0]
+    assert cells.data.shape == (4, 3)
+    # points stay in order, with their features
+    ids = cells.attributes["features"]["id"]
+    assert np.all(np.diff(ids) > 0)
+    np.testing.assert_array_equal(cells.data, points[ids])
+    # so it can't be saved over the cell file
+    assert cells.metadata[PARTIAL_KEY]
+
+    assert progressive.subsample_points(layers, max_points=10) == layers
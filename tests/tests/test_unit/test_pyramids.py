@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+import pytest
+import tifffile
+
+from brainglobe_napari_io.brainmapper import pyramids
+from brainglobe_napari_io.brainmapper.raw_planes import LazyPlaneStack
+
+
+@pytest.fixture
+def stack(tmp_path):
+    rng = np.random.default_rng(0)
+    plane_paths = []
+    for z in range(3):
+        plane_paths.append(tmp_path / "planes" / f"plane_{z}.tif")
+        plane_paths[-1].parent.mkdir(exist_ok=True)
+        tifffile.imwrite(
+            plane_paths[-1], rng.integers(0, 1000, (37, 64), dtype=np.uint16)
+        )
+    stack = LazyPlaneStack(plane_paths, prefetch=0)
+    yield stack
+    stack.close()
+
+
+def test_get_n_levels():
+    assert pyramids.get_n_levels((512, 100)) == 0
+    assert pyramids.get_n_levels((513, 100)) == 1
+    assert pyramids.get_n_levels((4000, 3000)) == 3
+    assert pyramids.get_n_levels((10**6, 10)) == 8
+
+
+def test_downsample_plane():
+    plane = np.arange(20, dtype=np.uint16).reshape(4, 5)
+    np.testing.assert_array_equal(
+        pyramids.downsample_plane(plane), [[3, 5], [13, 15]]
+    )
+
+
+def test_write_and_load_pyramid(tmp_path, stack):
+    pyramid_dir = tmp_path / "pyramids" / "signal_0"
+    assert pyramids.load_pyramid(stack, pyramid_dir) is None
+
+    level_paths = pyramids.write_pyramid(stack, pyramid_dir, n_levels=2)
+    assert [path.name for path in level_paths] == [
+        "level_1.tiff",
+        "level_2.tiff",
+    ]
+
+    pyramid = pyramids.load_pyramid(stack, pyramid_dir)
+    assert pyramid[0] is stack
+    assert [level.shape for level in pyramid[1:]] == [
+        (3, 18, 32),
+        (3, 9, 16),
+    ]
+    assert all(isinstance(level, np.memmap) for level in pyramid[1:])
+    np.testing.assert_array_equal(
+        pyramid[1][1], pyramids.downsample_plane(stack[1])
+    )
+    np.testing.assert_array_equal(
+        pyramid[2][2], pyramids.downsample_plane(pyramid[1][2])
+    )
+
+    # a pyramid older than its raw data isn't used
+    os.utime(pyramid_dir / pyramids.PYRAMID_METADATA_FILENAME, (0, 0))
+    assert pyramids.load_pyramid(stack, pyramid_dir) is None
@@ -0,0 +1,156 @@
+import threading
+from concurrent.futures import Future, wait
+
+import numpy as np
+import pytest
+import tifffile
+
+from brainglobe_napari_io.brainmapper import raw_planes
+from brainglobe_napari_io.brainmapper.raw_planes import (
+    LazyPageStack,
+    LazyPlaneStack,
+    get_plane_paths,
+    is_paged_tiff,
+    resolve_planes_path,
+)
+
+N_PLANES = 12
+PLANE_SHAPE = (8, 10)
+
+
+@pytest.fixture
+def planes_dir(tmp_path):
+    planes_dir = tmp_path / "signal"
+    planes_dir.mkdir()
+    rng = np.random.default_rng(0)
+    stack = rng.integers(0, 1000, (N_PLANES, *PLANE_SHAPE), dtype=np.uint16)
+    for idx, plane in enumerate(stack):
+        tifffile.imwrite(planes_dir / f"plane_{idx}.tif", plane)
+    (planes_dir / "notes.txt").write_text("not a plane")
+    return planes_dir, stack
+
+
+def test_get_plane_paths(planes_dir):
+    directory, _ = planes_dir
+    paths = get_plane_paths(directory)
+    assert len(paths) == N_PLANES
+    # natural, not lexicographic, sorting
+    assert [p.name for p in paths[:3]] == [
+        "plane_0.tif",
+        "plane_1.tif",
+        "plane_2.tif",
+    ]
+
+
+def test_resolve_planes_path(planes_dir, tmp_path):
+    directory, _ = planes_dir
+    assert resolve_planes_path(str(directory), tmp_path) == directory
+    assert resolve_planes_path("signal", tmp_path) == directory
+    assert resolve_planes_path("missing", tmp_path) is None
+
+
+def test_lazy_plane_stack_indexing(planes_dir):
+    directory, expected = planes_dir
+    stack = LazyPlaneStack(get_plane_paths(directory), prefetch=0)
+
+    assert stack.shape == expected.shape
+    assert stack.dtype == expected.dtype
+    assert stack.ndim == 3
+    assert len(stack) == N_PLANES
+
+    np.testing.assert_array_equal(stack[3], expected[3])
+    np.testing.assert_array_equal(stack[-1], expected[-1])
+    np.testing.assert_array_equal(stack[2:9:3, 1:5], expected[2:9:3, 1:5])
+    np.testing.assert_array_equal(stack[..., 2], expected[..., 2])
+    np.testing.assert_array_equal(stack[[0, 5]], expected[[0, 5]])
+    np.testing.assert_array_equal(np.asarray(stack), expected)
+    assert stack[5:5].shape == (0, *PLANE_SHAPE)
+
+    with pytest.raises(IndexError):
+        stack[N_PLANES]
+
+
+def test_lazy_plane_stack_only_reads_requested_planes(planes_dir, mocker):
+    directory, _ = planes_dir
+    stack = LazyPlaneStack(get_plane_paths(directory), prefetch=0)
+    imread = mocker.spy(tifffile, "imread")
+
+    stack[4]
+    stack[4]
+    assert imread.call_count == 1
+
+
+def test_lazy_plane_stack_cache_is_bounded(planes_dir):
+    directory, expected = planes_dir
+    stack = LazyPlaneStack(
+        get_plane_paths(directory), cache_size=3, prefetch=0
+    )
+    for z in range(N_PLANES):
+        np.testing.assert_array_equal(stack[z], expected[z])
+    assert list(stack._cache) == [N_PLANES - 3, N_PLANES - 2, N_PLANES - 1]
+
+
+def test_lazy_plane_stack_prefetches_neighbours(planes_dir):
+    directory, _ = planes_dir
+    stack = LazyPlaneStack(get_plane_paths(directory), prefetch=2)
+    stack[5]
+    wait(list(stack._pending.values()))
+    assert set(stack._cache) == {3, 4, 5, 6, 7}
+    stack.close()
+    assert len(stack._cache) == 0
+
+
+def test_stacks_share_prefetch_threads(planes_dir):
+    directory, _ = planes_dir
+    n_threads = threading.active_count()
+    stacks = [
+        LazyPlaneStack(get_plane_paths(directory), prefetch=1)
+        for _ in range(2 * raw_planes.N_PREFETCH_THREADS)
+    ]
+    for stack in stacks:
+        stack[5]
+    # without closing the stacks
+    assert (
+        threading.active_count() <= n_threads + raw_planes.N_PREFETCH_THREADS
+    )
+    for stack in stacks:
+        stack.close()
+        assert not stack._pending
+
+
+def test_cancelled_prefetch_is_read(planes_dir):
+    directory, stack_data = planes_dir
+    stack = LazyPlaneStack(get_plane_paths(directory), prefetch=0)
+    # a plane queued to be read ahead, and cancelled (e.g. by close)
+    pending: Future = Future()
+    pending.cancel()
+    pending.set_running_or_notify_cancel()
+    stack._pending[5] = pending
+    np.testing.assert_array_equal(stack[5], stack_data[5])
+
+
+def test_prefetch_threads_are_reset_in_forked_process():
+    executor = raw_planes.get_prefetch_executor()
+    raw_planes._reset_prefetch_executor()
+    assert raw_planes.get_prefetch_executor() is not executor
+    executor.shutdown()
+
+
+def test_lazy_plane_stack_no_planes():
+    with pytest.raises(ValueError):
+        LazyPlaneStack([])
+
+
+def test_lazy_page_stack(tmp_path):
+    path = tmp_path / "stack.tiff"
+    expected = np.arange(4 * 5 * 6, dtype=np.uint16).reshape(4, 5, 6)
+    tifffile.imwrite(
+        path, expected, photometric="minisblack", compression="zlib"
+    )
+    assert is_paged_tiff(path)
+
+    stack = LazyPageStack(path, cache_size=2, prefetch=0)
+    assert stack.shape == expected.shape
+    np.testing.assert_array_equal(stack[2], expected[2])
+    np.testing.assert_array_equal(np.asarray(stack), expected)
+    assert len(stack._cache) == 2
@@ -0,0 +1,127 @@
+import time
+
+import numpy as np
+import pytest
+import tifffile
+
+from benchmarks.synthetic import ThrottledOpener, write_ome_zarr
+from brainglobe_napari_io import readahead
+from brainglobe_napari_io.planning import LayerPlan, LoadPlan
+
+MB = 2**20
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for i in range(8):
+        path = tmp_path / f"file_{i}.bin"
+        path.write_bytes(bytes([i]) * MB)
+        paths.append(path)
+    return paths
+
+
+def test_files_are_read_concurrently_in_large_reads(files):
+    opener = ThrottledOpener(latency=0.05)
+    start = time.perf_counter()
+    ahead = readahead.ReadAhead(files, read_size=MB // 4, opener=opener)
+    assert ahead.wait(timeout=30) == len(files) * MB
+    elapsed = time.perf_counter() - start
+
+    # one open and four reads per file, which one after another would take
+    # 8 * 5 * 0.05 = 2s
+    assert elapsed < 1
+    assert opener.max_concurrent > 1
+    assert ahead.done
+    for path in files:
+        reads = [
+            (offset, size) for p, offset, size in opener.reads if p == path
+        ]
+        # each file is read from start to end
+        assert reads == [(i * MB // 4, MB // 4) for i in range(4)]
+
+
+def test_budget(files):
+    opener = ThrottledOpener(latency=0)
+    ahead = readahead.ReadAhead(
+        files[:4], budget=int(2.5 * MB), n_threads=1, opener=opener
+    )
+    assert ahead.wait(timeout=30) == int(2.5 * MB)
+    read_per_file = {path: 0 for path in files[:4]}
+    for path, _, size in opener.reads:
+        read_per_file[path] += size
+    # files are started in order, so the last is read in part, from the start
+    assert list(read_per_file.values()) == [MB, MB, MB // 2, 0]
+
+
+def test_missing_files_are_skipped(files, tmp_path):
+    ahead = readahead.ReadAhead([tmp_path / "missing.bin", files[0]])
+    assert ahead.wait(timeout=30) == MB
+
+
+def test_cancel(files):
+    opener = ThrottledOpener(latency=0.05)
+    ahead = readahead.ReadAhead(
+        files, read_size=MB // 16, n_threads=2, opener=opener
+    )
+    ahead.cancel()
+    ahead.wait(timeout=30)
+    assert ahead.bytes_read < len(files) * MB
+
+
+def test_budget_env_var(monkeypatch, files):
+    monkeypatch.delenv(readahead.READAHEAD_ENV_VAR, raising=False)
+    assert readahead.get_readahead_budget() is None
+    assert readahead.read_ahead(files) is None
+    monkeypatch.setenv(readahead.READAHEAD_ENV_VAR, "2M")
+    assert readahead.get_readahead_budget() == 2_000_000
+    assert readahead.get_readahead_budget(100) == 100
+    monkeypatch.setenv(readahead.READAHEAD_ENV_VAR, "0")
+    assert readahead.get_readahead_budget() is None
+    monkeypatch.setenv(readahead.READAHEAD_ENV_VAR, "lots")
+    with pytest.raises(ValueError, match="Invalid memory size"):
+        readahead.get_readahead_budget()
+
+
+def test_files_are_not_read_ahead_twice_at_once(files):
+    opener = ThrottledOpener(latency=0.05)
+    first = readahead.read_ahead(files[:2], budget=MB, opener=opener)
+    assert first is not None
+    second = readahead.read_ahead(files[:3], budget=MB, opener=opener)
+    assert second.paths == [files[2]]
+    first.wait(timeout=30)
+    second.wait(timeout=30)
+    # once read, files can be read ahead again
+    assert readahead.read_ahead(files[:2], budget=MB).wait(30) == MB
+
+
+def test_get_readahead_paths(tmp_path):
+    image = np.arange(4 * 8 * 8, dtype=np.uint16).reshape(4, 8, 8)
+    tifffile.imwrite(tmp_path / "eager.tiff", image)
+    zarr_path = write_ome_zarr(tmp_path / "zarr.ome.zarr", image)
+    cells_path = tmp_path / "cells.xml"
+    cells_path.write_text("<cells/>")
+
+    def plan(path, kind="image", strategy="eager"):
+        return LayerPlan(str(path), kind, image.shape, 0, strategy)
+
+    load_plan = LoadPlan(
+        None,
+        [
+            plan(tmp_path / "eager.tiff"),
+            plan(tmp_path / "memmapped.tiff", strategy="memmap"),
+            plan(tmp_path / "lazy.tiff", strategy="lazy"),
+            plan(cells_path, "cells", strategy="decimated"),
+            plan(zarr_path),
+        ],
+    )
+    assert readahead.get_readahead_paths(load_plan) == [
+        tmp_path / "eager.tiff",
+        cells_path,
+        zarr_path,
+    ]
+    # every file of a Zarr image is read
+    zarr_files = readahead.get_file_paths(zarr_path)
+    assert zarr_path / "zarr.json" in zarr_files
+    assert len(zarr_files) > 3
+    assert all(path.is_file() for path in zarr_files)
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from brainglobe_napari_io import reader_options
+from brainglobe_napari_io.meshes import ATLAS_MESHES_ENV_VAR
+
+ENV_VARS = (
+    reader_options.STRUCTURE_ENV_VAR,
+    reader_options.LOAD_DEFORMATION_FIELDS_ENV_VAR,
+    reader_options.LOAD_RAW_DATA_ENV_VAR,
+    ATLAS_MESHES_ENV_VAR,
+)
+
+
+@pytest.fixture(autouse=True)
+def environment(monkeypatch):
+    # unset, and restored after each test
+    for env_var in ENV_VARS:
+        monkeypatch.delenv(env_var, raising=False)
+
+
+@pytest.mark.parametrize(
+    "env_value, expected",
+    [("1", True), ("True", True), (" yes ", True), ("0", False), ("", False)],
+)
+def test_get_flag(monkeypatch, env_value, expected):
+    env_var = reader_options.LOAD_RAW_DATA_ENV_VAR
+    monkeypatch.setenv(env_var, env_value)
+    assert reader_options.get_flag(env_var) is expected
+    # options passed directly take precedence
+    assert reader_options.get_flag(env_var, not expected) is (not expected)
+
+
+def test_get_flag_unset():
+    assert reader_options.get_load_deformation_fields() is False
+    assert reader_options.get_load_raw_data() is False
+
+
+def test_get_flag_invalid(monkeypatch):
+    env_var = reader_options.LOAD_DEFORMATION_FIELDS_ENV_VAR
+    monkeypatch.setenv(env_var, "maybe")
+    with pytest.raises(ValueError, match=env_var):
+        reader_options.get_load_deformation_fields()
+
+
+def test_get_structure(monkeypatch):
+    assert reader_options.get_structure() is None
+    monkeypatch.setenv(reader_options.STRUCTURE_ENV_VAR, " HIP ")
+    assert reader_options.get_structure() == "HIP"
+    assert reader_options.get_structure("CH") == "CH"
+    monkeypatch.setenv(reader_options.STRUCTURE_ENV_VAR, "")
+    assert reader_options.get_structure() is None
+
+
+def test_set_reader_options():
+    reader_options.set_reader_options("HIP", True, False, "root,HIP")
+    assert reader_options.get_structure() == "HIP"
+    assert reader_options.get_load_deformation_fields() is True
+    assert reader_options.get_load_raw_data() is False
+    assert os.environ[ATLAS_MESHES_ENV_VAR] == "root,HIP"
+
+    reader_options.set_reader_options()
+    assert reader_options.get_structure() is None
+    assert reader_options.get_load_deformation_fields() is False
+    assert os.environ[ATLAS_MESHES_ENV_VAR] == ""
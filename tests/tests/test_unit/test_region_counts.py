@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import StandInAtlas
+from brainglobe_napari_io.cellfinder.region_counts import (
+    REGION_COUNTS_KEY,
+    RegionCounts,
+    add_region_counts,
+    get_region_counts,
+)
+
+
+class PlaneStack:
+    """A 3D array that can only be read one plane at a time."""
+
+    def __init__(self, array):
+        self.array = array
+        self.shape = array.shape
+        self.planes_read = []
+
+    def __getitem__(self, z):
+        self.planes_read.append(z)
+        return self.array[z]
+
+
+@pytest.fixture
+def atlas():
+    return StandInAtlas(shape=(8, 6, 10), n_structures=4)
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(0)
+    # in a space with 2 voxels per annotation voxel, and some outside it
+    return rng.uniform(-2, 22, (200, 3))
+
+
+def count(atlas, points):
+    voxels = np.round(points / 2).astype(int)
+    inside = np.all((voxels >= 0) & (voxels < atlas.shape), axis=1)
+    regions = np.zeros(len(points), int)
+    regions[inside] = atlas.annotation[tuple(voxels[inside].T)]
+    ids, counts = np.unique(regions, return_counts=True)
+    return dict(zip(ids.tolist(), counts.tolist()))
+
+
+def test_lookup(atlas, points):
+    region_counts = RegionCounts(atlas.annotation, scale=2)
+    regions = region_counts.lookup(points)
+    assert regions[np.any(points < -1, axis=1)].max() == 0
+
+    stack = PlaneStack(atlas.annotation)
+    lazy_regions = RegionCounts(stack, scale=2).lookup(points)
+    np.testing.assert_array_equal(lazy_regions, regions)
+    assert len(stack.planes_read) == len(set(stack.planes_read))
+
+    # translated by one annotation voxel
+    translated = RegionCounts(atlas.annotation, scale=2, translate=2)
+    np.testing.assert_array_equal(translated.lookup(points + 2), regions)
+
+
+def test_updates_match_recount(atlas, points):
+    region_counts = RegionCounts(atlas.annotation, scale=2)
+    region_counts.set_points("Cells", points)
+    assert region_counts.get_counts("Cells") == count(atlas, points)
+
+    # added (with negative indices, as napari reports them)
+    added = np.concatenate([points, [[4, 4, 4], [10, 6, 10]]])
+    region_counts.update("Cells", "added", (-2, -1), added)
+    assert region_counts.get_counts("Cells") == count(atlas, added)
+
+    # removed, with indices before removal
+    removed = np.delete(added, [0, 5, 201], axis=0)
+    region_counts.update("Cells", "removed", (0, 5, 201), removed)
+    assert region_counts.get_counts("Cells") == count(atlas, removed)
+
+    # moved
+    moved = removed.copy()
+    moved[[3, 7]] = [[0, 0, 0], [8, 6, 10]]
+    region_counts.update("Cells", "changed", (3, 7), moved)
+    assert region_counts.get_counts("Cells") == count(atlas, moved)
+
+    # inconsistent with the counted points, so counted again
+    region_counts.update("Cells", "changed", (0,), points[:10])
+    assert region_counts.get_counts("Cells") == count(atlas, points[:10])
+
+    # ignored
+    region_counts.update("Cells", "changing", (0,), points)
+    assert region_counts.get_counts("Cells") == count(atlas, points[:10])
+
+
+def test_export(atlas, points, tmp_path):
+    region_counts = RegionCounts(atlas.annotation, scale=2, atlas=atlas)
+    region_counts.set_points("Cells", points)
+    region_counts.set_points("Non cells", points[:50])
+
+    table = region_counts.to_dataframe()
+    assert list(table.columns) == [
+        "structure_id",
+        "acronym",
+        "structure_name",
+        "Cells",
+        "Non cells",
+    ]
+    assert table["Cells"].sum() == len(points)
+    assert table["Non cells"].sum() == 50
+    row = table[table["structure_id"] == 2].iloc[0]
+    assert row["acronym"] == "S2"
+    assert row["Cells"] == count(atlas, points)[2]
+    assert table["structure_name"].iloc[0] == "Outside brain"
+
+    region_counts.export(tmp_path / "counts.csv")
+    pd.testing.assert_frame_equal(
+        pd.read_csv(tmp_path / "counts.csv", keep_default_na=False), table
+    )
+
+
+def test_add_region_counts(atlas, points):
+    region_counts = RegionCounts(atlas.annotation, scale=2)
+    layers = add_region_counts(
+        [
+            (atlas.annotation, {"name": "atlas"}, "labels"),
+            (
+                points,
+                {"name": "Cells", "metadata": {"point_type": 2}},
+                "points",
+            ),
+        ],
+        region_counts,
+    )
+    assert REGION_COUNTS_KEY not in layers[0][1].get("metadata", {})
+    assert layers[1][1]["metadata"] == {
+        "point_type": 2,
+        REGION_COUNTS_KEY: region_counts,
+    }
+    assert get_region_counts(layers) is region_counts
+    assert region_counts.keys == ["Cells"]
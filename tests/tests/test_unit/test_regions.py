@@ -0,0 +1,209 @@
+import os
+from types import SimpleNamespace
+
+import brainglobe_space as bgs
+import numpy as np
+import pytest
+import tifffile
+
+from brainglobe_napari_io import regions
+from brainglobe_napari_io.utils import read_tiff_region, reorient_region
+
+
+@pytest.fixture
+def annotation():
+    annotation = np.zeros((20, 30, 40), dtype=np.uint32)
+    annotation[2:5, 3:10, 4:8] = 1
+    annotation[4:12, 20:25, 10:11] = 2
+    annotation[15, 0, 39] = 3
+    return annotation
+
+
+@pytest.fixture
+def atlas():
+    structures = {
+        "root": {"id": 1},
+        "child": {"id": 2},
+        "other": {"id": 3},
+        "absent": {"id": 4},
+    }
+    descendants = {"root": ["child"], "child": [], "other": [], "absent": []}
+    return SimpleNamespace(
+        atlas_name="test_regions_atlas",
+        structures=structures,
+        get_structure_descendants=descendants.__getitem__,
+    )
+
+
+def test_compute_bounding_boxes(annotation):
+    boxes = regions.compute_bounding_boxes(annotation)
+    np.testing.assert_array_equal(boxes["labels"], [0, 1, 2, 3])
+    np.testing.assert_array_equal(boxes["shape"], annotation.shape)
+    for label, start, stop in zip(
+        boxes["labels"], boxes["starts"], boxes["stops"]
+    ):
+        indices = np.argwhere(annotation == label)
+        np.testing.assert_array_equal(start, indices.min(axis=0))
+        np.testing.assert_array_equal(stop, indices.max(axis=0) + 1)
+
+
+def test_load_bounding_boxes(tmp_path, annotation, mocker, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setenv(regions.REGION_CACHE_DIR_ENV_VAR, str(cache_dir))
+    brainreg_dir = tmp_path / "brainreg"
+    brainreg_dir.mkdir()
+    annotation_path = brainreg_dir / "registered_atlas.tiff"
+    tifffile.imwrite(annotation_path, annotation)
+    compute = mocker.spy(regions, "compute_bounding_boxes")
+
+    boxes = regions.load_bounding_boxes(annotation_path)
+    index_path = regions.get_bounding_box_cache_path(annotation_path)
+    assert index_path.parent == cache_dir
+    assert index_path.exists()
+    # nothing is written to the directory being read
+    assert list(brainreg_dir.iterdir()) == [annotation_path]
+    assert compute.call_count == 1
+
+    cached = regions.load_bounding_boxes(annotation_path)
+    assert compute.call_count == 1
+    for key in boxes:
+        np.testing.assert_array_equal(cached[key], boxes[key])
+
+    # the index is recomputed if the annotation changes
+    stat = index_path.stat()
+    os.utime(annotation_path, (stat.st_atime, stat.st_mtime + 10))
+    regions.load_bounding_boxes(annotation_path)
+    assert compute.call_count == 2
+
+
+def test_written_bounding_boxes_are_used(tmp_path, annotation, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setenv(regions.REGION_CACHE_DIR_ENV_VAR, str(cache_dir))
+    annotation_path = tmp_path / "registered_atlas.tiff"
+    tifffile.imwrite(annotation_path, annotation)
+
+    index_path = regions.write_bounding_boxes(annotation_path)
+    assert index_path == tmp_path / "registered_atlas_bounding_boxes.npz"
+    boxes = regions.load_bounding_boxes(annotation_path)
+    assert not cache_dir.exists()
+    expected = regions.compute_bounding_boxes(annotation)
+    for key in expected:
+        np.testing.assert_array_equal(boxes[key], expected[key])
+
+
+def test_get_structure_region(annotation, atlas):
+    boxes = regions.compute_bounding_boxes(annotation)
+
+    region = regions.get_structure_region(boxes, atlas, "root")
+    assert region == {
+        "structure": "root",
+        "start": (2, 3, 4),
+        "stop": (12, 25, 11),
+        "shape": (20, 30, 40),
+    }
+    region = regions.get_structure_region(boxes, atlas, "other")
+    assert region["start"] == (15, 0, 39)
+    assert region["stop"] == (16, 1, 40)
+
+    with pytest.raises(ValueError, match="not in the annotation"):
+        regions.get_structure_region(boxes, atlas, "absent")
+    with pytest.raises(ValueError, match="not a structure"):
+        regions.get_structure_region(boxes, atlas, "missing")
+
+
+def test_get_atlas_bounding_boxes(annotation, atlas):
+    atlas.annotation = annotation
+    boxes = regions.get_atlas_bounding_boxes(atlas)
+    np.testing.assert_array_equal(boxes["labels"], [0, 1, 2, 3])
+    assert regions.get_atlas_bounding_boxes(atlas) is boxes
+
+
+@pytest.mark.parametrize(
+    "write_kwargs",
+    [
+        {},
+        {"compression": "zlib"},
+        {"compression": "zlib", "per_page": True},
+    ],
+    ids=["uncompressed", "compressed", "compressed_pages"],
+)
+def test_read_tiff_region(tmp_path, annotation, write_kwargs):
+    path = tmp_path / "image.tiff"
+    if write_kwargs.pop("per_page", False):
+        with tifffile.TiffWriter(path) as tiff:
+            for plane in annotation:
+                tiff.write(plane, **write_kwargs)
+    else:
+        tifffile.imwrite(path, annotation, **write_kwargs)
+
+    region = read_tiff_region(path, (2, 3, 4), (12, 25, 11))
+    np.testing.assert_array_equal(region, annotation[2:12, 3:25, 4:11])
+
+
+@pytest.mark.parametrize("target_orientation", ["asr", "psl", "sla", "ipl"])
+def test_reorient_region(annotation, target_orientation):
+    region = {
+        "start": (2, 3, 4),
+        "stop": (12, 25, 11),
+        "shape": annotation.shape,
+    }
+    reoriented = reorient_region(region, "asr", target_orientation)
+
+    crop = annotation[2:12, 3:25, 4:11]
+    full = bgs.map_stack_to("asr", target_orientation, annotation)
+    assert reoriented["shape"] == full.shape
+    np.testing.assert_array_equal(
+        full[
+            tuple(
+                slice(a, b)
+                for a, b in zip(reoriented["start"], reoriented["stop"])
+            )
+        ],
+        bgs.map_stack_to("asr", target_orientation, crop),
+    )
+
+
+def test_crop_points_layers():
+    points = np.array([[0, 0, 0], [5, 5, 5], [9.5, 1, 1], [10, 1, 1]])
+    layers = [
+        (np.zeros((2, 2, 2)), {"name": "image"}, "image"),
+        (
+            points,
+            {
+                "name": "points",
+                "features": {"id": np.arange(4)},
+                "metadata": {"raw": points * 2, "point_type": 2},
+            },
+            "points",
+        ),
+    ]
+
+    cropped = regions.crop_points_layers(
+        layers, (0, 0, 0.5), (10, 10, 10), metadata_keys=("raw",)
+    )
+    assert cropped[0][1] is layers[0][1]
+    data, attributes, _ = cropped[1]
+    np.testing.assert_array_equal(data, points[[1, 2]])
+    np.testing.assert_array_equal(attributes["features"]["id"], [1, 2])
+    np.testing.assert_array_equal(
+        attributes["metadata"]["raw"], points[[1, 2]] * 2
+    )
+    assert attributes["metadata"]["point_type"] == 2
+    # the original layer is unchanged
+    assert len(layers[1][1]["features"]["id"]) == 4
+
+
+def test_get_layers_region():
+    layers = [
+        (np.zeros((2, 2)), {"name": "points"}, "points"),
+        (np.zeros((4, 5, 6)), {"name": "uncropped"}, "image"),
+        (
+            np.zeros((2, 3, 4)),
+            {"name": "cropped", "translate": (10, 20, 30), "scale": (2, 2, 1)},
+            "labels",
+        ),
+    ]
+    start, stop = regions.get_layers_region(layers)
+    np.testing.assert_array_equal(start, (10, 20, 30))
+    np.testing.assert_array_equal(stop, (14, 26, 34))
+    assert regions.get_layers_region(layers[:2]) is None
@@ -0,0 +1,102 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+import tifffile
+
+from brainglobe_napari_io import shared
+from brainglobe_napari_io.utils import read_tiff
+
+
+@pytest.fixture(params=shared.SHARED_MODES)
+def shared_mode(request, monkeypatch, tmp_path):
+    monkeypatch.setenv(shared.SHARED_DIR_ENV_VAR, str(tmp_path / "scratch"))
+    monkeypatch.setenv(shared.SHARED_MEMORY_ENV_VAR, request.param)
+    yield request.param
+    shared.release_shared_arrays()
+
+
+@pytest.fixture
+def source_path(tmp_path):
+    path = tmp_path / "volume.tiff"
+    tifffile.imwrite(
+        path,
+        np.arange(4 * 5 * 6, dtype=np.uint16).reshape(4, 5, 6),
+        photometric="minisblack",
+    )
+    return path
+
+
+ATTACH_SCRIPT = """
+import json, os, sys
+from brainglobe_napari_io import shared
+
+def fail_to_load():
+    raise AssertionError("The volume should be shared, not loaded again")
+
+array = shared.get_shared_array("tiff", fail_to_load, [sys.argv[1]])
+name = shared.get_shared_name("tiff", [sys.argv[1]])
+holders = shared._read_record(name)["holders"]
+print(json.dumps([int(array.sum()), os.getpid() in holders]))
+"""
+
+
+def attach_in_other_process(source_path):
+    result = subprocess.run(
+        [sys.executable, "-c", ATTACH_SCRIPT, str(source_path)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout)
+
+
+def test_shared_mode_off(monkeypatch, source_path):
+    monkeypatch.delenv(shared.SHARED_MEMORY_ENV_VAR, raising=False)
+    assert shared.get_shared_mode() is None
+    array = shared.get_shared_array("tiff", lambda: np.ones(3), [source_path])
+    assert array.flags.writeable
+
+
+def test_invalid_shared_mode(monkeypatch):
+    monkeypatch.setenv(shared.SHARED_MEMORY_ENV_VAR, "gpu")
+    with pytest.raises(ValueError):
+        shared.get_shared_mode()
+
+
+def test_shared_between_processes(shared_mode, source_path):
+    expected = tifffile.imread(source_path)
+    array = read_tiff(source_path)
+    np.testing.assert_array_equal(array, expected)
+    assert not array.flags.writeable
+
+    # other processes attach instead of loading, and release at exit
+    for _ in range(2):
+        total, attached = attach_in_other_process(source_path)
+        assert total == int(expected.sum())
+        assert attached
+
+    name = shared.get_shared_name("tiff", [source_path])
+    assert shared._read_record(name)["holders"] == [os.getpid()]
+
+    # the volume is deleted once the last process releases it
+    del array
+    shared.release_shared_arrays()
+    assert shared._read_record(name) is None
+    if shared_mode == "shm":
+        assert not os.path.exists(f"/dev/shm/{name}")
+    else:
+        assert not shared._get_scratch_path(name).exists()
+
+
+def test_changed_source_is_loaded_again(shared_mode, source_path):
+    first = read_tiff(source_path)
+    tifffile.imwrite(
+        source_path, np.zeros((4, 5, 6), np.uint16), photometric="minisblack"
+    )
+    second = read_tiff(source_path)
+    assert first.sum() > 0
+    assert second.sum() == 0